@@ -0,0 +1,110 @@
+###############################################################################
+#   lazyflow: data flow based lazy parallel computation framework
+#
+#       Copyright (C) 2011-2017, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License
+# as published by the Free Software Foundation; either version 2.1
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# See the files LICENSE.lgpl2 and LICENSE.lgpl3 for full text of the
+# GNU Lesser General Public License version 2.1 and 3 respectively.
+# This information is also available on the ilastik web site at:
+#          http://ilastik.org/license/
+###############################################################################
+"""
+Measure the decoding throughput (MB of decoded voxels per second) of the chunk encodings
+supported by RESTfulPrecomputedChunkedVolume, for typical 64^3 chunks.
+
+Usage: python benchmarks/precomputedDecoding.py [--chunk N] [--repeat N]
+"""
+import argparse
+import gzip
+import io
+
+import numpy
+
+from lazyflow.utility import Timer
+from lazyflow.utility.io_util.RESTfulPrecomputedChunkedVolume import RESTfulPrecomputedChunkedVolume
+
+
+def encode_compressed_segmentation(data, block_size):
+    """Encode a single channel (zyx) uint32/uint64 chunk (xyz block size)"""
+    block_shape = block_size[::-1]
+    grid_shape = [-(-s // b) for s, b in zip(data.shape, block_shape)]
+    headers, body = [], []
+    offset = 2 * int(numpy.prod(grid_shape))
+    for index in numpy.ndindex(*grid_shape):
+        block = data[tuple(slice(i * b, (i + 1) * b) for i, b in zip(index, block_shape))]
+        table, indices = numpy.unique(block, return_inverse=True)
+        padded = numpy.zeros(block_shape, dtype=numpy.uint64)
+        padded[tuple(slice(0, s) for s in block.shape)] = indices.reshape(block.shape)
+        bits = next(b for b in (0, 1, 2, 4, 8, 16, 32) if len(table) <= 2 ** b)
+        packed = numpy.zeros(0, dtype=numpy.uint32)
+        if bits:
+            per_word = 32 // bits
+            shifted = padded.reshape(-1, per_word) << (numpy.arange(per_word, dtype=numpy.uint64) * bits)
+            packed = numpy.bitwise_or.reduce(shifted, axis=1).astype(numpy.uint32)
+        table = table.astype(data.dtype).view(numpy.uint32)
+        headers += [(offset + len(packed)) | (bits << 24), offset]
+        body += [packed, table]
+        offset += len(packed) + len(table)
+    channel = numpy.concatenate([numpy.array(headers, dtype=numpy.uint32)] + body)
+    return numpy.concatenate([numpy.array([1], dtype=numpy.uint32), channel]).astype("<u4").tobytes()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunk", type=int, default=64, help="edge length of the (cubic) chunks")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    rng = numpy.random.RandomState(0)
+    n = args.chunk
+    shape = (1, n, n, n)
+    z, y, x = numpy.mgrid[:n, :n, :n]
+    image = (128 + 60 * numpy.sin(x / 7.0) * numpy.cos(y / 5.0) + 10 * numpy.sin(z / 3.0)).astype(numpy.uint8)
+    image += rng.randint(0, 8, size=image.shape).astype(numpy.uint8)
+    # Segmentation: a few hundred supervoxels
+    segmentation = ((x // 9) * 10000 + (y // 11) * 100 + (z // 13)).astype(numpy.uint64) + 2 ** 40
+
+    cases = [
+        ("raw", "raw", image.tobytes(), numpy.uint8, None),
+        ("raw (gzip file)", "raw", gzip.compress(image.tobytes()), numpy.uint8, None),
+        ("raw uint64", "raw", segmentation.tobytes(), numpy.uint64, None),
+        (
+            "compressed_segmentation",
+            "compressed_segmentation",
+            encode_compressed_segmentation(segmentation, (8, 8, 8)),
+            numpy.uint64,
+            (8, 8, 8),
+        ),
+    ]
+    try:
+        from PIL import Image
+
+        output = io.BytesIO()
+        Image.fromarray(image.reshape(n * n, n)).save(output, format="jpeg", quality=90)
+        cases.append(("jpeg", "jpeg", output.getvalue(), numpy.uint8, None))
+    except ImportError:
+        print("PIL is not installed: skipping jpeg")
+
+    print("{:>24} {:>12} {:>12}".format("encoding", "content KB", "MB/s"))
+    for name, encoding, content, dtype, block_size in cases:
+        times = []
+        for _ in range(args.repeat):
+            with Timer() as timer:
+                decoded = RESTfulPrecomputedChunkedVolume.decode_content(content, encoding, shape, dtype, block_size)
+            times.append(timer.seconds())
+        print("{:>24} {:>12.1f} {:>12.1f}".format(name, len(content) / 1024, decoded.nbytes / min(times) / 1e6))
+
+
+if __name__ == "__main__":
+    main()
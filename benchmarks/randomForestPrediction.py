@@ -0,0 +1,77 @@
+###############################################################################
+#   lazyflow: data flow based lazy parallel computation framework
+#
+#       Copyright (C) 2011-2016, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License
+# as published by the Free Software Foundation; either version 2.1
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# See the files LICENSE.lgpl2 and LICENSE.lgpl3 for full text of the
+# GNU Lesser General Public License version 2.1 and 3 respectively.
+# This information is also available on the ilastik web site at:
+# 		   http://ilastik.org/license/
+###############################################################################
+"""
+Compare the prediction speed of the vigra random forest and its compiled counterpart
+for the default pixel classification forest (100 trees).
+
+Usage: python benchmarks/randomForestPrediction.py [--pixels N] [--features N] [--classes N]
+"""
+import argparse
+
+import numpy
+
+from lazyflow.classifiers import CompiledRfLazyflowClassifier, ParallelVigraRfLazyflowClassifierFactory
+from lazyflow.utility import Timer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pixels", type=int, default=512 * 512, help="number of pixels to predict")
+    parser.add_argument("--features", type=int, default=37, help="37 is the default feature selection of 3D data")
+    parser.add_argument("--classes", type=int, default=3)
+    parser.add_argument("--labels", type=int, default=5000, help="number of labeled pixels to train with")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    rng = numpy.random.RandomState(0)
+    centers = rng.normal(size=(args.classes, args.features)).astype(numpy.float32)
+    y = rng.randint(args.classes, size=args.labels)
+    X = centers[y] + rng.normal(size=(args.labels, args.features)).astype(numpy.float32)
+
+    with Timer() as timer:
+        vigra_classifier = ParallelVigraRfLazyflowClassifierFactory(100).create_and_train(X, y + 1)
+    print("Training: {:.2f}s".format(timer.seconds()))
+    with Timer() as timer:
+        compiled_classifier = CompiledRfLazyflowClassifier.from_vigra_classifier(vigra_classifier)
+    print("Conversion: {:.2f}s".format(timer.seconds()))
+
+    pixels = centers[rng.randint(args.classes, size=args.pixels)]
+    pixels += rng.normal(size=pixels.shape).astype(numpy.float32)
+    results = {}
+    for name, classifier in [("vigra", vigra_classifier), ("compiled", compiled_classifier)]:
+        times = []
+        for _ in range(args.repeat):
+            with Timer() as timer:
+                results[name] = classifier.predict_probabilities(pixels)
+            times.append(timer.seconds())
+        print(
+            "{:>8}: {:.3f}s (best of {}), {:.2f} Mpixels/s".format(
+                name, min(times), args.repeat, args.pixels / min(times) / 1e6
+            )
+        )
+
+    difference = numpy.abs(results["vigra"] - results["compiled"]).max()
+    print("Largest difference between the predictions: {}".format(difference))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+###############################################################################
+#   lazyflow: data flow based lazy parallel computation framework
+#
+#       Copyright (C) 2011-2016, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License
+# as published by the Free Software Foundation; either version 2.1
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# See the files LICENSE.lgpl2 and LICENSE.lgpl3 for full text of the
+# GNU Lesser General Public License version 2.1 and 3 respectively.
+# This information is also available on the ilastik web site at:
+# 		   http://ilastik.org/license/
+###############################################################################
+"""
+Compare how the training of the parallel vigra random forest scales with the number of cores,
+when the forests are trained in lazyflow requests (threads) or in worker processes.
+
+Usage: python benchmarks/randomForestTraining.py [--cores 8 16 32] [--labels N] [--features N]
+"""
+import argparse
+
+import numpy
+
+from lazyflow.classifiers import ParallelVigraRfLazyflowClassifierFactory, parallelVigraRfLazyflowClassifier
+from lazyflow.request import Request
+from lazyflow.utility import Timer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cores", type=int, nargs="+", default=[8, 16, 32])
+    parser.add_argument("--labels", type=int, default=100000, help="number of labeled pixels to train with")
+    parser.add_argument("--features", type=int, default=37, help="37 is the default feature selection of 3D data")
+    parser.add_argument("--classes", type=int, default=3)
+    parser.add_argument("--trees", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=2)
+    args = parser.parse_args()
+
+    rng = numpy.random.RandomState(0)
+    centers = rng.normal(size=(args.classes, args.features)).astype(numpy.float32)
+    y = rng.randint(args.classes, size=args.labels)
+    X = centers[y] + rng.normal(size=(args.labels, args.features)).astype(numpy.float32)
+    test_y = rng.randint(args.classes, size=10000)
+    test_X = centers[test_y] + rng.normal(size=(len(test_y), args.features)).astype(numpy.float32)
+
+    print("{:>6} {:>10} {:>10} {:>10}".format("cores", "backend", "seconds", "accuracy"))
+    for cores in args.cores:
+        Request.reset_thread_pool(cores)
+        for backend, processes in [("threads", 0), ("processes", cores)]:
+            parallelVigraRfLazyflowClassifier.setTrainingProcesses(processes)
+            factory = ParallelVigraRfLazyflowClassifierFactory(args.trees, num_forests=cores)
+            if processes:
+                # Start the workers outside of the measurement
+                factory.create_and_train(X[:100], y[:100] + 1)
+            times = []
+            for _ in range(args.repeat):
+                with Timer() as timer:
+                    classifier = factory.create_and_train(X, y + 1)
+                times.append(timer.seconds())
+            predicted = numpy.argmax(classifier.predict_probabilities(test_X), axis=-1)
+            print("{:>6} {:>10} {:>10.2f} {:>10.3f}".format(cores, backend, min(times), (predicted == test_y).mean()))
+    parallelVigraRfLazyflowClassifier.setTrainingProcesses(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -305,6 +305,22 @@ def _prepare_lazyflow_config(parsed_args):
     n_threads = os.getenv("LAZYFLOW_THREADS", None)
     total_ram_mb = os.getenv("LAZYFLOW_TOTAL_RAM_MB", None)
     status_interval_secs = int(os.getenv("LAZYFLOW_STATUS_MONITOR_SECONDS", "0"))
+    work_stealing = os.getenv("LAZYFLOW_WORK_STEALING", None)
+    eviction_policy = os.getenv("LAZYFLOW_CACHE_EVICTION_POLICY", None)
+    cache_event_driven = os.getenv("LAZYFLOW_CACHE_EVENT_DRIVEN", None)
+    cache_spill_mb = os.getenv("LAZYFLOW_CACHE_SPILL_MB", None)
+    cache_spill_directory = os.getenv("LAZYFLOW_CACHE_SPILL_DIRECTORY", None)
+    compressed_cache_backend = os.getenv("LAZYFLOW_COMPRESSED_CACHE_BACKEND", None)
+    compressed_cache_codec = os.getenv("LAZYFLOW_COMPRESSED_CACHE_CODEC", None)
+    cache_coalescing_max_mb = os.getenv("LAZYFLOW_CACHE_COALESCING_MAX_MB", None)
+    cache_prefetch_blocks = os.getenv("LAZYFLOW_CACHE_PREFETCH_BLOCKS", None)
+    cache_shared_memory_mb = os.getenv("LAZYFLOW_CACHE_SHARED_MEMORY_MB", None)
+    cascaded_presmoothing = os.getenv("LAZYFLOW_CASCADED_PRESMOOTHING", None)
+    fused_derivative_features = os.getenv("LAZYFLOW_FUSED_DERIVATIVE_FEATURES", None)
+    reduced_precision_features = os.getenv("LAZYFLOW_REDUCED_PRECISION_FEATURES", None)
+    rf_prediction_chunk_kb = os.getenv("LAZYFLOW_RF_PREDICTION_CHUNK_KB", None)
+    rf_training_processes = os.getenv("LAZYFLOW_RF_TRAINING_PROCESSES", None)
+    progressive_prediction = os.getenv("LAZYFLOW_PROGRESSIVE_PREDICTION", None)
 
     # Convert str -> int
     if n_threads is not None:
@@ -317,24 +333,87 @@ def _prepare_lazyflow_config(parsed_args):
         if n_threads == -1:
             n_threads = None
     total_ram_mb = total_ram_mb or ilastik_config.getint("lazyflow", "total_ram_mb")
+    if work_stealing is None:
+        work_stealing = ilastik_config.getboolean("lazyflow", "work_stealing")
+    else:
+        work_stealing = work_stealing.lower() in ("1", "true", "yes")
+    eviction_policy = eviction_policy or ilastik_config.get("lazyflow", "cache_eviction_policy")
+    if eviction_policy == "lru":
+        # The default; nothing to configure
+        eviction_policy = None
+    if cache_event_driven is None:
+        cache_event_driven = ilastik_config.getboolean("lazyflow", "cache_event_driven")
+    else:
+        cache_event_driven = cache_event_driven.lower() in ("1", "true", "yes")
+    cache_spill_mb = int(cache_spill_mb or ilastik_config.getint("lazyflow", "cache_spill_mb"))
+    cache_spill_directory = cache_spill_directory or ilastik_config.get("lazyflow", "cache_spill_directory") or None
+    compressed_cache_backend = compressed_cache_backend or ilastik_config.get("lazyflow", "compressed_cache_backend")
+    compressed_cache_codec = compressed_cache_codec or ilastik_config.get("lazyflow", "compressed_cache_codec")
+    if compressed_cache_backend == "hdf5":
+        # The default; nothing to configure
+        compressed_cache_backend = None
+    cache_coalescing_max_mb = int(
+        cache_coalescing_max_mb or ilastik_config.getint("lazyflow", "cache_coalescing_max_mb")
+    )
+    cache_prefetch_blocks = int(cache_prefetch_blocks or ilastik_config.getint("lazyflow", "cache_prefetch_blocks"))
+    cache_shared_memory_mb = int(cache_shared_memory_mb or ilastik_config.getint("lazyflow", "cache_shared_memory_mb"))
+    if cascaded_presmoothing is None:
+        cascaded_presmoothing = ilastik_config.getboolean("lazyflow", "cascaded_presmoothing")
+    else:
+        cascaded_presmoothing = cascaded_presmoothing.lower() in ("1", "true", "yes")
+    if fused_derivative_features is None:
+        fused_derivative_features = ilastik_config.getboolean("lazyflow", "fused_derivative_features")
+    else:
+        fused_derivative_features = fused_derivative_features.lower() in ("1", "true", "yes")
+    if reduced_precision_features is None:
+        reduced_precision_features = ilastik_config.getboolean("lazyflow", "reduced_precision_features")
+    else:
+        reduced_precision_features = reduced_precision_features.lower() in ("1", "true", "yes")
+    rf_prediction_chunk_kb = int(rf_prediction_chunk_kb or ilastik_config.getint("lazyflow", "rf_prediction_chunk_kb"))
+    rf_training_processes = int(rf_training_processes or ilastik_config.getint("lazyflow", "rf_training_processes"))
+    if progressive_prediction is None:
+        progressive_prediction = ilastik_config.getboolean("lazyflow", "progressive_prediction")
+    else:
+        progressive_prediction = progressive_prediction.lower() in ("1", "true", "yes")
 
     # Note that n_threads == 0 is valid and useful for debugging.
-    if (n_threads is not None) or total_ram_mb or status_interval_secs:
+    if (
+        (n_threads is not None)
+        or total_ram_mb
+        or status_interval_secs
+        or work_stealing
+        or eviction_policy
+        or cache_event_driven
+        or cache_spill_mb
+        or compressed_cache_backend
+        or cache_coalescing_max_mb
+        or cache_prefetch_blocks
+        or cache_shared_memory_mb
+        or cascaded_presmoothing
+        or fused_derivative_features
+        or reduced_precision_features
+        or rf_prediction_chunk_kb
+        or rf_training_processes
+        or progressive_prediction
+    ):
 
         def _configure_lazyflow_settings():
             import lazyflow
             import lazyflow.request
             from lazyflow.utility import Memory
-            from lazyflow.operators import cacheMemoryManager
+            from lazyflow.operators import cacheMemoryManager, cacheSpillStore
 
             if status_interval_secs:
                 memory_logger = logging.getLogger("lazyflow.operators.cacheMemoryManager")
                 memory_logger.setLevel(logging.DEBUG)
                 cacheMemoryManager.setRefreshInterval(status_interval_secs)
 
-            if n_threads is not None:
-                logger.info(f"Resetting lazyflow thread pool with {n_threads} threads.")
-                lazyflow.request.Request.reset_thread_pool(n_threads)
+            if n_threads is not None or work_stealing:
+                pool_kwargs = {"work_stealing": work_stealing}
+                if n_threads is not None:
+                    pool_kwargs["num_workers"] = n_threads
+                logger.info(f"Resetting lazyflow thread pool with {pool_kwargs}.")
+                lazyflow.request.Request.reset_thread_pool(**pool_kwargs)
             if total_ram_mb > 0:
                 if total_ram_mb < 500:
                     raise Exception(
@@ -346,6 +425,68 @@ def _prepare_lazyflow_config(parsed_args):
                 fmt = Memory.format(ram)
                 logger.info("Configuring lazyflow RAM limit to {}".format(fmt))
                 Memory.setAvailableRam(ram)
+            if eviction_policy:
+                logger.info(f"Using cache eviction policy {eviction_policy!r}.")
+                cacheMemoryManager.setEvictionPolicy(eviction_policy)
+            if cache_event_driven:
+                logger.info("Using event-driven cache memory management.")
+                cacheMemoryManager.setEventDriven(True)
+            if cache_spill_mb > 0:
+                store = cacheSpillStore.SpillStore(cache_spill_mb * 1024 ** 2, directory=cache_spill_directory)
+                logger.info(f"Spilling evicted cache blocks to {store.directory} (up to {cache_spill_mb} MB).")
+                cacheSpillStore.setSpillStore(store)
+            if compressed_cache_backend:
+                from lazyflow.operators import opCompressedCache
+
+                logger.info(f"Using {compressed_cache_backend!r} ({compressed_cache_codec}) compressed cache backend.")
+                opCompressedCache.setDefaultBackend(compressed_cache_backend, compressed_cache_codec)
+            if cache_coalescing_max_mb > 0:
+                from lazyflow.operators import opUnblockedArrayCache
+
+                logger.info(f"Merging overlapping cache requests of up to {cache_coalescing_max_mb} MB.")
+                opUnblockedArrayCache.setCoalescingLimit(cache_coalescing_max_mb * 1024 ** 2)
+            if cache_prefetch_blocks > 0:
+                from lazyflow.operators import opSimpleBlockedArrayCache
+
+                logger.info(f"Prefetching up to {cache_prefetch_blocks} blocks ahead of sequential cache accesses.")
+                opSimpleBlockedArrayCache.setPrefetchDepth(cache_prefetch_blocks)
+            if cache_shared_memory_mb > 0:
+                from lazyflow.operators import cacheSharedMemory
+
+                logger.info(f"Sharing cache blocks with other processes (up to {cache_shared_memory_mb} MB).")
+                cacheSharedMemory.setSharedMemoryStore(
+                    cacheSharedMemory.SharedMemoryStore(cache_shared_memory_mb * 1024 ** 2)
+                )
+            if cascaded_presmoothing:
+                from lazyflow.operators import opPixelFeaturesPresmoothed
+
+                logger.info("Using cascaded pre-smoothing for pixel features.")
+                opPixelFeaturesPresmoothed.setCascadedPresmoothing(True)
+            if fused_derivative_features:
+                from lazyflow.operators import opPixelFeaturesPresmoothed
+
+                logger.info("Computing derivative-based pixel features from shared derivative images.")
+                opPixelFeaturesPresmoothed.setFusedDerivatives(True)
+            if reduced_precision_features:
+                from ilastik.applets.featureSelection import opFeatureSelection
+
+                logger.info("Caching pixel features as float16.")
+                opFeatureSelection.setReducedPrecisionStorage(True)
+            if rf_prediction_chunk_kb > 0:
+                from lazyflow.classifiers import parallelVigraRfLazyflowClassifier
+
+                logger.info(f"Predicting with random forests in chunks of {rf_prediction_chunk_kb} KB of features.")
+                parallelVigraRfLazyflowClassifier.setPredictionChunkBytes(rf_prediction_chunk_kb * 1024)
+            if rf_training_processes > 0:
+                from lazyflow.classifiers import parallelVigraRfLazyflowClassifier
+
+                logger.info(f"Training random forests in {rf_training_processes} worker processes.")
+                parallelVigraRfLazyflowClassifier.setTrainingProcesses(rf_training_processes)
+            if progressive_prediction:
+                from lazyflow.operators import classifierOperators
+
+                logger.info("Showing provisional predictions while the complete classifier runs in the background.")
+                classifierOperators.setProgressivePrediction(True)
 
         return _configure_lazyflow_settings
     return None
@@ -54,6 +54,18 @@ FeatureNames = {
     "HessianOfGaussianEigenvalues": "Hessian of Gaussian Eigenvalues",
 }
 
+#: Default of OpFeatureSelection.ReducedPrecisionStorage for new operators, see setReducedPrecisionStorage()
+_default_reduced_precision_storage = False
+
+
+def setReducedPrecisionStorage(enabled):
+    """
+    Let OpFeatureSelection operators created from now on cache their features as float16
+    (see OpFeatureSelection.ReducedPrecisionStorage).
+    """
+    global _default_reduced_precision_storage
+    _default_reduced_precision_storage = enabled
+
 
 def getFeatureIdOrder():
     featureIrdOrder = []
@@ -95,6 +107,9 @@ class OpFeatureSelectionNoCache(Operator):
     # Output can be optionally accessed via an internal cache.
     # (Training a classifier benefits from caching, but predicting with an existing classifier does not.)
     OutputImage = OutputSlot()
+    # Identity of each channel of the output image (see OpPixelFeaturesPresmoothed.ChannelKeys),
+    # e.g. for OpFeatureMatrixCache.FeatureChannelKeys
+    FeatureChannelKeys = OutputSlot()
 
     # For the GUI, we also provide each feature as a separate slot in this multislot
     FeatureLayers = OutputSlot(level=1)
@@ -118,6 +133,7 @@ class OpFeatureSelectionNoCache(Operator):
         self.opReorderOut.Input.connect(self.opPixelFeatures.Output)
         self.opReorderLayers = OperatorWrapper(OpReorderAxes, parent=self, broadcastingSlotNames=["AxisOrder"])
         self.opReorderLayers.Input.connect(self.opPixelFeatures.Features)
+        self.FeatureChannelKeys.connect(self.opPixelFeatures.ChannelKeys)
 
         self.WINDOW_SIZE = self.opPixelFeatures.WINDOW_SIZE
 
@@ -229,6 +245,10 @@ class OpFeatureSelection(OpFeatureSelectionNoCache):
     """
 
     BypassCache = InputSlot(value=False)
+    # Cache the features as float16, which halves their memory.
+    # Values are converted back to float32 when they are read, with a relative error of up to 2**-11.
+    # Blocks with values beyond the range of float16 (+-65504) are stored as float32.
+    ReducedPrecisionStorage = InputSlot(value=False)
     CachedOutputImage = OutputSlot()
 
     def __init__(self, *args, **kwargs):
@@ -238,11 +258,16 @@ class OpFeatureSelection(OpFeatureSelectionNoCache):
         self.opPixelFeatureCache = OpSlicedBlockedArrayCache(parent=self)
         self.opPixelFeatureCache.name = "opPixelFeatureCache"
         self.opPixelFeatureCache.BypassModeEnabled.connect(self.BypassCache)
+        # Keep the channels that survive a change of the feature selection
+        self.opPixelFeatureCache.ChannelKeys.connect(self.opPixelFeatures.ChannelKeys)
 
         # Connect the cache to the feature output
         self.opPixelFeatureCache.Input.connect(self.OutputImage)
         self.opPixelFeatureCache.fixAtCurrent.setValue(False)
 
+        if _default_reduced_precision_storage:
+            self.ReducedPrecisionStorage.setValue(True)
+
     def change_feature_cache_size(self):
         curr_size = self.opPixelFeatureCache.BlockShape.value
         a = [list(i) for i in curr_size]
@@ -272,6 +297,9 @@ class OpFeatureSelection(OpFeatureSelectionNoCache):
 
             # Configure the cache
             self.opPixelFeatureCache.BlockShape.setValue((blockShapeX, blockShapeY, blockShapeZ))
+            self.opPixelFeatureCache.StorageDtype.setValue(
+                numpy.float16 if self.ReducedPrecisionStorage.value else None
+            )
 
             # Connect external output to internal output
             self.CachedOutputImage.connect(self.opPixelFeatureCache.Output)
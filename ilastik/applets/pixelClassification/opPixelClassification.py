@@ -47,6 +47,7 @@ import ilastik_feature_selection
 import numpy as np
 
 from lazyflow.classifiers import ParallelVigraRfLazyflowClassifierFactory
+from lazyflow.operators.classifierOperators import progressivePredictionEnabled
 
 # ilastik
 from ilastik.applets.base.applet import DatasetConstraintError
@@ -76,6 +77,8 @@ class OpPixelClassification(Operator):
 
     FeatureImages = InputSlot(level=1)  # Computed feature images (each channel is a different feature)
     CachedFeatureImages = InputSlot(level=1)  # Cached feature data.
+    # Identity of each feature channel, see OpFeatureMatrixCache.FeatureChannelKeys
+    FeatureChannelKeys = InputSlot(level=1, optional=True)
 
     FreezePredictions = InputSlot(stype="bool")
     ClassifierFactory = InputSlot(value=ParallelVigraRfLazyflowClassifierFactory(100))
@@ -182,6 +185,7 @@ class OpPixelClassification(Operator):
         self.opFeatureMatrixCaches = OpMultiLaneWrapper(OpFeatureMatrixCache, parent=self)
         self.opFeatureMatrixCaches.LabelImage.connect(self.opLabelPipeline.Output)
         self.opFeatureMatrixCaches.FeatureImage.connect(self.FeatureImages)
+        self.opFeatureMatrixCaches.FeatureChannelKeys.connect(self.FeatureChannelKeys)
         self.opFeatureMatrixCaches.LabelImage.setDirty()  # do I still need this?
 
         def _updateNumClasses(*args):
@@ -573,6 +577,19 @@ class OpPredictionPipeline(OpPredictionPipelineNoCache):
         self.predict.LabelsCount.connect(self.NumClasses)
         self.PredictionProbabilities.connect(self.predict.PMaps)
 
+        # Provisional predictions are only meant for display, so they get their own operator
+        # (the other outputs, e.g. for autocontext, always use the complete classifier)
+        gui_predict = self.predict
+        if progressivePredictionEnabled():
+            self.progressive_predict = OpClassifierPredict(parent=self)
+            self.progressive_predict.name = "OpClassifierPredict (Progressive)"
+            self.progressive_predict.Classifier.connect(self.Classifier)
+            self.progressive_predict.Image.connect(self.CachedFeatureImages)
+            self.progressive_predict.PredictionMask.connect(self.PredictionMask)
+            self.progressive_predict.LabelsCount.connect(self.NumClasses)
+            self.progressive_predict.ProgressivePrediction.setValue(True)
+            gui_predict = self.progressive_predict
+
         # Prepare operator for Autocontext
         self.opConvertPMapsToInputPixelType = OpPixelOperator(parent=self)
         self.opConvertPMapsToInputPixelType.Input.connect(self.predict.PMaps)
@@ -582,7 +599,7 @@ class OpPredictionPipeline(OpPredictionPipelineNoCache):
         self.prediction_cache_gui = OpSlicedBlockedArrayCache(parent=self)
         self.prediction_cache_gui.name = "prediction_cache_gui"
         self.prediction_cache_gui.inputs["fixAtCurrent"].connect(self.FreezePredictions)
-        self.prediction_cache_gui.inputs["Input"].connect(self.predict.PMaps)
+        self.prediction_cache_gui.inputs["Input"].connect(gui_predict.PMaps)
         self.CachedPredictionProbabilities.connect(self.prediction_cache_gui.Output)
 
         # Also provide each prediction channel as a separate layer (for the GUI)
@@ -46,6 +46,22 @@ plugin_directories: ~/.ilastik/plugins,
 [lazyflow]
 threads: -1
 total_ram_mb: 0
+work_stealing: false
+cache_eviction_policy: lru
+cache_event_driven: false
+cache_spill_mb: 0
+cache_spill_directory:
+compressed_cache_backend: hdf5
+compressed_cache_codec: auto
+cache_coalescing_max_mb: 0
+cache_prefetch_blocks: 0
+cache_shared_memory_mb: 0
+cascaded_presmoothing: false
+fused_derivative_features: false
+reduced_precision_features: false
+rf_prediction_chunk_kb: 0
+rf_training_processes: 0
+progressive_prediction: false
 
 [hbp]
 token_url: https://web.ilastik.org/token/
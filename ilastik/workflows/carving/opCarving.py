@@ -113,6 +113,9 @@ class OpCarving(Operator):
     #: User-defined prefix for autogenerated object names
     ObjectPrefix = OutputSlot(stype="string")
 
+    # Seeds and objects are edited by the user (see lazyflow.operators.cacheSharedMemory.upstreamContentHash())
+    _has_hidden_state = True
+
     def __init__(self, graph=None, hintOverlayFile=None, pmapOverlayFile=None, parent=None):
         super(OpCarving, self).__init__(graph=graph, parent=parent)
         self.opLabelArray = OpDenseLabelArray(parent=self)
@@ -274,6 +274,7 @@ class NewAutocontextWorkflowBase(Workflow):
         # Feature Images -> Classification Op (for training, prediction)
         opFirstClassify.FeatureImages.connect(opFirstFeatures.OutputImage)
         opFirstClassify.CachedFeatureImages.connect(opFirstFeatures.CachedOutputImage)
+        opFirstClassify.FeatureChannelKeys.connect(opFirstFeatures.FeatureChannelKeys)
 
         upstreamPcApplets = self.pcApplets[0:-1]
         downstreamFeatureApplets = self.featureSelectionApplets[1:]
@@ -306,6 +307,7 @@ class NewAutocontextWorkflowBase(Workflow):
             opDownstreamClassify.InputImages.connect(opStacker.Output)
             opDownstreamClassify.FeatureImages.connect(opDownstreamFeatures.OutputImage)
             opDownstreamClassify.CachedFeatureImages.connect(opDownstreamFeatures.CachedOutputImage)
+            opDownstreamClassify.FeatureChannelKeys.connect(opDownstreamFeatures.FeatureChannelKeys)
 
         # Data Export connections
         opDataExport.RawData.connect(opData.ImageGroup[self.DATA_ROLE_RAW])
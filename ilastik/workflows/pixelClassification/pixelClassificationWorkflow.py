@@ -256,6 +256,7 @@ class PixelClassificationWorkflow(Workflow):
         # Feature Images -> Classification Op (for training, prediction)
         opClassify.FeatureImages.connect(opTrainingFeatures.OutputImage)
         opClassify.CachedFeatureImages.connect(opTrainingFeatures.CachedOutputImage)
+        opClassify.FeatureChannelKeys.connect(opTrainingFeatures.FeatureChannelKeys)
 
         # Data Export connections
         opDataExport.RawData.connect(opData.ImageGroup[self.Roles.RAW_DATA])
@@ -10,7 +10,12 @@ from .parallelVigraRfLazyflowClassifier import (
     ParallelVigraRfLazyflowClassifier,
     ParallelVigraRfLazyflowClassifierFactory,
 )
-from .sklearnLazyflowClassifier import SklearnLazyflowClassifier, SklearnLazyflowClassifierFactory
+from .compiledRfLazyflowClassifier import CompiledRfLazyflowClassifier, CompiledRfLazyflowClassifierFactory
+from .sklearnLazyflowClassifier import (
+    SklearnLazyflowClassifier,
+    SklearnLazyflowClassifierFactory,
+    IncrementalSklearnLazyflowClassifierFactory,
+)
 
 # Testing
 from .vigraRfPixelwiseClassifier import VigraRfPixelwiseClassifier, VigraRfPixelwiseClassifierFactory
@@ -0,0 +1,392 @@
+###############################################################################
+#   lazyflow: data flow based lazy parallel computation framework
+#
+#       Copyright (C) 2011-2016, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License
+# as published by the Free Software Foundation; either version 2.1
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# See the files LICENSE.lgpl2 and LICENSE.lgpl3 for full text of the
+# GNU Lesser General Public License version 2.1 and 3 respectively.
+# This information is also available on the ilastik web site at:
+# 		   http://ilastik.org/license/
+###############################################################################
+"""
+Random forest prediction without vigra.
+
+Trained vigra forests are converted into flat node arrays, which are evaluated for many samples at once
+with numpy.  The forests are read from the HDF5 format vigra writes them in, so classifiers stored in
+project files by ParallelVigraRfLazyflowClassifier (or VigraRfLazyflowClassifier) can be loaded directly.
+
+Predictions are identical to vigra's ``RandomForest.predictProbabilities``: vigra accumulates the leaf
+distributions of all trees in float32 and their total weight in float64, in tree order, and so do we.
+"""
+import collections
+import logging
+import pickle
+from functools import partial
+
+import h5py
+import numpy
+
+from lazyflow.request import Request, RequestPool
+from .lazyflowClassifier import LazyflowVectorwiseClassifierABC
+from .parallelVigraRfLazyflowClassifier import ParallelVigraRfLazyflowClassifierFactory
+
+logger = logging.getLogger(__name__)
+
+# See vigra/random_forest/rf_nodeproxy.hxx
+_LEAF_NODE_TAG = 0x40000000
+_THRESHOLD_NODE = 0
+_CONST_PROB_NODE = 0 | _LEAF_NODE_TAG
+# The first two entries of a tree's topology are the column and class counts
+_ROOT_INDEX = 2
+# Children and (feature) column of a threshold node, relative to its topology index
+_CHILDREN_OFFSET = 2
+_COLUMN_OFFSET = 4
+
+
+def _read_group(group):
+    """
+    Read all datasets and attributes of an h5py group into nested dicts.
+    """
+    contents = {"attrs": dict(group.attrs), "datasets": {}, "groups": {}}
+    for name, item in group.items():
+        if isinstance(item, h5py.Group):
+            contents["groups"][name] = _read_group(item)
+        else:
+            contents["datasets"][name] = item[()]
+    return contents
+
+
+def _write_group(group, contents):
+    group.attrs.update(contents["attrs"])
+    for name, data in contents["datasets"].items():
+        group.create_dataset(name, data=data)
+    for name, subcontents in contents["groups"].items():
+        _write_group(group.create_group(name), subcontents)
+
+
+class CompiledForest(object):
+    """
+    One vigra random forest, as flat arrays with one entry per node of all trees.
+
+    Leaves are their own children, so that traversing a leaf does not move.
+    """
+
+    def __init__(self, vigra_group_contents):
+        """
+        :param vigra_group_contents: the forest group written by vigra's ``RandomForest.writeHDF5``, see _read_group()
+        """
+        # Kept to write the forest back in vigra's format
+        self._contents = vigra_group_contents
+
+        groups = vigra_group_contents["groups"]
+        options = groups.get("_options", {"datasets": {}})["datasets"]
+        ext_param = groups.get("_ext_param", {"datasets": {}})["datasets"]
+        self.predict_weighted = bool(numpy.ravel(options.get("predict_weighted_", [0]))[0])
+
+        tree_names = sorted((name for name in groups if name.startswith("Tree_")), key=lambda n: int(n[len("Tree_") :]))
+        trees = [(groups[name]["datasets"]["topology"], groups[name]["datasets"]["parameters"]) for name in tree_names]
+        if not trees:
+            raise ValueError("The forest has no trees")
+        if "column_count_" in ext_param:
+            self.column_count = int(numpy.ravel(ext_param["column_count_"])[0])
+        else:
+            self.column_count = int(trees[0][0][0])
+        if "class_count_" in ext_param:
+            self.class_count = int(numpy.ravel(ext_param["class_count_"])[0])
+        else:
+            self.class_count = int(trees[0][0][1])
+        self.tree_count = len(trees)
+
+        feature, threshold, left, right, leaf = [], [], [], [], []
+        leaf_values = []
+
+        def new_node():
+            for column in (feature, threshold, left, right, leaf):
+                column.append(None)
+            return len(feature) - 1
+
+        self.roots = numpy.zeros(self.tree_count, dtype=numpy.intp)
+        depth = 0
+        for tree_index, (topology, parameters) in enumerate(trees):
+            self.roots[tree_index] = new_node()
+            # (topology index, node id, depth) of the nodes that are not filled in yet
+            stack = [(_ROOT_INDEX, self.roots[tree_index], 0)]
+            while stack:
+                index, node, node_depth = stack.pop()
+                depth = max(depth, node_depth)
+                node_type = int(topology[index])
+                parameter_address = int(topology[index + 1])
+                if node_type == _CONST_PROB_NODE:
+                    feature[node], threshold[node], left[node], right[node] = -1, numpy.inf, node, node
+                    leaf[node] = len(leaf_values)
+                    # Weight, followed by the class distribution
+                    leaf_values.append(parameters[parameter_address : parameter_address + 1 + self.class_count])
+                elif node_type == _THRESHOLD_NODE:
+                    feature[node] = int(topology[index + _COLUMN_OFFSET])
+                    threshold[node] = parameters[parameter_address + 1]
+                    leaf[node] = -1
+                    left[node], right[node] = new_node(), new_node()
+                    stack.append((int(topology[index + _CHILDREN_OFFSET]), left[node], node_depth + 1))
+                    stack.append((int(topology[index + _CHILDREN_OFFSET + 1]), right[node], node_depth + 1))
+                else:
+                    raise ValueError("Unsupported random forest node type: {:#x}".format(node_type))
+
+        self.feature = numpy.array(feature, dtype=numpy.intp)
+        self.threshold = numpy.array(threshold, dtype=numpy.float64)
+        self.left = numpy.array(left, dtype=numpy.intp)
+        self.right = numpy.array(right, dtype=numpy.intp)
+        self.leaf = numpy.array(leaf, dtype=numpy.intp)
+        leaf_values = numpy.array(leaf_values, dtype=numpy.float64)
+        self.leaf_weights = leaf_values[:, 0]
+        self.leaf_distributions = leaf_values[:, 1:]
+        self.depth = depth
+
+    @classmethod
+    def from_hdf5(cls, group):
+        return cls(_read_group(group))
+
+    def write_hdf5(self, group):
+        """
+        Write the forest to the (empty) group, in vigra's format.
+        """
+        _write_group(group, self._contents)
+
+    @property
+    def node_count(self):
+        return len(self.feature)
+
+    def leaves(self, X, tree_count=None):
+        """
+        Return the leaf (index) that each sample (row of X) reaches in each tree, shape (len(X), tree_count).
+        Only the first tree_count trees are evaluated, if given.
+        """
+        roots = self.roots[:tree_count]
+        rows = numpy.repeat(numpy.arange(len(X)), len(roots))
+        nodes = numpy.tile(roots, len(X))
+        # Only (sample, tree) pairs that did not reach a leaf yet are followed further
+        active = numpy.flatnonzero(self.feature[nodes] >= 0)
+        while active.size:
+            current = nodes[active]
+            # (float32 features are compared as float64 to the thresholds, as in vigra)
+            go_left = X[rows[active], self.feature[current]] < self.threshold[current]
+            nodes[active] = numpy.where(go_left, self.left[current], self.right[current])
+            active = active[self.feature[nodes[active]] >= 0]
+        return self.leaf[nodes].reshape(len(X), len(roots))
+
+    def predict_probabilities(self, X, tree_count=None):
+        """
+        Equivalent to vigra's ``RandomForest.predictProbabilities``, for a float32 feature matrix X.
+        Only the first tree_count trees are used, if given.
+        """
+        leaves = self.leaves(X, tree_count)
+        probabilities = numpy.zeros((len(X), self.class_count), dtype=numpy.float32)
+        total_weight = numpy.zeros(len(X), dtype=numpy.float64)
+        for tree in range(leaves.shape[1]):
+            votes = self.leaf_distributions[leaves[:, tree]]
+            if self.predict_weighted:
+                votes = votes * self.leaf_weights[leaves[:, tree], numpy.newaxis]
+            probabilities += votes.astype(numpy.float32)
+            for label in range(self.class_count):
+                total_weight += votes[:, label]
+        probabilities /= total_weight.astype(numpy.float32)[:, numpy.newaxis]
+
+        # vigra doesn't assign samples with NaN features to any class
+        probabilities[numpy.isnan(X).any(axis=1)] = 0
+        return probabilities
+
+
+class CompiledRfLazyflowClassifierFactory(ParallelVigraRfLazyflowClassifierFactory):
+    """
+    Trains a forest-of-forests with vigra (see ParallelVigraRfLazyflowClassifierFactory),
+    and converts it into a CompiledRfLazyflowClassifier.
+    """
+
+    VERSION = 1  # This is used to determine compatibility of pickled classifier factories.
+    # You must bump this if any instance members are added/removed/renamed.
+
+    def create_and_train(self, X, y, feature_names=None):
+        classifier = super(CompiledRfLazyflowClassifierFactory, self).create_and_train(X, y, feature_names)
+        return CompiledRfLazyflowClassifier.from_vigra_classifier(classifier)
+
+    @property
+    def description(self):
+        return "Compiled Random Forest Factory ({} trees total)".format(self._num_trees)
+
+
+class CompiledRfLazyflowClassifier(LazyflowVectorwiseClassifierABC):
+    """
+    Predict with vigra random forests, converted to flat node arrays (see CompiledForest).
+
+    Gives the same probabilities as ParallelVigraRfLazyflowClassifier, and is stored in project files in the same way.
+    """
+
+    # Samples per prediction request
+    CHUNK_ROWS = 4096
+
+    def __init__(self, forests, known_labels, feature_names=None, oobs=None, named_importances=None):
+        self._forests = forests
+        self._known_labels = known_labels
+        self._feature_names = feature_names
+        self._oobs = oobs
+        self._named_importances = named_importances
+        self._num_trees = sum(forest.tree_count for forest in forests)
+
+    @classmethod
+    def from_vigra_classifier(cls, classifier):
+        """
+        Convert a trained ParallelVigraRfLazyflowClassifier.
+        """
+        with h5py.File("compiled_rf", "w", driver="core", backing_store=False) as f:
+            classifier.serialize_hdf5(f.create_group("classifier"))
+            compiled = cls.deserialize_hdf5(f["classifier"])
+        compiled._oobs = classifier.oobs
+        return compiled
+
+    def predict_probabilities(self, X):
+        logger.debug("Predicting with compiled RF")
+        return self._predict_probabilities(X, [forest.tree_count for forest in self._forests])
+
+    def predict_probabilities_partially(self, X, fraction):
+        """
+        Predict with the first trees only, (at least) the given fraction of all trees.
+        """
+        remaining = int(numpy.ceil(fraction * self._num_trees))
+        if remaining >= self._num_trees:
+            return None
+        tree_counts = []
+        for forest in self._forests:
+            tree_counts.append(min(forest.tree_count, remaining))
+            remaining -= tree_counts[-1]
+        logger.debug("Predicting with {} of {} trees of compiled RF".format(sum(tree_counts), self._num_trees))
+        return self._predict_probabilities(X, tree_counts)
+
+    def _predict_probabilities(self, X, tree_counts):
+        """
+        Predict with the first tree_counts[i] trees of the i-th forest.
+        """
+        X = numpy.asarray(X, dtype=numpy.float32)
+        assert X.ndim == 2
+
+        if self._feature_names is not None:
+            assert X.shape[1] == len(
+                self._feature_names
+            ), "Feature count ({}) doesn't match the training feature count ({}).\nExpected features: {}".format(
+                X.shape[1], len(self._feature_names), self._feature_names
+            )
+
+        predictions = numpy.zeros((len(X), self._forests[0].class_count), dtype=numpy.float32)
+
+        def predict(chunk_slice):
+            # Aggregate the forests like ParallelVigraRfLazyflowClassifier does
+            total = None
+            for forest, tree_count in zip(self._forests, tree_counts):
+                if tree_count == 0:
+                    continue
+                forest_predictions = forest.predict_probabilities(X[chunk_slice], tree_count)
+                forest_predictions *= tree_count
+                if total is None:
+                    total = forest_predictions
+                else:
+                    total += forest_predictions
+            total /= sum(tree_counts)
+            predictions[chunk_slice] = total
+
+        pool = RequestPool()
+        for start in range(0, len(X), self.CHUNK_ROWS):
+            pool.add(Request(partial(predict, slice(start, start + self.CHUNK_ROWS))))
+        pool.wait()
+        return predictions
+
+    @property
+    def oobs(self):
+        return self._oobs
+
+    @property
+    def known_classes(self):
+        return self._known_labels
+
+    @property
+    def feature_names(self):
+        return self._feature_names
+
+    @property
+    def feature_count(self):
+        if self._feature_names is not None:
+            return len(self._feature_names)
+        # (The trees don't necessarily split on every column)
+        return self._forests[0].column_count
+
+    @property
+    def named_importances(self):
+        return self._named_importances
+
+    def serialize_hdf5(self, h5py_group):
+        # Same layout as ParallelVigraRfLazyflowClassifier
+        for i, forest in enumerate(self._forests):
+            forest.write_hdf5(h5py_group.create_group("Forest{:04d}".format(i)))
+
+        h5py_group["known_labels"] = self._known_labels
+        if self._feature_names is not None:
+            feature_names = [name.encode("utf-8") for name in self._feature_names]
+            h5py_group.create_dataset("feature_names", data=feature_names)
+
+        # This field is required for all classifiers
+        h5py_group["pickled_type"] = pickle.dumps(type(self), 0)
+
+        if self._named_importances:
+            h5py_group.create_dataset("named_importances_keys", data=list(self._named_importances.keys()))
+            h5py_group.create_dataset("named_importances_values", data=list(self._named_importances.values()))
+
+    @classmethod
+    def deserialize_hdf5(cls, h5py_group):
+        """
+        Also loads classifiers stored by ParallelVigraRfLazyflowClassifier and VigraRfLazyflowClassifier.
+        """
+        forests = [
+            CompiledForest.from_hdf5(forest_group)
+            for name, forest_group in sorted(h5py_group.items())
+            if name.startswith("Forest") or name == "forest"
+        ]
+
+        try:
+            known_labels = list(h5py_group["known_labels"][:])
+        except KeyError:
+            # Older projects didn't store the labels explicitly.
+            known_labels = list(range(1, forests[0].class_count + 1))
+
+        try:
+            feature_names = [
+                name.decode("utf-8") if isinstance(name, bytes) else str(name)
+                for name in h5py_group["feature_names"][:]
+            ]
+        except KeyError:
+            # Older projects don't store feature names.
+            feature_names = None
+
+        try:
+            oobs = list(h5py_group["oobs"][:])
+        except KeyError:
+            oobs = [-1.0] * len(forests)
+
+        try:
+            keys = list(map(str, h5py_group["named_importances_keys"][:]))
+            values = h5py_group["named_importances_values"][:]
+            named_importances = collections.OrderedDict(list(zip(keys, values)))
+        except KeyError:
+            named_importances = None
+
+        return cls(forests, known_labels, feature_names, oobs, named_importances)
+
+
+assert issubclass(CompiledRfLazyflowClassifier, LazyflowVectorwiseClassifierABC)
@@ -2,6 +2,8 @@ from builtins import object
 import abc
 from future.utils import with_metaclass
 
+import numpy
+
 
 def _has_attribute(cls, attr):
     return any(attr in B.__dict__ for B in cls.__mro__)
@@ -38,6 +40,23 @@ class LazyflowVectorwiseClassifierFactoryABC(with_metaclass(abc.ABCMeta, object)
         """
         raise NotImplementedError
 
+    def train_incrementally(
+        self, labels_and_features, previous_classifier=None, previous_generation=None, feature_names=None
+    ):
+        """
+        Train a classifier with a matrix of labels (first column) and features (remaining columns).
+
+        If labels_and_features is a TrainingMatrixView, and previous_classifier was trained with the snapshot
+        of the same matrix at previous_generation, labels_and_features.changes_since(previous_generation)
+        tells which rows were added since.  Factories whose classifiers can learn from new samples
+        may update (a copy of) previous_classifier with them instead of training a new classifier.
+
+        By default, a new classifier is trained with create_and_train().
+        """
+        X = labels_and_features[:, 1:]
+        y = labels_and_features[:, 0].astype(numpy.uint32)
+        return self.create_and_train(X, y, feature_names)
+
     def estimated_ram_usage_per_requested_predictionchannel(self):
         """
         Return the RAM (in bytes) needed by the classifier to run classification.
@@ -101,6 +120,15 @@ class LazyflowVectorwiseClassifierABC(with_metaclass(abc.ABCMeta, object)):
         """
         raise NotImplementedError
 
+    def predict_probabilities_partially(self, X, fraction):
+        """
+        Quickly predict provisional probabilities for ``X``, using only (about) the given fraction of the model,
+        e.g. of the trees of a random forest.
+
+        Returns None if the classifier can't do that.
+        """
+        return None
+
     @classmethod
     def __subclasshook__(cls, C):
         if cls is LazyflowVectorwiseClassifierABC:
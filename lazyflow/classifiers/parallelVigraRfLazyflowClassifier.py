@@ -35,7 +35,10 @@ if sys.version_info.major >= 3:
 
 import os
 import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
 from functools import partial
+from multiprocessing import get_context, shared_memory
 import pickle as pickle
 import collections
 
@@ -52,6 +55,99 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+# Size of the row chunks of X that are predicted separately (0: predict all of X at once)
+_prediction_chunk_bytes = 0
+
+
+def setPredictionChunkBytes(nbytes):
+    """
+    Predict in chunks of (about) nbytes of features, e.g. sized to fit into the L2 cache.
+
+    The prediction of each (chunk, forest) pair is a separate request, so only a few chunk-sized
+    probability arrays are in flight at any time, and forests predicting different chunks don't wait
+    for each other to aggregate their results.  With nbytes=0, each forest predicts all of X at once.
+    """
+    global _prediction_chunk_bytes
+    _prediction_chunk_bytes = max(0, int(nbytes))
+
+
+# Number of worker processes that train the forests (0: train them in lazyflow requests, i.e. threads)
+_training_processes = 0
+_training_pool = None
+_training_pool_lock = threading.Lock()
+
+
+def setTrainingProcesses(num_processes):
+    """
+    Train the forests in a pool of num_processes worker processes instead of lazyflow requests.
+
+    Training in threads only runs in parallel as far as vigra releases the GIL.  Worker processes
+    read the training data from shared memory (it is copied there once per training), and send the
+    trained forests back in serialized form.  The workers are started when they are first needed,
+    and are kept for subsequent trainings.  With num_processes=0, forests are trained in threads.
+    """
+    global _training_processes, _training_pool
+    with _training_pool_lock:
+        _training_processes = max(0, int(num_processes))
+        if _training_pool is not None:
+            _training_pool.shutdown(wait=False)
+            _training_pool = None
+
+
+def _get_training_pool():
+    global _training_pool
+    with _training_pool_lock:
+        if _training_pool is None:
+            # Forking a process with running lazyflow threads is not safe
+            _training_pool = ProcessPoolExecutor(_training_processes, mp_context=get_context("spawn"))
+        return _training_pool
+
+
+def _train_forest_in_process(shm_name, X_shape, y_shape, tree_count, kwargs):
+    """
+    Train a forest with the training data in the given shared memory segment (see _train_forests_in_processes()).
+
+    Returns the oob and the forest, as the contents of an hdf5 file.
+    """
+    # Attaching registers the segment with the resource tracker of the parent process,
+    # which stops tracking it when the parent unlinks it.
+    shm = shared_memory.SharedMemory(shm_name)
+    try:
+        X = numpy.ndarray(X_shape, numpy.float32, buffer=shm.buf)
+        y = numpy.ndarray(y_shape, numpy.uint32, buffer=shm.buf, offset=X.nbytes)
+        forest = vigra.learning.RandomForest(tree_count, **kwargs)
+        oob = forest.learnRF(X, y)
+        del X, y
+    finally:
+        shm.close()
+    return oob, _forest_to_bytes(forest)
+
+
+def _forest_to_bytes(forest):
+    # vigra can only write to files (see ParallelVigraRfLazyflowClassifier.serialize_hdf5())
+    tmpDir = tempfile.mkdtemp()
+    cachePath = os.path.join(tmpDir, "tmp_forest.h5").replace("\\", "/")
+    try:
+        forest.writeHDF5(cachePath, "forest")
+        with open(cachePath, "rb") as f:
+            return f.read()
+    finally:
+        if os.path.exists(cachePath):
+            os.remove(cachePath)
+        os.rmdir(tmpDir)
+
+
+def _forest_from_bytes(data):
+    tmpDir = tempfile.mkdtemp()
+    cachePath = os.path.join(tmpDir, "tmp_forest.h5").replace("\\", "/")
+    try:
+        with open(cachePath, "wb") as f:
+            f.write(data)
+        return vigra.learning.RandomForest(cachePath, "forest")
+    finally:
+        os.remove(cachePath)
+        os.rmdir(tmpDir)
+
 
 class ParallelVigraRfLazyflowClassifierFactory(LazyflowVectorwiseClassifierFactoryABC):
     """
@@ -160,6 +256,9 @@ class ParallelVigraRfLazyflowClassifierFactory(LazyflowVectorwiseClassifierFacto
                 forests, X, y, feature_names, export_path=self._variable_importance_path
             )
 
+        elif _training_processes > 0:
+            forests, oobs = self._train_forests_in_processes(tree_counts, X, y, self._kwargs)
+
         else:
             # train classifier without feature importance visitor
 
@@ -189,6 +288,35 @@ class ParallelVigraRfLazyflowClassifierFactory(LazyflowVectorwiseClassifierFacto
         logger.info("Training took, {} seconds".format(train_timer.seconds()))
         return oobs
 
+    @staticmethod
+    def _train_forests_in_processes(tree_counts, X, y, kwargs):
+        """
+        Train forests with the given tree counts in worker processes (see setTrainingProcesses()),
+        and return them and their oobs.
+        """
+        X = numpy.ascontiguousarray(X)
+        y = numpy.ascontiguousarray(y)
+        with Timer() as train_timer:
+            shm = shared_memory.SharedMemory(create=True, size=max(1, X.nbytes + y.nbytes))
+            try:
+                numpy.ndarray(X.shape, X.dtype, buffer=shm.buf)[...] = X
+                numpy.ndarray(y.shape, y.dtype, buffer=shm.buf, offset=X.nbytes)[...] = y
+
+                pool = _get_training_pool()
+                futures = [
+                    pool.submit(_train_forest_in_process, shm.name, X.shape, y.shape, tree_count, kwargs)
+                    for tree_count in tree_counts
+                ]
+                results = [future.result() for future in futures]
+            finally:
+                shm.close()
+                shm.unlink()
+
+            oobs = [oob for oob, _ in results]
+            forests = [_forest_from_bytes(data) for _, data in results]
+        logger.info("Training in {} processes took, {} seconds".format(_training_processes, train_timer.seconds()))
+        return forests, oobs
+
     @staticmethod
     def _train_forests_with_feature_importance(forests, X, y, feature_names, export_path=None):
         """
@@ -330,6 +458,23 @@ class ParallelVigraRfLazyflowClassifier(LazyflowVectorwiseClassifierABC):
 
     def predict_probabilities(self, X):
         logger.debug("Predicting with parallel vigra RF")
+        return self._predict_probabilities(X, self._forests)
+
+    def predict_probabilities_partially(self, X, fraction):
+        """
+        Predict with the first forests only, which hold (at least) the given fraction of all trees.
+        """
+        num_trees = 0
+        for num_forests, forest in enumerate(self._forests, start=1):
+            num_trees += forest.treeCount()
+            if num_trees >= fraction * self._num_trees:
+                break
+        if num_forests == len(self._forests):
+            return None
+        logger.debug("Predicting with {} of {} trees of parallel vigra RF".format(num_trees, self._num_trees))
+        return self._predict_probabilities(X, self._forests[:num_forests])
+
+    def _predict_probabilities(self, X, forests):
         X = numpy.asarray(X, dtype=numpy.float32)
         assert X.ndim == 2
 
@@ -341,6 +486,13 @@ class ParallelVigraRfLazyflowClassifier(LazyflowVectorwiseClassifierABC):
                 X.shape[1], len(self._feature_names), self._feature_names
             )
 
+        num_trees = sum(forest.treeCount() for forest in forests)
+        chunk_rows = len(X)
+        if _prediction_chunk_bytes:
+            chunk_rows = max(1, _prediction_chunk_bytes // max(1, X.shape[1] * X.itemsize))
+        if 0 < chunk_rows < len(X):
+            return self._predict_probabilities_in_chunks(X, forests, num_trees, chunk_rows)
+
         # As each forest completes, aggregate results in a shared array.
         # (Must put in a list so we can update it in this closure.)
         total_predictions = [None]
@@ -356,16 +508,42 @@ class ParallelVigraRfLazyflowClassifier(LazyflowVectorwiseClassifierABC):
 
         # Create a request for each forest
         pool = RequestPool()
-        for forest in self._forests:
+        for forest in forests:
             req = Request(partial(forest.predictProbabilities, X))
             req.notify_finished(partial(update_predictions, forest))
             pool.add(req)
         del req
         pool.wait()
 
-        total_predictions[0] /= self._num_trees
+        total_predictions[0] /= num_trees
         return total_predictions[0]
 
+    def _predict_probabilities_in_chunks(self, X, forests, num_trees, chunk_rows):
+        """
+        Predict X in row chunks of chunk_rows, with one request per (chunk, forest) pair.
+        Each chunk accumulates its predictions under its own lock.
+        """
+        predictions = numpy.zeros((len(X), forests[0].labelCount()), dtype=numpy.float32)
+
+        def predict(forest, chunk_slice, lock):
+            chunk_predictions = forest.predictProbabilities(X[chunk_slice])
+            chunk_predictions *= forest.treeCount()
+            with lock:
+                predictions[chunk_slice] += chunk_predictions
+
+        # Requests are ordered chunk by chunk, so that the forests working on the same chunk at the same
+        # time share it in the cache
+        pool = RequestPool()
+        for start in range(0, len(X), chunk_rows):
+            chunk_slice = slice(start, start + chunk_rows)
+            lock = RequestLock()
+            for forest in forests:
+                pool.add(Request(partial(predict, forest, chunk_slice, lock)))
+        pool.wait()
+
+        predictions /= num_trees
+        return predictions
+
     @property
     def oobs(self):
         return self._oobs
@@ -2,6 +2,7 @@ from __future__ import absolute_import
 from future import standard_library
 
 standard_library.install_aliases()
+import copy
 import pickle as pickle
 import numpy
 import vigra
@@ -67,6 +68,53 @@ class SklearnLazyflowClassifierFactory(LazyflowVectorwiseClassifierFactoryABC):
 assert issubclass(SklearnLazyflowClassifierFactory, LazyflowVectorwiseClassifierFactoryABC)
 
 
+class IncrementalSklearnLazyflowClassifierFactory(SklearnLazyflowClassifierFactory):
+    """
+    A factory for sklearn classifiers that support online learning (i.e. have a partial_fit() method,
+    e.g. sklearn.linear_model.SGDClassifier).
+
+    When only new samples were added since the previous classifier was trained (see train_incrementally()),
+    a copy of it is updated with the new samples instead of training a new classifier with all samples.
+    Removed or changed samples, or samples of classes the previous classifier doesn't know, still require
+    training a new classifier.
+    """
+
+    VERSION = 1
+
+    def __init__(self, classifier_type, *args, **kwargs):
+        assert hasattr(classifier_type, "partial_fit"), "{} does not support online learning".format(
+            classifier_type.__name__
+        )
+        super(IncrementalSklearnLazyflowClassifierFactory, self).__init__(classifier_type, *args, **kwargs)
+
+    def train_incrementally(
+        self, labels_and_features, previous_classifier=None, previous_generation=None, feature_names=None
+    ):
+        changes = None
+        if isinstance(previous_classifier, SklearnLazyflowClassifier) and hasattr(labels_and_features, "changes_since"):
+            changes = labels_and_features.changes_since(previous_generation)
+
+        if changes is not None:
+            added_rows, removed = changes
+            X = numpy.asarray(labels_and_features[added_rows, 1:], numpy.float32)
+            y = numpy.asarray(labels_and_features[added_rows, 0], numpy.uint32)
+            if not removed and numpy.isin(y, previous_classifier.known_classes).all():
+                logger.debug("Updating sklearn classifier with {} new samples".format(len(y)))
+                sklearn_classifier = copy.deepcopy(previous_classifier._sklearn_classifier)
+                if len(y) > 0:
+                    sklearn_classifier.partial_fit(X, y)
+                return SklearnLazyflowClassifier(
+                    sklearn_classifier, previous_classifier.known_classes, X.shape[1], feature_names
+                )
+
+        return super(IncrementalSklearnLazyflowClassifierFactory, self).train_incrementally(
+            labels_and_features, previous_classifier, previous_generation, feature_names
+        )
+
+
+assert issubclass(IncrementalSklearnLazyflowClassifierFactory, LazyflowVectorwiseClassifierFactoryABC)
+
+
 class SklearnLazyflowClassifier(LazyflowVectorwiseClassifierABC):
 
     VERSION = 2  # Used for pickling compatibility
@@ -0,0 +1,298 @@
+###############################################################################
+#   lazyflow: data flow based lazy parallel computation framework
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License
+# as published by the Free Software Foundation; either version 2.1
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# See the files LICENSE.lgpl2 and LICENSE.lgpl3 for full text of the
+# GNU Lesser General Public License version 2.1 and 3 respectively.
+# This information is also available on the ilastik web site at:
+# 		   http://ilastik.org/license/
+###############################################################################
+"""
+Speculative prefetching of cache blocks.
+
+Sweeps through a volume (e.g. scrolling through slices, or a batch export going block by block)
+request the blocks of a cache in a sequential or strided order.  The prefetcher recognizes such
+patterns and schedules the blocks that are expected next as low-priority requests, so that idle
+workers compute them before they are asked for.
+
+Speculative requests are root requests with a lower priority than any regular request, and are
+cancelled as soon as the access pattern breaks.
+"""
+
+import collections
+import itertools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Dict
+
+import numpy
+
+from lazyflow.request import Request
+
+logger = logging.getLogger(__name__)
+
+# Regular root requests have priority [0, n]: background requests always come after them
+BACKGROUND_PRIORITY = [1]
+
+_submitter = None
+_submitter_lock = threading.Lock()
+
+
+def submit_as_root(fn):
+    """
+    Call fn from a thread that does not belong to the request system.
+
+    Requests created from within a request become children of it: they would inherit its priority and
+    could not be cancelled while it is running.  Background requests (e.g. prefetch requests) are created
+    from a separate thread instead.
+    """
+    global _submitter
+    with _submitter_lock:
+        if _submitter is None:
+            _submitter = ThreadPoolExecutor(max_workers=1, thread_name_prefix="lazyflow-prefetch")
+    _submitter.submit(fn)
+
+
+class AccessPatternDetector:
+    """
+    Detect sequential or strided accesses to a block grid.
+
+    Each access is described by the bounding box of the accessed blocks, in block coordinates.
+    A pattern is recognized when the last ``history`` distinct accesses have the same extent
+    and are all shifted by the same (nonzero) stride::
+
+        >>> detector = AccessPatternDetector(history=3)
+        >>> for z in (0, 2, 4):
+        ...     stride = detector.record((z, 0), (z + 1, 3))
+        >>> stride
+        (2, 0)
+        >>> detector.predict(2)
+        [((6, 0), (7, 3)), ((8, 0), (9, 3))]
+    """
+
+    def __init__(self, history=3):
+        assert history >= 2, "At least two accesses are needed to determine a stride"
+        self._history = collections.deque(maxlen=history)
+        self._stride = None
+
+    @property
+    def stride(self):
+        """The stride of the current pattern, or None"""
+        return self._stride
+
+    def record(self, start, stop):
+        """
+        Record an access to the blocks in [start, stop) and return the stride of the current pattern (or None).
+
+        Repeated accesses to the same blocks (e.g. several tiles of the same slice) do not change the state.
+        """
+        bbox = (tuple(map(int, start)), tuple(map(int, stop)))
+        if self._history and self._history[-1] == bbox:
+            return self._stride
+
+        self._history.append(bbox)
+        self._stride = None
+        if len(self._history) == self._history.maxlen:
+            starts = numpy.array([b[0] for b in self._history])
+            extents = numpy.array([numpy.subtract(b[1], b[0]) for b in self._history])
+            strides = numpy.diff(starts, axis=0)
+            if (extents == extents[0]).all() and (strides == strides[0]).all() and strides[0].any():
+                self._stride = tuple(int(s) for s in strides[0])
+        return self._stride
+
+    def predict(self, steps):
+        """The next ``steps`` accesses, if the pattern continues"""
+        if self._stride is None:
+            return []
+        start, stop = self._history[-1]
+        return [
+            (
+                tuple(b + s * i for b, s in zip(start, self._stride)),
+                tuple(e + s * i for e, s in zip(stop, self._stride)),
+            )
+            for i in range(1, steps + 1)
+        ]
+
+    def reset(self):
+        self._history.clear()
+        self._stride = None
+
+
+class BlockPrefetcher:
+    """
+    Schedule the blocks a cache is expected to be asked for next.
+
+    The cache calls :py:meth:`access` with the blocks of every request.  Once a pattern is recognized,
+    up to ``depth`` of the predicted blocks are requested in the background (via ``fetch_block``).
+    When the pattern breaks, all speculative requests that did not start yet are cancelled.
+
+    With ``depth <= 0``, prefetching is disabled.
+    """
+
+    def __init__(self, fetch_block, is_cached, depth=0, history=3):
+        """
+        :param fetch_block: callable(block_roi) that computes the block and stores it in the cache
+        :param is_cached: callable(block_roi) -> True if the block does not need to be fetched
+        :param depth: maximum number of blocks to prefetch ahead
+        :param history: number of accesses that must follow the same stride before prefetching starts
+        """
+        self._fetch_block = fetch_block
+        self._is_cached = is_cached
+        self.depth = depth
+        self._detector = AccessPatternDetector(history)
+        self._lock = threading.Lock()
+        # block roi -> prefetch Request, or None while its submission is queued
+        self._pending = collections.OrderedDict()
+        # Recently prefetched blocks, to count hits
+        self._prefetched = collections.OrderedDict()
+        self.resetStats()
+
+    @property
+    def enabled(self):
+        return self.depth > 0
+
+    def resetStats(self):
+        with self._lock:
+            self._stats = {"scheduled": 0, "completed": 0, "cancelled": 0, "hits": 0}
+
+    def getStats(self) -> Dict[str, int]:
+        """
+        Return counters since the last reset:
+
+        * scheduled: blocks requested speculatively
+        * completed: speculative requests that finished
+        * cancelled: speculative requests cancelled because the access pattern changed
+        * hits: accesses to blocks that had been prefetched
+        """
+        with self._lock:
+            return dict(self._stats)
+
+    def access(self, block_rois, block_shape, dataset_shape, max_blocks=None):
+        """
+        Record an access to the given (full) block rois and update the speculative requests.
+
+        :param block_rois: the block rois of the current request, as (start, stop) pairs
+        :param block_shape: the block shape of the cache
+        :param dataset_shape: the shape of the cached volume
+        :param max_blocks: further limit on the number of blocks to prefetch (e.g. due to memory)
+        :returns: the block rois that were scheduled
+        """
+        if not self.enabled or not block_rois:
+            return []
+
+        block_rois = [(tuple(map(int, start)), tuple(map(int, stop))) for start, stop in block_rois]
+        block_shape = numpy.asarray(block_shape)
+        starts = numpy.array([start for start, _ in block_rois]) // block_shape
+        grid_shape = (numpy.asarray(dataset_shape) + block_shape - 1) // block_shape
+        stride = self._detector.record(starts.min(axis=0), starts.max(axis=0) + 1)
+
+        limit = self.depth if max_blocks is None else min(self.depth, max_blocks)
+        predicted = []
+        if stride is not None:
+            predicted = self._predictedBlocks(block_shape, dataset_shape, grid_shape, set(block_rois), limit)
+        # (Not while holding self._lock: is_cached() may have to wait for the cache's RequestLock)
+        uncached = [roi for roi in predicted if not self._is_cached(roi)]
+
+        with self._lock:
+            for block_roi in block_rois:
+                if self._prefetched.pop(block_roi, False):
+                    self._stats["hits"] += 1
+            # Don't cancel what is needed right now: the current request may be waiting for it
+            keep = set(predicted) | set(block_rois)
+            self._cancel([roi for roi in self._pending if roi not in keep])
+            scheduled = [roi for roi in uncached if roi not in self._pending]
+            for block_roi in scheduled:
+                self._pending[block_roi] = None
+            self._stats["scheduled"] += len(scheduled)
+
+        if scheduled:
+            submit_as_root(partial(self._submit, scheduled))
+        return scheduled
+
+    def _predictedBlocks(self, block_shape, dataset_shape, grid_shape, exclude, limit):
+        predicted = []
+        # Bounded, in case the stride leads outside of the grid slowly, e.g. along a very long axis
+        for start, stop in self._detector.predict(limit):
+            start = numpy.maximum(start, 0)
+            stop = numpy.minimum(stop, grid_shape)
+            if (start >= stop).any():
+                break
+            for index in itertools.product(*map(range, start, stop)):
+                block_start = numpy.multiply(index, block_shape)
+                block_stop = numpy.minimum(block_start + block_shape, dataset_shape)
+                block_roi = (tuple(map(int, block_start)), tuple(map(int, block_stop)))
+                if block_roi not in exclude:
+                    predicted.append(block_roi)
+                if len(predicted) >= limit:
+                    return predicted
+        return predicted
+
+    def _submit(self, block_rois):
+        for block_roi in block_rois:
+            with self._lock:
+                if block_roi not in self._pending:
+                    # Cancelled before it was submitted
+                    continue
+                req = Request(partial(self._fetch_block, block_roi), root_priority=BACKGROUND_PRIORITY)
+                self._pending[block_roi] = req
+            req.notify_finished(partial(self._finished, block_roi, req))
+            req.notify_failed(partial(self._failed, block_roi, req))
+            req.notify_cancelled(partial(self._forget, block_roi, req))
+            req.submit()
+
+    def _finished(self, block_roi, req, result):
+        with self._lock:
+            if self._forget_unlocked(block_roi, req):
+                self._stats["completed"] += 1
+                self._prefetched[block_roi] = True
+                while len(self._prefetched) > 4 * max(1, self.depth):
+                    self._prefetched.popitem(last=False)
+
+    def _failed(self, block_roi, req, exc, exc_info):
+        logger.debug(f"Prefetching block {block_roi} failed: {exc}")
+        self._forget(block_roi, req)
+
+    def _forget(self, block_roi, req):
+        with self._lock:
+            self._forget_unlocked(block_roi, req)
+
+    def _forget_unlocked(self, block_roi, req):
+        if self._pending.get(block_roi) is req:
+            del self._pending[block_roi]
+            return True
+        return False
+
+    def _cancel(self, block_rois):
+        # Must hold _lock
+        for block_roi in block_rois:
+            req = self._pending.pop(block_roi)
+            self._stats["cancelled"] += 1
+            if req is not None:
+                req.cancel()
+
+    def cancel(self):
+        """
+        Cancel all speculative requests and forget the access history, e.g. because the data became dirty.
+        """
+        with self._lock:
+            self._detector.reset()
+            self._cancel(list(self._pending))
+            self._prefetched.clear()
+
+    def pendingBlocks(self):
+        with self._lock:
+            return list(self._pending)
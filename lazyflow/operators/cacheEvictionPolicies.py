@@ -0,0 +1,157 @@
+###############################################################################
+#   lazyflow: data flow based lazy parallel computation framework
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License
+# as published by the Free Software Foundation; either version 2.1
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# See the files LICENSE.lgpl2 and LICENSE.lgpl3 for full text of the
+# GNU Lesser General Public License version 2.1 and 3 respectively.
+# This information is also available on the ilastik web site at:
+# 		   http://ilastik.org/license/
+###############################################################################
+"""
+Eviction policies for the cache memory manager.
+
+A policy ranks everything the memory manager may free (whole caches and single blocks)
+and hands out the next victim on request.  The ranking is kept in a persistent heap:
+on each cleanup pass the manager reports the current state of every entry via ``update()``,
+and only entries that are new or were accessed since the previous pass are (re-)pushed.
+Stale heap items are skipped lazily when popping.
+"""
+
+import heapq
+import itertools
+from abc import ABCMeta, abstractmethod
+from typing import Hashable, Iterable, NamedTuple, Optional
+
+
+class EvictionEntry(NamedTuple):
+    #: Identifies what to free, e.g. (cache weakref, block id)
+    key: Hashable
+    #: python timestamp of the last access
+    last_access: float
+    #: size in bytes (0 if unknown)
+    size: float
+    #: seconds it took to compute the data (None if unknown)
+    cost: Optional[float]
+
+
+class EvictionPolicy(metaclass=ABCMeta):
+    def __init__(self):
+        self._heap = []
+        # key -> (last_access, heap item) of the valid heap item for each entry
+        self._entries = {}
+        self._counter = itertools.count()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @abstractmethod
+    def priority(self, entry: EvictionEntry) -> float:
+        """
+        Priority of an entry that was just inserted or accessed.  Lowest priority is evicted first.
+        """
+        ...
+
+    def update(self, entries: Iterable[EvictionEntry]):
+        """
+        Synchronize the policy with the entries that can currently be freed.
+
+        Entries that are not listed any more are forgotten.
+        Only entries that are new or have a different access time are re-prioritized.
+        """
+        entries = list(entries)
+        self._prepare(entries)
+        current = {}
+        for entry in entries:
+            known = self._entries.get(entry.key)
+            if known is not None and known[0] == entry.last_access:
+                current[entry.key] = known
+            else:
+                item = [self.priority(entry), next(self._counter), entry.key]
+                heapq.heappush(self._heap, item)
+                current[entry.key] = (entry.last_access, item)
+        self._entries = current
+
+        # Drop stale items once they dominate the heap
+        if len(self._heap) > 2 * len(self._entries) + 64:
+            self._heap = [item for _, item in self._entries.values()]
+            heapq.heapify(self._heap)
+
+    def _prepare(self, entries):
+        """Hook for policies that need statistics over all entries before prioritizing."""
+        pass
+
+    def pop(self) -> Optional[Hashable]:
+        """
+        Remove and return the key of the next entry to evict, or None if there is nothing left.
+        """
+        while self._heap:
+            item = heapq.heappop(self._heap)
+            priority, _, key = item
+            known = self._entries.get(key)
+            if known is not None and known[1] is item:
+                del self._entries[key]
+                self._evicted(priority)
+                return key
+        return None
+
+    def _evicted(self, priority):
+        pass
+
+
+class LRUEvictionPolicy(EvictionPolicy):
+    """
+    Evict the least recently used entry first.
+    """
+
+    def priority(self, entry):
+        return entry.last_access
+
+
+class GreedyDualSizeEvictionPolicy(EvictionPolicy):
+    """
+    GreedyDual-Size (Cao & Irani, 1997): weigh the cost of recomputing an entry against its size and recency.
+
+    Each entry gets the priority ``H = L + cost / size`` when it is inserted or accessed,
+    where ``L`` is the priority of the most recently evicted entry.
+    Since ``L`` only grows, entries that are not accessed age relative to fresh ones,
+    while blocks that are expensive to recompute per byte (e.g. features, predictions)
+    outlive cheap ones (e.g. raw data).
+
+    Entries without a measured cost are assumed to cost the average cost per byte of the measured ones.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._inflation = 0.0
+        self._default_cost_per_byte = 0.0
+
+    def _prepare(self, entries):
+        measured = [(e.cost, e.size) for e in entries if e.cost is not None and e.size > 0]
+        total_size = sum(size for _, size in measured)
+        if total_size > 0:
+            self._default_cost_per_byte = sum(cost for cost, _ in measured) / total_size
+
+    def priority(self, entry):
+        if entry.cost is None or entry.size <= 0:
+            cost_per_byte = self._default_cost_per_byte
+        else:
+            cost_per_byte = entry.cost / entry.size
+        return self._inflation + cost_per_byte
+
+    def _evicted(self, priority):
+        self._inflation = max(self._inflation, priority)
+
+
+eviction_policies = {"lru": LRUEvictionPolicy, "gds": GreedyDualSizeEvictionPolicy}
@@ -26,15 +26,14 @@ from __future__ import division
 import gc
 import threading
 import weakref
-import functools
 import atexit
 import warnings
 
-
 # lazyflow
 from lazyflow.utility import OrderedSignal
 from lazyflow.utility import log_exception
 from lazyflow.utility import Memory
+from lazyflow.operators.cacheEvictionPolicies import EvictionEntry, LRUEvictionPolicy, eviction_policies
 
 
 import logging
@@ -43,6 +42,9 @@ logger = logging.getLogger(__name__)
 
 default_refresh_interval = 10
 
+# Block id used in eviction keys of caches that can only be freed as a whole
+_WHOLE_CACHE = None
+
 
 class _CacheMemoryManager(threading.Thread):
     """
@@ -72,6 +74,20 @@ class _CacheMemoryManager(threading.Thread):
 
     the interval is measured in seconds. Each change of refresh interval
     triggers cleanup.
+
+    In the default (polling) mode, the manager measures the caches on every
+    interval. In event-driven mode, caches report their allocations as they
+    happen (see ObservableCache.reportMemoryChange()): the manager keeps a
+    running total, starts cleaning up as soon as the budget is exceeded and
+    makes new block fetches wait (see ObservableCache.waitForCacheMemory())
+    until the cleanup is done::
+
+        cache_mem_manager.setEventDriven(True)
+
+    Which blocks are freed first is decided by an eviction policy
+    (see lazyflow.operators.cacheEvictionPolicies), least recently used by default::
+
+        cache_mem_manager.setEvictionPolicy("gds")
     """
 
     totalCacheMemory = OrderedSignal()
@@ -97,6 +113,30 @@ class _CacheMemoryManager(threading.Thread):
         # target usage fraction
         self._target_usage = 0.90
 
+        self._eviction_policy = LRUEvictionPolicy()
+
+        # Event-driven mode
+        self._event_driven = False
+        self._reported_lock = threading.Lock()
+        # weakref(cache) -> bytes currently reported by that cache
+        self._reported_memory = {}
+        self._reported_total = 0
+        # weakrefs of garbage collected caches, whose share is subtracted lazily
+        # (weakref callbacks may run at any point, even while _reported_lock is held)
+        self._dead_caches = []
+        # Notified after each cleanup pass, to release fetches waiting for memory
+        self._backpressure_condition = threading.Condition()
+        self._cleanup_passes = 0
+        # Upper limit for how long a fetch waits for memory to be freed
+        self._backpressure_timeout = 10.0
+        # Set when a cache exceeds the budget while a cleanup pass is already running
+        self._cleanup_requested = False
+        # Cache memory measured by the last cleanup pass (polling mode)
+        self._last_total = 0
+        # Memory of the caches that do not report their allocations,
+        # measured by the last cleanup pass (event-driven mode)
+        self._unreported_total = 0
+
         self._stopped = False
         self.start()
         atexit.register(self.stop)
@@ -180,9 +220,18 @@ class _CacheMemoryManager(threading.Thread):
             with self._first_class_caches_lock:
                 first_class_caches = self._first_class_caches.copy()
 
-            for cache in first_class_caches:
-                if isinstance(cache, ObservableCache):
-                    total += cache.usedMemory()
+            if self._event_driven:
+                # No need to measure the caches that told us already, but keep polling the others
+                unreported = 0
+                for cache in first_class_caches:
+                    unreported += self._unreportedMemory(cache)
+                self._unreported_total = unreported
+                total = self.reportedMemory() + unreported
+            else:
+                for cache in first_class_caches:
+                    if isinstance(cache, ObservableCache):
+                        total += cache.usedMemory()
+            self._last_total = total
             self.totalCacheMemory(total)
             cache = None
 
@@ -204,27 +253,28 @@ class _CacheMemoryManager(threading.Thread):
             if total <= self._max_usage * cache_memory:
                 return
 
-            cache_entries = []
-            cache_entries += [
-                (cache.lastAccessTime(), cache.name, cache.freeMemory) for cache in list(self._managed_caches)
-            ]
-            cache_entries += [
-                (lastAccessTime, f"{cache.name}: {blockKey}", functools.partial(cache.freeBlock, blockKey))
-                for cache in list(self._managed_blocked_caches)
-                for blockKey, lastAccessTime in cache.getBlockAccessTimes()
-            ]
-            cache_entries.sort(key=lambda entry: entry[0])
-
-            for lastAccessTime, info, cleanupFun in cache_entries:
-                if total <= self._target_usage * cache_memory:
+            policy = self._eviction_policy
+            policy.update(self._evictionEntries())
+
+            while total > self._target_usage * cache_memory:
+                key = policy.pop()
+                if key is None:
                     break
-                mem = cleanupFun()
+                cache_ref, block_id = key
+                cache = cache_ref()
+                if cache is None:
+                    continue
+                if block_id is _WHOLE_CACHE:
+                    mem = cache.freeMemory()
+                    info = cache.name
+                else:
+                    mem = cache.freeBlock(block_id)
+                    info = f"{cache.name}: {block_id}"
                 logger.debug(f"Cleaned up {info} ({Memory.format(mem)})")
                 total -= mem
 
-            # Remove references to cache entries before triggering garbage collection.
-            cleanupFun = None
-            cache_entries = None
+            # Remove references to caches before triggering garbage collection.
+            cache = None
             gc.collect()
 
             msg = "Done cleaning up, cache memory usage is now at {}".format(Memory.format(total))
@@ -233,13 +283,145 @@ class _CacheMemoryManager(threading.Thread):
             logger.debug(msg)
         except:
             log_exception(logger)
+        finally:
+            with self._backpressure_condition:
+                self._cleanup_passes += 1
+                self._backpressure_condition.notify_all()
+
+    def _unreportedMemory(self, cache):
+        """
+        measure the memory of cache and its children, skipping the caches that report their allocations
+
+        A cache with observable children is assumed to hold its memory in those children
+        (like OpBlockedArrayCache and OpSlicedBlockedArrayCache do).
+        """
+        from lazyflow.operators.opCache import ObservableCache
+
+        if not isinstance(cache, ObservableCache) or cache.reportsMemoryChanges:
+            return 0
+        children = [child for child in cache.children if isinstance(child, ObservableCache)]
+        if not children:
+            return cache.usedMemory()
+        return sum(self._unreportedMemory(child) for child in children)
+
+    def reportAllocation(self, cache, nbytes):
+        """
+        Add nbytes (negative when memory was released) to the running total of the given cache.
+
+        In event-driven mode, this wakes up the manager thread as soon as the cache budget is exceeded.
+        """
+        with self._reported_lock:
+            self._forgetDeadCaches()
+            key = weakref.ref(cache)
+            if key not in self._reported_memory:
+                # Forget the cache's share when it is garbage collected without freeing its memory
+                key = weakref.ref(cache, self._forgetCache)
+                self._reported_memory[key] = 0
+            self._reported_memory[key] += nbytes
+            self._reported_total += nbytes
+
+        if nbytes > 0 and self._event_driven and self._isOverBudget():
+            self._requestCleanup()
+
+    def _requestCleanup(self):
+        with self._condition:
+            self._cleanup_requested = True
+            self._condition.notify()
+
+    def _forgetCache(self, key):
+        self._dead_caches.append(key)
+
+    def _forgetDeadCaches(self):
+        # Must hold _reported_lock
+        while self._dead_caches:
+            self._reported_total -= self._reported_memory.pop(self._dead_caches.pop(), 0)
+
+    def reportedMemory(self):
+        """
+        get the running total of the memory reported by all caches
+        """
+        with self._reported_lock:
+            self._forgetDeadCaches()
+            return self._reported_total
+
+    def availableMemory(self):
+        """
+        Estimate how many bytes the caches may still allocate before a cleanup is due.
+
+        In event-driven mode this is based on the running total reported by the caches,
+        otherwise on the measurement of the last cleanup pass.
+        """
+        used = self.reportedMemory() + self._unreported_total if self._event_driven else self._last_total
+        return max(0, int(self._max_usage * Memory.getAvailableRamCaches() - used))
+
+    def _isOverBudget(self):
+        return self._reported_total + self._unreported_total > self._max_usage * Memory.getAvailableRamCaches()
+
+    def waitForMemory(self, timeout=None):
+        """
+        In event-driven mode, block while the cache budget is exceeded.
+
+        Returns when the reported cache memory drops below the budget, when the
+        manager finished a cleanup pass (even if it could not free enough,
+        e.g. because all memory is held by blocks in use), or after the timeout.
+        Returns False only if the budget is still exceeded at that point.
+        """
+        if not self._event_driven or self._disabled or not self._isOverBudget():
+            return True
+
+        if timeout is None:
+            timeout = self._backpressure_timeout
+        with self._backpressure_condition:
+            passes = self._cleanup_passes
+            self._requestCleanup()
+            self._backpressure_condition.wait_for(
+                lambda: self._cleanup_passes > passes or self._stopped or not self._isOverBudget(), timeout
+            )
+        return not self._isOverBudget()
+
+    def setEventDriven(self, enabled):
+        """
+        Switch between polling the caches on every refresh interval (default)
+        and cleaning up as soon as the caches report exceeding the budget.
+        """
+        self._event_driven = bool(enabled)
+        with self._condition:
+            self._condition.notifyAll()
+
+    def _evictionEntries(self):
+        """
+        Describe everything that can be freed, for the eviction policy.
+        """
+        for cache in list(self._managed_caches):
+            yield EvictionEntry((weakref.ref(cache), _WHOLE_CACHE), cache.lastAccessTime(), cache.usedMemory(), None)
+
+        for cache in list(self._managed_blocked_caches):
+            cache_ref = weakref.ref(cache)
+            costs = {block_id: (cost, size) for block_id, cost, size in cache.getBlockComputeCosts()}
+            for block_id, last_access in cache.getBlockAccessTimes():
+                cost, size = costs.get(block_id, (None, 0))
+                yield EvictionEntry((cache_ref, block_id), last_access, size, cost)
+
+    def setEvictionPolicy(self, policy):
+        """
+        Set the policy that decides which cache blocks are freed first.
+
+        :param policy: an EvictionPolicy instance, or the name of one of the
+                       built-in policies ("lru" or "gds", see cacheEvictionPolicies)
+        """
+        if isinstance(policy, str):
+            policy = eviction_policies[policy]()
+        with self._disable_lock:
+            self._eviction_policy = policy
 
     def _wait(self):
         """
         sleep for _refresh_interval seconds or until woken up
         """
         with self._condition:
-            self._condition.wait(self._refresh_interval)
+            if not self._cleanup_requested:
+                self._condition.wait(self._refresh_interval)
+            self._cleanup_requested = False
 
     def stop(self):
         """
@@ -300,3 +482,23 @@ def addFirstClassCache(cache):
 
 def setRefreshInterval(seconds):
     _cache_memory_manager.setRefreshInterval(seconds)
+
+
+def setEvictionPolicy(policy):
+    _cache_memory_manager.setEvictionPolicy(policy)
+
+
+def setEventDriven(enabled):
+    _cache_memory_manager.setEventDriven(enabled)
+
+
+def reportAllocation(cache, nbytes):
+    _cache_memory_manager.reportAllocation(cache, nbytes)
+
+
+def waitForMemory(timeout=None):
+    return _cache_memory_manager.waitForMemory(timeout)
+
+
+def availableMemory():
+    return _cache_memory_manager.availableMemory()
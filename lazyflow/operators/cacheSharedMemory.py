@@ -0,0 +1,377 @@
+###############################################################################
+#   lazyflow: data flow based lazy parallel computation framework
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License
+# as published by the Free Software Foundation; either version 2.1
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# See the files LICENSE.lgpl2 and LICENSE.lgpl3 for full text of the
+# GNU Lesser General Public License version 2.1 and 3 respectively.
+# This information is also available on the ilastik web site at:
+# 		   http://ilastik.org/license/
+###############################################################################
+"""
+Cache blocks shared between processes on the same node.
+
+Several headless processes working on the same data (e.g. one per dataset, or MPI ranks on one node)
+would each compute and keep their own copy of the same raw data and feature blocks.
+With a shared memory store configured, the array caches publish every block they compute as a
+POSIX shared memory segment, and look for a segment published by a sibling process before computing
+a block themselves.  Blocks read from a segment are mapped, not copied.
+
+Segments are named after a content hash of the upstream graph (see upstreamContentHash()) and the
+block roi, so processes find each other's blocks without any coordination.
+Each process keeps its own published segments within a size budget (unlinking the oldest ones when
+it is exceeded), and all of them are unlinked when it exits.  Processes that mapped a segment can
+keep using it after it was unlinked.
+
+The store is disabled by default; enable it in every process with::
+
+    from lazyflow.operators import cacheSharedMemory
+    cacheSharedMemory.setSharedMemoryStore(cacheSharedMemory.SharedMemoryStore(max_bytes=8 * 2 ** 30))
+"""
+
+import collections
+import hashlib
+import logging
+import struct
+import threading
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy
+
+logger = logging.getLogger(__name__)
+
+# The header holds a flag that is set once the data is completely written
+_HEADER_BYTES = 64
+_READY = 1
+
+
+class UnhashableGraph(Exception):
+    """
+    The upstream graph contains an operator whose outputs do not only depend on its inputs.
+    """
+
+
+# Values whose repr() is complete (unlike e.g. the repr() of large arrays, which is abbreviated)
+_REPR_TYPES = (type(None), bool, int, float, complex, str, bytes, slice, type, numpy.generic, numpy.dtype)
+
+
+def _value_digest(value):
+    h = hashlib.blake2b(digest_size=16)
+    _update_value_digest(h, value)
+    return h.digest()
+
+
+def _update_value_digest(h, value):
+    if isinstance(value, numpy.ma.MaskedArray):
+        h.update(b"masked")
+        _update_value_digest(h, value.data)
+        _update_value_digest(h, numpy.ma.getmaskarray(value))
+        _update_value_digest(h, value.fill_value)
+    elif isinstance(value, numpy.ndarray) and value.dtype != object:
+        h.update(b"ndarray")
+        h.update(value.dtype.str.encode())
+        h.update(repr(value.shape).encode())
+        h.update(str(getattr(value, "axistags", "")).encode())
+        h.update(numpy.ascontiguousarray(value).view(numpy.uint8).data)
+    elif isinstance(value, (list, tuple, numpy.ndarray)):
+        h.update(type(value).__qualname__.encode())
+        h.update(repr(numpy.shape(value) if isinstance(value, numpy.ndarray) else len(value)).encode())
+        for item in value.flat if isinstance(value, numpy.ndarray) else value:
+            _update_value_digest(h, item)
+    elif isinstance(value, dict):
+        h.update(b"dict")
+        h.update(repr(len(value)).encode())
+        for key, item in value.items():
+            _update_value_digest(h, key)
+            _update_value_digest(h, item)
+    elif isinstance(value, _REPR_TYPES):
+        h.update(type(value).__qualname__.encode())
+        h.update(repr(value).encode())
+    else:
+        raise UnhashableGraph("Can't hash values of type {}".format(type(value).__qualname__))
+
+
+class _GraphHasher:
+    def __init__(self):
+        self._slot_digests = {}
+        self._op_digests = {}
+        self._visiting = set()
+
+    def slot(self, slot):
+        key = id(slot)
+        if key not in self._slot_digests:
+            self._slot_digests[key] = self._slot(slot)
+        return self._slot_digests[key]
+
+    def _slot(self, slot):
+        h = hashlib.blake2b(digest_size=16)
+        if slot.upstream_slot is not None:
+            h.update(b"connected")
+            h.update(self.slot(slot.upstream_slot))
+        elif slot.level > 0 and slot._type == "input":
+            h.update(b"multi")
+            for subslot in slot._subSlots:
+                h.update(self.slot(subslot))
+        elif slot._type == "input":
+            h.update(b"value")
+            h.update(_value_digest(slot._value))
+        else:
+            h.update(b"output")
+            h.update(self.operator(slot.operator))
+            h.update(slot.top_level_slot.name.encode())
+            h.update(repr(slot.subindex).encode())
+        return h.digest()
+
+    def operator(self, op):
+        key = id(op)
+        if key in self._op_digests:
+            return self._op_digests[key]
+        if getattr(op, "_has_hidden_state", False):
+            raise UnhashableGraph("{} holds state that is not determined by its inputs".format(op.name))
+        if key in self._visiting:
+            raise UnhashableGraph("Cycle in the graph at {}".format(op.name))
+
+        self._visiting.add(key)
+        try:
+            h = hashlib.blake2b(digest_size=16)
+            h.update("{}.{}".format(type(op).__module__, type(op).__qualname__).encode())
+            for name in sorted(op.inputs):
+                h.update(name.encode())
+                h.update(self.slot(op.inputs[name]))
+        finally:
+            self._visiting.discard(key)
+        self._op_digests[key] = h.hexdigest().encode()
+        return self._op_digests[key]
+
+
+# Incremented whenever an operator acquires hidden state, see markHiddenState()
+_hidden_state_generation = 0
+
+
+def markHiddenState(op):
+    """
+    Declare that the data of op is not determined by its inputs alone any more (e.g. because data was set into
+    a cache).  Graph hashes computed before that are outdated then, see hiddenStateGeneration().
+    """
+    global _hidden_state_generation
+    if not getattr(op, "_has_hidden_state", False):
+        op._has_hidden_state = True
+        _hidden_state_generation += 1
+
+
+def hiddenStateGeneration():
+    return _hidden_state_generation
+
+
+def upstreamContentHash(slot):
+    """
+    Hash everything that determines the data of the given slot: the types of all upstream operators,
+    how they are connected, and the values of all unconnected input slots.
+
+    Two slots (in the same or in different processes) with the same hash provide the same data,
+    as long as the external resources they read from (e.g. files) are the same.
+    Operators that hold data which does not come from their inputs (e.g. user labels) declare so with
+    a ``_has_hidden_state = True`` class (or instance, e.g. once data was set into a cache) attribute;
+    graphs that contain such operators raise UnhashableGraph.
+    """
+    return _GraphHasher().slot(slot).hex()
+
+
+class _Mapping:
+    """
+    Exposes the data part of a segment to numpy.
+
+    Arrays created from it keep it, and with it the mapped segment, alive.
+    """
+
+    def __init__(self, shm, shape, dtype, readonly):
+        # The temporary array must be gone before the segment can be closed
+        probe = numpy.frombuffer(shm.buf, dtype=numpy.uint8, count=1)
+        address = probe.__array_interface__["data"][0] + _HEADER_BYTES
+        del probe
+        self._shm = shm
+        self.__array_interface__ = {
+            "version": 3,
+            "shape": tuple(shape),
+            "typestr": numpy.dtype(dtype).str,
+            "data": (address, readonly),
+        }
+
+
+def _as_array(shm, shape, dtype, readonly=True):
+    return numpy.asarray(_Mapping(shm, shape, dtype, readonly))
+
+
+def _attach(name):
+    try:
+        shm = shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        # Before Python 3.13, attaching also registers the segment with this process' resource tracker,
+        # which would unlink it at exit, although it belongs to another process
+        shm = shared_memory.SharedMemory(name)
+        resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+
+class SharedMemoryStore:
+    """
+    Thread-safe access to cache blocks in shared memory.
+
+    Blocks are identified by segment names (see blockName()).  Blocks returned by get() and put()
+    are read-only arrays mapped to the shared memory.
+    """
+
+    def __init__(self, max_bytes, prefix="lzf"):
+        """
+        :param max_bytes: budget for the segments published by this process
+        :param prefix: prefix of all segment names (at most 7 characters), to separate unrelated groups of processes
+        """
+        assert len(prefix) <= 7, "Segment names must not be longer than 31 characters"
+        self._max_bytes = max_bytes
+        self._prefix = prefix
+        self._lock = threading.Lock()
+        # segment name -> bytes, least recently published first
+        self._published = collections.OrderedDict()
+        self._used_bytes = 0
+        self._stats = {"hits": 0, "misses": 0, "published": 0}
+
+    def maxBytes(self):
+        return self._max_bytes
+
+    def usedBytes(self):
+        with self._lock:
+            return self._used_bytes
+
+    def __len__(self):
+        with self._lock:
+            return len(self._published)
+
+    def getStats(self):
+        """
+        hits/misses of get() and the number of blocks published by put() in this process
+        """
+        with self._lock:
+            return dict(self._stats)
+
+    def blockName(self, graph_hash, block_roi, dtype):
+        """
+        Name of the segment of the given block of a slot whose upstreamContentHash() is graph_hash
+        """
+        h = hashlib.blake2b(digest_size=12)
+        h.update(graph_hash.encode())
+        h.update(repr((tuple(map(int, block_roi[0])), tuple(map(int, block_roi[1])))).encode())
+        h.update(numpy.dtype(dtype).str.encode())
+        # Short enough for the 31 character limit of some platforms
+        return self._prefix + h.hexdigest()
+
+    def get(self, name, shape, dtype):
+        """
+        Map the block published under the given name, or return None if no (complete) block was published.
+        """
+        nbytes = int(numpy.prod(shape)) * numpy.dtype(dtype).itemsize
+        try:
+            shm = _attach(name)
+        except FileNotFoundError:
+            shm = None
+        if shm is not None and (shm.size < _HEADER_BYTES + nbytes or struct.unpack_from("<Q", shm.buf)[0] != _READY):
+            # Still being written by its owner (or something else entirely)
+            shm.close()
+            shm = None
+        with self._lock:
+            self._stats["hits" if shm is not None else "misses"] += 1
+        if shm is None:
+            return None
+        return _as_array(shm, shape, dtype)
+
+    def put(self, name, data):
+        """
+        Publish a copy of data under the given name and return the shared block,
+        or None if the block was not published (too large, or published by another process already).
+        """
+        data = numpy.asarray(data)
+        nbytes = data.nbytes
+        if nbytes > self._max_bytes:
+            return None
+        try:
+            shm = shared_memory.SharedMemory(name, create=True, size=_HEADER_BYTES + max(nbytes, 1))
+        except FileExistsError:
+            return None
+        except OSError as e:
+            logger.warning(f"Could not create shared memory segment for cache block: {e}")
+            return None
+
+        target = _as_array(shm, data.shape, data.dtype, readonly=False)
+        target[...] = data
+        del target
+        struct.pack_into("<Q", shm.buf, 0, _READY)
+
+        with self._lock:
+            self._published[name] = nbytes
+            self._used_bytes += nbytes
+            self._stats["published"] += 1
+            expired = []
+            while self._used_bytes > self._max_bytes:
+                old_name, old_bytes = self._published.popitem(last=False)
+                self._used_bytes -= old_bytes
+                expired.append(old_name)
+        for old_name in expired:
+            self._unlink(old_name)
+        return _as_array(shm, data.shape, data.dtype)
+
+    def discard(self, name):
+        """
+        Unlink the segment with the given name (e.g. because its data is outdated), if it exists.
+        Processes that mapped it already keep their mapping.
+        """
+        with self._lock:
+            nbytes = self._published.pop(name, None)
+            if nbytes is not None:
+                self._used_bytes -= nbytes
+        self._unlink(name)
+
+    def clear(self):
+        """
+        Unlink all segments published by this process.
+        """
+        with self._lock:
+            names = list(self._published)
+            self._published.clear()
+            self._used_bytes = 0
+        for name in names:
+            self._unlink(name)
+
+    @staticmethod
+    def _unlink(name):
+        try:
+            shm = shared_memory.SharedMemory(name)
+        except FileNotFoundError:
+            return
+        # Also unregisters the segment from the resource tracker
+        shm.unlink()
+        shm.close()
+
+
+_shared_memory_store = None
+
+
+def setSharedMemoryStore(store):
+    """
+    Set the SharedMemoryStore that the array caches share their blocks through (None to disable sharing).
+    """
+    global _shared_memory_store
+    _shared_memory_store = store
+
+
+def getSharedMemoryStore():
+    return _shared_memory_store
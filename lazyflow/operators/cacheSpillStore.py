@@ -0,0 +1,219 @@
+###############################################################################
+#   lazyflow: data flow based lazy parallel computation framework
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License
+# as published by the Free Software Foundation; either version 2.1
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# See the files LICENSE.lgpl2 and LICENSE.lgpl3 for full text of the
+# GNU Lesser General Public License version 2.1 and 3 respectively.
+# This information is also available on the ilastik web site at:
+# 		   http://ilastik.org/license/
+###############################################################################
+"""
+Optional on-disk second tier for the managed block caches.
+
+When the memory manager evicts a block, the cache hands the block to the spill store
+(see ManagedBlockedCache.spillBlock()) instead of just discarding it.
+The next request for that block reads it back from disk instead of recomputing the
+whole upstream pipeline.  The store has its own size budget and evicts the least
+recently spilled blocks when it is exceeded.
+
+The tier is disabled by default; enable it with::
+
+    from lazyflow.operators import cacheSpillStore
+    cacheSpillStore.setSpillStore(cacheSpillStore.SpillStore(max_bytes=20 * 2**30, directory="/scratch"))
+"""
+
+import collections
+import itertools
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import weakref
+
+import numpy
+
+logger = logging.getLogger(__name__)
+
+
+class SpillStore:
+    """
+    Thread-safe LRU store of numpy arrays on disk, one .npy file per block.
+
+    Blocks are keyed by (namespace, key), where each cache gets its own namespace
+    (see namespaceFor()) and the key is the cache's block id.
+    Blocks are moved, not copied, between the tiers: take() removes the block from disk.
+    """
+
+    def __init__(self, max_bytes, directory=None):
+        """
+        :param max_bytes: disk budget of the store
+        :param directory: where to create the store's (temporary) directory, defaults to the system temp directory
+        """
+        self._max_bytes = max_bytes
+        self._directory = tempfile.mkdtemp(prefix="lazyflow-spill-", dir=directory)
+        self._finalizer = weakref.finalize(self, shutil.rmtree, self._directory, True)
+        # Reentrant, since the finalizer of a cache may discard its namespace at any time
+        self._lock = threading.RLock()
+        # (namespace, key) -> (path, nbytes), least recently spilled first
+        self._entries = collections.OrderedDict()
+        self._keys_by_namespace = collections.defaultdict(set)
+        self._used_bytes = 0
+        self._file_counter = itertools.count()
+        self._namespace_counter = itertools.count()
+        self._namespaces = weakref.WeakKeyDictionary()
+
+    @property
+    def directory(self):
+        return self._directory
+
+    @property
+    def maxBytes(self):
+        return self._max_bytes
+
+    def usedBytes(self):
+        return self._used_bytes
+
+    def __len__(self):
+        return len(self._entries)
+
+    def namespaceFor(self, owner):
+        """
+        Get the namespace for the blocks of the given cache.  Its blocks are dropped when it is garbage collected.
+        """
+        with self._lock:
+            namespace = self._namespaces.get(owner)
+            if namespace is None:
+                namespace = next(self._namespace_counter)
+                self._namespaces[owner] = namespace
+                weakref.finalize(owner, self.discardNamespace, namespace)
+            return namespace
+
+    def put(self, namespace, key, data):
+        """
+        Write a block to disk, evicting the least recently spilled blocks if the budget is exceeded.
+
+        :return: False if the block is too large for the store
+        """
+        data = numpy.asarray(data)
+        if data.nbytes > self._max_bytes or data.dtype.hasobject:
+            return False
+
+        path = os.path.join(self._directory, "{}.npy".format(next(self._file_counter)))
+        try:
+            numpy.save(path, data, allow_pickle=False)
+        except OSError:
+            logger.warning("Could not spill block to {}".format(path), exc_info=True)
+            self._remove_files([path])
+            return False
+
+        entry_key = (namespace, key)
+        with self._lock:
+            obsolete = self._pop(entry_key)
+            self._entries[entry_key] = (path, data.nbytes)
+            self._keys_by_namespace[namespace].add(key)
+            self._used_bytes += data.nbytes
+            while self._used_bytes > self._max_bytes:
+                oldest = next(iter(self._entries))
+                obsolete += self._pop(oldest)
+        self._remove_files(obsolete)
+        return True
+
+    def take(self, namespace, key):
+        """
+        Remove a block from the store and return it, or None if it is not stored.
+        """
+        with self._lock:
+            paths = self._pop((namespace, key))
+        if not paths:
+            return None
+        try:
+            return numpy.load(paths[0], allow_pickle=False)
+        except (OSError, ValueError):
+            logger.warning("Could not read spilled block {}".format(paths[0]), exc_info=True)
+            return None
+        finally:
+            self._remove_files(paths)
+
+    def contains(self, namespace, key):
+        return (namespace, key) in self._entries
+
+    def keys(self, namespace):
+        with self._lock:
+            return list(self._keys_by_namespace.get(namespace, ()))
+
+    def discard(self, namespace, keys):
+        """
+        Drop the given blocks (e.g. because they became dirty).  Unknown keys are ignored.
+        """
+        obsolete = []
+        with self._lock:
+            for key in keys:
+                obsolete += self._pop((namespace, key))
+        self._remove_files(obsolete)
+
+    def discardNamespace(self, namespace):
+        """
+        Drop all blocks of a namespace.
+        """
+        obsolete = []
+        with self._lock:
+            for key in list(self._keys_by_namespace.get(namespace, ())):
+                obsolete += self._pop((namespace, key))
+        self._remove_files(obsolete)
+
+    def clear(self):
+        obsolete = []
+        with self._lock:
+            for entry_key in list(self._entries):
+                obsolete += self._pop(entry_key)
+        self._remove_files(obsolete)
+
+    def _pop(self, entry_key):
+        # Must hold _lock.  Returns the paths of the files to remove.
+        entry = self._entries.pop(entry_key, None)
+        if entry is None:
+            return []
+        namespace, key = entry_key
+        keys = self._keys_by_namespace[namespace]
+        keys.discard(key)
+        if not keys:
+            del self._keys_by_namespace[namespace]
+        path, nbytes = entry
+        self._used_bytes -= nbytes
+        return [path]
+
+    @staticmethod
+    def _remove_files(paths):
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+_spill_store = None
+
+
+def setSpillStore(store):
+    """
+    Set the SpillStore that all managed block caches spill their evicted blocks to (None to disable spilling).
+    """
+    global _spill_store
+    _spill_store = store
+
+
+def getSpillStore():
+    return _spill_store
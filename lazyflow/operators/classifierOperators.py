@@ -23,8 +23,11 @@ from __future__ import absolute_import
 ###############################################################################
 # Python
 from abc import abstractmethod
+import collections
 import copy
 import logging
+import threading
+from functools import partial
 
 traceLogger = logging.getLogger("TRACE." + __name__)
 
@@ -34,6 +37,7 @@ import numpy
 # lazyflow
 from lazyflow.graph import Operator, InputSlot, OutputSlot, OrderedSignal, OperatorWrapper
 from lazyflow.roi import sliceToRoi, roiToSlice, getIntersection, roiFromShape, nonzero_bounding_box, enlargeRoiForHalo
+from lazyflow.request import Request
 from lazyflow.utility import Timer
 from lazyflow.classifiers import (
     LazyflowVectorwiseClassifierABC,
@@ -44,9 +48,27 @@ from lazyflow.classifiers import (
 
 from .opFeatureMatrixCache import OpFeatureMatrixCache
 from .opConcatenateFeatureMatrices import OpConcatenateFeatureMatrices
+from .blockPrefetcher import BACKGROUND_PRIORITY, submit_as_root
 
 logger = logging.getLogger(__name__)
 
+_progressive_prediction = False
+
+
+def setProgressivePrediction(enabled):
+    """
+    Enable progressive prediction (see OpVectorwiseClassifierPredict) for interactive prediction pipelines.
+
+    Only pipelines for display check progressivePredictionEnabled() (e.g. for the GUI cache of pixel classification),
+    all other predictions always use the complete classifier.
+    """
+    global _progressive_prediction
+    _progressive_prediction = enabled
+
+
+def progressivePredictionEnabled():
+    return _progressive_prediction
+
 
 class OpTrainClassifierBlocked(Operator):
     """
@@ -312,6 +334,9 @@ class OpTrainClassifierFromFeatureVectors(Operator):
     def __init__(self, *args, **kwargs):
         super(OpTrainClassifierFromFeatureVectors, self).__init__(*args, **kwargs)
         self.trainingCompleteSignal = OrderedSignal()
+        # (classifier, factory, TrainingMatrix, generation) of the last training,
+        # so that factories can update the classifier instead of training a new one
+        self._last_training = None
 
         # TODO: Progress...
         # self.progressSignal = OrderedSignal()
@@ -326,12 +351,10 @@ class OpTrainClassifierFromFeatureVectors(Operator):
     def execute(self, slot, subindex, roi, result):
         channel_names = self.LabelAndFeatureMatrix.meta.channel_names
         labels_and_features = self.LabelAndFeatureMatrix.value
-        featMatrix = labels_and_features[:, 1:]
-        labelsMatrix = labels_and_features[:, 0:1].astype(numpy.uint32)
 
         maxLabel = self.MaxLabel.value
 
-        if featMatrix.shape[0] < maxLabel:
+        if labels_and_features.shape[0] < maxLabel:
             # If there isn't enough data for the random forest to train with, return None
             result[:] = None
             self.trainingCompleteSignal()
@@ -344,13 +367,28 @@ class OpTrainClassifierFromFeatureVectors(Operator):
         )
 
         logger.debug("Training new classifier: {}".format(classifier_factory.description))
-        classifier = classifier_factory.create_and_train(featMatrix, labelsMatrix[:, 0], channel_names)
+        previous_classifier, previous_generation = None, None
+        source = getattr(labels_and_features, "source", None)
+        if self._last_training is not None:
+            last_classifier, last_factory, last_source, last_generation = self._last_training
+            if (
+                source is not None
+                and source is last_source
+                and last_factory == classifier_factory
+                and last_classifier.feature_names == channel_names
+            ):
+                previous_classifier, previous_generation = last_classifier, last_generation
+        classifier = classifier_factory.train_incrementally(
+            labels_and_features, previous_classifier, previous_generation, channel_names
+        )
         result[0] = classifier
         if classifier is not None:
             assert issubclass(type(classifier), LazyflowVectorwiseClassifierABC), (
                 "Classifier is of type {}, which does not satisfy the LazyflowVectorwiseClassifierABC interface."
                 "".format(type(classifier))
             )
+            if source is not None:
+                self._last_training = (classifier, classifier_factory, source, labels_and_features.generation)
 
         self.trainingCompleteSignal()
         return result
@@ -368,6 +406,9 @@ class OpClassifierPredict(Operator):
     # Otherwise, the request is serviced as usual and the mask is ignored.
     PredictionMask = InputSlot(optional=True)
 
+    # Only supported by vectorwise classifiers, see OpVectorwiseClassifierPredict
+    ProgressivePrediction = InputSlot(value=False)
+
     PMaps = OutputSlot()
 
     def __init__(self, *args, **kwargs):
@@ -402,6 +443,7 @@ class OpClassifierPredict(Operator):
 
         if self._mode == "vectorwise":
             self._prediction_op = OpVectorwiseClassifierPredict(parent=self)
+            self._prediction_op.ProgressivePrediction.connect(self.ProgressivePrediction)
         elif self._mode == "pixelwise":
             self._prediction_op = OpPixelwiseClassifierPredict(parent=self)
 
@@ -417,6 +459,7 @@ class OpClassifierPredict(Operator):
     def propagateDirty(self, slot, subindex, roi):
         if slot == self.Classifier:
             self.PMaps.setDirty()
+        # ProgressivePrediction is handled by the inner operator
 
 
 class OpBaseClassifierPredict(Operator):
@@ -555,6 +598,36 @@ class OpPixelwiseClassifierPredict(OpBaseClassifierPredict):
 
 
 class OpVectorwiseClassifierPredict(OpBaseClassifierPredict):
+    """
+    With ProgressivePrediction, requests are answered with a provisional prediction by a part of the classifier
+    (e.g. a quarter of the trees of a random forest, see predict_probabilities_partially()).  Pixels whose
+    provisional prediction is not confident are predicted with the complete classifier in the background;
+    once that is done, the roi is marked dirty, and the next request for it gets the refined result.
+    A roi is refined at most once (until the classifier or the features change): when it is requested again, e.g.
+    because the refinement of an overlapping roi of another view marked it dirty, it is predicted completely.
+    Otherwise, views with different slicings would keep refining and dirtying each other.
+    """
+
+    ProgressivePrediction = InputSlot(value=False)
+
+    # Part of the classifier used for provisional predictions
+    PROVISIONAL_FRACTION = 0.25
+    # Pixels whose provisional probabilities are all below this are refined
+    PROVISIONAL_CONFIDENCE = 0.9
+    # Refined results that were not requested (yet) are dropped beyond this number
+    MAX_REFINED_RESULTS = 64
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._refinement_lock = threading.Lock()
+        # spatial roi -> refined probabilities, oldest first
+        self._refined_results = collections.OrderedDict()
+        self._refining = set()
+        # Rois whose refinement finished; they are not predicted provisionally anymore
+        self._refined = set()
+        # Refinements that were started before the classifier or the features changed are discarded
+        self._refinement_generation = 0
+
     def setupOutputs(self):
         super().setupOutputs()
         nlabels = max(self.LabelsCount.value, 1)
@@ -585,6 +658,13 @@ class OpVectorwiseClassifierPredict(OpBaseClassifierPredict):
             classifier, LazyflowVectorwiseClassifierABC
         ), f"Classifier {classifier} must be sublcass of {LazyflowVectorwiseClassifierABC}"
 
+        spatial_roi = (tuple(roi.start[:-1]), tuple(roi.stop[:-1]))
+        if self.ProgressivePrediction.value:
+            with self._refinement_lock:
+                refined = self._refined_results.pop(spatial_roi, None)
+            if refined is not None:
+                return refined
+
         key = roi.toSlice()
         newKey = key[:-1]
         newKey += (slice(0, self.Image.meta.shape[-1], None),)
@@ -598,7 +678,11 @@ class OpVectorwiseClassifierPredict(OpBaseClassifierPredict):
         features = input_data.reshape((prod, shape[-1]))
 
         with Timer() as prediction_timer:
-            probabilities = classifier.predict_probabilities(features)
+            probabilities = None
+            if self.ProgressivePrediction.value:
+                probabilities = self._predict_progressively(classifier, features, spatial_roi, shape)
+            if probabilities is None:
+                probabilities = classifier.predict_probabilities(features)
 
         logger.debug(
             f"Features took {features_timer.seconds()} seconds."
@@ -607,3 +691,77 @@ class OpVectorwiseClassifierPredict(OpBaseClassifierPredict):
 
         probabilities.shape = shape[:-1] + (probabilities.shape[-1],)
         return probabilities
+
+    def _predict_progressively(self, classifier, features, spatial_roi, shape):
+        """
+        Return the provisional prediction of features, and start refining it in the background if necessary.
+        Returns None if the classifier can't predict provisionally, or if the roi was refined already.
+        """
+        with self._refinement_lock:
+            if spatial_roi in self._refined:
+                return None
+
+        predict_partially = getattr(classifier, "predict_probabilities_partially", None)
+        provisional = predict_partially and predict_partially(features, self.PROVISIONAL_FRACTION)
+        if provisional is None:
+            return None
+
+        uncertain = numpy.flatnonzero(provisional.max(axis=-1) < self.PROVISIONAL_CONFIDENCE)
+        if len(uncertain) == 0:
+            return provisional
+
+        with self._refinement_lock:
+            if spatial_roi in self._refining:
+                return provisional
+            self._refining.add(spatial_roi)
+            generation = self._refinement_generation
+
+        # (The returned provisional prediction is modified by the caller)
+        refined = provisional.copy()
+        uncertain_features = features[uncertain]
+
+        def refine():
+            refined[uncertain] = classifier.predict_probabilities(uncertain_features)
+            return refined.reshape(shape[:-1] + (refined.shape[-1],))
+
+        def submit():
+            # Low priority: provisional predictions of other rois come first
+            req = Request(refine, root_priority=BACKGROUND_PRIORITY)
+            req.notify_finished(partial(self._refinement_finished, spatial_roi, generation))
+            req.notify_failed(lambda exc, exc_info: self._refinement_finished(spatial_roi, generation, None))
+            req.notify_cancelled(partial(self._refinement_finished, spatial_roi, generation, None))
+            req.submit()
+
+        logger.debug(f"Refining {len(uncertain)} of {len(provisional)} provisional predictions in {spatial_roi}")
+        submit_as_root(submit)
+        return provisional
+
+    def _refinement_finished(self, spatial_roi, generation, refined):
+        with self._refinement_lock:
+            if generation != self._refinement_generation:
+                return
+            self._refining.discard(spatial_roi)
+            if refined is None:
+                return
+            self._refined.add(spatial_roi)
+            self._refined_results[spatial_roi] = refined
+            while len(self._refined_results) > self.MAX_REFINED_RESULTS:
+                self._refined_results.popitem(last=False)
+        start, stop = spatial_roi
+        self.PMaps.setDirty(start + (0,), stop + (self.PMaps.meta.shape[-1],))
+
+    def _discardRefinements(self):
+        with self._refinement_lock:
+            self._refinement_generation += 1
+            self._refined_results.clear()
+            self._refining.clear()
+            self._refined.clear()
+
+    def propagateDirty(self, slot, subindex, roi):
+        if slot == self.ProgressivePrediction:
+            self._discardRefinements()
+            self.PMaps.setDirty()
+        else:
+            if slot in (self.Classifier, self.Image):
+                self._discardRefinements()
+            super().propagateDirty(slot, subindex, roi)
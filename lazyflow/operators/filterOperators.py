@@ -552,3 +552,59 @@ class OpLaplacianOfGaussian(OpBaseFilter):
 
     def resultingChannels(self):
         return 1
+
+
+#: Features (see OpPixelFeaturesPresmoothed.FeatureIds) that fusedDerivativeFeatures() can compute
+FUSABLE_FEATURES = (
+    "LaplacianOfGaussian",
+    "GaussianGradientMagnitude",
+    "StructureTensorEigenvalues",
+    "HessianOfGaussianEigenvalues",
+)
+
+
+def fusedDerivativeFeatures(image, feature_ids, scale, outer_scale, window_size):
+    """
+    Compute several derivative-based features of an image at the same scale, convolving with each
+    first and second derivative kernel only once:
+
+    * the Laplacian of Gaussian is the trace of the Hessian of Gaussian
+    * the Hessian of Gaussian eigenvalues are the eigenvalues of the same Hessian
+    * the Gaussian gradient magnitude is the norm of the Gaussian gradient
+    * the structure tensor is the (outer_scale) smoothed outer product of the same gradient
+
+    The results match those of the respective filter operators (when using vigra's filters).
+
+    :param image: single-channel VigraArray, channel axis first (axistags "cyx" or "czyx")
+    :param feature_ids: which features to compute, out of FUSABLE_FEATURES
+    :param scale: scale of all features (the inner scale of the structure tensor)
+    :param outer_scale: outer scale of the structure tensor
+    :returns: one array per feature id, channel axis first, with the channels of the respective operator
+    """
+    assert image.shape[0] == 1, "Only single-channel images are supported"
+    assert set(feature_ids) <= set(FUSABLE_FEATURES), feature_ids
+
+    gradient = None
+    if {"GaussianGradientMagnitude", "StructureTensorEigenvalues"} & set(feature_ids):
+        gradient = vigra.filters.gaussianGradient(image, scale, window_size=window_size)
+    hessian = None
+    if {"LaplacianOfGaussian", "HessianOfGaussianEigenvalues"} & set(feature_ids):
+        hessian = vigra.filters.hessianOfGaussian(image, scale, window_size=window_size)
+
+    results = []
+    for feature_id in feature_ids:
+        if feature_id == "LaplacianOfGaussian":
+            # Position of the diagonal elements in the (upper triangular) tensor channels
+            n = image.ndim - 1
+            diagonal = [i * n - i * (i - 1) // 2 for i in range(n)]
+            result = numpy.asarray(hessian)[diagonal].sum(axis=0, keepdims=True)
+        elif feature_id == "HessianOfGaussianEigenvalues":
+            result = vigra.filters.tensorEigenvalues(hessian)
+        elif feature_id == "GaussianGradientMagnitude":
+            result = numpy.sqrt((numpy.asarray(gradient) ** 2).sum(axis=0, keepdims=True))
+        elif feature_id == "StructureTensorEigenvalues":
+            tensor = vigra.filters.vectorToTensor(gradient)
+            tensor = vigra.filters.gaussianSmoothing(tensor, outer_scale, window_size=window_size)
+            result = vigra.filters.tensorEigenvalues(tensor)
+        results.append(numpy.asarray(result))
+    return results
@@ -26,6 +26,8 @@ import os
 import math
 import logging
 import glob
+import threading
+from functools import partial
 import h5py
 import z5py
 from collections import OrderedDict
@@ -36,9 +38,11 @@ traceLogger = logging.getLogger("TRACE." + __name__)
 import psutil
 
 import numpy
+import tifffile
 import vigra
 
 from lazyflow.graph import OrderedSignal, Operator, OutputSlot, InputSlot
+from lazyflow.request import Request, RequestPool
 from lazyflow.roi import roiToSlice, roiFromShape, determineBlockShape
 from lazyflow.utility.bigRequestStreamer import BigRequestStreamer
 
@@ -116,6 +120,11 @@ class OpStackLoader(Operator):
           operator to a cache whose block size is large in the X-Y
           plane.
 
+    The metadata of all files is read (and validated) once, in setupOutputs().
+    The images needed for a request are read concurrently (at most ConcurrentReads
+    at a time).  Uncompressed TIFF images are memory-mapped, so that only the
+    requested part of each image is read; other formats are read completely.
+
     :param globstring: A glob string as defined by the glob module. We
         also support the following special extension to globstring
         syntax: A single string can hold a *list* of globstrings.
@@ -137,8 +146,12 @@ class OpStackLoader(Operator):
 
     globstring = InputSlot()
     SequenceAxis = InputSlot(optional=True)
+    # Maximum number of images that are read at the same time
+    ConcurrentReads = InputSlot(value=8)
     stack = OutputSlot()
 
+    TIFF_EXTS = [".tif", ".tiff"]
+
     class FileOpenError(Exception):
         def __init__(self, filename):
             self.filename = filename
@@ -147,17 +160,32 @@ class OpStackLoader(Operator):
 
     def setupOutputs(self):
         self.fileNameList = self.expandGlobStrings(self.globstring.value)
+        self._read_slots = threading.BoundedSemaphore(max(1, self.ConcurrentReads.value))
 
         num_files = len(self.fileNameList)
         if len(self.fileNameList) == 0:
             self.stack.meta.NOTREADY = True
             return
-        try:
-            self.info = vigra.impex.ImageInfo(self.fileNameList[0])
-            self.slices_per_file = vigra.impex.numberImages(self.fileNameList[0])
-        except RuntimeError as e:
-            logger.error(str(e))
-            raise OpStackLoader.FileOpenError(self.fileNameList[0]) from e
+
+        file_infos = [None] * num_files
+
+        def read_file_info(i):
+            file_infos[i] = self._readFileInfo(self.fileNameList[i])
+
+        pool = RequestPool()
+        for i in range(num_files):
+            pool.add(Request(partial(read_file_info, i)))
+        pool.wait()
+
+        self.info, self.slices_per_file, _ = file_infos[0]
+        for fileName, (info, slices, _) in zip(self.fileNameList, file_infos):
+            if info.getShape() != self.info.getShape():
+                raise RuntimeError(f"not all files have the same shape: {fileName}")
+            if info.getDtype() != self.info.getDtype():
+                raise RuntimeError(f"not all files have the same data type: {fileName}")
+            if slices != self.slices_per_file:
+                raise RuntimeError(f"Not all files have the same number of slices: {fileName}")
+        self._tiff_layouts = [layout for _, _, layout in file_infos]
 
         slice_shape = self.info.getShape()
         X, Y, C = slice_shape
@@ -199,7 +227,78 @@ class OpStackLoader(Operator):
         self.stack.meta.axistags = axistags
         self.stack.meta.dtype = self.info.getDtype()
 
+    def _readFileInfo(self, fileName):
+        """
+        Returns the vigra ImageInfo, the number of images and the TIFF layout (see _tiffLayout) of the given file.
+        """
+        traceLogger.debug(f"Reading image info: {fileName}")
+        try:
+            info = vigra.impex.ImageInfo(fileName)
+            num_images = vigra.impex.numberImages(fileName)
+        except RuntimeError as e:
+            logger.error(str(e))
+            raise OpStackLoader.FileOpenError(fileName) from e
+
+        layout = None
+        if os.path.splitext(fileName)[1].lower() in self.TIFF_EXTS:
+            layout = self._tiffLayout(fileName, info, num_images)
+        return info, num_images, layout
+
+    @staticmethod
+    def _tiffLayout(fileName, info, num_images):
+        """
+        If the images of the given TIFF file can be memory-mapped, return (data offset of each image, dtype, shape).
+        Otherwise (e.g. compressed images), return None.
+        """
+        X, Y, C = info.getShape()
+        page_shapes = [(Y, X, C)] + ([(Y, X)] if C == 1 else [])
+        try:
+            with tifffile.TiffFile(fileName) as tiff_file:
+                pages = tiff_file.pages
+                if len(pages) != num_images:
+                    return None
+                offsets = []
+                for page in pages:
+                    if (
+                        not page.is_memmappable
+                        or page.photometric == tifffile.TIFF.PHOTOMETRIC.PALETTE
+                        or tuple(page.shape) not in page_shapes
+                    ):
+                        return None
+                    contiguous = page.is_contiguous
+                    # Older versions of tifffile return (offset, bytecount)
+                    offsets.append(contiguous[0] if isinstance(contiguous, tuple) else page.dataoffsets[0])
+                dtype = numpy.dtype(page.dtype).newbyteorder(tiff_file.byteorder)
+                return offsets, dtype, (Y, X, C)
+        except Exception as e:
+            logger.debug(f"Can't memory-map {fileName}: {e}")
+            return None
+
+    def _readImage(self, file_index, image_index, y_slice, x_slice):
+        """
+        Read (the given region of) an image as yxc array.
+        """
+        fileName = self.fileNameList[file_index]
+        layout = self._tiff_layouts[file_index]
+        traceLogger.debug(f"Reading image: {fileName} [{image_index}]")
+        with self._read_slots:
+            if layout is None:
+                return vigra.impex.readImage(fileName, dtype="NATIVE", index=image_index).withAxes(*"yxc")[
+                    y_slice, x_slice
+                ]
+            offsets, dtype, shape = layout
+            image = numpy.memmap(fileName, dtype=dtype, mode="r", offset=offsets[image_index], shape=shape)
+            return numpy.array(image[y_slice, x_slice])
+
+    def _readAll(self, readers):
+        pool = RequestPool()
+        for reader in readers:
+            pool.add(Request(reader))
+        pool.wait()
+
     def propagateDirty(self, slot, subindex, roi):
+        if slot == self.ConcurrentReads:
+            return
         assert slot == self.globstring
         # Any change to the globstring means our entire output is dirty.
         self.stack.setDirty()
@@ -214,59 +313,55 @@ class OpStackLoader(Operator):
         else:
             assert False, f"Unexpected output shape: {self.stack.meta.shape}"
 
+    def _channelsPerFile(self, c_start, c_stop):
+        """
+        For images stacked along c: (file index, channel range of the image, channel range of the result)
+        for each file in the channel range [c_start, c_stop).
+        """
+        C = self.info.getShape()[2]
+        for i in range(c_start // C, (c_stop + C - 1) // C):
+            start, stop = max(c_start, i * C), min(c_stop, (i + 1) * C)
+            yield i, slice(start - i * C, stop - i * C), slice(start - c_start, stop - c_start)
+
     def _execute_3d(self, roi, result):
         traceLogger.debug("OpStackLoader: Execute for: " + str(roi))
         # roi is in xyc order; stacking over c
         x_start, y_start, c_start = roi.start
         x_stop, y_stop, c_stop = roi.stop
 
-        # get C of slice
-        C = self.info.getShape()[2]
+        def read(file_index, image_channels, result_channels):
+            image = self._readImage(file_index, 0, slice(y_start, y_stop), slice(x_start, x_stop))
+            result[:, :, result_channels] = image[..., image_channels].transpose(1, 0, 2)
 
-        # Copy each c-slice one at a time.
-        for i, fileName in enumerate(self.fileNameList[c_start // C : c_stop // C]):
-            traceLogger.debug(f"Reading image: {fileName}")
-            file_shape = vigra.impex.ImageInfo(fileName).getShape()
-            if self.info.getShape() != file_shape:
-                raise RuntimeError("not all files have the same shape")
-            images_per_file = vigra.impex.numberImages(self.fileNameList[0])
-            if self.slices_per_file != images_per_file:
-                raise RuntimeError("Not all files have the same number of slices")
-
-            result[:, :, i * C : (i + 1) * C] = vigra.impex.readImage(fileName)[
-                x_start:x_stop, y_start:y_stop, :
-            ].withAxes(*"xyc")
+        self._readAll(partial(read, *channels) for channels in self._channelsPerFile(c_start, c_stop))
         return result
 
     def _execute_4d(self, roi, result):
         traceLogger.debug("OpStackLoader: Execute for: " + str(roi))
-        # roi is in zyxc, tyxc or czyx order, depending on SequenceAxis
-        z_start, y_start, x_start, c_start = roi.start
-        z_stop, y_stop, x_stop, c_stop = roi.stop
+        if self.stack.meta.axistags.channelIndex == 0:
+            # czyx order: multi-page files stacked along c
+            c_start, z_start, y_start, x_start = roi.start
+            c_stop, z_stop, y_stop, x_stop = roi.stop
+
+            def read(file_index, image_channels, result_channels, z):
+                image = self._readImage(file_index, z, slice(y_start, y_stop), slice(x_start, x_stop))
+                result[result_channels, z - z_start] = image[..., image_channels].transpose(2, 0, 1)
+
+            self._readAll(
+                partial(read, *channels, z)
+                for channels in self._channelsPerFile(c_start, c_stop)
+                for z in range(z_start, z_stop)
+            )
+        else:
+            # zyxc or tyxc order, depending on SequenceAxis: one file per z (or t)
+            z_start, y_start, x_start, c_start = roi.start
+            z_stop, y_stop, x_stop, c_stop = roi.stop
 
-        # get C of slice
-        C = self.info.getShape()[2]
+            def read(z):
+                image = self._readImage(z, 0, slice(y_start, y_stop), slice(x_start, x_stop))
+                result[z - z_start] = image[..., c_start:c_stop]
 
-        # Copy each z-slice one at a time.
-        for result_z, fileName in enumerate(self.fileNameList[z_start:z_stop]):
-            traceLogger.debug(f"Reading image: {fileName}")
-            file_shape = vigra.impex.ImageInfo(fileName).getShape()
-            if self.info.getShape() != file_shape:
-                raise RuntimeError("not all files have the same shape")
-            images_per_file = vigra.impex.numberImages(self.fileNameList[0])
-            if self.slices_per_file != images_per_file:
-                raise RuntimeError("Not all files have the same number of slices")
-
-            if self.stack.meta.axistags.channelIndex == 0:
-                # czyx order -> read slice along z (here y)
-                for result_y, y in enumerate(range(y_start, y_stop)):
-                    result[result_z * C : (result_z + 1) * C, result_y, ...] = vigra.impex.readImage(fileName, index=y)[
-                        c_start:c_stop, x_start:x_stop
-                    ].withAxes(*"cyx")
-            else:
-                result[result_z, ...] = vigra.impex.readImage(fileName)[
-                    x_start:x_stop, y_start:y_stop, c_start:c_stop
-                ].withAxes(*"yxc")
+            self._readAll(partial(read, z) for z in range(z_start, z_stop))
         return result
 
     def _execute_5d(self, roi, result):
@@ -275,14 +370,11 @@ class OpStackLoader(Operator):
         t_start, z_start, y_start, x_start, c_start = roi.start
         t_stop, z_stop, y_stop, x_stop, c_stop = roi.stop
 
-        # Use *enumerated* range to get global t coords and result t coords
-        for result_t, t in enumerate(range(t_start, t_stop)):
-            file_name = self.fileNameList[t]
-            for result_z, z in enumerate(range(z_start, z_stop)):
-                img = vigra.readImage(file_name, index=z)
-                result[result_t, result_z, :, :, :] = img[x_start:x_stop, y_start:y_stop, c_start:c_stop].withAxes(
-                    *"yxc"
-                )
+        def read(t, z):
+            image = self._readImage(t, z, slice(y_start, y_stop), slice(x_start, x_stop))
+            result[t - t_start, z - z_start] = image[..., c_start:c_stop]
+
+        self._readAll(partial(read, t, z) for t in range(t_start, t_stop) for z in range(z_start, z_stop))
         return result
 
     @staticmethod
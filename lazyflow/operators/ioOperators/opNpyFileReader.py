@@ -21,6 +21,7 @@
 ###############################################################################
 from lazyflow.graph import Operator, InputSlot, OutputSlot
 from lazyflow.utility.helpers import get_default_axisordering
+from lazyflow.utility.io_util.memmapAccess import MemmapAccessAdvisor, contiguous_blockshape
 
 import vigra
 import numpy
@@ -32,11 +33,20 @@ logger = logging.getLogger(__name__)
 
 
 class OpNpyFileReader(Operator):
+    """
+    Reads .npy files (memory-mapped) and datasets of .npz files.
+
+    With MemmapViews, requests that don't provide a destination get read-only views
+    of the data instead of copies.
+    """
+
     name = "OpNpyFileReader"
     category = "Input"
 
     FileName = InputSlot(stype="filestring")
     InternalPath = InputSlot(optional=True)
+    # Return read-only views of the data (copied only into given destinations)
+    MemmapViews = InputSlot(value=False)
 
     Output = OutputSlot()
 
@@ -47,13 +57,23 @@ class OpNpyFileReader(Operator):
         super(OpNpyFileReader, self).__init__(*args, **kwargs)
         self._memmapFile = None
         self._rawVigraArray = None
+        self._advisor = None
+        self._viewsGiven = False
+
+    def _closeFile(self):
+        if self._memmapFile is not None and not self._viewsGiven:
+            self._memmapFile.close()
+        # Otherwise, the views that were handed out keep the file mapped until they are gone
+        self._memmapFile = None
+        self._rawVigraArray = None
+        self._advisor = None
+        self._viewsGiven = False
 
     def setupOutputs(self):
         """
         Load the file specified via our input slot and present its data on the output slot.
         """
-        if self._memmapFile is not None:
-            self._memmapFile.close()
+        self._closeFile()
         fileName = self.FileName.value
 
         try:
@@ -92,9 +112,18 @@ class OpNpyFileReader(Operator):
         self.Output.meta.dtype = self._rawVigraArray.dtype.type
         self.Output.meta.axistags = copy.copy(self._rawVigraArray.axistags)
         self.Output.meta.shape = self._rawVigraArray.shape
+        self.Output.meta.ideal_blockshape = contiguous_blockshape(rawNumpyArray)
+
+        self._advisor = MemmapAccessAdvisor(rawNumpyArray)
 
     def execute(self, slot, subindex, roi, result):
         key = roi.toSlice()
+        self._advisor.access(roi.start, roi.stop)
+        if self.MemmapViews.value:
+            self._viewsGiven = True
+            view = self._rawVigraArray[key].view(numpy.ndarray)
+            view.flags.writeable = False
+            return view
         result[:] = self._rawVigraArray[key]
         return result
 
@@ -103,6 +132,5 @@ class OpNpyFileReader(Operator):
             self.Output.setDirty(slice(None))
 
     def cleanUp(self):
-        if self._memmapFile is not None:
-            self._memmapFile.close()
+        self._closeFile()
         super(OpNpyFileReader, self).cleanUp()
@@ -22,9 +22,11 @@
 import os
 import copy
 import tempfile
+from functools import partial
 import h5py
 import vigra
 from lazyflow.graph import Operator, InputSlot, OutputSlot
+from lazyflow.request import Request, RequestPool
 from lazyflow.utility.io_util.RESTfulPrecomputedChunkedVolume import RESTfulPrecomputedChunkedVolume
 from lazyflow.operators.opBlockedArrayCache import OpBlockedArrayCache
 import lazyflow.roi
@@ -39,6 +41,9 @@ class OpRESTfulPrecomputedChunkedVolumeReaderNoCache(Operator):
     """
     An operator to retrieve precomputed chunked volumes from a remote server.
     These types of volumes are e.g. used in neuroglancer.
+
+    The blocks of a request are downloaded concurrently (at most ConcurrentDownloads at a time,
+    over the pooled connections of a single session), and copied into the result as they arrive.
     """
 
     name = "OpRESTfulPrecomputedChunkedVolumeReader"
@@ -49,6 +54,9 @@ class OpRESTfulPrecomputedChunkedVolumeReaderNoCache(Operator):
     # There is also the scale to configure
     Scale = InputSlot(optional=True)
 
+    # Maximum number of blocks that are downloaded at the same time
+    ConcurrentDownloads = InputSlot(value=8)
+
     # Available scales of the data
     AvailableScales = OutputSlot()
     # The data itself
@@ -64,10 +72,16 @@ class OpRESTfulPrecomputedChunkedVolumeReaderNoCache(Operator):
         if self._volume_object is not None:
             # check if the volume url has changed, to avoid downloading
             # info twice (i.e. setting up the volume twice)
-            if self._volume_object.volume_url == self.BaseUrl.value:
+            if (
+                self._volume_object.volume_url == self.BaseUrl.value
+                and self._volume_object.n_threads == self.ConcurrentDownloads.value
+            ):
                 return
+            self._volume_object.close()
 
-        self._volume_object = RESTfulPrecomputedChunkedVolume(self.BaseUrl.value)
+        self._volume_object = RESTfulPrecomputedChunkedVolume(
+            self.BaseUrl.value, n_threads=self.ConcurrentDownloads.value
+        )
 
         self._axes = self._volume_object.axes
 
@@ -82,49 +96,6 @@ class OpRESTfulPrecomputedChunkedVolumeReaderNoCache(Operator):
         # is this a good idea? Triggers setupOutputs again
         self.Scale.setValue(self._volume_object._use_scale)
 
-    @staticmethod
-    def get_intersecting_blocks(blockshape, roi, shape):
-        """Find block indices for given roi
-
-        Wraps around lazyflow.roi.getIntersectingBlocks
-        Idea is that only the required blocks are allocated using
-
-        Everything in 'czyx' - order
-
-        Args:
-            blockshape (iterable): block shape
-            roi (tuple): (start, stop), inclusive start of block, exclusive end
-
-        Difference is that it returns a dictionary consisting of
-          * 'array_of_blocks' the array of blocks
-          * 'subimage_shape' shape of the subimage
-          * 'block_offsets' array of offset for each of the blocks
-          * 'subimage_roi' the roi in the sub_image
-        """
-        blocks = lazyflow.roi.getIntersectingBlocks(blockshape, roi, asarray=True)
-
-        num_indexes = numpy.prod(blocks.shape[0:-1])
-        axiscount = blocks.shape[-1]
-        blocks_array = numpy.reshape(blocks, (num_indexes, axiscount))
-
-        block_aligned_subimage_start = blocks_array.min(axis=0)
-        block_aligned_subimage_end = blocks_array.max(axis=0)
-
-        assert (block_aligned_subimage_start == blocks_array).all(axis=1).any(), "roi does not seem to be block aligned"
-        assert (block_aligned_subimage_end == blocks_array).all(axis=1).any(), "roi does not seem to be block aligned"
-
-        # get the real end of the image:
-        block_aligned_subimage_end += blockshape
-        # take care of image border
-        block_aligned_subimage_end = numpy.min([block_aligned_subimage_end, shape], axis=0)
-
-        subimage_shape = block_aligned_subimage_end - block_aligned_subimage_start
-        block_offsets = blocks_array - block_aligned_subimage_start
-        subimage_start = roi[0] - block_aligned_subimage_start
-        subimage_roi = ((subimage_start), (subimage_start + (roi[1] - roi[0])))
-
-        return blocks_array, block_offsets, subimage_roi, subimage_shape
-
     def execute(self, slot, subindex, roi, result):
         """
         Args:
@@ -134,25 +105,27 @@ class OpRESTfulPrecomputedChunkedVolumeReaderNoCache(Operator):
             result (ndarray): array in which the results are written in
 
         """
-        start, stop = roi.start, roi.stop
-        roi = (start, stop)
+        roi = numpy.array((roi.start, roi.stop))
 
         scale = self.Scale.value
-        assert len(roi) == 2
         assert all(len(x) == len(self._volume_object.get_shape(scale)) for x in roi)
         block_shape = self._volume_object.get_block_shape(scale)
         image_shape = self._volume_object.get_shape(scale)
-        array_of_blocks, block_offsets, subimage_roi, subimage_shape = self.get_intersecting_blocks(
-            blockshape=block_shape, roi=roi, shape=image_shape
-        )
-        subimage = numpy.zeros((subimage_shape))
-        assert array_of_blocks.shape[-1] == 4
-
-        for block, offset in zip(array_of_blocks, block_offsets):
-            slicing = lazyflow.roi.roiToSlice(offset, offset + block_shape)
-            subimage[slicing] = self._volume_object.download_block(block, scale)
-        slicing = lazyflow.roi.roiToSlice(subimage_roi[0], subimage_roi[1])
-        result[...] = subimage[slicing]
+        block_starts = lazyflow.roi.getIntersectingBlocks(block_shape, roi)
+        assert block_starts.shape[-1] == 4
+
+        def copy_block(block_start, block_roi, intersection):
+            block = self._volume_object.download_block(block_start, scale)
+            result_slicing = lazyflow.roi.roiToSlice(*(intersection - roi[0]))
+            block_slicing = lazyflow.roi.roiToSlice(*(intersection - block_roi[0]))
+            result[result_slicing] = block[block_slicing]
+
+        pool = RequestPool()
+        for block_start in block_starts:
+            block_roi = numpy.array(lazyflow.roi.getBlockBounds(image_shape, block_shape, block_start))
+            intersection = numpy.array(lazyflow.roi.getIntersection(block_roi, roi))
+            pool.add(Request(partial(copy_block, block_start, block_roi, intersection)))
+        pool.wait()
         return result
 
     def propagateDirty(self, slot, subindex, roi):
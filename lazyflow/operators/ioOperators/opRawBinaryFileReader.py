@@ -25,6 +25,7 @@ import numpy
 import vigra
 from lazyflow.graph import Operator, InputSlot, OutputSlot
 from lazyflow.utility.helpers import get_default_axisordering
+from lazyflow.utility.io_util.memmapAccess import MemmapAccessAdvisor, contiguous_blockshape
 
 
 class OpRawBinaryFileReader(Operator):
@@ -40,11 +41,16 @@ class OpRawBinaryFileReader(Operator):
         /path/to/myvolume-100-200-300-3-uint8.bin
 
     For now, the axis order is merely guessed.
+
+    The file is memory-mapped.  With MemmapViews, requests that don't provide a destination get
+    read-only views of the mapped file instead of copies.
     """
 
     name = "OpRawBinaryFileReader"
 
     FilePath = InputSlot(stype="filestring")
+    # Return read-only views of the memory-mapped file (copied only into given destinations)
+    MemmapViews = InputSlot(value=False)
     Output = OutputSlot()
 
     class DatasetReadError(Exception):
@@ -53,13 +59,16 @@ class OpRawBinaryFileReader(Operator):
     def __init__(self, *args, **kwargs):
         super(OpRawBinaryFileReader, self).__init__(*args, **kwargs)
         self._memmap = None
+        self._advisor = None
 
     def cleanUp(self):
         self._memmap = None  # Closes the file
+        self._advisor = None
         super(OpRawBinaryFileReader, self).cleanUp()
 
     def setupOutputs(self):
         self._memmap = None  # Closes the file
+        self._advisor = None
         filepath = self.FilePath.value
         filename = os.path.split(filepath)[1]
 
@@ -89,13 +98,19 @@ class OpRawBinaryFileReader(Operator):
         except:
             raise OpRawBinaryFileReader.DatasetReadError("Unable to open numpy dataset: {}".format(filepath))
 
+        self._advisor = MemmapAccessAdvisor(self._memmap)
+
         axisorder = get_default_axisordering(shape)
 
         self.Output.meta.dtype = dtype
         self.Output.meta.axistags = vigra.defaultAxistags(axisorder)
         self.Output.meta.shape = shape
+        self.Output.meta.ideal_blockshape = contiguous_blockshape(self._memmap)
 
     def execute(self, slot, subindex, roi, result):
+        self._advisor.access(roi.start, roi.stop)
+        if self.MemmapViews.value:
+            return self._memmap[roi.toSlice()].view(numpy.ndarray)
         result[:] = self._memmap[roi.toSlice()]
         return result
 
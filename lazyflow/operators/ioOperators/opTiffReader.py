@@ -1,8 +1,12 @@
+import threading
+from functools import partial
+
 import numpy
 import tifffile
 import vigra
 from lazyflow.graph import Operator, InputSlot, OutputSlot
-from lazyflow.roi import roiToSlice
+from lazyflow.request import Request, RequestPool
+from lazyflow.roi import roiToSlice, getIntersection
 from lazyflow.utility.helpers import get_default_axisordering
 
 import logging
@@ -15,7 +19,10 @@ class OpTiffReader(Operator):
     Reads TIFF files as an ND array. We use two different libraries:
 
     - To read the image metadata (determine axis order), we use tifffile.py (by Christoph Gohlke)
-    - To actually read the data, we use vigra (which supports more compression types, e.g. JPEG)
+    - To actually read the data, we use tifffile if it can decode the file: only the tiles (or strips)
+      that intersect the requested roi are read, and they are decoded in parallel.  Every thread keeps
+      its own open TiffFile.  Otherwise (e.g. the codec is not available), we use vigra, which supports
+      more compression types (e.g. JPEG), but always reads whole pages.
 
     Note: This operator intentionally ignores any colormap
           information and uses only the raw stored pixel values.
@@ -33,8 +40,18 @@ class OpTiffReader(Operator):
         super(OpTiffReader, self).__init__(*args, **kwargs)
         self._filepath = None
         self._page_shape = None
+        # (length, width) of the tiles or strips, if tifffile can read them
+        self._segment_shape = None
+        self._handles_lock = threading.Lock()
+        self._thread_handles = threading.local()
+        self._open_handles = []
+
+    def cleanUp(self):
+        self._closeHandles()
+        super(OpTiffReader, self).cleanUp()
 
     def setupOutputs(self):
+        self._closeHandles()
         self._filepath = self.Filepath.value
         with tifffile.TiffFile(self._filepath) as tiff_file:
             series = tiff_file.series[0]
@@ -112,16 +129,74 @@ class OpTiffReader(Operator):
                     f"Unknown axistags detected - assuming default axis order. Guessed {axes} from {old_axes}."
                 )
 
+            self._segment_shape = self._segmentShape(tiff_file, first_page)
+            self._segments_per_row = 1
+            ideal_page_blockshape = self._page_shape
+            if self._segment_shape is not None and first_page.is_tiled:
+                self._segments_per_row = -(-X // self._segment_shape[1])
+                ideal_page_blockshape = self._segment_shape + self._page_shape[2:]
+
             self.Output.meta.shape = shape
             self.Output.meta.axistags = vigra.defaultAxistags(str(axes))
             self.Output.meta.dtype = numpy.dtype(dtype_code).type
-            self.Output.meta.ideal_blockshape = ((1,) * len(self._non_page_shape)) + self._page_shape
+            self.Output.meta.ideal_blockshape = ((1,) * len(self._non_page_shape)) + ideal_page_blockshape
 
-    def execute(self, slot, subindex, roi, result):
+    def _segmentShape(self, tiff_file, page):
         """
-        Use vigra (not tifffile) to read the result.
-        This allows us to support JPEG-compressed TIFFs.
+        Return the shape (length, width) of the tiles or strips of the given page,
+        or None if we can't read them with tifffile.
+        """
+        Y, X = self._page_shape[:2]
+        if page.is_tiled:
+            segment_shape = (page.tilelength, page.tilewidth)
+        else:
+            segment_shape = (min(page.rowsperstrip or Y, Y), X)
+
+        # Make sure that tifffile can decode this file (e.g. that the codec is installed)
+        try:
+            self._decodeSegment(tiff_file, page, 0)
+        except Exception as e:
+            logger.info(f"Reading {self._filepath} with vigra: {e}")
+            return None
+        return segment_shape
+
+    @staticmethod
+    def _decodeSegment(tiff_file, page, index):
+        """
+        Read and decode a tile (or strip) of the given page, as (length, width, samples) array.
+        Returns None for tiles that are not stored in the file.
+        """
+        offset, bytecount = page.dataoffsets[index], page.databytecounts[index]
+        if not bytecount:
+            return None
+        filehandle = tiff_file.filehandle
+        filehandle.seek(offset)
+        data = filehandle.read(bytecount)
+        segment = page.decode(data, index, jpegtables=page.jpegtables)[0]
+        return segment.reshape(segment.shape[-3:])
+
+    def _tiffFile(self):
         """
+        The TiffFile of the current thread (file handles can't be shared between threads).
+        """
+        tiff_file = getattr(self._thread_handles, "tiff_file", None)
+        if tiff_file is None:
+            tiff_file = tifffile.TiffFile(self._filepath)
+            # Keep the parsed pages
+            tiff_file.pages.cache = True
+            self._thread_handles.tiff_file = tiff_file
+            with self._handles_lock:
+                self._open_handles.append(tiff_file)
+        return tiff_file
+
+    def _closeHandles(self):
+        with self._handles_lock:
+            handles, self._open_handles = self._open_handles, []
+            self._thread_handles = threading.local()
+        for tiff_file in handles:
+            tiff_file.close()
+
+    def execute(self, slot, subindex, roi, result):
         num_page_axes = len(self._page_shape)
         roi = numpy.array([roi.start, roi.stop])
         page_index_roi = roi[:, :-num_page_axes]
@@ -129,26 +204,76 @@ class OpTiffReader(Operator):
 
         logger.debug("Roi: {}".format(list(map(tuple, roi))))
 
-        # Read each page out individually
         page_index_roi_shape = page_index_roi[1] - page_index_roi[0]
+        if self._segment_shape is None:
+            # Read each page out individually
+            for roi_page_ndindex in numpy.ndindex(*page_index_roi_shape):
+                page_index = self._pageIndex(roi_page_ndindex + page_index_roi[0])
+                result[roi_page_ndindex] = self._readPageWithVigra(page_index)[roiToSlice(*roi_within_page)]
+            return
+
+        # Read the intersecting tiles (or strips) of all pages in parallel
+        (y_start, x_start), (y_stop, x_stop) = roi_within_page[:, :2]
+        length, width = self._segment_shape
+        pool = RequestPool()
         for roi_page_ndindex in numpy.ndindex(*page_index_roi_shape):
-            if self._non_page_shape:
-                tiff_page_ndindex = roi_page_ndindex + page_index_roi[0]
-                tiff_page_list_index = numpy.ravel_multi_index(tiff_page_ndindex, self._non_page_shape)
-                logger.debug("Reading page: {} = {}".format(tuple(tiff_page_ndindex), tiff_page_list_index))
-                page_data = vigra.impex.readImage(
-                    self._filepath, dtype="NATIVE", index=int(tiff_page_list_index), order="C"
-                )
-            else:
-                # Only a single page
-                page_data = vigra.impex.readImage(self._filepath, dtype="NATIVE", index=0, order="C")
+            page_index = self._pageIndex(roi_page_ndindex + page_index_roi[0])
+            for segment_y in range(y_start // length, (y_stop - 1) // length + 1):
+                for segment_x in range(x_start // width, (x_stop - 1) // width + 1):
+                    pool.add(
+                        Request(
+                            partial(
+                                self._readSegment,
+                                page_index,
+                                (segment_y, segment_x),
+                                roi_within_page,
+                                result[roi_page_ndindex],
+                            )
+                        )
+                    )
+        pool.wait()
+
+    def _pageIndex(self, tiff_page_ndindex):
+        if not self._non_page_shape:
+            # Only a single page
+            return 0
+        tiff_page_list_index = numpy.ravel_multi_index(tiff_page_ndindex, self._non_page_shape)
+        logger.debug("Reading page: {} = {}".format(tuple(tiff_page_ndindex), tiff_page_list_index))
+        return int(tiff_page_list_index)
+
+    def _readPageWithVigra(self, page_index):
+        """
+        Use vigra (not tifffile) to read the page.
+        This allows us to support JPEG-compressed TIFFs.
+        """
+        page_data = vigra.impex.readImage(self._filepath, dtype="NATIVE", index=page_index, order="C")
+        page_data = page_data.withAxes(self._page_axes)
+        assert page_data.shape == self._page_shape, "Unexpected page shape: {} vs {}".format(
+            page_data.shape, self._page_shape
+        )
+        return page_data
+
+    def _readSegment(self, page_index, segment_ndindex, roi_within_page, page_result):
+        """
+        Copy the intersection of a tile (or strip) with roi_within_page into page_result.
+        """
+        tiff_file = self._tiffFile()
+        page = tiff_file.pages[page_index]
+        segment_index = segment_ndindex[0] * self._segments_per_row + segment_ndindex[1]
 
-            page_data = page_data.withAxes(self._page_axes)
-            assert page_data.shape == self._page_shape, "Unexpected page shape: {} vs {}".format(
-                page_data.shape, self._page_shape
-            )
+        segment_start = numpy.zeros_like(roi_within_page[0])
+        segment_start[:2] = numpy.multiply(segment_ndindex, self._segment_shape)
+        segment_stop = numpy.minimum(segment_start + (self._segment_shape + self._page_shape[2:]), self._page_shape)
+        intersection = numpy.array(getIntersection((segment_start, segment_stop), roi_within_page))
+        result_slicing = roiToSlice(*(intersection - roi_within_page[0]))
 
-            result[roi_page_ndindex] = page_data[roiToSlice(*roi_within_page)]
+        segment = self._decodeSegment(tiff_file, page, segment_index)
+        if segment is None:
+            page_result[result_slicing] = 0
+            return
+        if self._page_axes == "yx":
+            segment = segment[..., 0]
+        page_result[result_slicing] = segment[roiToSlice(*(intersection - segment_start))]
 
     def propagateDirty(self, slot, subindex, roi):
         if slot == self.Filepath:
@@ -923,7 +923,7 @@ class OpBaseFilter(Operator):
 
 # difference of Gaussians
 def differenceOfGausssians(image, sigma0, sigma1, window_size, roi, out=None):
-    """ difference of gaussian function"""
+    """difference of gaussian function"""
     return vigra.filters.gaussianSmoothing(
         image, sigma0, window_size=window_size, roi=roi
     ) - vigra.filters.gaussianSmoothing(image, sigma1, window_size=window_size, roi=roi)
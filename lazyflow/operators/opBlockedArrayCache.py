@@ -49,6 +49,8 @@ class OpBlockedArrayCache(Operator, ManagedBlockedCache):
     # If not provided, will be set to Input.meta.shape
     BypassModeEnabled = InputSlot(value=False)
     CompressionEnabled = InputSlot(value=False)
+    ChannelKeys = InputSlot(optional=True)  # See OpUnblockedArrayCache
+    StorageDtype = InputSlot(optional=True)  # See OpUnblockedArrayCache
 
     Output = OutputSlot(allow_mask=True)
     CleanBlocks = OutputSlot()  # A list of slicings indicating which blocks are stored in the cache and clean.
@@ -75,6 +77,8 @@ class OpBlockedArrayCache(Operator, ManagedBlockedCache):
         self._opSimpleBlockedArrayCache = OpSimpleBlockedArrayCache(parent=self)
         self._opSimpleBlockedArrayCache.Input.connect(self._opCacheFixer.Output)
         self._opSimpleBlockedArrayCache.CompressionEnabled.connect(self.CompressionEnabled)
+        self._opSimpleBlockedArrayCache.ChannelKeys.connect(self.ChannelKeys)
+        self._opSimpleBlockedArrayCache.StorageDtype.connect(self.StorageDtype)
         self._opSimpleBlockedArrayCache.Input.connect(self._opCacheFixer.Output)
         self._opSimpleBlockedArrayCache.BlockShape.connect(self.BlockShape)
         self._opSimpleBlockedArrayCache.BypassModeEnabled.connect(self.BypassModeEnabled)
@@ -123,6 +127,21 @@ class OpBlockedArrayCache(Operator, ManagedBlockedCache):
     def getBlockAccessTimes(self):
         return self._opSimpleBlockedArrayCache.getBlockAccessTimes()
 
+    def getBlockComputeCosts(self):
+        return self._opSimpleBlockedArrayCache.getBlockComputeCosts()
+
+    def getCoalescingStats(self):
+        return self._opSimpleBlockedArrayCache.getCoalescingStats()
+
+    def savedMemory(self):
+        return self._opSimpleBlockedArrayCache.savedMemory()
+
+    def setPrefetchDepth(self, blocks):
+        self._opSimpleBlockedArrayCache.setPrefetchDepth(blocks)
+
+    def getPrefetchStats(self):
+        return self._opSimpleBlockedArrayCache.getPrefetchStats()
+
     def freeMemory(self):
         return self._opSimpleBlockedArrayCache.freeMemory()
 
@@ -26,6 +26,7 @@ from abc import abstractmethod, ABCMeta
 
 # lazyflow
 from lazyflow.operators import cacheMemoryManager
+from lazyflow.operators import cacheSpillStore
 from future.utils import with_metaclass
 
 
@@ -85,6 +86,10 @@ class ObservableCache(Cache):
     be cleaned up by the cache memory manager.
     """
 
+    # Set to True by caches that call reportMemoryChange() for every allocation,
+    # the memory manager keeps polling usedMemory() of all other caches
+    reportsMemoryChanges = False
+
     @abstractmethod
     def usedMemory(self):
         """
@@ -108,6 +113,24 @@ class ObservableCache(Cache):
         """
         return 0.0
 
+    def reportMemoryChange(self, nbytes):
+        """
+        tell the memory manager that this cache allocated (positive nbytes)
+        or released (negative nbytes) memory
+
+        Only the event-driven mode of the memory manager relies on these
+        reports. Caches that report must report every change, so that the
+        reported total matches usedMemory(), and set reportsMemoryChanges.
+        """
+        cacheMemoryManager.reportAllocation(self, nbytes)
+
+    def waitForCacheMemory(self):
+        """
+        call before fetching a new block: in event-driven mode, this waits
+        while the memory manager frees memory if the cache budget is exceeded
+        """
+        cacheMemoryManager.waitForMemory()
+
     def generateReport(self, memInfoNode):
         super(ObservableCache, self).generateReport(memInfoNode)
         memInfoNode.usedMemory = self.usedMemory()
@@ -188,6 +211,16 @@ class ManagedBlockedCache(ManagedCache):
         """
         raise NotImplementedError("No default implementation for getBlockAccessTimes()")
 
+    def getBlockComputeCosts(self):
+        """
+        get a list of (block id, compute time in seconds, size in bytes)
+
+        Optional: eviction policies that weigh recompute cost against size
+        (see cacheEvictionPolicies) treat blocks missing from this list as
+        having an average cost.
+        """
+        return []
+
     @abstractmethod
     def freeBlock(self, block_id):
         """
@@ -201,6 +234,50 @@ class ManagedBlockedCache(ManagedCache):
         """
         raise NotImplementedError("No default implementation for freeBlock()")
 
+    def spillBlock(self, block_id, data):
+        """
+        hand the data of a block that is being evicted to the on-disk
+        spill store (see cacheSpillStore), if one is configured
+
+        @return True if the block was written to disk
+        """
+        store = cacheSpillStore.getSpillStore()
+        if store is None:
+            return False
+        return store.put(store.namespaceFor(self), block_id, data)
+
+    def unspillBlock(self, block_id):
+        """
+        get the data of a block back from the spill store, or None if it
+        was not spilled (or has been dropped from the store since)
+        """
+        store = cacheSpillStore.getSpillStore()
+        if store is None or len(store) == 0:
+            return None
+        return store.take(store.namespaceFor(self), block_id)
+
+    def discardSpilledBlocks(self, block_ids=None):
+        """
+        drop spilled blocks that became dirty (all of them if block_ids is None)
+        """
+        store = cacheSpillStore.getSpillStore()
+        if store is None or len(store) == 0:
+            return
+        namespace = store.namespaceFor(self)
+        if block_ids is None:
+            store.discardNamespace(namespace)
+        else:
+            store.discard(namespace, block_ids)
+
+    def spilledBlocks(self):
+        """
+        get the ids of the blocks of this cache that are in the spill store
+        """
+        store = cacheSpillStore.getSpillStore()
+        if store is None:
+            return []
+        return store.keys(store.namespaceFor(self))
+
 
 class MemInfoNode(object):
     """
@@ -40,8 +40,10 @@ import h5py
 from lazyflow.request import Request, RequestPool, RequestLock
 from lazyflow.graph import Operator, InputSlot, OutputSlot
 from lazyflow.roi import TinyVector, getIntersectingBlocks, getBlockBounds, roiToSlice, getIntersection
+from lazyflow.operators import cacheSharedMemory
 from lazyflow.operators.opCache import ManagedBlockedCache
 from lazyflow.utility.chunkHelpers import chooseChunkShape
+from lazyflow.utility.compressedArray import CompressedArray, available_codecs
 
 logger = logging.getLogger(__name__)
 
@@ -52,9 +54,64 @@ def get_storage_size(h5dataset):
 
     (shorthand for the hidden h5py functionality)
     """
+    if isinstance(h5dataset, CompressedArray):
+        return h5dataset.nbytes_compressed
     return h5py.h5d.DatasetID.get_storage_size(h5dataset.id)
 
 
+#: How OpUnmanagedCompressedCache stores its blocks by default, see setDefaultBackend()
+_default_backend = ("hdf5", None)
+
+
+def setDefaultBackend(backend, codec="auto"):
+    """
+    Choose how compressed caches created from now on store their blocks:
+
+    * "hdf5": one in-memory hdf5 file per block, with an lzf-compressed chunked dataset
+    * "chunks": one CompressedArray per block, i.e. a dict of compressed bytes per chunk.
+      This bypasses the HDF5 library (and its global lock), so blocks can be read and
+      written by several threads at once.  codec is one of lazyflow.utility.compressedArray.available_codecs()
+      or "auto" for the fastest available one.
+    """
+    global _default_backend
+    if backend not in ("hdf5", "chunks"):
+        raise ValueError("Unknown compressed cache backend: {!r}".format(backend))
+    if backend == "chunks" and codec != "auto" and codec not in available_codecs():
+        raise ValueError("Compression codec {!r} is not available (available: {})".format(codec, available_codecs()))
+    _default_backend = (backend, codec if backend == "chunks" else None)
+
+
+class _ChunkedBlockFile(dict):
+    """
+    Stand-in for the in-memory hdf5 file of a block when using the "chunks" backend:
+    maps "data" (and "mask", "fill_value") to CompressedArrays (and a 0-d array).
+    """
+
+    def __getitem__(self, key):
+        if key == "/":
+            return self
+        return super(_ChunkedBlockFile, self).__getitem__(key)
+
+    def close(self):
+        self.clear()
+
+
+def _read_block_region(dataset, block_slicing, destination, destination_slicing):
+    if isinstance(dataset, CompressedArray):
+        # Decompress straight into the destination
+        dataset.read_direct(destination, block_slicing, destination_slicing)
+    else:
+        destination[destination_slicing] = dataset[block_slicing]
+
+
+def _replace_dataset(cachefile, name, h5dataset):
+    if isinstance(cachefile, _ChunkedBlockFile):
+        cachefile[name][...] = h5dataset[()]
+    else:
+        del cachefile[name]
+        cachefile.copy(h5dataset, name)
+
+
 class OpUnmanagedCompressedCache(Operator):
     """
     A blockwise cache that stores each block as a separate in-memory hdf5 file with a compressed dataset.
@@ -68,6 +125,9 @@ class OpUnmanagedCompressedCache(Operator):
         3. Automatically determined shape with t=1, c=1 and xyz such that the
            blocks are smaller than 1MiB (raw)
 
+    Alternatively, the blocks can be stored as dicts of compressed chunks that bypass the HDF5 library
+    (see setDefaultBackend()).
+
     Note: This class is not managed by the memory manager, so there can be non-managed subclasses.
           The "managed" version is OpCompressedCache, defined below.
 
@@ -94,6 +154,8 @@ class OpUnmanagedCompressedCache(Operator):
 
     def __init__(self, *args, **kwargs):
         super(OpUnmanagedCompressedCache, self).__init__(*args, **kwargs)
+        # (backend, codec), see setDefaultBackend()
+        self._backend = _default_backend
         self._lock = RequestLock()
         self._init_cache(None)
         self._block_id_counter = itertools.count()  # Used to ensure unique in-memory file names
@@ -107,6 +169,8 @@ class OpUnmanagedCompressedCache(Operator):
             self._blockLocks = {}
             self._chunkshape = self._chooseChunkshape(self._blockshape)
             self._last_access_times = collections.defaultdict(float)
+            # Seconds it took to fetch each block from upstream
+            self._block_compute_times = {}
 
     def cleanUp(self):
         logger.debug("Cleaning up")
@@ -198,15 +262,23 @@ class OpUnmanagedCompressedCache(Operator):
             # Copy from block to destination
             dataset = self._getBlockDataset(entire_block_roi)
             if self.Output.meta.has_mask:
-                destination.data[destination_relative_intersection_slicing] = dataset["data"][
-                    block_relative_intersection_slicing
-                ]
-                destination.mask[destination_relative_intersection_slicing] = dataset["mask"][
-                    block_relative_intersection_slicing
-                ]
+                _read_block_region(
+                    dataset["data"],
+                    block_relative_intersection_slicing,
+                    destination.data,
+                    destination_relative_intersection_slicing,
+                )
+                _read_block_region(
+                    dataset["mask"],
+                    block_relative_intersection_slicing,
+                    destination.mask,
+                    destination_relative_intersection_slicing,
+                )
                 destination.fill_value = dataset["fill_value"][()]
             else:
-                destination[destination_relative_intersection_slicing] = dataset[block_relative_intersection_slicing]
+                _read_block_region(
+                    dataset, block_relative_intersection_slicing, destination, destination_relative_intersection_slicing
+                )
             self._last_access_times[block_start] = time.time()
 
     def _executeCleanBlocks(self, destination):
@@ -241,7 +313,15 @@ class OpUnmanagedCompressedCache(Operator):
         self._ensureCached(block_roi)
         dataset = self._getBlockDataset(block_roi)
         assert str(block_roi) not in destination, "destination hdf5 group already has a dataset with this block's name"
-        destination.copy(dataset, str(block_roi))
+        if isinstance(dataset, (h5py.Dataset, h5py.Group)):
+            destination.copy(dataset, str(block_roi))
+        elif self.Output.meta.has_mask:
+            group = destination.create_group(str(block_roi))
+            group.create_dataset("data", data=dataset["data"][...], compression="lzf")
+            group.create_dataset("mask", data=dataset["mask"][...], compression="lzf")
+            group.create_dataset("fill_value", data=dataset["fill_value"][()])
+        else:
+            destination.create_dataset(str(block_roi), data=dataset[...], compression="lzf")
         return destination
 
     def propagateDirty(self, slot, subindex, roi):
@@ -377,7 +457,8 @@ class OpUnmanagedCompressedCache(Operator):
             # uncompressed size
             unc += ds.size * self._getDtypeBytes(ds.dtype)
         if "mask" in group:
-            tot += group["mask"].size * self._getDtypeBytes(group["mask"].dtype)
+            # The mask is compressed, too
+            tot += get_storage_size(group["mask"])
         if "fill_value" in group:
             tot += group["fill_value"].size * self._getDtypeBytes(group["fill_value"].dtype)
         return tot, unc
@@ -395,28 +476,36 @@ class OpUnmanagedCompressedCache(Operator):
                 # Create an in-memory hdf5 file with a unique name
                 # (the counter ensures that even blocks that have been deleted previously get a unique name when they are re-created).
                 logger.debug("Creating a cache file for block: {}".format(list(block_start)))
-                filename = (
-                    str(id(self)) + str(id(self._cacheFiles)) + str(block_start) + str(next(self._block_id_counter))
-                )
-                mem_file = h5py.File(filename, driver="core", backing_store=False, mode="w")
-
                 # h5py will crash if the chunkshape is larger than the dataset shape.
                 datashape = tuple(entire_block_roi[1] - entire_block_roi[0])
                 chunkshape = numpy.minimum(numpy.array(datashape), self._chunkshape)
                 chunkshape = tuple(chunkshape)
 
-                # Make a compressed dataset
-                mem_file.create_dataset(
-                    "data", shape=datashape, dtype=self.Output.meta.dtype, chunks=chunkshape, compression="lzf"
-                )  # lzf should be faster than gzip,
-                # with a slightly worse compression ratio
-                # Add mask information if needed.
-                if self.Output.meta.has_mask:
+                backend, codec = self._backend
+                if backend == "chunks":
+                    mem_file = _ChunkedBlockFile()
+                    mem_file["data"] = CompressedArray(datashape, self.Output.meta.dtype, chunkshape, codec)
+                    if self.Output.meta.has_mask:
+                        mem_file["mask"] = CompressedArray(datashape, bool, chunkshape, codec)
+                        mem_file["fill_value"] = numpy.zeros((), dtype=self.Output.meta.dtype)
+                else:
+                    filename = (
+                        str(id(self)) + str(id(self._cacheFiles)) + str(block_start) + str(next(self._block_id_counter))
+                    )
+                    mem_file = h5py.File(filename, driver="core", backing_store=False, mode="w")
+
+                    # Make a compressed dataset
                     mem_file.create_dataset(
-                        "mask", shape=datashape, dtype=bool, chunks=chunkshape, compression="lzf"
+                        "data", shape=datashape, dtype=self.Output.meta.dtype, chunks=chunkshape, compression="lzf"
                     )  # lzf should be faster than gzip,
                     # with a slightly worse compression ratio
-                    mem_file.create_dataset("fill_value", shape=tuple(), dtype=self.Output.meta.dtype)
+                    # Add mask information if needed.
+                    if self.Output.meta.has_mask:
+                        mem_file.create_dataset(
+                            "mask", shape=datashape, dtype=bool, chunks=chunkshape, compression="lzf"
+                        )  # lzf should be faster than gzip,
+                        # with a slightly worse compression ratio
+                        mem_file.create_dataset("fill_value", shape=tuple(), dtype=self.Output.meta.dtype)
 
                 self._blockLocks[block_start] = RequestLock()
                 self._cacheFiles[block_start] = mem_file
@@ -439,7 +528,9 @@ class OpUnmanagedCompressedCache(Operator):
                     # Can't write directly into the hdf5 dataset because
                     #  h5py.dataset.__getitem__ creates a copy, not a view.
                     # We must use a temporary numpy array to hold the data.
-                    data = self.Input(*entire_block_roi).wait()
+                    compute_start = time.time()
+                    data = self._fetchBlock(entire_block_roi)
+                    compute_time = time.time() - compute_start
                     block_file["data"][...] = data
                     if self.Output.meta.has_mask:
                         block_file["mask"][...] = data.mask
@@ -447,11 +538,11 @@ class OpUnmanagedCompressedCache(Operator):
 
                     if logger.isEnabledFor(logging.DEBUG):
                         uncompressed_size = numpy.prod(data.shape) * self._getDtypeBytes(data.dtype)
-                        storage_size = block_file["data"].id.get_storage_size()
+                        storage_size = get_storage_size(block_file["data"])
                         if "mask" in block_file:
-                            storage_size += block_file["mask"].id.get_storage_size()
+                            storage_size += get_storage_size(block_file["mask"])
                         if "fill_value" in block_file:
-                            storage_size += block_file["fill_value"].id.get_storage_size()
+                            storage_size += block_file["fill_value"].size * self._getDtypeBytes(data.dtype)
                         logger.debug(
                             "Storage for block: {} is {}. ({}% of original)".format(
                                 block_start, storage_size, 100 * storage_size / uncompressed_size
@@ -459,6 +550,7 @@ class OpUnmanagedCompressedCache(Operator):
                         )
                     with self._lock:
                         self._dirtyBlocks.remove(block_start)
+                        self._block_compute_times[block_start] = compute_time
                     updated_cache = True
 
             if updated_cache:
@@ -467,10 +559,15 @@ class OpUnmanagedCompressedCache(Operator):
                 self.OutputHdf5._sig_value_changed()
                 self.CleanBlocks._sig_value_changed()
 
+    def _fetchBlock(self, entire_block_roi):
+        return self.Input(*entire_block_roi).wait()
+
     def setInSlot(self, slot, subindex, roi, value):
         """
         Overridden from Operator
         """
+        # From now on, our data is not determined by our inputs alone
+        cacheSharedMemory.markHiddenState(self)
         if slot == self.Input:
             self._setInSlotInput(slot, subindex, roi, value)
         elif slot == self.InputHdf5:
@@ -580,13 +677,11 @@ class OpUnmanagedCompressedCache(Operator):
                     assert cachefile[each].shape == value[each].shape
 
                 for each in ["data", "mask", "fill_value"]:
-                    del cachefile[each]
-                    cachefile.copy(value[each], each)
+                    _replace_dataset(cachefile, each, value[each])
             else:
                 assert cachefile["data"].dtype == value.dtype
                 assert cachefile["data"].shape == value.shape
-                del cachefile["data"]
-                cachefile.copy(value, "data")
+                _replace_dataset(cachefile, "data", value)
 
             block_start = tuple(roi.start)
             self._dirtyBlocks.discard(block_start)
@@ -632,11 +727,72 @@ class OpUnmanagedCompressedCache(Operator):
 
 
 class OpCompressedCache(OpUnmanagedCompressedCache, ManagedBlockedCache):
+    reportsMemoryChanges = True
+
     def __init__(self, *args, **kwargs):
         super(OpCompressedCache, self).__init__(*args, **kwargs)
         # Now that we're initialized, it's safe to register with the memory manager
         self.registerWithMemoryManager()
 
+    def _init_cache(self, new_blockshape):
+        self._forgetReportedMemory()
+        self.discardSpilledBlocks()
+        super(OpCompressedCache, self)._init_cache(new_blockshape)
+
+    def _fetchBlock(self, entire_block_roi):
+        if not self.Output.meta.has_mask:
+            # Reading the block back from the spill store is cheaper than recomputing it
+            data = self.unspillBlock(tuple(entire_block_roi[0]))
+            if data is not None:
+                return data
+        return super(OpCompressedCache, self)._fetchBlock(entire_block_roi)
+
+    def propagateDirty(self, slot, subindex, roi):
+        super(OpCompressedCache, self).propagateDirty(slot, subindex, roi)
+        if slot == self.Input and self._blockshape is not None:
+            block_starts = getIntersectingBlocks(self._blockshape, (roi.start, roi.stop))
+            self.discardSpilledBlocks(list(map(tuple, block_starts)))
+
+    def _ensureCached(self, entire_block_roi):
+        block_start = tuple(entire_block_roi[0])
+        if block_start in self._cacheFiles and block_start not in self._dirtyBlocks:
+            # Already cached and clean: nothing will be allocated
+            return super(OpCompressedCache, self)._ensureCached(entire_block_roi)
+        self.waitForCacheMemory()
+        super(OpCompressedCache, self)._ensureCached(entire_block_roi)
+        self._reportBlockMemory(block_start)
+
+    def _setInSlotInput(self, slot, subindex, roi, value, store_zero_blocks=True):
+        super(OpCompressedCache, self)._setInSlotInput(slot, subindex, roi, value, store_zero_blocks)
+        for block_start in getIntersectingBlocks(self._blockshape, (roi.start, roi.stop)):
+            self._reportBlockMemory(tuple(block_start))
+
+    def _setInSlotInputHdf5(self, slot, subindex, roi, value):
+        super(OpCompressedCache, self)._setInSlotInputHdf5(slot, subindex, roi, value)
+        self._reportBlockMemory(tuple(roi.start))
+
+    def _reportBlockMemory(self, block_start):
+        """
+        Report the change of the compressed size of a block to the memory manager.
+        """
+        memory = self._memoryForBlock(block_start)
+        nbytes = memory[0] if memory else 0
+        with self._lock:
+            previous = self._reported_block_memory.get(block_start, 0)
+            if nbytes:
+                self._reported_block_memory[block_start] = nbytes
+            else:
+                self._reported_block_memory.pop(block_start, None)
+        if nbytes != previous:
+            self.reportMemoryChange(nbytes - previous)
+
+    def _forgetReportedMemory(self):
+        reported = getattr(self, "_reported_block_memory", {})
+        self._reported_block_memory = {}
+        freed = sum(reported.values())
+        if freed:
+            self.reportMemoryChange(-freed)
+
     def fractionOfUsedMemoryDirty(self):
         tot = 0.0
         dirty = 0.0
@@ -662,6 +818,7 @@ class OpCompressedCache(OpUnmanagedCompressedCache, ManagedBlockedCache):
         with self._lock:
             self._cacheFiles = {}
             self._dirtyBlocks = set()
+            self._forgetReportedMemory()
         return mem
 
     def freeDirtyMemory(self):
@@ -688,14 +845,37 @@ class OpCompressedCache(OpUnmanagedCompressedCache, ManagedBlockedCache):
             # use actual size, not number of bytes in
             # *uncompressed* array
             mem = get_storage_size(ds)
+            spill_data = None
+            if block_id not in self._dirtyBlocks and not self.Output.meta.has_mask:
+                spill_data = ds[...]
             f.close()
             with self._lock:
                 del self._cacheFiles[block_id]
                 del self._last_access_times[block_id]
-            return mem
+                self._block_compute_times.pop(block_id, None)
+                reported = self._reported_block_memory.pop(block_id, 0)
+            if reported:
+                self.reportMemoryChange(-reported)
+        if spill_data is not None and self.spillBlock(block_id, spill_data):
+            with self._lock:
+                if block_id in self._dirtyBlocks:
+                    # Became dirty while it was written
+                    self.discardSpilledBlocks([block_id])
+        return mem
 
     def getBlockAccessTimes(self):
         with self._lock:
             # needs to be locked because dicts must not change size
             # during iteration
             return [(key, self._last_access_times[key]) for key in self._last_access_times]
+
+    def getBlockComputeCosts(self):
+        with self._lock:
+            block_times = [(key, t) for key, t in self._block_compute_times.items() if key in self._cacheFiles]
+        costs = []
+        for key, compute_time in block_times:
+            memory = self._memoryForBlock(key)
+            if memory:
+                # Compressed storage size, since that is what freeBlock() frees
+                costs.append((key, compute_time, memory[0]))
+        return costs
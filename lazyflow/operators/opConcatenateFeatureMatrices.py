@@ -9,13 +9,16 @@ import numpy
 
 from lazyflow.graph import Operator, InputSlot, OutputSlot
 from lazyflow.request import RequestPool, RequestLock
-from lazyflow.utility import OrderedSignal
+from lazyflow.utility import OrderedSignal, TrainingMatrix, TrainingMatrixView
 
 
 class OpConcatenateFeatureMatrices(Operator):
     """
     Designed to receive a multi-slot of FeatureMatrix outputs from OpFeatureMatrixCache,
     and concatenate the results into one big feature matrix.
+
+    With a single lane, its matrix is passed through as is.  Otherwise, the lanes are combined in a
+    TrainingMatrix, in which only the lanes whose matrix changed since the last execute() are replaced.
     """
 
     FeatureMatrices = InputSlot(level=1)  # Each subslot is a 'value' slot with a matrix as the value.
@@ -26,9 +29,13 @@ class OpConcatenateFeatureMatrices(Operator):
     def __init__(self, *args, **kwargs):
         super(OpConcatenateFeatureMatrices, self).__init__(*args, **kwargs)
         self._dirty_slots = set()
+        self._lock = RequestLock()
         self.progressSignal = OrderedSignal()
         self._num_feature_channels = 0  # Not including the labels...
         self._channel_names = []
+        self._combined_matrix = None
+        # Matrix sources (see TrainingMatrixView) of the lanes in _combined_matrix -> generation
+        self._combined_generations = {}
 
         # Normally, lane removal does not trigger a dirty notification.
         # But in this case, if the lane contained any label data whatsoever,
@@ -125,10 +132,36 @@ class OpConcatenateFeatureMatrices(Operator):
         #  we have to unpack them from their single-element lists.
         subresult_list = list(itertools.chain(*subresults))
 
-        total_matrix = numpy.concatenate(subresult_list, axis=0)
+        total_matrix = self._combine(subresult_list)
         self.progressSignal(100.0)
         result[0] = total_matrix
 
+    def _combine(self, matrices):
+        if len(matrices) == 1:
+            return matrices[0]
+        if not all(isinstance(m, TrainingMatrixView) and m.source is not None for m in matrices):
+            return numpy.concatenate(matrices, axis=0)
+
+        with self._lock:
+            num_columns = matrices[0].shape[1]
+            dtype = numpy.result_type(*matrices)
+            combined = self._combined_matrix
+            if combined is None or combined.num_columns != num_columns or combined.dtype != dtype:
+                combined = self._combined_matrix = TrainingMatrix(num_columns, dtype=dtype)
+                self._combined_generations = {}
+
+            # Lanes are identified by the TrainingMatrix their rows come from
+            sources = {m.source: m for m in matrices}
+            for source in list(self._combined_generations):
+                if source not in sources:
+                    combined.remove(source)
+                    del self._combined_generations[source]
+            for source, matrix in sources.items():
+                if self._combined_generations.get(source) != matrix.generation:
+                    combined.set(source, matrix)
+                    self._combined_generations[source] = matrix.generation
+            return combined.snapshot()
+
     def propagateDirty(self, slot, subindex, roi):
         if slot == self.FeatureMatrices:
             self._dirty_slots.add(self.FeatureMatrices[subindex])
@@ -44,6 +44,9 @@ class OpDenseLabelArray(Operator):
     MaxLabelValue = OutputSlot()  # Hard-coded for now
     NonzeroBlocks = OutputSlot()  # list of slicings
 
+    # Holds data that is not determined by the inputs (see cacheSharedMemory.upstreamContentHash())
+    _has_hidden_state = True
+
     def __init__(self, *args, **kwargs):
         super(OpDenseLabelArray, self).__init__(*args, **kwargs)
         self._cache = None
@@ -30,7 +30,7 @@ import numpy
 
 from lazyflow.graph import Operator, InputSlot, OutputSlot
 from lazyflow.request import RequestLock, Request, RequestPool
-from lazyflow.utility import OrderedSignal
+from lazyflow.utility import OrderedSignal, TrainingMatrix
 from lazyflow.roi import getBlockBounds, getIntersectingBlocks, determineBlockShape
 
 
@@ -41,6 +41,12 @@ class OpFeatureMatrixCache(Operator):
     - Cache the feature matrix for each block separately
     - Output the concatenation of all feature matrices
 
+    The blockwise matrices are kept in a single TrainingMatrix, so updating a few blocks only copies their rows,
+    and the output is a (read-only) snapshot of it rather than a new concatenation of all blocks.
+
+    Features are only requested for boxes around the labeled pixels of a block.  Labels that are far apart
+    (e.g. a few brush strokes in a large block) get separate boxes, see _label_boxes().
+
     Note: This operator does not currently have "NonZeroLabelBlocks" input slot.
           Instead, it only requests labels for blocks that have been
           marked dirty via dirty notifications from the LabelImage slot.
@@ -52,6 +58,16 @@ class OpFeatureMatrixCache(Operator):
 
     FeatureImage = InputSlot()
     LabelImage = InputSlot()
+    # Identity of each feature channel (see OpPixelFeaturesPresmoothed.ChannelKeys): when the channels are only
+    # rearranged, e.g. by a change of the feature selection, the FeatureImage doesn't become dirty
+    FeatureChannelKeys = InputSlot(optional=True)
+
+    # Labeled pixels are grouped into cells of this size first, which are then merged into boxes
+    SPARSE_CELL_SIZE = 16
+    # The halo that the feature computation is assumed to add to each side of a requested box
+    ASSUMED_FEATURE_HALO = 16
+    # Blocks with labels in more cells than this are considered densely labeled (and get a single box)
+    MAX_SPARSE_CELLS = 64
 
     # Output is a single 'value', which is a 2D ndarray.
     # The first row is labels, the rest are the features.
@@ -71,7 +87,7 @@ class OpFeatureMatrixCache(Operator):
 
         self._blockshape = None
         self._dirty_blocks = set()
-        self._blockwise_feature_matrices = {}
+        self._training_matrix = None
         self._block_locks = {}  # One lock per stored block
 
         self._init_blocks(None, None)
@@ -82,7 +98,7 @@ class OpFeatureMatrixCache(Operator):
             # Nothing to do
             return
 
-        if len(self._dirty_blocks) != 0 or len(self._blockwise_feature_matrices) != 0:
+        if len(self._dirty_blocks) != 0 or self._stored_blocks():
             raise RuntimeError(
                 "It's too late to change the dimensionality of your data after you've already started training.\n"
                 "Delete all your labels and try again."
@@ -114,6 +130,12 @@ class OpFeatureMatrixCache(Operator):
 
         num_feature_channels = self.FeatureImage.meta.shape[-1]
         if num_feature_channels != self.LabelAndFeatureMatrix.meta.num_feature_channels:
+            # Changes of the feature selection only dirty the new channels (see OpPixelFeaturesPresmoothed),
+            # but our matrices have to be re-extracted as a whole
+            with self._lock:
+                self._dirty_blocks.update(self._stored_blocks())
+                # All stored blocks are dirty now: start over with rows of the new width
+                self._training_matrix = TrainingMatrix(1 + num_feature_channels, dtype=self._matrix_dtype())
             self.LabelAndFeatureMatrix.meta.num_feature_channels = num_feature_channels
             self.LabelAndFeatureMatrix.setDirty()
 
@@ -185,51 +207,46 @@ class OpFeatureMatrixCache(Operator):
                 labels_and_features_matrix = req.result
                 self._dirty_blocks.remove(block_start)
 
-                if labels_and_features_matrix.shape[0] > 0:
-                    # Update the block entry with the new matrix.
-                    self._blockwise_feature_matrices[block_start] = labels_and_features_matrix
-                else:
-                    # All labels were removed from the block,
-                    # So the new feature matrix is empty.
-                    # Just delete its entry from our list.
-                    try:
-                        del self._blockwise_feature_matrices[block_start]
-                    except KeyError:
-                        pass
-
-        # Concatenate the all blockwise results
-        if self._blockwise_feature_matrices:
-            total_feature_matrix = numpy.concatenate(list(self._blockwise_feature_matrices.values()), axis=0)
-        else:
-            # No label points at all.
-            # Return an empty label&feature matrix (of the correct shape)
-            num_feature_channels = self.FeatureImage.meta.shape[-1]
-            total_feature_matrix = numpy.ndarray(shape=(0, 1 + num_feature_channels), dtype=numpy.float32)
+                # Replace the block's rows with the new matrix (all labels were removed if it is empty)
+                self._training_matrix.set(block_start, labels_and_features_matrix)
+
+            total_feature_matrix = self._training_matrix.snapshot()
+            num_blocks = len(self._training_matrix.keys())
 
         self.progressSignal(100.0)
-        logger.debug("After update, there are {} clean blocks".format(len(self._blockwise_feature_matrices)))
+        logger.debug("After update, there are {} clean blocks".format(num_blocks))
         result[0] = total_feature_matrix
 
+    def _matrix_dtype(self):
+        # The matrix is used for training as it is (its snapshots are not copied, see TrainingMatrix.snapshot()),
+        # so it is kept with (at least) float32 precision, even if the features are cached with a lower precision
+        return numpy.result_type(numpy.float32, self.FeatureImage.meta.dtype)
+
+    def _stored_blocks(self):
+        if self._training_matrix is None:
+            return []
+        return self._training_matrix.keys()
+
     def propagateDirty(self, slot, subindex, roi):
-        assert slot == self.FeatureImage or slot == self.LabelImage
+        assert slot == self.FeatureImage or slot == self.LabelImage or slot == self.FeatureChannelKeys
 
-        # Our blocks are tracked by label roi (1 channel)
-        roi = roi.copy()
-        roi.start[-1] = 0
-        roi.stop[-1] = 1
         # Bookkeeping: Track the dirty blocks
 
         # If the features were dirty (not labels), we only really care about
         #  the blocks that are actually stored already
         # For big dirty rois (e.g. the entire image),
         #  we avoid a lot of unnecessary entries in self._dirty_blocks
-        if slot == self.FeatureImage:
+        if slot == self.FeatureImage or slot == self.FeatureChannelKeys:
             # We ignore the ROI and assume all blocks are dirty.
             # Technically, this would be inefficient if it's possible for the features
             # to become only partially dirty in a small ROI.
             # But currently, there is no known use-case for that.
-            block_starts = list(self._blockwise_feature_matrices.keys())
+            block_starts = self._stored_blocks()
         else:
+            # Our blocks are tracked by label roi (1 channel)
+            roi = roi.copy()
+            roi.start[-1] = 0
+            roi.stop[-1] = 1
             block_starts = getIntersectingBlocks(self._blockshape, (roi.start, roi.stop))
             block_starts = list(map(tuple, block_starts))
 
@@ -256,6 +273,54 @@ class OpFeatureMatrixCache(Operator):
             labels_and_features_matrix = self._extract_feature_matrix(block_roi)
             return labels_and_features_matrix
 
+    @classmethod
+    def _label_boxes(cls, label_positions):
+        """
+        Group labeled pixels into boxes whose features are requested separately.
+
+        The cost of a box is estimated as the number of pixels it covers, including the feature halo.
+        Starting from the bounding boxes of the labels in each (nonempty) cell of a grid, the two boxes that
+        gain the most by being merged (i.e. whose bounding box costs less than both of them) are merged,
+        until no such pair is left.
+
+        :param label_positions: coordinates of the labeled pixels, as returned by numpy.nonzero()
+        :returns: list of (start, stop, indices of the labeled pixels in the box)
+        """
+        positions = numpy.transpose(label_positions)
+        halo = 2 * cls.ASSUMED_FEATURE_HALO
+
+        cells, pixel_cells = numpy.unique(positions // cls.SPARSE_CELL_SIZE, axis=0, return_inverse=True)
+        pixel_cells = pixel_cells.reshape(-1)
+        if len(cells) > cls.MAX_SPARSE_CELLS:
+            return [(positions.min(axis=0), positions.max(axis=0) + 1, numpy.arange(len(positions)))]
+
+        starts = numpy.array([positions[pixel_cells == i].min(axis=0) for i in range(len(cells))])
+        stops = numpy.array([positions[pixel_cells == i].max(axis=0) + 1 for i in range(len(cells))])
+        cell_boxes = numpy.arange(len(cells))
+        alive = numpy.ones(len(cells), dtype=bool)
+
+        while alive.sum() > 1:
+            costs = numpy.prod((stops - starts + halo).astype(numpy.float64), axis=-1)
+            merged_starts = numpy.minimum(starts[:, None], starts[None, :])
+            merged_stops = numpy.maximum(stops[:, None], stops[None, :])
+            gains = (
+                costs[:, None]
+                + costs[None, :]
+                - numpy.prod((merged_stops - merged_starts + halo).astype(numpy.float64), axis=-1)
+            )
+            # Only pairs of two different living boxes
+            gains[~(alive[:, None] & alive[None, :])] = -numpy.inf
+            numpy.fill_diagonal(gains, -numpy.inf)
+            i, j = numpy.unravel_index(numpy.argmax(gains), gains.shape)
+            if gains[i, j] < 0:
+                break
+            starts[i], stops[i] = merged_starts[i, j], merged_stops[i, j]
+            alive[j] = False
+            cell_boxes[cell_boxes == j] = i
+
+        pixel_boxes = cell_boxes[pixel_cells]
+        return [(starts[i], stops[i], numpy.flatnonzero(pixel_boxes == i)) for i in numpy.flatnonzero(alive)]
+
     def _extract_feature_matrix(self, label_block_roi):
         num_feature_channels = self.FeatureImage.meta.shape[-1]
         labels = self.LabelImage(label_block_roi[0], label_block_roi[1]).wait()
@@ -269,26 +334,26 @@ class OpFeatureMatrixCache(Operator):
             # Return an empty label&feature matrix (of the correct shape)
             return numpy.ndarray(shape=(0, 1 + num_feature_channels), dtype=numpy.float32)
 
-        # Shrink the roi to the bounding box of nonzero labels
-        block_bounding_box_start = numpy.min(label_block_positions, axis=1)
-        block_bounding_box_stop = 1 + numpy.max(label_block_positions, axis=1)
-
-        global_bounding_box_start = block_bounding_box_start + label_block_roi[0][:-1]
-        global_bounding_box_stop = block_bounding_box_stop + label_block_roi[0][:-1]
+        features_matrix = numpy.empty((len(labels_matrix), num_feature_channels), dtype=self.FeatureImage.meta.dtype)
 
-        # Since we're just requesting the bounding box, offset the feature positions by the box start
-        bounding_box_positions = numpy.transpose(
-            numpy.transpose(label_block_positions) - numpy.array(block_bounding_box_start)
-        )
-        bounding_box_positions = tuple(bounding_box_positions)
+        def extract_features(box_start, box_stop, members):
+            global_start = numpy.add(box_start, label_block_roi[0][:-1])
+            global_stop = numpy.add(box_stop, label_block_roi[0][:-1])
+            # Request features (box only, all feature channels)
+            features = self.FeatureImage(list(global_start) + [0], list(global_stop) + [num_feature_channels]).wait()
 
-        # Append channel roi (all feature channels)
-        feature_roi_start = list(global_bounding_box_start) + [0]
-        feature_roi_stop = list(global_bounding_box_stop) + [num_feature_channels]
+            # Since we're just requesting the box, offset the feature positions by the box start
+            box_positions = tuple(p[members] - start for p, start in zip(label_block_positions, box_start))
+            # Cast as plain ndarray (not VigraArray), since we don't need/want axistags
+            features_matrix[members] = features[box_positions].view(numpy.ndarray)
 
-        # Request features (bounding box only)
-        features = self.FeatureImage(feature_roi_start, feature_roi_stop).wait()
+        boxes = self._label_boxes(label_block_positions)
+        if len(boxes) == 1:
+            extract_features(*boxes[0])
+        else:
+            pool = RequestPool()
+            for box in boxes:
+                pool.add(Request(partial(extract_features, *box)))
+            pool.wait()
 
-        # Cast as plain ndarray (not VigraArray), since we don't need/want axistags
-        features_matrix = features[bounding_box_positions].view(numpy.ndarray)
         return numpy.concatenate((labels_matrix, features_matrix), axis=1)
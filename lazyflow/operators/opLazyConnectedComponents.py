@@ -258,6 +258,9 @@ class OpLazyConnectedComponents(Operator, ObservableCache):
     _Input = OutputSlot()
     _Output = OutputSlot()
 
+    # The cache can be filled from InputHdf5 (see cacheSharedMemory.upstreamContentHash())
+    _has_hidden_state = True
+
     def __init__(self, *args, **kwargs):
         super(OpLazyConnectedComponents, self).__init__(*args, **kwargs)
         self._lock = HardLock()
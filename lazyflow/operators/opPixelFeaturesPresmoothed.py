@@ -19,6 +19,7 @@
 # This information is also available on the ilastik web site at:
 #          http://ilastik.org/license/
 ###############################################################################
+import collections
 import copy
 import logging
 import math
@@ -30,7 +31,7 @@ from functools import partial
 from lazyflow import roi
 from lazyflow.graph import Operator, InputSlot, OutputSlot
 from lazyflow.request import RequestPool
-from lazyflow.roi import sliceToRoi, roiToSlice
+from lazyflow.roi import sliceToRoi, roiToSlice, indexRuns
 from lazyflow.rtype import SubRegion
 
 from .operators import OpArrayPiper
@@ -42,6 +43,8 @@ from .filterOperators import (
     OpGaussianGradientMagnitude,
     OpLaplacianOfGaussian,
     WITH_FAST_FILTERS,
+    FUSABLE_FEATURES,
+    fusedDerivativeFeatures,
 )
 
 if WITH_FAST_FILTERS:
@@ -49,6 +52,31 @@ if WITH_FAST_FILTERS:
 
 logger = logging.getLogger(__name__)
 
+#: Default of OpPixelFeaturesPresmoothed.CascadedPresmoothing for new operators, see setCascadedPresmoothing()
+_default_cascaded_presmoothing = False
+
+
+def setCascadedPresmoothing(enabled):
+    """
+    Let OpPixelFeaturesPresmoothed operators created from now on derive the pre-smoothed volume of each scale
+    from the one of the next smaller scale (see OpPixelFeaturesPresmoothed.CascadedPresmoothing).
+    """
+    global _default_cascaded_presmoothing
+    _default_cascaded_presmoothing = enabled
+
+
+#: Default of OpPixelFeaturesPresmoothed.FusedDerivatives for new operators, see setFusedDerivatives()
+_default_fused_derivatives = False
+
+
+def setFusedDerivatives(enabled):
+    """
+    Let OpPixelFeaturesPresmoothed operators created from now on compute the derivative-based features of each
+    scale from shared derivative images (see OpPixelFeaturesPresmoothed.FusedDerivatives).
+    """
+    global _default_fused_derivatives
+    _default_fused_derivatives = enabled
+
 
 class OpPixelFeaturesPresmoothed(Operator):
     name = "OpPixelFeaturesPresmoothed"
@@ -58,6 +86,12 @@ class OpPixelFeaturesPresmoothed(Operator):
     Scales = InputSlot()
     SelectionMatrix = InputSlot()
     ComputeIn2d = InputSlot()
+    # Pre-smooth each scale incrementally, starting from the pre-smoothed volume of a smaller scale
+    # (less work for large scales, but results differ slightly from smoothing the input directly)
+    CascadedPresmoothing = InputSlot(value=False)
+    # Compute the derivative-based features of each scale (LoG, gradient magnitude, structure tensor and
+    # Hessian eigenvalues) from one set of first and second derivative images, see fusedDerivativeFeatures()
+    FusedDerivatives = InputSlot(value=False)
 
     # Specify a default set & order for the features we compute
     FeatureIds = InputSlot(
@@ -73,13 +107,34 @@ class OpPixelFeaturesPresmoothed(Operator):
 
     Output = OutputSlot()  # The entire block of features as a single image (many channels)
     Features = OutputSlot(level=1)  # Each feature image listed separately, with feature name provided in metadata
+    # Identity of each Output channel, for downstream caches (see OpUnblockedArrayCache.ChannelKeys)
+    # to keep the channels that survive a change of the feature selection
+    ChannelKeys = OutputSlot()
 
     WINDOW_SIZE = 3.5
 
+    # Sampled Gaussians with smaller sigmas do not compose well: only cascade from (and by) at least this much
+    MIN_CASCADE_SIGMA = 1.0
+
     def __init__(self, *args, **kwargs):
         Operator.__init__(self, *args, **kwargs)
         self.source = OpArrayPiper(parent=self)
         self.source.Input.connect(self.Input)
+        if _default_cascaded_presmoothing:
+            self.CascadedPresmoothing.setValue(True)
+        if _default_fused_derivatives:
+            self.FusedDerivatives.setValue(True)
+
+        # Identity of each output channel (see setupOutputs()), and the output channels that changed identity
+        # in the last call to setupOutputs() (None: all of them)
+        self._channel_keys = None
+        self._changed_channels = None
+        # Channel keys must not match across different input data, which may be connected without dirtiness
+        self._input_generation = 0
+        self.Input.notifyUnready(self._onInputUnready)
+
+    def _onInputUnready(self, *args):
+        self._input_generation += 1
 
     def getInvalidScales(self):
         """
@@ -149,6 +204,7 @@ class OpPixelFeaturesPresmoothed(Operator):
         self.Features.resize(0)
         self.featureOutputChannels = []
         channel_names = []
+        channel_keys = []
         # create and connect individual operators
         for i, featureId in enumerate(self.FeatureIds.value):
             for j in range(dimCol):
@@ -198,6 +254,10 @@ class OpPixelFeaturesPresmoothed(Operator):
                     assert featureChannels == featureMeta.shape[1]
                     assert featureMeta.axistags.index("c") == 1
 
+                    channel_keys += [
+                        (self._input_generation, featureId, self.scales[j], bool(self.ComputeIn2d.value[j]), k)
+                        for k in range(featureChannels)
+                    ]
                     if featureChannels == 1:
                         channel_names.append(featureName)
                     else:
@@ -233,6 +293,15 @@ class OpPixelFeaturesPresmoothed(Operator):
         self.Output.meta.axistags["c"].description = ""  # Discard any semantics related to the input channels
         self.Output.meta.display_mode = "grayscale"
         self.Output.meta.channel_names = channel_names
+        self.ChannelKeys.meta.shape = (1,)
+        self.ChannelKeys.meta.dtype = object
+        self.ChannelKeys.setValue(channel_keys)
+        if self._channel_keys is None:
+            self._changed_channels = None
+        else:
+            previous_keys = set(self._channel_keys)
+            self._changed_channels = [c for c, key in enumerate(channel_keys) if key not in previous_keys]
+        self._channel_keys = channel_keys
         self.Output.meta.shape = self.Input.meta.shape[:1] + (channelCount,) + self.Input.meta.shape[2:]
         self.Output.meta.ideal_blockshape = self._get_ideal_blockshape()
 
@@ -288,6 +357,13 @@ class OpPixelFeaturesPresmoothed(Operator):
             or inputSlot == self.FeatureIds
             or inputSlot == self.ComputeIn2d
         ):
+            if self._changed_channels is None:
+                self.Output.setDirty(slice(None))
+                return
+            # Channels that were computed before just moved (see ChannelKeys): only new ones are dirty
+            for start, stop in indexRuns(self._changed_channels):
+                self.Output.setDirty((slice(None), slice(start, stop)) + (slice(None),) * 3)
+        elif inputSlot == self.CascadedPresmoothing or inputSlot == self.FusedDerivatives:
             self.Output.setDirty(slice(None))
         else:
             assert False, "Unknown dirty input slot."
@@ -399,31 +475,33 @@ class OpPixelFeaturesPresmoothed(Operator):
                 full_output_stop[0] - full_output_start[0],
                 self.Input.meta.shape[1],
             ) + source_smooth_shape
+            droi = (
+                (0, *tuple(smooth_filter_start._asint())),
+                (sourceV.shape[1], *tuple(smooth_filter_stop._asint())),
+            )
+            # There is at least one filter op at these scales
+            scale_indices = [j for j in range(dimCol) if self.matrix[:, j].any()]
+            steps = self._presmoothingSteps(scale_indices, self.CascadedPresmoothing.value)
+            bases = {base for _, base, _ in steps}
+            # Pre-smoothed volumes of the whole smooth frame (per time slice) that later scales start from
+            uncropped = {}
             try:
-                for j in range(dimCol):
-                    for i in range(dimRow):
-                        if self.matrix[i, j]:
-                            # There is at least one filter op with this scale
-                            break
-                    else:
-                        # There is no filter op at this scale
-                        continue
-
-                    if self.scales[j] > 1.0:
-                        tempSigma = math.sqrt(self.scales[j] ** 2 - 1.0)
-                    else:
-                        tempSigma = self.scales[j]
-
+                for j, base, sigma in steps:
                     presmoothed_source[j] = numpy.ndarray(full_source_smooth_shape, numpy.float32)
-
-                    droi = (
-                        (0, *tuple(smooth_filter_start._asint())),
-                        (sourceV.shape[1], *tuple(smooth_filter_stop._asint())),
-                    )
-                    for i, vsa in enumerate(sourceV.timeIter()):
-                        presmoothed_source[j][i, ...] = self._computeGaussianSmoothing(
-                            vsa, tempSigma, droi, in2d=self.ComputeIn2d.value[j]
-                        )
+                    in2d = self.ComputeIn2d.value[j]
+                    volumes = list(sourceV.timeIter()) if base is None else uncropped.pop(base)
+                    if j in bases:
+                        uncropped[j] = []
+                        for i, vol in enumerate(volumes):
+                            smoothed = self._computeGaussianSmoothing(vol, sigma, ((0,) * 4, vol.shape), in2d=in2d)
+                            smoothed = smoothed.view(vigra.VigraArray)
+                            smoothed.axistags = copy.copy(vol.axistags)
+                            presmoothed_source[j][i, ...] = smoothed[roiToSlice(*droi)]
+                            uncropped[j].append(smoothed)
+                    else:
+                        for i, vol in enumerate(volumes):
+                            presmoothed_source[j][i, ...] = self._computeGaussianSmoothing(vol, sigma, droi, in2d=in2d)
+                    del volumes
 
             except RuntimeError as e:
                 if "kernel longer than line" in str(e):
@@ -444,7 +522,7 @@ class OpPixelFeaturesPresmoothed(Operator):
 
             cnt = 0
             written = 0
-            closures = []
+            jobs = []
             # connect individual operators
             for i in range(dimRow):
                 for j in range(dimCol):
@@ -468,22 +546,35 @@ class OpPixelFeaturesPresmoothed(Operator):
                             feature_slice = (slice(None), slice(written, written + end - begin)) + (slice(None),) * 3
 
                             subtarget = target[feature_slice]
-                            # readjust the roi for the new source array
-                            full_filter_target_slice = [full_output_slice[0], slice(begin, end), *filter_target_slice]
-                            filter_target_roi = SubRegion(oslot, pslice=full_filter_target_slice)
-
-                            closure = partial(
-                                oslot.operator.call_execute,
-                                oslot,
-                                (),
-                                filter_target_roi,
-                                subtarget,
-                                sourceArray=presmoothed_source[j],
-                            )
-                            closures.append(closure)
+                            jobs.append((i, j, begin, end, subtarget))
 
                             written += end - begin
                         cnt += slices
+
+            fused = self._fusedJobs(jobs) if self.FusedDerivatives.value else {}
+            fused_features = {(i, j) for group in fused.values() for i, j, *_ in group}
+            closures = [
+                partial(self._computeFusedFeatures, group, presmoothed_source[j], filter_target_slice)
+                for j, group in fused.items()
+            ]
+            for i, j, begin, end, subtarget in jobs:
+                if (i, j) in fused_features:
+                    continue
+                oslot = self.featureOps[i][j].Output
+                # readjust the roi for the new source array
+                full_filter_target_slice = [full_output_slice[0], slice(begin, end), *filter_target_slice]
+                filter_target_roi = SubRegion(oslot, pslice=full_filter_target_slice)
+
+                closure = partial(
+                    oslot.operator.call_execute,
+                    oslot,
+                    (),
+                    filter_target_roi,
+                    subtarget,
+                    sourceArray=presmoothed_source[j],
+                )
+                closures.append(closure)
+
             pool = RequestPool()
             for c in closures:
                 pool.request(c)
@@ -497,6 +588,90 @@ class OpPixelFeaturesPresmoothed(Operator):
                     except Exception:
                         presmoothed_source[i] = None
 
+    def _fusedJobs(self, jobs):
+        """
+        Group the (feature index, scale index, begin, end, subtarget) jobs that can be computed from shared
+        derivative images by scale index.  Only scales with at least two such features are worth it.
+        """
+        groups = collections.defaultdict(list)
+        for job in jobs:
+            if self.FeatureIds.value[job[0]] in FUSABLE_FEATURES:
+                groups[job[1]].append(job)
+        return {j: group for j, group in groups.items() if len(group) > 1}
+
+    def _computeFusedFeatures(self, jobs, sourceArray, filter_target_slice):
+        """
+        Compute the channels [begin, end) of the features of the given jobs (all of the same scale) from the
+        pre-smoothed sourceArray (filter frame) and write them to their subtargets.
+        """
+        j = jobs[0][1]
+        feature_ids = [self.FeatureIds.value[i] for i, *_ in jobs]
+        # All operators of a scale have the same dimensionality and window
+        ops = [self.featureOps[i][j] for i, *_ in jobs]
+        process_in_2d = ops[0].invalid_z or ops[0].ComputeIn2d.value
+        window_size = ops[0].window_size_feature
+        scale = self.newScales[j]
+        z_slice, *yx_slice = filter_target_slice
+
+        if process_in_2d:
+            axistags = vigra.defaultAxistags("cyx")
+            # source z index, target z index
+            z_steps = [(z_slice.start + k, k) for k in range(z_slice.stop - z_slice.start)]
+            result_slice = tuple(yx_slice)
+        else:
+            axistags = vigra.defaultAxistags("czyx")
+            z_steps = [(slice(None), slice(None))]
+            result_slice = tuple(filter_target_slice)
+
+        for tstep in range(sourceArray.shape[0]):
+            for c in range(sourceArray.shape[1]):
+                for source_z, target_z in z_steps:
+                    image = sourceArray[tstep, c : c + 1, source_z].view(vigra.VigraArray)
+                    image.axistags = copy.copy(axistags)
+                    results = fusedDerivativeFeatures(image, feature_ids, scale, 0.5 * scale, window_size)
+                    for (i, _, begin, end, subtarget), result in zip(jobs, results):
+                        # Channels of this input channel in the feature, and where they go in the subtarget
+                        n = result.shape[0]
+                        first, last = max(c * n, begin), min((c + 1) * n, end)
+                        if first >= last:
+                            continue
+                        subtarget[tstep, first - begin : last - begin, target_z] = result[
+                            (slice(first - c * n, last - c * n),) + result_slice
+                        ]
+
+    def _presmoothingSigma(self, j):
+        # The feature operators smooth with (at most) 1.0 themselves, see setupOutputs()
+        if self.scales[j] > 1.0:
+            return math.sqrt(self.scales[j] ** 2 - 1.0)
+        return self.scales[j]
+
+    def _presmoothingSteps(self, scale_indices, cascaded):
+        """
+        Plan the pre-smoothing of the given scales as a list of (scale index, base scale index, sigma):
+        the pre-smoothed volume of each scale is computed by smoothing the volume of its base scale
+        (or the input, if the base is None) with sigma.
+
+        In cascaded mode, scales (of the same dimensionality) are smoothed in order of increasing sigma,
+        each one starting from the previous one with the incremental sigma sqrt(sigma_j^2 - sigma_base^2).
+        """
+        sigmas = {j: self._presmoothingSigma(j) for j in scale_indices}
+        if not cascaded:
+            return [(j, None, sigmas[j]) for j in scale_indices]
+
+        steps = []
+        for in2d in (False, True):
+            base = None
+            for j in sorted((j for j in scale_indices if bool(self.ComputeIn2d.value[j]) == in2d), key=sigmas.get):
+                if base is not None and sigmas[base] >= self.MIN_CASCADE_SIGMA:
+                    increment = math.sqrt(max(sigmas[j] ** 2 - sigmas[base] ** 2, 0.0))
+                    if increment >= self.MIN_CASCADE_SIGMA:
+                        steps.append((j, base, increment))
+                        base = j
+                        continue
+                steps.append((j, None, sigmas[j]))
+                base = j
+        return steps
+
     def _computeGaussianSmoothing(self, vol, sigma, roi, in2d):
         if WITH_FAST_FILTERS:
             # Use fast filters (if available)
@@ -5,10 +5,25 @@ import numpy
 from functools import partial
 from lazyflow.graph import Operator, InputSlot
 from .opUnblockedArrayCache import OpUnblockedArrayCache
+from .blockPrefetcher import BlockPrefetcher
+from . import cacheMemoryManager
 from lazyflow.request import Request, RequestPool
 from lazyflow.roi import getIntersectingRois, roiToSlice
 from lazyflow.rtype import SubRegion
 
+#: Number of blocks new caches prefetch ahead of sequential/strided sweeps, see setPrefetchDepth()
+_default_prefetch_depth = 0
+
+
+def setPrefetchDepth(blocks):
+    """
+    Let caches created from now on detect sequential or strided block accesses and
+    speculatively compute up to the given number of blocks ahead (0 disables prefetching, the default).
+    See lazyflow.operators.blockPrefetcher.
+    """
+    global _default_prefetch_depth
+    _default_prefetch_depth = blocks
+
 
 class OpSimpleBlockedArrayCache(OpUnblockedArrayCache):
     BlockShape = InputSlot(
@@ -19,8 +34,11 @@ class OpSimpleBlockedArrayCache(OpUnblockedArrayCache):
     def __init__(self, *args, **kwargs):
         super(OpSimpleBlockedArrayCache, self).__init__(*args, **kwargs)
         self._blockshape = None
+        self._prefetcher = BlockPrefetcher(self._prefetch_block, self._is_block_cached, depth=_default_prefetch_depth)
 
     def setupOutputs(self):
+        # Before the base class possibly remaps the stored blocks
+        self._prefetcher.cancel()
         super(OpSimpleBlockedArrayCache, self).setupOutputs()
         if self.BlockShape.ready():
             self._blockshape = self.BlockShape.value
@@ -69,7 +87,7 @@ class OpSimpleBlockedArrayCache(OpUnblockedArrayCache):
             if self.BypassModeEnabled.value:
                 full_block_data = self.Output.stype.allocateDestination(SubRegion(self.Output, *full_block_roi))
 
-                self.Input(*full_block_roi).writeInto(full_block_data).block()
+                self._fetch_into(full_block_roi, full_block_data)
 
                 roi_within_block = clipped_block_roi - full_block_roi[0]
                 self.Output.stype.copy_data(
@@ -81,7 +99,7 @@ class OpSimpleBlockedArrayCache(OpUnblockedArrayCache):
                 self._execute_Output_impl(clipped_block_roi, result[roiToSlice(*output_roi)])
             elif self.Input.meta.dontcache:
                 # Data isn't in the cache, but we don't need it in the cache anyway.
-                self.Input(*clipped_block_roi).writeInto(result[roiToSlice(*output_roi)]).block()
+                self._fetch_into(clipped_block_roi, result[roiToSlice(*output_roi)])
             else:
                 # Data doesn't exist yet in the cache.
                 # Request the full block, but then discard the parts we don't need.
@@ -99,13 +117,50 @@ class OpSimpleBlockedArrayCache(OpUnblockedArrayCache):
         clipped_block_rois = getIntersectingRois(self.Input.meta.shape, self._blockshape, (roi.start, roi.stop), True)
         full_block_rois = getIntersectingRois(self.Input.meta.shape, self._blockshape, (roi.start, roi.stop), False)
 
+        if self._prefetcher.enabled and not self.BypassModeEnabled.value and not self.Input.meta.dontcache:
+            self._prefetcher.access(
+                full_block_rois, self._blockshape, self.Input.meta.shape, max_blocks=self._prefetch_budget()
+            )
+
         pool = RequestPool()
         for full_block_roi, clipped_block_roi in zip(full_block_rois, clipped_block_rois):
             req = Request(partial(copy_block, full_block_roi, clipped_block_roi))
             pool.add(req)
         pool.wait()
 
+    def _prefetch_budget(self):
+        """
+        Number of blocks that can be prefetched without pushing the caches over their memory budget
+        """
+        block_shape = numpy.minimum(self._blockshape, self.Input.meta.shape)
+        block_nbytes = numpy.prod(block_shape) * (self.Output.meta.ram_usage_per_requested_pixel or 1)
+        return int(cacheMemoryManager.availableMemory() // max(1, block_nbytes))
+
+    def _is_block_cached(self, block_roi):
+        with self._lock:
+            return block_roi in self._block_data
+
+    def _prefetch_block(self, block_roi):
+        if not self._is_block_cached(block_roi):
+            self._fetch_and_store_block(block_roi, None)
+
+    def setPrefetchDepth(self, blocks):
+        """
+        Override the module default (see setPrefetchDepth()) for this cache.
+        """
+        self._prefetcher.depth = blocks
+        if blocks <= 0:
+            self._prefetcher.cancel()
+
+    def getPrefetchStats(self):
+        """
+        Statistics on speculatively fetched blocks, see BlockPrefetcher.getStats()
+        """
+        return self._prefetcher.getStats()
+
     def propagateDirty(self, slot, subindex, roi):
-        if slot in (self.BypassModeEnabled, self.BlockShape):
+        if slot in (self.BypassModeEnabled, self.BlockShape, self.ChannelKeys, self.StorageDtype):
             return
+        # Speculative requests might store stale data, and the sweep is likely to start over
+        self._prefetcher.cancel()
         super(OpSimpleBlockedArrayCache, self).propagateDirty(slot, subindex, roi)
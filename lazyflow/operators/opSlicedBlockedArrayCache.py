@@ -47,6 +47,8 @@ class OpSlicedBlockedArrayCache(Operator, ObservableCache):
     BlockShape = InputSlot()
     BypassModeEnabled = InputSlot(value=False)
     CompressionEnabled = InputSlot(value=False)
+    ChannelKeys = InputSlot(optional=True)  # See OpUnblockedArrayCache
+    StorageDtype = InputSlot(optional=True)  # See OpUnblockedArrayCache
 
     # Outputs
     Output = OutputSlot(allow_mask=True)
@@ -86,6 +88,12 @@ class OpSlicedBlockedArrayCache(Operator, ObservableCache):
             tot += iOp.usedMemory()
         return tot
 
+    def savedMemory(self):
+        """
+        Bytes saved by storing blocks with a reduced precision, see OpUnblockedArrayCache.savedMemory()
+        """
+        return sum(iOp.savedMemory() for iOp in self._innerOps)
+
     def fractionOfUsedMemoryDirty(self):
         tot = 0.0
         dirty = 0.0
@@ -121,6 +129,8 @@ class OpSlicedBlockedArrayCache(Operator, ObservableCache):
                 op.inputs["fixAtCurrent"].connect(self.inputs["fixAtCurrent"])
                 op.BypassModeEnabled.connect(self.BypassModeEnabled)
                 op.CompressionEnabled.connect(self.CompressionEnabled)
+                op.ChannelKeys.connect(self.ChannelKeys)
+                op.StorageDtype.connect(self.StorageDtype)
                 self._innerOps.append(op)
 
                 op.inputs["Input"].connect(self.inputs["Input"])
@@ -197,5 +207,5 @@ class OpSlicedBlockedArrayCache(Operator, ObservableCache):
                 # It is considered an error to change the blockshape after the initial configuration.
             elif slot is self.fixAtCurrent:
                 self.Output.setDirty(slice(None))
-            elif slot not in (self.BypassModeEnabled, self.CompressionEnabled):
+            elif slot not in (self.BypassModeEnabled, self.CompressionEnabled, self.ChannelKeys, self.StorageDtype):
                 assert False, "Unknown dirty input slot"
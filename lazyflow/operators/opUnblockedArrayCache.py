@@ -29,15 +29,56 @@ import numpy
 import vigra
 
 from lazyflow.graph import Operator, InputSlot, OutputSlot
+from lazyflow.operators import cacheSharedMemory
 from lazyflow.operators.opCache import ManagedBlockedCache
 from lazyflow.request import RequestLock
-from lazyflow.roi import getIntersection, roiFromShape, roiToSlice, containing_rois, sliceToRoi
+from lazyflow.roi import indexRuns, roiFromShape, roiToSlice, sliceToRoi
+from lazyflow.utility import RequestCoalescer, RoiIndex
 
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+#: Upper limit (in bytes) for merged upstream requests of new caches, see setCoalescingLimit()
+_default_coalescing_limit = 0
+
+
+def setCoalescingLimit(max_bytes):
+    """
+    Let caches created from now on merge concurrent overlapping upstream requests
+    into bounding requests of up to max_bytes (0 disables merging, the default).
+    See lazyflow.utility.RequestCoalescer.
+    """
+    global _default_coalescing_limit
+    _default_coalescing_limit = max_bytes
+
+
+def _intersects(roi_a, roi_b):
+    return all(a_start < b_stop and b_start < a_stop for a_start, a_stop, b_start, b_stop in zip(*roi_a, *roi_b))
+
+
+# Placeholder for a graph hash that still has to be computed
+_UNKNOWN = object()
+
+
+def _is_object_dtype(dtype):
+    return dtype is None or numpy.dtype(dtype) == numpy.object_
+
+
+def _overflows(data, reduced_data):
+    """
+    True if finite values of data became infinite in reduced_data (a copy with a smaller dtype)
+    """
+    return bool((numpy.isinf(reduced_data) & numpy.isfinite(data)).any())
+
+
+def _block_nbytes(block):
+    if block is None:
+        return 0
+    return block.size * numpy.dtype(block.dtype).itemsize
+
+
 class OpUnblockedArrayCache(Operator, ManagedBlockedCache):
     """
     This cache operator stores the results of all requests that pass through
@@ -47,6 +88,13 @@ class OpUnblockedArrayCache(Operator, ManagedBlockedCache):
         be stored multiple times, except for the special case where the new request happens
         to fall ENTIRELY within an existing block of data.
     - If any portion of a stored block is marked dirty, the entire block is discarded.
+      Exception: if ChannelKeys identifies the channels of the Input (one key per channel, see
+      OpPixelFeaturesPresmoothed.ChannelKeys), blocks that span all channels only lose the dirty channels, and
+      stored blocks are remapped to the new channel layout when the channel keys change.
+      Missing channels are fetched when the block is requested next time.
+    - If StorageDtype is set (e.g. to float16 for features), floating point blocks are
+      stored with that (lower) precision, and converted back to the Input dtype when they are read.
+      Blocks with values outside of the range of the storage dtype are stored with full precision.
 
     Unlike other caches, this cache does not impose its own blocking on the data.
     Instead, it is assumed that the downstream operators have chosen some reasonable blocking.
@@ -56,16 +104,29 @@ class OpUnblockedArrayCache(Operator, ManagedBlockedCache):
 
     Input = InputSlot(allow_mask=True)
     CompressionEnabled = InputSlot(value=False)  # If True, compression will be enabled for certain dtypes
+    ChannelKeys = InputSlot(optional=True)  # One identity per channel of the Input (see above)
+    StorageDtype = InputSlot(optional=True)  # Precision to store floating point blocks with (see above)
     Output = OutputSlot(allow_mask=True)
 
     CleanBlocks = OutputSlot()  # A list of slicings indicating which blocks are stored in the cache and clean.
 
+    reportsMemoryChanges = True
+
     def __init__(self, *args, **kwargs):
         super(OpUnblockedArrayCache, self).__init__(*args, **kwargs)
         self._lock = RequestLock()
+        # Incremented whenever blocks become dirty, so that blocks spilled concurrently can be discarded
+        self._dirty_generation = 0
+        # Merges concurrent overlapping requests to our Input
+        self._coalescer = RequestCoalescer(self.Input, max_merged_bytes=_default_coalescing_limit)
+        # Content hash of the upstream graph, for sharing blocks with other processes (see _shared_graph_hash())
+        self._graph_hash = _UNKNOWN
+        self._graph_hash_generation = None
+        # (shape, dtype, axis keys, channel keys) of the Input our blocks were computed from
+        self._block_layout = None
         self._resetBlocks()
 
-        self.Input.notifyUnready(self._resetBlocks)
+        self.Input.notifyUnready(self._onInputUnready)
 
         # Now that we're initialized, it's safe to register with the memory manager
         self.registerWithMemoryManager()
@@ -79,8 +140,165 @@ class OpUnblockedArrayCache(Operator, ManagedBlockedCache):
 
     def setupOutputs(self):
         self.Output.meta.assignFrom(self.Input.meta)
+        if self.Input.meta.dtype is not None and self.Input.meta.dtype != object:
+            self._coalescer.bytes_per_pixel = numpy.dtype(self.Input.meta.dtype).itemsize
         self.CleanBlocks.meta.shape = (1,)
         self.CleanBlocks.meta.dtype = object  # it's a list
+        self._graph_hash = _UNKNOWN
+        self._updateBlockLayout()
+
+    def _onInputUnready(self, *args):
+        if self._block_layout is not None and self._block_layout[3] is not None:
+            # Keep the blocks until the Input is ready again: channels with the same keys can be reused
+            return
+        self._resetBlocks()
+
+    def _currentLayout(self):
+        meta = self.Input.meta
+        axes = tuple(meta.getAxisKeys()) if meta.axistags is not None else None
+        channel_keys = None
+        if self.ChannelKeys.ready() and axes is not None and "c" in axes:
+            channel_keys = tuple(self.ChannelKeys.value)
+        return (tuple(meta.shape), meta.dtype, axes, channel_keys)
+
+    def _channelIndex(self):
+        """
+        Index of the channel axis, or None if the Input does not identify its channels
+        """
+        if self._block_layout is None:
+            return None
+        shape, dtype, axes, channel_keys = self._block_layout
+        if channel_keys is None or axes is None or "c" not in axes or _is_object_dtype(dtype):
+            return None
+        if len(channel_keys) != shape[axes.index("c")]:
+            return None
+        return axes.index("c")
+
+    def _updateBlockLayout(self):
+        layout = self._currentLayout()
+        shape, dtype, axes, channel_keys = layout
+        if channel_keys is not None and len(channel_keys) != shape[axes.index("c")]:
+            # ChannelKeys and Input are updated one after the other (e.g. when the feature selection changes):
+            # keep the blocks as they are until both are
+            return
+        previous, self._block_layout = self._block_layout, layout
+        if previous is None or previous == layout or previous[3] is None:
+            return
+        if not self._remapChannels(previous, layout):
+            self._resetBlocks()
+
+    def _remapChannels(self, previous, layout):
+        """
+        Move the channels of all stored blocks to their positions in the new channel layout
+        (by channel key), and mark the channels that were not computed before as missing.
+        Returns False if the blocks can't be remapped.
+        """
+        old_shape, dtype, axes, old_keys = previous
+        new_shape, new_dtype, new_axes, new_keys = layout
+        if new_keys is None or dtype != new_dtype or axes != new_axes or axes is None or "c" not in axes:
+            return False
+        c = axes.index("c")
+        if (
+            _is_object_dtype(dtype)
+            or old_shape[:c] + old_shape[c + 1 :] != new_shape[:c] + new_shape[c + 1 :]
+            or len(old_keys) != old_shape[c]
+            or len(new_keys) != new_shape[c]
+        ):
+            return False
+        old_channels = {key: i for i, key in enumerate(old_keys)}
+        new_positions = [i for i, key in enumerate(new_keys) if key in old_channels]
+        if not new_positions:
+            return False
+        old_positions = [old_channels[new_keys[i]] for i in new_positions]
+
+        with self._lock:
+            blocks = list(self._block_data.items())
+            old_missing = dict(self._missing_channels)
+            access_times = dict(self._last_access_times)
+            compute_times = dict(self._block_compute_times)
+
+        remapped = {}
+        for (start, stop), block in blocks:
+            if start[c] != 0 or stop[c] != old_shape[c] or isinstance(block, numpy.ma.MaskedArray):
+                # Only blocks that span all channels can be remapped
+                return False
+            # Extra [:] here is in case we are decompressing from a chunkedarray
+            block = numpy.asarray(block[:])
+            data = numpy.zeros(block.shape[:c] + (new_shape[c],) + block.shape[c + 1 :], dtype=block.dtype)
+            index = [slice(None)] * data.ndim
+            index[c] = new_positions
+            data[tuple(index)] = numpy.take(block, old_positions, axis=c)
+            missing = numpy.ones(new_shape[c], dtype=bool)
+            block_missing = old_missing.get((start, stop))
+            missing[new_positions] = block_missing[old_positions] if block_missing is not None else False
+            new_roi = (start, stop[:c] + (new_shape[c],) + stop[c + 1 :])
+            remapped[new_roi] = (data, missing, access_times.get((start, stop)), compute_times.get((start, stop)))
+
+        self._resetBlocks()
+        with self._lock:
+            for block_roi, (data, missing, access_time, compute_time) in remapped.items():
+                self._block_data[block_roi] = data
+                self._block_locks[block_roi] = RequestLock()
+                self._block_index.add(block_roi)
+                self._last_access_times[block_roi] = access_time or time.time()
+                if compute_time is not None:
+                    self._block_compute_times[block_roi] = compute_time
+                if missing.any():
+                    self._missing_channels[block_roi] = missing
+                self.reportMemoryChange(_block_nbytes(data))
+        logger.debug(f"{self.name}: kept {len(new_positions)} of {new_shape[c]} channels in {len(remapped)} blocks")
+        return True
+
+    def _markChannelsMissing(self, block_roi, dirty_roi):
+        """
+        If only some channels of the stored block are dirty, remember to fetch them again instead of
+        discarding the block.  Returns False if the block has to be discarded.
+        """
+        c = self._channelIndex()
+        if c is None:
+            return False
+        num_channels = self._block_layout[0][c]
+        if block_roi[0][c] != 0 or block_roi[1][c] != num_channels:
+            return False
+        dirty_start, dirty_stop = max(dirty_roi[0][c], 0), min(dirty_roi[1][c], num_channels)
+        if dirty_start == 0 and dirty_stop == num_channels:
+            return False
+        with self._lock:
+            block = self._block_data.get(block_roi)
+            if block is None or isinstance(block, numpy.ma.MaskedArray):
+                return False
+            missing = self._missing_channels.setdefault(block_roi, numpy.zeros(num_channels, dtype=bool))
+            missing[dirty_start:dirty_stop] = True
+        return True
+
+    def _fillMissingChannels(self, block_roi):
+        """
+        Fetch the missing channels of a stored block (see _remapChannels() and _markChannelsMissing()).
+        The block_lock is not obtained here, so lock it before you call this.
+        """
+        with self._lock:
+            block = self._block_data.get(block_roi)
+            missing = self._missing_channels.get(block_roi)
+            if block is None or missing is None:
+                return
+            missing = missing.copy()
+            dirty_generation = self._dirty_generation
+
+        c = self._channelIndex()
+        # Extra [:] here is in case we are decompressing from a chunkedarray
+        data = numpy.array(block[:])
+        for channel_start, channel_stop in indexRuns(numpy.flatnonzero(missing)):
+            start, stop = list(block_roi[0]), list(block_roi[1])
+            start[c], stop[c] = channel_start, channel_stop
+            index = [slice(None)] * data.ndim
+            index[c] = slice(channel_start, channel_stop)
+            data[tuple(index)] = self._fetch_into((tuple(start), tuple(stop)), None)
+
+        with self._lock:
+            if self._dirty_generation == dirty_generation:
+                # Otherwise, some channels may have become dirty again while we were fetching
+                self._missing_channels.pop(block_roi, None)
+        self._store_block_data(block_roi, data, copy=False)
 
     def execute(self, slot, subindex, roi, result):
         if slot is self.Output:
@@ -97,15 +315,24 @@ class OpUnblockedArrayCache(Operator, ManagedBlockedCache):
         request_roi = self._standardize_roi(*request_roi)
         with self._lock:
             block_roi = self._get_containing_block_roi(request_roi)
-            if block_roi is not None:
+            incomplete = block_roi is not None and block_roi in self._missing_channels
+            if block_roi is not None and not incomplete:
                 # Data is already in the cache. Just extract it.
                 block_relative_roi = numpy.array(request_roi) - block_roi[0]
                 self.Output.stype.copy_data(result, self._block_data[block_roi][roiToSlice(*block_relative_roi)])
+                self._last_access_times[block_roi] = time.time()
                 return
 
+        if incomplete:
+            # Some channels have to be fetched first
+            block_data = self._fetch_and_store_block(block_roi, None)
+            block_relative_roi = numpy.array(request_roi) - block_roi[0]
+            self.Output.stype.copy_data(result, block_data[roiToSlice(*block_relative_roi)])
+            return
+
         if self.Input.meta.dontcache:
             # Data isn't in the cache, but we don't want to cache it anyway.
-            self.Input(*request_roi).writeInto(result).block()
+            self._fetch_into(request_roi, result)
             return
 
         # Data isn't in the cache, so request it and cache it
@@ -114,11 +341,9 @@ class OpUnblockedArrayCache(Operator, ManagedBlockedCache):
     def _get_containing_block_roi(self, request_roi):
         # Does this roi happen to fit ENTIRELY within an existing stored block?
         request_roi = self._standardize_roi(*request_roi)
-        outer_rois = containing_rois(list(self._block_data.keys()), request_roi)
+        outer_rois = self._block_index.containing(request_roi)
         if len(outer_rois) > 0:
-            # Standardize roi for usage as dict key
-            block_roi = self._standardize_roi(*outer_rois[0])
-            return block_roi
+            return outer_rois[0]
         return None
 
     def _fetch_and_store_block(self, block_roi, out):
@@ -131,29 +356,133 @@ class OpUnblockedArrayCache(Operator, ManagedBlockedCache):
             if block_roi not in self._block_locks:
                 self._block_locks[block_roi] = RequestLock()
             block_lock = self._block_locks[block_roi]
+            cached = block_roi in self._block_data
+
+        if not cached:
+            # Don't add to the cache while the memory manager is still freeing space.
+            # Wait before taking the block lock, so that the manager can free this block meanwhile.
+            self.waitForCacheMemory()
 
         # Handle identical simultaneous requests for the same block
         # without preventing parallel requests for different blocks.
         with block_lock:
+            if block_roi in self._missing_channels:
+                self._fillMissingChannels(block_roi)
             if block_roi in self._block_data:
                 if out is None:
                     # Extra [:] here is in case we are decompressing from a chunkedarray
-                    return self._block_data[block_roi][:]
+                    return self._upcast(self._block_data[block_roi][:])
                 else:
                     # Extra [:] here is in case we are decompressing from a chunkedarray
                     self.Output.stype.copy_data(out, self._block_data[block_roi][:])
                     return out
 
-            req = self.Input(*block_roi)
-            if out is not None:
-                req.writeInto(out)
-            block_data = req.wait()
-            self._store_block_data(block_roi, block_data)
+            compute_start = time.time()
+            # Reading the block back from the spill store or from another process is cheaper than recomputing it
+            shared = False
+            block_data = self.unspillBlock(block_roi)
+            if block_data is None:
+                block_data = self._get_shared_block(block_roi)
+                shared = block_data is not None
+            if block_data is None:
+                block_data = self._fetch_into(block_roi, out)
+                shared_data = self._publish_shared_block(block_roi, block_data)
+                if shared_data is not None:
+                    block_data, shared = shared_data, True
+            elif out is not None:
+                self.Output.stype.copy_data(out, block_data)
+            compute_time = time.time() - compute_start
+            # Shared blocks are read-only mappings: no need for a private copy
+            self._store_block_data(block_roi, block_data, copy=not shared)
+            with self._lock:
+                self._block_compute_times[block_roi] = compute_time
         return block_data
 
-    def _store_block_data(self, block_roi, block_data):
+    def _fetch_into(self, roi, out):
+        """
+        Request the given roi from upstream (merged with concurrent overlapping requests if enabled),
+        copy it into out (if given) and return it.
+        """
+        data = self._coalescer.get(roi, out)
+        if out is not None and data is not out:
+            self.Output.stype.copy_data(out, data)
+        return data
+
+    def _shared_graph_hash(self):
+        """
+        Content hash of the upstream graph (see cacheSharedMemory.upstreamContentHash()),
+        or None if our blocks can't be shared with other processes.
+        """
+        # Operators upstream may have acquired hidden state without notifying us
+        generation = cacheSharedMemory.hiddenStateGeneration()
+        if self._graph_hash is _UNKNOWN or self._graph_hash_generation != generation:
+            graph_hash = None
+            dtype = self.Input.meta.dtype
+            if (
+                self.Input.ready()
+                and not self.CompressionEnabled.value
+                and dtype is not None
+                and numpy.dtype(dtype) != numpy.object_
+            ):
+                try:
+                    graph_hash = cacheSharedMemory.upstreamContentHash(self.Input)
+                except cacheSharedMemory.UnhashableGraph as e:
+                    logger.debug(f"Not sharing the blocks of {self.name}: {e}")
+            self._graph_hash = graph_hash
+            self._graph_hash_generation = generation
+        return self._graph_hash
+
+    def _shared_block_name(self, block_roi):
+        store = cacheSharedMemory.getSharedMemoryStore()
+        if store is None or self.Input.meta.dontcache:
+            return store, None
+        graph_hash = self._shared_graph_hash()
+        if graph_hash is None:
+            return store, None
+        return store, store.blockName(graph_hash, block_roi, self.Input.meta.dtype)
+
+    def _get_shared_block(self, block_roi):
+        """
+        The block as published by another process (mapped read-only), or None
+        """
+        store, name = self._shared_block_name(block_roi)
+        if name is None:
+            return None
+        shape = numpy.subtract(block_roi[1], block_roi[0])
+        return store.get(name, shape, self.Input.meta.dtype)
+
+    def _publish_shared_block(self, block_roi, block_data):
+        """
+        Copy the block to shared memory, and return the shared block (None if it was not published)
+        """
+        if isinstance(block_data, numpy.ma.MaskedArray) or not isinstance(block_data, numpy.ndarray):
+            return None
+        store, name = self._shared_block_name(block_roi)
+        if name is None:
+            return None
+        return store.put(name, block_data)
+
+    def _discard_shared_blocks(self, block_rois):
+        """
+        Unlink the shared segments of the given blocks, e.g. because they are dirty.
+        (Upstream changes are not always reflected in the graph hash, e.g. if a file was modified.)
+        """
+        if cacheSharedMemory.getSharedMemoryStore() is None:
+            return
+        for block_roi in block_rois:
+            store, name = self._shared_block_name(block_roi)
+            if name is not None:
+                store.discard(name)
+
+    def getCoalescingStats(self):
+        """
+        Statistics on how often concurrent upstream requests were merged, see RequestCoalescer.getStats()
+        """
+        return self._coalescer.getStats()
+
+    def _store_block_data(self, block_roi, block_data, copy=True):
         """
-        Copy block_data and store it into the cache.
+        Copy block_data (unless copy is False) and store it into the cache.
         The block_lock is not obtained here, so lock it before you call this.
         """
         with self._lock:
@@ -167,27 +496,75 @@ class OpUnblockedArrayCache(Operator, ManagedBlockedCache):
                 )
                 compressed_block[:] = block_data
                 block_storage_data = compressed_block
+            elif copy:
+                # (astype always copies)
+                with numpy.errstate(over="ignore"):
+                    block_storage_data = block_data.astype(self._storage_dtype(block_data))
+                if block_storage_data.dtype != block_data.dtype and _overflows(block_data, block_storage_data):
+                    # Out of range for the storage dtype (e.g. > 65504 for float16): keep full precision
+                    block_storage_data = block_data.copy()
             else:
-                block_storage_data = block_data.copy()
+                block_storage_data = block_data
 
             # Store the data.
             # First double-check that the block wasn't removed from the
             #   cache while we were requesting it.
             # (Could have happened via propagateDirty() or eventually the arrayCacheMemoryMgr)
             if block_roi in self._block_locks:
+                old_block = self._block_data.get(block_roi)
                 self._block_data[block_roi] = block_storage_data
+                self._block_index.add(block_roi)
+                self.reportMemoryChange(_block_nbytes(block_storage_data) - _block_nbytes(old_block))
 
         self._last_access_times[block_roi] = time.time()
 
+    def _storage_dtype(self, block_data):
+        """
+        The dtype to store block_data with, see StorageDtype
+        """
+        storage_dtype = self.StorageDtype.value if self.StorageDtype.ready() else None
+        if (
+            storage_dtype is None
+            or isinstance(block_data, numpy.ma.MaskedArray)
+            or not numpy.issubdtype(block_data.dtype, numpy.floating)
+            or numpy.dtype(storage_dtype).itemsize >= block_data.dtype.itemsize
+        ):
+            return block_data.dtype
+        return numpy.dtype(storage_dtype)
+
+    def _upcast(self, block_data):
+        dtype = self.Input.meta.dtype
+        if _is_object_dtype(dtype) or block_data.dtype == dtype:
+            return block_data
+        return block_data.astype(dtype)
+
+    def savedMemory(self):
+        """
+        Bytes saved by storing blocks with a reduced precision (see StorageDtype)
+        """
+        dtype = self.Input.meta.dtype
+        if _is_object_dtype(dtype):
+            return 0
+        itemsize = numpy.dtype(dtype).itemsize
+        with self._lock:
+            blocks = list(self._block_data.values())
+        return sum(
+            block.size * (itemsize - block.dtype.itemsize)
+            for block in blocks
+            if isinstance(block, numpy.ndarray) and block.dtype.itemsize < itemsize
+        )
+
     def _execute_CleanBlocks(self, slot, subindex, roi, result):
         with self._lock:
-            block_rois = sorted(self._block_data.keys())
+            block_rois = sorted(k for k in self._block_data.keys() if k not in self._missing_channels)
             block_slicings = list(starmap(roiToSlice, block_rois))
             result[0] = block_slicings
 
     def setInSlot(self, slot, subindex, roi, block_data):
         assert slot == self.Input
-        block_roi = (tuple(roi.start), tuple(roi.stop))
+        # From now on, our data is not determined by our Input alone
+        cacheSharedMemory.markHiddenState(self)
+        block_roi = self._standardize_roi(roi.start, roi.stop)
 
         with self._lock:
             if block_roi not in self._block_locks:
@@ -198,24 +575,34 @@ class OpUnblockedArrayCache(Operator, ManagedBlockedCache):
             self._store_block_data(block_roi, block_data)
 
     def propagateDirty(self, slot, subindex, roi):
-        if slot is self.CompressionEnabled:
+        if slot in (self.CompressionEnabled, self.ChannelKeys, self.StorageDtype):
+            # Stored blocks are remapped in setupOutputs(), or keep their precision
             return
 
         dirty_roi = self._standardize_roi(roi.start, roi.stop)
         maximum_roi = roiFromShape(self.Input.meta.shape)
         maximum_roi = self._standardize_roi(*maximum_roi)
 
+        # Requests for the dirty roi must not be served by upstream requests that are still running
+        self._coalescer.invalidate(dirty_roi)
+
+        dirty_blocks = list(self._block_index.intersecting(dirty_roi))
         if dirty_roi == maximum_roi:
             # Optimize the common case:
             # Everything is dirty, so no need to loop
             self._resetBlocks()
         else:
-            # FIXME: This is O(N) for now.
-            #        We should speed this up by maintaining a bookkeeping data structure in execute().
-            for block_roi in list(self._block_data.keys()):
-                if getIntersection(block_roi, dirty_roi, assertIntersect=False):
-                    self.freeBlock(block_roi)
-
+            with self._lock:
+                self._dirty_generation += 1
+            for block_roi in dirty_blocks:
+                if not self._markChannelsMissing(block_roi, dirty_roi):
+                    self._freeBlock(block_roi)
+            self.discardSpilledBlocks([r for r in self.spilledBlocks() if _intersects(r, dirty_roi)])
+        # (With the graph hash they were published under)
+        self._discard_shared_blocks(dirty_blocks)
+
+        # Whatever changed upstream might be reflected in the graph hash
+        self._graph_hash = _UNKNOWN
         self.Output.setDirty(roi.start, roi.stop)
 
     ##
@@ -251,28 +638,73 @@ class OpUnblockedArrayCache(Operator, ManagedBlockedCache):
             l = [(k, self._last_access_times[k]) for k in self._last_access_times]
         return l
 
+    def getBlockComputeCosts(self):
+        with self._lock:
+            costs = []
+            for k, seconds in self._block_compute_times.items():
+                block = self._block_data.get(k)
+                if block is not None:
+                    costs.append((k, seconds, block.size * numpy.dtype(block.dtype).itemsize))
+        return costs
+
     def freeMemory(self):
         used = self.usedMemory()
-        self._resetBlocks()
+        self._clearBlocks()
         return used
 
     def freeBlock(self, key):
         with self._lock:
-            if key not in self._block_locks:
-                return 0
-            block = self._block_data[key]
-            bytes_per_pixel = numpy.dtype(block.dtype).itemsize
-            mem = block.size * bytes_per_pixel
-            del self._block_data[key]
+            incomplete = key in self._missing_channels
+        block, mem, dirty_generation = self._freeBlock(key)
+        if block is not None and not incomplete and not isinstance(block, numpy.ma.MaskedArray):
+            # Extra [:] here is in case we are decompressing from a chunkedarray
+            if self.spillBlock(key, block[:]):
+                with self._lock:
+                    if self._dirty_generation != dirty_generation:
+                        # Became dirty while it was written
+                        self.discardSpilledBlocks([key])
+        return mem
+
+    def _freeBlock(self, key):
+        """
+        Remove a block from memory.  Returns the block data (None if there was none), the bytes freed
+        and the dirty generation at the time of removal.
+        """
+        with self._lock:
+            if key not in self._block_locks or key not in self._block_data:
+                # Unknown, or still being fetched
+                return None, 0, self._dirty_generation
+            block = self._block_data.pop(key)
+            mem = _block_nbytes(block)
             del self._block_locks[key]
             del self._last_access_times[key]
-            return mem
+            self._block_compute_times.pop(key, None)
+            self._missing_channels.pop(key, None)
+            self._block_index.remove(key)
+            self.reportMemoryChange(-mem)
+            return block, mem, self._dirty_generation
 
     def freeDirtyMemory(self):
         return 0.0
 
     def _resetBlocks(self, *_):
+        # Everything is dirty
+        with self._lock:
+            self._dirty_generation += 1
+        self._clearBlocks()
+        self.discardSpilledBlocks()
+
+    def _clearBlocks(self):
         with self._lock:
+            freed = sum(map(_block_nbytes, getattr(self, "_block_data", {}).values()))
+            if freed:
+                self.reportMemoryChange(-freed)
             self._block_data = {}
             self._block_locks = {}
+            # Spatial index of the keys of _block_data, for containment and dirtiness lookups
+            self._block_index = RoiIndex()
             self._last_access_times = collections.defaultdict(float)
+            # Seconds it took to fetch each block from upstream (blocks set via setInSlot have no entry)
+            self._block_compute_times = {}
+            # Channels of stored blocks that have to be fetched before the block can be used (boolean masks)
+            self._missing_channels = {}
@@ -191,6 +191,9 @@ class OpOutputProvider(Operator):
 
     Output = OutputSlot()
 
+    # The data is passed to the constructor
+    _has_hidden_state = True
+
     def __init__(self, data, meta, *args, **kwargs):
         super(OpOutputProvider, self).__init__(*args, **kwargs)
 
@@ -219,6 +222,9 @@ class OpValueCache(Operator, ObservableCache):
     fixAtCurrent = InputSlot(value=False)
     Output = OutputSlot()
 
+    # The value can be forced in, see forceValue()
+    _has_hidden_state = True
+
     loggerName = __name__ + ".OpValueCache"
     logger = logging.getLogger(loggerName)
     traceLogger = logging.getLogger("TRACE." + loggerName)
@@ -117,8 +117,12 @@ class Request(object):
     class_lock = threading.Lock()
     active_count = 0
 
+    # Opt-in event recorder (see lazyflow.request.tracing.RequestTracer).
+    # When None, tracing costs a single attribute check per event.
+    _tracer = None
+
     @classmethod
-    def reset_thread_pool(cls, num_workers=min(multiprocessing.cpu_count(), 8)):
+    def reset_thread_pool(cls, num_workers=min(multiprocessing.cpu_count(), 8), work_stealing=False):
         """
         Change the number of threads allocated to the request system.
 
@@ -127,6 +131,9 @@ class Request(object):
                             workers, even on machines with many CPUs.
                             For more details, see:
                             https://github.com/ilastik/ilastik/issues/1458
+        :param work_stealing: If True, requests submitted from within a worker are queued on that worker,
+                              and idle workers steal not-yet-started requests from busy peers.
+                              See ``ThreadPool.get_stats()`` for the per-worker counters.
 
         As a special case, you may set ``num_workers`` to 0.
         In that case, the normal thread pool is not used at all.
@@ -142,7 +149,7 @@ class Request(object):
 
             if cls.global_thread_pool is not None:
                 cls.global_thread_pool.stop()
-            cls.global_thread_pool = threadPool.ThreadPool(num_workers)
+            cls.global_thread_pool = threadPool.ThreadPool(num_workers, work_stealing=work_stealing)
 
     class CancellationException(Exception):
         """
@@ -353,6 +360,9 @@ class Request(object):
         """
         Do the real work of this request.
         """
+        if Request._tracer is not None:
+            Request._tracer.record(self, "start")
+
         # Did someone cancel us before we even started?
         if not self.cancelled:
             try:
@@ -375,6 +385,9 @@ class Request(object):
         with self._lock:
             self.finished = True
 
+        if Request._tracer is not None:
+            Request._tracer.record(self, "finish")
+
         try:
             # Notify ONE callback (never more than one)
             if self.exception is not None:
@@ -451,6 +464,8 @@ class Request(object):
             with self._lock:
                 if not self.started:
                     self._set_started()
+                    if Request._tracer is not None:
+                        Request._tracer.record(self, "submit")
                     self._wake_up()
         else:
             # For debug purposes, we support a worker count of zero.
@@ -458,6 +473,8 @@ class Request(object):
             # This can have unintended consequences.  Use with care.
             if not self.started:
                 self._set_started()
+                if Request._tracer is not None:
+                    Request._tracer.record(self, "submit")
                 self._execute()
 
             # TODO: Exactly how to handle cancellation in this debug mode is not quite clear...
@@ -516,6 +533,13 @@ class Request(object):
         """
         Suspend this request so another one can be woken up by the worker.
         """
+        # Every request that shares our greenlet (see direct execution in wait()) is suspended along with us.
+        tracer = Request._tracer
+        if tracer is not None:
+            suspended_requests = list(self.greenlet.owning_requests)
+            for req in suspended_requests:
+                tracer.record(req, "suspend")
+
         # Switch back to the worker that we're currently running in.
         try:
             self.greenlet.parent.switch()
@@ -527,6 +551,10 @@ class Request(object):
             )
             raise
 
+        if tracer is not None:
+            for req in suspended_requests:
+                tracer.record(req, "resume")
+
     def wait(self, timeout=None):
         """
         Start this request if necessary, then wait for it to complete.  Return the request's result.
@@ -788,6 +816,9 @@ class Request(object):
                 self.child_requests = set()
 
         if self.cancelled:
+            if Request._tracer is not None:
+                Request._tracer.record(self, "cancel")
+
             # Cancel all requests that were spawned from this one.
             for child in child_requests:
                 child.cancel()
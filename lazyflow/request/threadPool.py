@@ -24,7 +24,8 @@ import atexit
 import logging
 import queue
 import threading
-from typing import Callable, List
+import time
+from typing import Callable, Dict, List
 
 logger = logging.getLogger(__name__)
 
@@ -34,11 +35,16 @@ class ThreadPool:
 
     Attributes:
         num_workers: The number of worker threads.
+        work_stealing: If True, tasks submitted from within a worker are queued locally on that worker,
+            and idle workers steal not-yet-started tasks from the local queues of busy peers.
+            Tasks that have already been started (i.e. resumed greenlets) are never stolen,
+            since a greenlet cannot switch threads.
     """
 
-    def __init__(self, num_workers: int):
+    def __init__(self, num_workers: int, work_stealing: bool = False):
         """Start all workers."""
         self.unassigned_tasks = queue.PriorityQueue()
+        self.work_stealing = work_stealing
 
         self.workers = {_Worker(self, i) for i in range(num_workers)}
         for w in self.workers:
@@ -57,11 +63,18 @@ class ThreadPool:
         """
         if hasattr(task, "assigned_worker") and task.assigned_worker is not None:
             task.assigned_worker.wake_up(task)
+            return
+
+        current_thread = threading.current_thread()
+        if self.work_stealing and isinstance(current_thread, _Worker) and current_thread.thread_pool is self:
+            # Keep new work close to the worker that spawned it; idle peers may steal it.
+            current_thread.unstarted_tasks.put_nowait(task)
         else:
             self.unassigned_tasks.put_nowait(task)
-            for worker in self.workers:
-                with worker.job_queue_condition:
-                    worker.job_queue_condition.notify()
+
+        for worker in self.workers:
+            with worker.job_queue_condition:
+                worker.job_queue_condition.notify()
 
     def stop(self) -> None:
         """Stop all threads in the pool, and block for them to complete.
@@ -77,6 +90,35 @@ class ThreadPool:
     def get_states(self) -> List[str]:
         return [w.state for w in self.workers]
 
+    def get_stats(self) -> List[Dict]:
+        """Return scheduling counters for each worker, sorted by worker name.
+
+        Each entry contains:
+            name: The worker thread name.
+            executed: Number of tasks (starts and resumes) the worker has run.
+            steals: Number of unstarted tasks the worker took from the local queues of its peers.
+            queue_depth: Number of tasks currently waiting in the worker's own queues.
+            idle_time: Total seconds the worker spent blocked, waiting for work.
+        """
+        return [w.get_stats() for w in sorted(self.workers, key=lambda w: w.name)]
+
+    def _steal(self, thief) -> Callable[[], None]:
+        """Take the highest-priority unstarted task from the busiest peer of the given worker.
+
+        Return None if no peer has any unstarted tasks.
+
+        Non-blocking.
+        """
+        peers = sorted(
+            (w for w in self.workers if w is not thief), key=lambda w: w.unstarted_tasks.qsize(), reverse=True
+        )
+        for victim in peers:
+            try:
+                return victim.unstarted_tasks.get_nowait()
+            except queue.Empty:
+                continue
+        return None
+
 
 class _Worker(threading.Thread):
     """Run in a loop until stopped.
@@ -90,8 +132,14 @@ class _Worker(threading.Thread):
         self.stopped = False
         self.job_queue_condition = threading.Condition()
         self.job_queue = queue.PriorityQueue()
+        # Tasks spawned on this worker that have not been started yet (work-stealing mode only).
+        self.unstarted_tasks = queue.PriorityQueue()
         self.state = "initialized"
 
+        self.executed_count = 0
+        self.steal_count = 0
+        self.idle_time = 0.0
+
     def run(self):
         """Keep executing available tasks until we're stopped."""
         # Try to get some work.
@@ -101,6 +149,7 @@ class _Worker(threading.Thread):
         while not self.stopped:
             # Start (or resume) the work by switching to its greenlet
             self.state = "running task"
+            self.executed_count += 1
             try:
                 next_task()
             except Exception:
@@ -128,6 +177,15 @@ class _Worker(threading.Thread):
         with self.job_queue_condition:
             self.job_queue_condition.notify()
 
+    def get_stats(self) -> Dict:
+        return {
+            "name": self.name,
+            "executed": self.executed_count,
+            "steals": self.steal_count,
+            "queue_depth": self.job_queue.qsize() + self.unstarted_tasks.qsize(),
+            "idle_time": self.idle_time,
+        }
+
     def wake_up(self, task):
         """Add this task to the queue of tasks that are ready to be processed.
 
@@ -151,7 +209,9 @@ class _Worker(threading.Thread):
 
             while next_task is None and not self.stopped:
                 # Wait for work to become available
+                wait_start = time.perf_counter()
                 self.job_queue_condition.wait()
+                self.idle_time += time.perf_counter() - wait_start
                 if self.stopped:
                     return None
                 next_task = self._pop_job()
@@ -165,20 +225,41 @@ class _Worker(threading.Thread):
     def _pop_job(self):
         """If possible, get a job from our own job queue; otherwise, get one from the global job queue.
 
-        Return None if neither queue has work to do.
+        In work-stealing mode, our own unstarted tasks are tried before the global queue,
+        and unstarted tasks of our peers after it.
+
+        Return None if no queue has work to do.
 
         Non-blocking.
         """
         try:
             return self.job_queue.get_nowait()
         except queue.Empty:
+            pass
+
+        task = None
+        if self.thread_pool.work_stealing:
+            try:
+                task = self.unstarted_tasks.get_nowait()
+            except queue.Empty:
+                pass
+
+        if task is None:
             try:
                 task = self.thread_pool.unassigned_tasks.get_nowait()
             except queue.Empty:
-                return None
-            else:
-                # If this fails, then your callable is some built-in that doesn't allow arbitrary
-                # members (e.g. .assigned_worker) to be "monkey-patched" onto it.
-                # You may have to wrap it in a custom class first.
-                task.assigned_worker = self
-                return task
+                pass
+
+        if task is None and self.thread_pool.work_stealing:
+            task = self.thread_pool._steal(self)
+            if task is not None:
+                self.steal_count += 1
+
+        if task is None:
+            return None
+
+        # If this fails, then your callable is some built-in that doesn't allow arbitrary
+        # members (e.g. .assigned_worker) to be "monkey-patched" onto it.
+        # You may have to wrap it in a custom class first.
+        task.assigned_worker = self
+        return task
@@ -0,0 +1,262 @@
+###############################################################################
+#   lazyflow: data flow based lazy parallel computation framework
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License
+# as published by the Free Software Foundation; either version 2.1
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# See the files LICENSE.lgpl2 and LICENSE.lgpl3 for full text of the
+# GNU Lesser General Public License version 2.1 and 3 respectively.
+# This information is also available on the ilastik web site at:
+# 		   http://ilastik.org/license/
+###############################################################################
+import collections
+import itertools
+import json
+import threading
+import time
+from typing import Dict, List
+
+from .request import Request
+
+
+def request_name(fn) -> str:
+    """
+    Return a human-readable name for a request workload.
+
+    Requests created by ``Slot.get()`` are named ``<operator name>.<slot name>``,
+    everything else by the qualified name of the callable.
+    """
+    # Unwrap Request.writeInto() / functools.partial
+    fn = getattr(fn, "func", fn)
+    slot = getattr(fn, "slot", None)
+    if slot is not None:
+        operator = getattr(slot, "operator", None)
+        operator_name = operator.name if operator is not None else "<no operator>"
+        return "{}.{}".format(operator_name, slot.name)
+    return getattr(fn, "__qualname__", type(fn).__qualname__)
+
+
+class _RequestRecord:
+    __slots__ = ("session", "id", "name", "parent_id", "events")
+
+    def __init__(self, session, id_, name, parent_id):
+        self.session = session
+        self.id = id_
+        self.name = name
+        self.parent_id = parent_id
+        # List of (kind, timestamp, thread ident)
+        self.events = []
+
+
+class RequestTracer:
+    """
+    Opt-in recorder for the life cycle of every :py:class:`Request`.
+
+    While installed, each request records ``submit``, ``start``, ``suspend``, ``resume``, ``finish``
+    and ``cancel`` events together with its name (the operator/slot it computes, see :py:func:`request_name`)
+    and the request that created it.
+    The recording can be exported as Chrome trace-event JSON (open it in ``chrome://tracing`` or Perfetto)
+    or as collapsed stacks for flame graph tools (e.g. ``flamegraph.pl`` or speedscope).
+
+    Example::
+
+        with RequestTracer() as tracer:
+            opExport.run_export()
+
+        tracer.dump_chrome_trace("export-trace.json")
+        tracer.dump_collapsed_stacks("export.folded")
+
+    .. note:: Only one tracer can be installed at a time.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        # Records attached to requests by an earlier session (or another tracer) are ignored.
+        self._session = object()
+        self._records: Dict[int, _RequestRecord] = collections.OrderedDict()
+        self._id_counter = itertools.count()
+        self._thread_names: Dict[int, str] = {}
+        self._t0 = time.perf_counter()
+
+    def __enter__(self):
+        self.install()
+        return self
+
+    def __exit__(self, *args):
+        self.uninstall()
+
+    def install(self):
+        assert Request._tracer in (None, self), "Another RequestTracer is already installed."
+        Request._tracer = self
+
+    def uninstall(self):
+        if Request._tracer is self:
+            Request._tracer = None
+
+    def clear(self):
+        with self._lock:
+            self._reset()
+
+    def record(self, request, kind):
+        """
+        Record a single life cycle event of the given request.  Called by the request framework.
+        """
+        timestamp = time.perf_counter()
+        thread = threading.current_thread()
+        record = self._get_record(request)
+        record.events.append((kind, timestamp, thread.ident))
+        if thread.ident not in self._thread_names:
+            self._thread_names[thread.ident] = thread.name
+
+    def _get_record(self, request):
+        record = getattr(request, "_trace_record", None)
+        if record is not None and record.session is self._session:
+            return record
+
+        with self._lock:
+            record = getattr(request, "_trace_record", None)
+            if record is not None and record.session is self._session:
+                return record
+
+            # The parent must be looked up now: it is forgotten once the request is cleaned.
+            parent = request.parent_request
+            parent_id = self._get_record(parent).id if parent is not None else None
+            record = _RequestRecord(self._session, next(self._id_counter), request_name(request.fn), parent_id)
+            self._records[record.id] = record
+            request._trace_record = record
+        return record
+
+    def _snapshot(self) -> List[_RequestRecord]:
+        with self._lock:
+            return list(self._records.values())
+
+    @staticmethod
+    def _running_intervals(record):
+        """
+        Yield (start, stop, thread ident) for each period the request was executing on a thread.
+        """
+        start = None
+        for kind, timestamp, thread_id in record.events:
+            if kind in ("start", "resume"):
+                start = (timestamp, thread_id)
+            elif kind in ("suspend", "finish") and start is not None:
+                yield start[0], timestamp, start[1]
+                start = None
+
+    def chrome_trace_events(self) -> List[Dict]:
+        """
+        Return the recording in the Chrome trace-event format.
+
+        Each execution slice of a request becomes a complete ("X") event on the thread that executed it.
+        The lifetime of each request, from submission to completion, becomes an async ("b"/"e") event,
+        and cancellations become instant ("i") events.
+        """
+
+        def us(timestamp):
+            return (timestamp - self._t0) * 1e6
+
+        trace_events = []
+        for thread_id, name in list(self._thread_names.items()):
+            trace_events.append({"name": "thread_name", "ph": "M", "pid": 0, "tid": thread_id, "args": {"name": name}})
+
+        for record in self._snapshot():
+            args = {"request_id": record.id, "parent_id": record.parent_id}
+            for start, stop, thread_id in self._running_intervals(record):
+                trace_events.append(
+                    {
+                        "name": record.name,
+                        "cat": "request",
+                        "ph": "X",
+                        "ts": us(start),
+                        "dur": us(stop) - us(start),
+                        "pid": 0,
+                        "tid": thread_id,
+                        "args": args,
+                    }
+                )
+
+            events = list(record.events)
+            if not events:
+                continue
+            for kind, timestamp, thread_id in events:
+                if kind == "cancel":
+                    trace_events.append(
+                        {
+                            "name": record.name,
+                            "cat": "request",
+                            "ph": "i",
+                            "s": "t",
+                            "ts": us(timestamp),
+                            "pid": 0,
+                            "tid": thread_id,
+                        }
+                    )
+            first_kind, first_timestamp, first_thread = events[0]
+            last_kind, last_timestamp, last_thread = events[-1]
+            common = {"name": record.name, "cat": "request.lifetime", "id": record.id, "pid": 0}
+            trace_events.append(dict(common, ph="b", ts=us(first_timestamp), tid=first_thread, args=args))
+            if last_kind == "finish":
+                trace_events.append(dict(common, ph="e", ts=us(last_timestamp), tid=last_thread))
+        return trace_events
+
+    def dump_chrome_trace(self, path):
+        with open(path, "w") as f:
+            json.dump({"traceEvents": self.chrome_trace_events(), "displayTimeUnit": "ms"}, f)
+
+    def collapsed_stacks(self) -> Dict[str, int]:
+        """
+        Return the exclusive execution time (in microseconds) of each request call stack,
+        keyed by the ``;``-separated chain of request names from the root request down to the request itself.
+
+        Time spent in a request that was executed directly within its waiting parent
+        is attributed to the child only, so the values can be summed up in a flame graph.
+        """
+        records = {r.id: r for r in self._snapshot()}
+
+        # Collect execution slices per thread; slices on one thread are either disjoint or nested.
+        intervals_by_thread = collections.defaultdict(list)
+        for record in records.values():
+            for start, stop, thread_id in self._running_intervals(record):
+                intervals_by_thread[thread_id].append((start, stop, record.id))
+
+        exclusive = collections.Counter()
+        for intervals in intervals_by_thread.values():
+            intervals.sort(key=lambda interval: (interval[0], -interval[1]))
+            stack = []
+            for start, stop, record_id in intervals:
+                while stack and stack[-1][1] <= start:
+                    stack.pop()
+                duration = stop - start
+                exclusive[record_id] += duration
+                if stack:
+                    exclusive[stack[-1][2]] -= duration
+                stack.append((start, stop, record_id))
+
+        stacks = collections.Counter()
+        for record_id, seconds in exclusive.items():
+            frames = []
+            record = records.get(record_id)
+            while record is not None:
+                frames.append(record.name.replace(";", ":"))
+                record = records.get(record.parent_id)
+            stacks[";".join(reversed(frames))] += max(0, int(round(seconds * 1e6)))
+        return dict(stacks)
+
+    def dump_collapsed_stacks(self, path):
+        with open(path, "w") as f:
+            for stack, microseconds in sorted(self.collapsed_stacks().items()):
+                if microseconds > 0:
+                    f.write("{} {}\n".format(stack, microseconds))
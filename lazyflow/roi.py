@@ -25,7 +25,7 @@ import numbers
 from functools import partial
 from itertools import combinations
 from math import ceil, floor, log10, pow
-from typing import Sequence, Tuple, Union
+from typing import List, Sequence, Tuple, Union
 
 import numpy
 
@@ -440,6 +440,30 @@ def roiToSlice(start: Sequence[numbers.Integral], stop: Sequence[numbers.Integra
     return tuple(slice(int(a), int(b)) for a, b in zip(start, stop))
 
 
+def indexRuns(indices: Sequence[numbers.Integral]) -> List[Tuple[int, int]]:
+    """Group sorted indices into ranges of consecutive indices.
+
+    Args:
+        indices: Sorted, unique indices.
+
+    Returns:
+        (start, stop) pairs, stop exclusive.
+
+    Examples:
+        >>> indexRuns([0, 1, 2, 5, 7, 8])
+        [(0, 3), (5, 6), (7, 9)]
+        >>> indexRuns([])
+        []
+    """
+    runs = []
+    for i in map(int, indices):
+        if runs and runs[-1][1] == i:
+            runs[-1] = (runs[-1][0], i + 1)
+        else:
+            runs.append((i, i + 1))
+    return runs
+
+
 def nonzero_bounding_box(data):
     """
     For an array with sparsely distributed non-zero values,
@@ -35,6 +35,7 @@ from .pathHelpers import PathComponents, getPathVariants, isUrl, make_absolute,
 from .roiRequestBatch import RoiRequestBatch
 from .roiRequestBuffer import RoiRequestBufferIter
 from .bigRequestStreamer import BigRequestStreamer
+from .requestCoalescer import RequestCoalescer
 from . import io_util
 from .format_known_keys import format_known_keys
 from .timer import Timer, timeLogged
@@ -42,6 +43,9 @@ from . import testing
 from .ramMeasurementContext import RamMeasurementContext
 from .export_to_tiles import export_to_tiles
 from .blockwise_view import blockwise_view
+from .roiIndex import RoiIndex
+from .compressedArray import CompressedArray
+from .trainingMatrix import TrainingMatrix, TrainingMatrixView
 from .log_exception import log_exception
 from .transposed_view import TransposedView
 from .reorderAxesDecorator import reorder_options, reorder
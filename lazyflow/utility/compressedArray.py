@@ -0,0 +1,280 @@
+###############################################################################
+#   lazyflow: data flow based lazy parallel computation framework
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License
+# as published by the Free Software Foundation; either version 2.1
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# See the files LICENSE.lgpl2 and LICENSE.lgpl3 for full text of the
+# GNU Lesser General Public License version 2.1 and 3 respectively.
+# This information is also available on the ilastik web site at:
+# 		   http://ilastik.org/license/
+###############################################################################
+"""
+A chunked, compressed in-memory array that does not go through the HDF5 library.
+
+Each chunk is kept as a compressed ``bytes`` object in a plain dict.
+All supported codecs release the GIL while (de)compressing, so worker threads
+reading and writing different blocks do not serialize on a global lock.
+"""
+import itertools
+import threading
+import zlib
+from typing import Dict, Tuple
+
+import numpy
+
+try:
+    import blosc
+except ImportError:
+    blosc = None
+
+try:
+    import lz4.block
+except ImportError:
+    lz4 = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class _Codec:
+    name = None
+
+    def compress(self, chunk: numpy.ndarray) -> bytes:
+        """Compress a C-contiguous array."""
+        raise NotImplementedError()
+
+    def decompress_into(self, buf: bytes, out: numpy.ndarray):
+        """Decompress into a C-contiguous array of the original shape and dtype."""
+        out[...] = numpy.frombuffer(self.decompress(buf, out.nbytes), dtype=out.dtype).reshape(out.shape)
+
+    def decompress(self, buf: bytes, nbytes: int) -> bytes:
+        raise NotImplementedError()
+
+
+class _BloscCodec(_Codec):
+    name = "blosc"
+
+    def __init__(self):
+        if hasattr(blosc, "set_releasegil"):
+            blosc.set_releasegil(True)
+
+    def compress(self, chunk):
+        return blosc.compress_ptr(
+            chunk.__array_interface__["data"][0],
+            chunk.size,
+            typesize=chunk.dtype.itemsize,
+            clevel=5,
+            shuffle=blosc.SHUFFLE,
+            cname="lz4",
+        )
+
+    def decompress_into(self, buf, out):
+        # Decompresses straight into the destination memory
+        blosc.decompress_ptr(buf, out.__array_interface__["data"][0])
+
+
+class _Lz4Codec(_Codec):
+    name = "lz4"
+
+    def compress(self, chunk):
+        return lz4.block.compress(memoryview(chunk).cast("B"), store_size=False)
+
+    def decompress(self, buf, nbytes):
+        return lz4.block.decompress(buf, uncompressed_size=nbytes)
+
+
+class _ZstdCodec(_Codec):
+    name = "zstd"
+
+    def compress(self, chunk):
+        # (De)compressor objects must not be shared between threads
+        return zstandard.ZstdCompressor(level=1).compress(memoryview(chunk).cast("B"))
+
+    def decompress(self, buf, nbytes):
+        return zstandard.ZstdDecompressor().decompress(buf, max_output_size=nbytes)
+
+
+class _ZlibCodec(_Codec):
+    name = "zlib"
+
+    def compress(self, chunk):
+        return zlib.compress(memoryview(chunk).cast("B"), 1)
+
+    def decompress(self, buf, nbytes):
+        return zlib.decompress(buf, bufsize=max(nbytes, 1))
+
+
+def available_codecs():
+    """
+    Names of the usable codecs, fastest first.  zlib (from the standard library) is always available.
+    """
+    modules = {"blosc": blosc, "lz4": lz4, "zstd": zstandard, "zlib": zlib}
+    return [name for name, module in modules.items() if module is not None]
+
+
+def _make_codec(name):
+    if name == "auto":
+        name = available_codecs()[0]
+    if name not in available_codecs():
+        raise ValueError("Compression codec {!r} is not available (available: {})".format(name, available_codecs()))
+    return {"blosc": _BloscCodec, "lz4": _Lz4Codec, "zstd": _ZstdCodec, "zlib": _ZlibCodec}[name]()
+
+
+def _normalize_selection(selection, shape) -> Tuple[Tuple[int, ...], Tuple[int, ...]]:
+    """Convert a tuple of slices (possibly with Ellipsis) into a (start, stop) roi."""
+    if not isinstance(selection, tuple):
+        selection = (selection,)
+    if any(s is Ellipsis for s in selection):
+        i = selection.index(Ellipsis)
+        selection = selection[:i] + (slice(None),) * (len(shape) - len(selection) + 1) + selection[i + 1 :]
+    selection = selection + (slice(None),) * (len(shape) - len(selection))
+    if len(selection) != len(shape):
+        raise IndexError("Too many indices for array of shape {}".format(shape))
+
+    start, stop = [], []
+    for s, length in zip(selection, shape):
+        if not isinstance(s, slice):
+            raise TypeError("CompressedArray only supports slicing, not {!r}".format(s))
+        begin, end, step = s.indices(length)
+        if step != 1:
+            raise TypeError("CompressedArray does not support strided slicing")
+        start.append(begin)
+        stop.append(max(begin, end))
+    return tuple(start), tuple(stop)
+
+
+class CompressedArray:
+    """
+    An array stored as independently compressed chunks.
+
+    Supports reading and writing (non-strided) slices, like an h5py dataset::
+
+        >>> a = CompressedArray((100, 100), numpy.uint8, chunkshape=(50, 50), codec="zlib")
+        >>> a[10:20, :] = 1
+        >>> int(a[:, :].sum())
+        1000
+        >>> out = numpy.zeros((10, 100), numpy.uint8)
+        >>> a.read_direct(out, numpy.s_[10:20, :])
+        >>> int(out.sum())
+        1000
+
+    Chunks that were never written read as zeros and take no memory.
+    ``nbytes_compressed`` is the exact number of bytes held by the compressed chunks.
+    The array is safe to use from multiple threads, but concurrent writes to the same chunk may be lost.
+    """
+
+    def __init__(self, shape, dtype, chunkshape=None, codec="auto"):
+        self.shape = tuple(map(int, shape))
+        self.dtype = numpy.dtype(dtype)
+        if chunkshape is None:
+            chunkshape = self.shape
+        self.chunkshape = tuple(max(1, min(int(c), s)) for c, s in zip(chunkshape, self.shape))
+        self.codec = _make_codec(codec) if isinstance(codec, str) else codec
+        self._chunks: Dict[Tuple[int, ...], bytes] = {}
+        self._nbytes_compressed = 0
+        self._lock = threading.Lock()
+
+    @property
+    def size(self):
+        return int(numpy.prod(self.shape))
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def nbytes(self):
+        """Uncompressed size"""
+        return self.size * self.dtype.itemsize
+
+    @property
+    def nbytes_compressed(self):
+        return self._nbytes_compressed
+
+    def __len__(self):
+        return self.shape[0]
+
+    def _chunk_rois(self, start, stop):
+        """Yield (chunk index, chunk start, chunk stop) for all chunks intersecting the roi."""
+        ranges = [
+            range(b // c, (e - 1) // c + 1) if e > b else range(0) for b, e, c in zip(start, stop, self.chunkshape)
+        ]
+        for index in itertools.product(*ranges):
+            chunk_start = tuple(i * c for i, c in zip(index, self.chunkshape))
+            chunk_stop = tuple(min(b + c, s) for b, c, s in zip(chunk_start, self.chunkshape, self.shape))
+            yield index, chunk_start, chunk_stop
+
+    def _read_chunk(self, index, chunk_shape, out=None):
+        buf = self._chunks.get(index)
+        if out is None:
+            out = numpy.empty(chunk_shape, dtype=self.dtype)
+        if buf is None:
+            out[...] = 0
+        else:
+            self.codec.decompress_into(buf, out)
+        return out
+
+    def read_direct(self, dest, source_sel=numpy.s_[...], dest_sel=numpy.s_[...]):
+        """
+        Decompress the selected region straight into ``dest[dest_sel]`` (which must be a view, e.g. basic slicing).
+        """
+        start, stop = _normalize_selection(source_sel, self.shape)
+        target = dest[dest_sel]
+        assert target.shape == tuple(e - b for b, e in zip(start, stop)), "Shape mismatch"
+        for index, chunk_start, chunk_stop in self._chunk_rois(start, stop):
+            inter_start = tuple(map(max, start, chunk_start))
+            inter_stop = tuple(map(min, stop, chunk_stop))
+            target_view = target[tuple(slice(b - o, e - o) for b, e, o in zip(inter_start, inter_stop, start))]
+            chunk_shape = tuple(e - b for b, e in zip(chunk_start, chunk_stop))
+            whole_chunk = inter_start == chunk_start and inter_stop == chunk_stop
+            if whole_chunk and target_view.flags.c_contiguous and target_view.dtype == self.dtype:
+                self._read_chunk(index, chunk_shape, out=target_view)
+            else:
+                chunk = self._read_chunk(index, chunk_shape)
+                target_view[...] = chunk[
+                    tuple(slice(b - o, e - o) for b, e, o in zip(inter_start, inter_stop, chunk_start))
+                ]
+
+    def __getitem__(self, selection):
+        start, stop = _normalize_selection(selection, self.shape)
+        out = numpy.empty(tuple(e - b for b, e in zip(start, stop)), dtype=self.dtype)
+        self.read_direct(out, selection)
+        return out
+
+    def __setitem__(self, selection, value):
+        start, stop = _normalize_selection(selection, self.shape)
+        region_shape = tuple(e - b for b, e in zip(start, stop))
+        value = numpy.broadcast_to(numpy.asarray(value, dtype=self.dtype), region_shape)
+        for index, chunk_start, chunk_stop in self._chunk_rois(start, stop):
+            inter_start = tuple(map(max, start, chunk_start))
+            inter_stop = tuple(map(min, stop, chunk_stop))
+            value_part = value[tuple(slice(b - o, e - o) for b, e, o in zip(inter_start, inter_stop, start))]
+            if inter_start == chunk_start and inter_stop == chunk_stop:
+                chunk = numpy.ascontiguousarray(value_part)
+            else:
+                # Partial write: merge with the existing contents of the chunk
+                chunk = self._read_chunk(index, tuple(e - b for b, e in zip(chunk_start, chunk_stop)))
+                chunk[tuple(slice(b - o, e - o) for b, e, o in zip(inter_start, inter_stop, chunk_start))] = value_part
+            buf = self.codec.compress(chunk)
+            with self._lock:
+                old = self._chunks.get(index)
+                self._chunks[index] = buf
+                self._nbytes_compressed += len(buf) - (len(old) if old is not None else 0)
+
+    def clear(self):
+        with self._lock:
+            self._chunks = {}
+            self._nbytes_compressed = 0
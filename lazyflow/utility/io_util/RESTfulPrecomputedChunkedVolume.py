@@ -19,10 +19,15 @@
 # This information is also available on the ilastik web site at:
 #          http://ilastik.org/license/
 ###############################################################################
+import gzip
 import json
 import jsonschema
 import logging
+import threading
 import requests
+from requests.adapters import HTTPAdapter
+from io import BytesIO
+from urllib3.util.retry import Retry
 
 import numpy
 
@@ -63,7 +68,13 @@ class RESTfulPrecomputedChunkedVolume(object):
         "required": ["type", "data_type", "num_channels", "scales"],
     }
 
-    def __init__(self, volume_url, tmp_data_file=None, n_threads=4):
+    # Late import (only needed for jpeg encoded volumes)
+    PIL = None
+
+    # Responses that are worth retrying (with backoff)
+    retry_status_codes = (429, 500, 502, 503, 504)
+
+    def __init__(self, volume_url, tmp_data_file=None, n_threads=4, max_retries=3, backoff_factor=0.5, timeout=30.0):
         """
         Args:
             volume_url (string): base url of the precomputed volume.
@@ -74,6 +85,11 @@ class RESTfulPrecomputedChunkedVolume(object):
               temporary hdf5 file. If `None`, a file will be generated in the
               temp-folder.
             n_threads (int, optional): number of concurrent downloads
+            max_retries (int, optional): how often failed downloads (connection
+              errors and `retry_status_codes`) are retried
+            backoff_factor (float, optional): retries wait for
+              backoff_factor * 2 ** (retry - 1) seconds
+            timeout (float, optional): timeout of each download in seconds
         """
         # might come in handy if one wants to process data on a different scale.
         # ilastik can only process data at a single scale.
@@ -89,6 +105,15 @@ class RESTfulPrecomputedChunkedVolume(object):
         self.dtype = None
         self.n_channels = None
 
+        # Downloads share the connections of a single session
+        self.n_threads = max(1, n_threads)
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.timeout = timeout
+        self._session = None
+        self._session_lock = threading.Lock()
+        self._download_slots = threading.BoundedSemaphore(self.n_threads)
+
         if volume_url is not None:
             self._init_config()
 
@@ -156,6 +181,12 @@ class RESTfulPrecomputedChunkedVolume(object):
         encoding = self._scale_info[scale]["encoding"]
         return encoding
 
+    def get_compressed_segmentation_block_size(self, scale=None):
+        """block size (xyz) of compressed_segmentation encoded volumes"""
+        if scale is None:
+            scale = self._use_scale
+        return self._scale_info[scale].get("compressed_segmentation_block_size")
+
     def get_shape(self, scale=None):
         if scale is None:
             scale = self._use_scale
@@ -163,9 +194,32 @@ class RESTfulPrecomputedChunkedVolume(object):
         shape = numpy.array([n_channels] + self._scale_info[scale]["size"][::-1])
         return shape
 
+    def _get_session(self):
+        with self._session_lock:
+            if self._session is None:
+                retry = Retry(
+                    total=self.max_retries,
+                    backoff_factor=self.backoff_factor,
+                    status_forcelist=self.retry_status_codes,
+                    raise_on_status=False,
+                )
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.n_threads, max_retries=retry)
+                session = requests.Session()
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._session = session
+            return self._session
+
+    def close(self):
+        """Close the connections of the download session"""
+        with self._session_lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
     def download_info(self):
         logger.debug(f"getting volume from {self.volume_url}/info")
-        r = requests.get(f"{self.volume_url}/info")
+        r = self._get_session().get(f"{self.volume_url}/info", timeout=self.timeout)
 
         # check if success:
         if r.status_code != 200:
@@ -176,41 +230,144 @@ class RESTfulPrecomputedChunkedVolume(object):
     def download_block(self, block_coordinates, scale=None):
         """downloads a single block at a given scale
 
+        Blocks that don't exist on the server (404) are returned as zeros.
+        Other failures are retried (see `__init__`), and raise if they persist.
+
         Args:
             block_coordinates (iterable): start of the block, 'czyx' axistags
               assumed
             scale (string): key identifying the scale to be used
+
+        Returns:
+            ndarray: the block (czyx, `self.dtype`), possibly read-only
         """
         if scale is None:
             scale = self._use_scale
 
         url, blockshape = self.generate_url(block_coordinates, scale)
-        try:
-            content = self.downloading(url)
-        except requests.exceptions.ConnectionError:
+        content = self.downloading(url)
+        if content is None:
             return numpy.zeros(shape=blockshape, dtype=self.dtype)
-        return self.decode_content(content, encoding=self.get_encoding(scale), shape=blockshape, dtype=self.dtype)
+        return self.decode_content(
+            content,
+            encoding=self.get_encoding(scale),
+            shape=blockshape,
+            dtype=self.dtype,
+            block_size=self.get_compressed_segmentation_block_size(scale),
+        )
 
     @classmethod
-    def decode_content(cls, content, encoding, shape, dtype):
+    def decode_content(cls, content, encoding, shape, dtype, block_size=None):
         """converts to numpy array according to self.encoding
 
+        Content that was gzipped by the server is decompressed by requests already
+        (Content-Encoding), but chunks are often stored (and then served) as
+        gzip files: these are decompressed here.
+
         Args:
-            content (string): encoding type: {'raw', 'jpg'}
-              raw: is gz
+            content (bytes): the downloaded chunk
+            encoding (string): encoding type: {'raw', 'jpeg', 'compressed_segmentation'}
+            shape (iterable): shape of the chunk (czyx)
+            dtype: dtype of the volume
+            block_size (iterable, optional): block size (xyz) of the
+              compressed_segmentation encoding
+
+        Returns:
+            ndarray: the chunk (czyx), possibly read-only
         """
         logger.debug(f"decoding encoding {encoding}; dtype {dtype}")
+        dtype = numpy.dtype(dtype)
+        if content[:2] == b"\x1f\x8b" and (encoding != "raw" or len(content) != numpy.prod(shape) * dtype.itemsize):
+            content = gzip.decompress(content)
+
         if encoding == "raw":
-            raw = content
-            arr = numpy.fromstring(raw, dtype=dtype).reshape(shape)
+            # No copy: the array is a read-only view of the content
+            arr = numpy.frombuffer(content, dtype=dtype).reshape(shape)
             return arr
+        elif encoding == "jpeg":
+            return cls._decode_jpeg(content, shape, dtype)
+        elif encoding == "compressed_segmentation":
+            return cls._decode_compressed_segmentation(content, shape, dtype, block_size)
         else:
             raise NotImplementedError(f"encoding {encoding} not supported :(")
 
+    @classmethod
+    def _decode_jpeg(cls, content, shape, dtype):
+        """The chunk is a single jpeg image, with width x and height y * z (and 1 or 3 channels)"""
+        if cls.PIL is None:
+            import PIL
+            import PIL.Image
+
+            cls.PIL = PIL
+
+        img = numpy.asarray(cls.PIL.Image.open(BytesIO(content)))
+        n_channels, z, y, x = shape
+        if n_channels == 1:
+            return img.reshape((1, z, y, x)).astype(dtype, copy=False)
+        assert img.ndim == 3 and img.shape[-1] == n_channels, f"Expected a jpeg with {n_channels} channels"
+        return numpy.moveaxis(img.reshape((z, y, x, n_channels)), -1, 0).astype(dtype, copy=False)
+
     @staticmethod
-    def downloading(url):
+    def _decode_compressed_segmentation(content, shape, dtype, block_size):
+        """Decode neuroglancer's compressed_segmentation encoding
+
+        Each channel is split into blocks of `block_size`. Each block has a lookup
+        table of the (uint32 or uint64) values in it, and stores the index into
+        that table of every voxel, bit-packed with 0, 1, 2, 4, 8, 16 or 32 bits.
+        See neuroglancer/src/neuroglancer/sliceview/compressed_segmentation/README.md
+
+        All blocks with the same number of bits are decoded at once.
+        """
+        assert dtype in (numpy.uint32, numpy.uint64), "compressed_segmentation is only defined for uint32 and uint64"
+        assert block_size is not None, "compressed_segmentation_block_size is missing"
+        words = numpy.frombuffer(content, dtype="<u4")
+        block_shape = numpy.array(block_size[::-1])
+        block_voxels = int(numpy.prod(block_shape))
+        grid_shape = -(-numpy.array(shape[1:]) // block_shape)
+        num_blocks = int(numpy.prod(grid_shape))
+        table_words = dtype.itemsize // 4
+
+        result = numpy.empty(shape, dtype=dtype)
+        for c in range(shape[0]):
+            channel = words[words[c] :]
+            # One 64 bit header per block (x fastest):
+            # lookup table offset (24 bits), encoded bits (8 bits), encoded values offset (32 bits)
+            headers = channel[: 2 * num_blocks].reshape(num_blocks, 2)
+            table_offsets = headers[:, 0] & 0xFFFFFF
+            encoded_bits = headers[:, 0] >> 24
+            values_offsets = headers[:, 1]
+
+            indices = numpy.zeros((num_blocks, block_voxels), dtype=numpy.uint32)
+            for bits in numpy.unique(encoded_bits):
+                if bits == 0:
+                    continue
+                blocks = numpy.flatnonzero(encoded_bits == bits)
+                num_words = -(-block_voxels * int(bits) // 32)
+                packed = channel[values_offsets[blocks, None] + numpy.arange(num_words)]
+                shifts = numpy.arange(0, 32, bits, dtype=numpy.uint32)
+                unpacked = (packed[..., None] >> shifts) & numpy.uint32((1 << int(bits)) - 1)
+                indices[blocks] = unpacked.reshape(len(blocks), -1)[:, :block_voxels]
+
+            table_positions = table_offsets[:, None] + indices * table_words
+            values = channel[table_positions].astype(dtype)
+            if table_words == 2:
+                values |= channel[table_positions + 1].astype(dtype) << numpy.uint64(32)
+
+            # (blocks zyx, voxels zyx) -> zyx
+            padded = values.reshape(tuple(grid_shape) + tuple(block_shape))
+            padded = padded.transpose(0, 3, 1, 4, 2, 5).reshape(tuple(grid_shape * block_shape))
+            result[c] = padded[: shape[1], : shape[2], : shape[3]]
+        return result
+
+    def downloading(self, url):
+        """Download url (at most `n_threads` at a time), returns None if it doesn't exist"""
         logger.debug(f"requesting {url}")
-        r = requests.get(url)
+        with self._download_slots:
+            r = self._get_session().get(url, timeout=self.timeout)
+        if r.status_code == requests.codes.not_found:
+            logger.debug(f"not found, using zeros: {url}")
+            return None
+        r.raise_for_status()
         return r.content
 
     def generate_url(self, block_coordinates, scale=None):
@@ -0,0 +1,133 @@
+###############################################################################
+#   lazyflow: data flow based lazy parallel computation framework
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License
+# as published by the Free Software Foundation; either version 2.1
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# See the files LICENSE.lgpl2 and LICENSE.lgpl3 for full text of the
+# GNU Lesser General Public License version 2.1 and 3 respectively.
+# This information is also available on the ilastik web site at:
+# 		   http://ilastik.org/license/
+###############################################################################
+"""
+Helpers for operators that read from memory-mapped arrays (see OpRawBinaryFileReader, OpNpyFileReader).
+"""
+import logging
+import mmap
+import threading
+
+import numpy
+
+logger = logging.getLogger(__name__)
+
+
+def contiguous_blockshape(array, min_bytes=mmap.PAGESIZE):
+    """
+    The smallest blockshape that covers whole contiguous runs of the given array (C or F order)
+    and at least min_bytes (unless the array is smaller), e.g. for meta.ideal_blockshape.
+
+    >>> contiguous_blockshape(numpy.zeros((10, 20, 300), dtype=numpy.uint8), min_bytes=4096)
+    (1, 14, 300)
+    >>> contiguous_blockshape(numpy.zeros((10, 20, 300), dtype=numpy.uint8, order="F"), min_bytes=4096)
+    (10, 20, 21)
+
+    Returns None for arrays that are neither C nor F contiguous.
+    """
+    if array.flags.c_contiguous:
+        axes = reversed(range(array.ndim))
+    elif array.flags.f_contiguous:
+        axes = range(array.ndim)
+    else:
+        return None
+
+    blockshape = [1] * array.ndim
+    nbytes = array.itemsize
+    for axis in axes:
+        if nbytes * array.shape[axis] >= min_bytes:
+            blockshape[axis] = min(array.shape[axis], -(-min_bytes // nbytes))
+            break
+        blockshape[axis] = array.shape[axis]
+        nbytes *= array.shape[axis]
+    return tuple(blockshape)
+
+
+class MemmapAccessAdvisor(object):
+    """
+    Advise the kernel about the access pattern of requests to a memory-mapped array (see madvise(2)).
+
+    Requests that continue where the previous one stopped are considered sequential:
+    their pages are read ahead aggressively, and the next range of the same size is prefetched.
+    For any other request, read-ahead is disabled for the requested range, so that reading small
+    tiles of a large file doesn't read much more than the tiles.
+
+    Does nothing if madvise is not available (e.g. on Windows).
+    """
+
+    def __init__(self, array):
+        """
+        :param array: a numpy.memmap (or an array loaded with numpy.load(..., mmap_mode=...))
+        """
+        self._array = array
+        self._mmap = getattr(array, "_mmap", None)
+        if self._mmap is not None and hasattr(self._mmap, "madvise"):
+            # The mapping starts at the last allocation boundary before the array
+            self._array_offset = getattr(array, "offset", 0) % mmap.ALLOCATIONGRANULARITY
+        else:
+            self._mmap = None
+        self._lock = threading.Lock()
+        self._last_range = None
+
+    @property
+    def enabled(self):
+        return self._mmap is not None
+
+    def byteRange(self, start, stop):
+        """
+        The range of bytes of the mapping that contains the elements of the given roi.
+        """
+        strides = numpy.array(self._array.strides)
+        first = self._array_offset + int(numpy.dot(start, strides))
+        last = self._array_offset + int(numpy.dot(numpy.subtract(stop, 1), strides))
+        return first, last + self._array.itemsize
+
+    def access(self, start, stop):
+        """
+        Call before reading the roi [start, stop) of the array.
+        """
+        if self._mmap is None or (numpy.subtract(stop, start) <= 0).any():
+            return
+
+        first, end = self.byteRange(start, stop)
+        with self._lock:
+            last_range = self._last_range
+            self._last_range = (first, end)
+        length = end - first
+        sequential = last_range is not None and last_range[1] <= first <= last_range[1] + length
+
+        # Contiguous enough to read everything in between?
+        dense = length <= 2 * int(numpy.prod(numpy.subtract(stop, start))) * self._array.itemsize
+        try:
+            if sequential and dense:
+                self._advise(mmap.MADV_SEQUENTIAL, first, end)
+                self._advise(mmap.MADV_WILLNEED, end, end + length)
+            else:
+                self._advise(mmap.MADV_RANDOM, first, end)
+        except (OSError, ValueError) as e:
+            logger.debug(f"madvise failed: {e}")
+
+    def _advise(self, option, first, end):
+        end = min(end, len(self._mmap))
+        # The start must be aligned to a page
+        first -= first % mmap.PAGESIZE
+        if end > first:
+            self._mmap.madvise(option, first, end - first)
@@ -0,0 +1,204 @@
+###############################################################################
+#   lazyflow: data flow based lazy parallel computation framework
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License
+# as published by the Free Software Foundation; either version 2.1
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# See the files LICENSE.lgpl2 and LICENSE.lgpl3 for full text of the
+# GNU Lesser General Public License version 2.1 and 3 respectively.
+# This information is also available on the ilastik web site at:
+# 		   http://ilastik.org/license/
+###############################################################################
+import threading
+from functools import partial
+from typing import Dict
+
+import numpy
+
+from lazyflow.request import Request
+from lazyflow.roi import roiToSlice
+
+
+def _volume(roi):
+    return int(numpy.prod(numpy.subtract(roi[1], roi[0])))
+
+
+def _contains(outer, inner):
+    return all(o <= i for o, i in zip(outer[0], inner[0])) and all(o >= i for o, i in zip(outer[1], inner[1]))
+
+
+def _intersects(a, b):
+    return all(
+        a_start < b_stop and b_start < a_stop for a_start, a_stop, b_start, b_stop in zip(a[0], a[1], b[0], b[1])
+    )
+
+
+def _union(a, b):
+    return (tuple(map(min, a[0], b[0])), tuple(map(max, a[1], b[1])))
+
+
+class _InFlight:
+    __slots__ = ("roi", "leader_out", "joined", "executing", "shared", "request")
+
+    def __init__(self, roi, leader_out):
+        self.roi = roi
+        self.leader_out = leader_out
+        # Whether other callers are waiting for this request, too
+        self.joined = False
+        # Set once the upstream request was issued: the roi can't grow any more
+        self.executing = False
+        # False if the result is the leader's own output array, which others must not read from
+        self.shared = True
+        self.request = None
+
+
+class RequestCoalescer:
+    """
+    Merge concurrent requests for overlapping rois of the same source.
+
+    Each call to :py:meth:`get` first looks for an in-flight request that already covers its roi.
+    Otherwise, it looks for a queued (not yet executing) request that overlaps its roi,
+    and grows that request to the bounding roi of both, provided that
+
+    * the bounding roi is not larger than both rois together (i.e. merging does not waste work), and
+    * the bounding roi is at most ``max_merged_bytes`` large.
+
+    Only if neither is possible a new upstream request is issued.
+    Every caller gets back its own slice of the (possibly larger) result.
+    Queued requests exist while the thread pool is busy, which is exactly when merging saves the most.
+
+    With ``max_merged_bytes <= 0``, coalescing is disabled and :py:meth:`get` just forwards to ``fetch``.
+
+    Example::
+
+        coalescer = RequestCoalescer(lambda start, stop: op.Input(start, stop), max_merged_bytes=2**28)
+        data = coalescer.get(((0, 0), (100, 100)))
+    """
+
+    def __init__(self, fetch, max_merged_bytes=0, bytes_per_pixel=1):
+        """
+        :param fetch: callable(start, stop) -> Request for the data of the given roi
+        :param max_merged_bytes: upper limit for the size of merged requests (0 disables coalescing)
+        :param bytes_per_pixel: to convert max_merged_bytes to a number of pixels
+        """
+        self._fetch = fetch
+        self.max_merged_bytes = max_merged_bytes
+        self.bytes_per_pixel = bytes_per_pixel
+        self._lock = threading.Lock()
+        self._in_flight = []
+        self.resetStats()
+
+    def resetStats(self):
+        with self._lock:
+            self._stats = {"requests": 0, "upstream_requests": 0, "contained": 0, "merged": 0, "saved_pixels": 0}
+
+    def getStats(self) -> Dict[str, int]:
+        """
+        Return counters since the last reset:
+
+        * requests: calls to get()
+        * upstream_requests: requests issued to the source
+        * contained: calls served by an in-flight request that already covered their roi
+        * merged: calls merged into a queued request
+        * saved_pixels: pixels that did not have to be requested from the source thanks to coalescing
+        """
+        with self._lock:
+            return dict(self._stats)
+
+    @property
+    def enabled(self):
+        return self.max_merged_bytes > 0
+
+    def get(self, roi, out=None):
+        """
+        Get the data for the given (start, stop) roi.
+
+        If out is given, the data may be written into it, but the result is not necessarily ``out``:
+        callers must copy the result into ``out`` unless the returned object is ``out`` itself.
+        """
+        roi = (tuple(map(int, roi[0])), tuple(map(int, roi[1])))
+        if not self.enabled:
+            req = self._fetch(*roi)
+            if out is not None:
+                req.writeInto(out)
+            return req.wait()
+
+        with self._lock:
+            self._stats["requests"] += 1
+            entry = self._attach(roi)
+            created = entry is None
+            if created:
+                entry = _InFlight(roi, out)
+                entry.request = Request(partial(self._execute, entry))
+                self._in_flight.append(entry)
+
+        if created:
+            # Submit instead of executing directly, so that requests arriving while this one is queued can join it
+            entry.request.submit()
+        data = entry.request.wait()
+        if data is out:
+            return out
+        return data[roiToSlice(*numpy.subtract(roi, entry.roi[0]))]
+
+    def invalidate(self, roi):
+        """
+        Don't let later calls to get() join in-flight requests that intersect the given (start, stop) roi,
+        e.g. because the source data of that roi changed, so that their results may be outdated.
+        Callers that joined already still get the results of these requests.
+        """
+        roi = (tuple(map(int, roi[0])), tuple(map(int, roi[1])))
+        with self._lock:
+            self._in_flight = [entry for entry in self._in_flight if not _intersects(entry.roi, roi)]
+
+    def _attach(self, roi):
+        # Must hold _lock
+        volume = _volume(roi)
+        for entry in self._in_flight:
+            if entry.shared and _contains(entry.roi, roi):
+                self._stats["contained"] += 1
+                self._stats["saved_pixels"] += volume
+                entry.joined = True
+                return entry
+
+        max_pixels = self.max_merged_bytes // max(1, self.bytes_per_pixel)
+        for entry in self._in_flight:
+            if entry.executing or not _intersects(entry.roi, roi):
+                continue
+            merged = _union(entry.roi, roi)
+            merged_volume = _volume(merged)
+            separate_volume = _volume(entry.roi) + volume
+            if merged_volume <= separate_volume and merged_volume <= max_pixels:
+                self._stats["merged"] += 1
+                self._stats["saved_pixels"] += separate_volume - merged_volume
+                entry.roi = merged
+                entry.joined = True
+                return entry
+        return None
+
+    def _execute(self, entry):
+        with self._lock:
+            entry.executing = True
+            self._stats["upstream_requests"] += 1
+            # Nobody joined: write straight into the leader's output array
+            write_into_leader = entry.leader_out is not None and not entry.joined
+            entry.shared = not write_into_leader
+        try:
+            req = self._fetch(*entry.roi)
+            if write_into_leader:
+                req.writeInto(entry.leader_out)
+            return req.wait()
+        finally:
+            with self._lock:
+                if entry in self._in_flight:
+                    # (Unless it was invalidated)
+                    self._in_flight.remove(entry)
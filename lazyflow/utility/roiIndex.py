@@ -0,0 +1,248 @@
+###############################################################################
+#   lazyflow: data flow based lazy parallel computation framework
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License
+# as published by the Free Software Foundation; either version 2.1
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# See the files LICENSE.lgpl2 and LICENSE.lgpl3 for full text of the
+# GNU Lesser General Public License version 2.1 and 3 respectively.
+# This information is also available on the ilastik web site at:
+# 		   http://ilastik.org/license/
+###############################################################################
+import threading
+from typing import List, Tuple
+
+Roi = Tuple[Tuple[int, ...], Tuple[int, ...]]
+
+
+def _contains(outer, inner):
+    return all(o <= i for o, i in zip(outer[0], inner[0])) and all(o >= i for o, i in zip(outer[1], inner[1]))
+
+
+def _intersects(a, b):
+    return all(
+        a_start < b_stop and b_start < a_stop for a_start, a_stop, b_start, b_stop in zip(a[0], a[1], b[0], b[1])
+    )
+
+
+def _union(a, b):
+    return (tuple(map(min, a[0], b[0])), tuple(map(max, a[1], b[1])))
+
+
+def _volume(roi):
+    volume = 1
+    for start, stop in zip(*roi):
+        volume *= stop - start
+    return volume
+
+
+def _bounding_roi(entries):
+    starts = list(zip(*(entry.roi[0] for entry in entries)))
+    stops = list(zip(*(entry.roi[1] for entry in entries)))
+    return (tuple(map(min, starts)), tuple(map(max, stops)))
+
+
+class _Node:
+    __slots__ = ("roi", "children", "leaf", "parent")
+
+    def __init__(self, leaf, parent=None):
+        self.roi = None
+        self.children = []
+        self.leaf = leaf
+        self.parent = parent
+
+
+class _Entry:
+    __slots__ = ("roi",)
+
+    def __init__(self, roi):
+        self.roi = roi
+
+
+class RoiIndex:
+    """
+    An R-tree of rois (``(start, stop)`` tuples of ints) supporting containment and intersection queries.
+
+    Queries visit only the subtrees whose bounding box can hold a match,
+    so for reasonably distributed rois they take O(log N) instead of scanning every stored roi.
+    The index is thread-safe; operations never block on anything but a short internal lock.
+
+    Example:
+        >>> index = RoiIndex()
+        >>> index.add(((0, 0), (10, 10)))
+        >>> index.add(((10, 0), (20, 10)))
+        >>> index.containing(((2, 2), (4, 4)))
+        [((0, 0), (10, 10))]
+        >>> sorted(index.intersecting(((5, 5), (15, 6))))
+        [((0, 0), (10, 10)), ((10, 0), (20, 10))]
+        >>> index.remove(((0, 0), (10, 10)))
+        >>> len(index)
+        1
+    """
+
+    def __init__(self, max_entries=16):
+        assert max_entries >= 4
+        self._max_entries = max_entries
+        self._min_entries = max_entries // 2
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._root = _Node(leaf=True)
+            # roi -> leaf node holding it
+            self._leaves = {}
+
+    def __len__(self):
+        return len(self._leaves)
+
+    def __contains__(self, roi):
+        return roi in self._leaves
+
+    def add(self, roi: Roi):
+        """Add a roi to the index.  Adding a roi that is already present has no effect."""
+        with self._lock:
+            if roi not in self._leaves:
+                self._insert(_Entry(roi))
+
+    def remove(self, roi: Roi):
+        """Remove a roi from the index.  Removing a roi that is not present has no effect."""
+        with self._lock:
+            leaf = self._leaves.pop(roi, None)
+            if leaf is None:
+                return
+            leaf.children = [entry for entry in leaf.children if entry.roi != roi]
+            self._condense(leaf)
+
+    def containing(self, roi: Roi) -> List[Roi]:
+        """Return all stored rois that entirely envelop the given roi."""
+        with self._lock:
+            return self._search(roi, _contains)
+
+    def intersecting(self, roi: Roi) -> List[Roi]:
+        """Return all stored rois that overlap the given roi (by at least one pixel)."""
+        with self._lock:
+            return self._search(roi, _intersects)
+
+    def _search(self, roi, predicate):
+        # Both predicates are monotonic: if a roi matches, so does every bounding box around it.
+        if self._root.roi is None:
+            return []
+        matches = []
+        nodes = [self._root]
+        while nodes:
+            node = nodes.pop()
+            if node.leaf:
+                matches += [entry.roi for entry in node.children if predicate(entry.roi, roi)]
+            else:
+                nodes += [child for child in node.children if predicate(child.roi, roi)]
+        return matches
+
+    def _insert(self, entry):
+        # Descend to the leaf that needs the least enlargement to hold the new entry
+        node = self._root
+        while not node.leaf:
+            node = min(
+                node.children,
+                key=lambda child: (_volume(_union(child.roi, entry.roi)) - _volume(child.roi), _volume(child.roi)),
+            )
+
+        node.children.append(entry)
+        self._leaves[entry.roi] = node
+
+        # Split overfull nodes and update bounding boxes on the way back up
+        while node is not None:
+            if len(node.children) > self._max_entries:
+                self._split(node)
+            node.roi = _bounding_roi(node.children)
+            node = node.parent
+
+    def _split(self, node):
+        # Linear split: seed both halves with the two children that are furthest apart
+        # along the axis with the largest normalized separation, then assign the rest greedily.
+        children = node.children
+        best_separation, seeds = -1.0, (0, 1)
+        for axis in range(len(children[0].roi[0])):
+            highest_start = max(range(len(children)), key=lambda i: children[i].roi[0][axis])
+            lowest_stop = min(range(len(children)), key=lambda i: children[i].roi[1][axis])
+            width = max(c.roi[1][axis] for c in children) - min(c.roi[0][axis] for c in children)
+            separation = (children[highest_start].roi[0][axis] - children[lowest_stop].roi[1][axis]) / max(width, 1)
+            if highest_start != lowest_stop and separation > best_separation:
+                best_separation, seeds = separation, (lowest_stop, highest_start)
+
+        groups = ([children[seeds[0]]], [children[seeds[1]]])
+        rois = [groups[0][0].roi, groups[1][0].roi]
+        rest = [c for i, c in enumerate(children) if i not in seeds]
+        for i, child in enumerate(rest):
+            remaining = len(rest) - i
+            if len(groups[0]) + remaining <= self._min_entries:
+                target = 0
+            elif len(groups[1]) + remaining <= self._min_entries:
+                target = 1
+            else:
+                growth = [_volume(_union(r, child.roi)) - _volume(r) for r in rois]
+                target = 0 if (growth[0], len(groups[0])) <= (growth[1], len(groups[1])) else 1
+            groups[target].append(child)
+            rois[target] = _union(rois[target], child.roi)
+
+        sibling = _Node(node.leaf)
+        node.children, sibling.children = groups
+        node.roi, sibling.roi = rois
+        for child in sibling.children:
+            if node.leaf:
+                self._leaves[child.roi] = sibling
+            else:
+                child.parent = sibling
+
+        if node.parent is None:
+            # Grow the tree by one level
+            root = _Node(leaf=False)
+            root.children = [node, sibling]
+            node.parent = sibling.parent = root
+            self._root = root
+        else:
+            sibling.parent = node.parent
+            node.parent.children.append(sibling)
+
+    def _condense(self, node):
+        # Remove underfull nodes and re-insert their orphaned contents
+        orphans = []
+        while node.parent is not None:
+            parent = node.parent
+            if len(node.children) < self._min_entries:
+                parent.children.remove(node)
+                orphans.append(node)
+            elif node.children:
+                node.roi = _bounding_roi(node.children)
+            node = parent
+
+        while not self._root.leaf and len(self._root.children) == 1:
+            self._root = self._root.children[0]
+            self._root.parent = None
+        if not self._root.children:
+            self._root = _Node(leaf=True)
+
+        if self._root.children:
+            self._root.roi = _bounding_roi(self._root.children)
+        else:
+            self._root.roi = None
+
+        # Re-inserting whole subtrees at the right height is fiddly; re-inserting their entries is simple and rare.
+        for orphan in orphans:
+            for entry in self._entries(orphan):
+                self._insert(entry)
+
+    def _entries(self, node):
+        if node.leaf:
+            return list(node.children)
+        return [entry for child in node.children for entry in self._entries(child)]
@@ -0,0 +1,212 @@
+###############################################################################
+#   lazyflow: data flow based lazy parallel computation framework
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License
+# as published by the Free Software Foundation; either version 2.1
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# See the files LICENSE.lgpl2 and LICENSE.lgpl3 for full text of the
+# GNU Lesser General Public License version 2.1 and 3 respectively.
+# This information is also available on the ilastik web site at:
+# 		   http://ilastik.org/license/
+###############################################################################
+import sys
+import threading
+
+import numpy
+
+
+class TrainingMatrixView(numpy.ndarray):
+    """
+    Read-only snapshot of a TrainingMatrix (see TrainingMatrix.snapshot()).
+    """
+
+    def __array_finalize__(self, obj):
+        self.source = getattr(obj, "source", None)
+        self.generation = getattr(obj, "generation", None)
+
+    def changes_since(self, generation):
+        """
+        Describe how the matrix changed since the snapshot of the given generation was taken.
+
+        :returns: (indices of the rows that were added since, whether any rows were removed since),
+                  or None if that is unknown (e.g. the matrix was modified after this snapshot was taken).
+        """
+        if self.source is None:
+            return None
+        return self.source.changes(generation, self.generation)
+
+
+class TrainingMatrix(object):
+    """
+    A growable matrix of training samples (rows), in groups identified by keys (e.g. label blocks).
+
+    Setting or removing the rows of a key takes time proportional to the number of rows of that key
+    (amortized): new rows are appended to a preallocated buffer that grows geometrically, and the gaps
+    left by removed rows are filled with rows from the end.  Rows are therefore not in any particular order.
+
+    snapshot() returns the current rows without copying them.  If a snapshot (or any other view of it)
+    is still alive when the matrix is modified, the buffer is copied first, so snapshots never change.
+    """
+
+    def __init__(self, num_columns, dtype=numpy.float32, capacity=1024):
+        self._lock = threading.Lock()
+        self._data = numpy.empty((max(1, capacity), num_columns), dtype=dtype)
+        self._size = 0
+
+        # key -> indices of its rows
+        self._key_rows = {}
+        # Owner of each row: key index (see _key_ids) and position in the owner's row indices
+        self._key_ids = {}
+        self._id_keys = []
+        self._row_owners = numpy.zeros(len(self._data), dtype=numpy.intp)
+        self._row_positions = numpy.zeros(len(self._data), dtype=numpy.intp)
+
+        # Every modification increments the generation
+        self._generation = 0
+        self._key_generations = {}
+        self._last_removal = 0
+
+    @property
+    def num_columns(self):
+        return self._data.shape[1]
+
+    @property
+    def dtype(self):
+        return self._data.dtype
+
+    @property
+    def generation(self):
+        return self._generation
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, key):
+        return key in self._key_rows
+
+    def keys(self):
+        with self._lock:
+            return list(self._key_rows.keys())
+
+    def rows(self, key):
+        """
+        A copy of the rows of the given key
+        """
+        with self._lock:
+            return self._data[self._key_rows[key]]
+
+    def set(self, key, rows):
+        """
+        Replace the rows of the given key (an empty matrix removes the key).
+        """
+        rows = numpy.asarray(rows)
+        if len(rows) == 0:
+            self.remove(key)
+            return
+        assert rows.ndim == 2 and rows.shape[1] == self.num_columns, "Expected rows with {} columns, got {}".format(
+            self.num_columns, rows.shape
+        )
+        with self._lock:
+            self._prepare_write()
+            self._generation += 1
+            if key in self._key_rows:
+                self._remove(key)
+                self._last_removal = self._generation
+            self._append(key, rows)
+            self._key_generations[key] = self._generation
+
+    def remove(self, key):
+        with self._lock:
+            if key not in self._key_rows:
+                return
+            self._prepare_write()
+            self._generation += 1
+            self._remove(key)
+            self._last_removal = self._generation
+            del self._key_generations[key]
+
+    def clear(self):
+        for key in self.keys():
+            self.remove(key)
+
+    def snapshot(self):
+        """
+        Return the current rows as a read-only TrainingMatrixView, without copying them.
+        """
+        with self._lock:
+            view = self._data[: self._size].view(TrainingMatrixView)
+            view.flags.writeable = False
+            view.source = self
+            view.generation = self._generation
+            return view
+
+    def changes(self, since_generation, at_generation):
+        """
+        See TrainingMatrixView.changes_since(); at_generation must be the current generation.
+        """
+        with self._lock:
+            if at_generation != self._generation or since_generation is None or since_generation > at_generation:
+                return None
+            changed_keys = [key for key, generation in self._key_generations.items() if generation > since_generation]
+            rows = [self._key_rows[key] for key in changed_keys]
+            rows = numpy.concatenate(rows) if rows else numpy.zeros((0,), dtype=numpy.intp)
+            return rows, self._last_removal > since_generation
+
+    def _prepare_write(self):
+        # Snapshots and their views hold a reference to the buffer (see ndarray.resize(refcheck=True)):
+        # one reference is ours, the other one is getrefcount's argument.
+        if sys.getrefcount(self._data) > 2:
+            self._data = self._data.copy()
+
+    def _reserve(self, size):
+        if size <= len(self._data):
+            return
+        capacity = max(size, 2 * len(self._data))
+        data = numpy.empty((capacity,) + self._data.shape[1:], dtype=self._data.dtype)
+        data[: self._size] = self._data[: self._size]
+        self._data = data
+        self._row_owners = numpy.resize(self._row_owners, capacity)
+        self._row_positions = numpy.resize(self._row_positions, capacity)
+
+    def _append(self, key, rows):
+        start, stop = self._size, self._size + len(rows)
+        self._reserve(stop)
+        self._data[start:stop] = rows
+
+        if key not in self._key_ids:
+            self._key_ids[key] = len(self._id_keys)
+            self._id_keys.append(key)
+        self._key_rows[key] = numpy.arange(start, stop)
+        self._row_owners[start:stop] = self._key_ids[key]
+        self._row_positions[start:stop] = numpy.arange(len(rows))
+        self._size = stop
+
+    def _remove(self, key):
+        removed = self._key_rows.pop(key)
+        new_size = self._size - len(removed)
+
+        # Fill the gaps before new_size with the remaining rows after it
+        gaps = removed[removed < new_size]
+        tail = numpy.arange(new_size, self._size)
+        moved = tail[~numpy.isin(tail, removed)]
+        assert len(gaps) == len(moved)
+
+        self._data[gaps] = self._data[moved]
+        owners = self._row_owners[moved]
+        positions = self._row_positions[moved]
+        for owner in numpy.unique(owners):
+            selection = owners == owner
+            self._key_rows[self._id_keys[owner]][positions[selection]] = gaps[selection]
+        self._row_owners[gaps] = owners
+        self._row_positions[gaps] = positions
+        self._size = new_size
@@ -0,0 +1,81 @@
+import h5py
+import numpy
+import pytest
+
+from lazyflow.classifiers import (
+    CompiledRfLazyflowClassifier,
+    CompiledRfLazyflowClassifierFactory,
+    ParallelVigraRfLazyflowClassifier,
+    ParallelVigraRfLazyflowClassifierFactory,
+)
+
+
+@pytest.fixture(scope="module")
+def training_data():
+    rng = numpy.random.RandomState(0)
+    X = rng.uniform(-5, 5, size=(2000, 5)).astype(numpy.float32)
+    y = (X[:, 0] * X[:, 1] > 0).astype(numpy.uint32) + 1 + (X[:, 2] > 3)
+    return X, y
+
+
+@pytest.fixture(scope="module")
+def vigra_classifier(training_data):
+    # With two forests, the order in which vigra's results are added up doesn't matter
+    factory = ParallelVigraRfLazyflowClassifierFactory(20, num_forests=2)
+    return factory.create_and_train(*training_data, feature_names=["f{}".format(i) for i in range(5)])
+
+
+def test_identical_to_vigra(training_data, vigra_classifier):
+    compiled = CompiledRfLazyflowClassifier.from_vigra_classifier(vigra_classifier)
+    assert list(compiled.known_classes) == [1, 2, 3]
+    assert compiled.feature_count == 5
+
+    X = numpy.random.RandomState(1).uniform(-6, 6, size=(10000, 5)).astype(numpy.float32)
+    X[3, 2] = numpy.nan
+    # Exactly at a threshold
+    X[:100] = training_data[0][:100]
+    probabilities = compiled.predict_probabilities(X)
+    assert probabilities.dtype == numpy.float32
+    numpy.testing.assert_array_equal(probabilities, vigra_classifier.predict_probabilities(X))
+
+
+def test_feature_count_without_feature_names(training_data):
+    X, y = training_data
+    # Constant columns are never split on
+    X = numpy.concatenate([X, numpy.zeros((len(X), 2), dtype=X.dtype)], axis=1)
+    vigra_classifier = ParallelVigraRfLazyflowClassifierFactory(5, num_forests=1).create_and_train(X, y)
+    compiled = CompiledRfLazyflowClassifier.from_vigra_classifier(vigra_classifier)
+    assert compiled.feature_names is None
+    assert compiled.feature_count == 7
+
+
+def test_partial_prediction(training_data, vigra_classifier):
+    compiled = CompiledRfLazyflowClassifier.from_vigra_classifier(vigra_classifier)
+    X = training_data[0]
+    # The first of the two forests
+    expected = vigra_classifier.predict_probabilities_partially(X, 0.5)
+    numpy.testing.assert_array_equal(compiled.predict_probabilities_partially(X, 0.5), expected)
+    assert compiled.predict_probabilities_partially(X, 1.0) is None
+
+
+def test_project_file_round_trip(tmp_path, training_data, vigra_classifier):
+    X = training_data[0]
+    expected = vigra_classifier.predict_probabilities(X)
+    with h5py.File(str(tmp_path / "project.ilp"), "w") as f:
+        vigra_classifier.serialize_hdf5(f.create_group("vigra"))
+        compiled = CompiledRfLazyflowClassifier.deserialize_hdf5(f["vigra"])
+        numpy.testing.assert_array_equal(compiled.predict_probabilities(X), expected)
+        assert compiled.feature_names == vigra_classifier.feature_names
+
+        # Stored in a format vigra can read back
+        compiled.serialize_hdf5(f.create_group("compiled"))
+        restored = ParallelVigraRfLazyflowClassifier.deserialize_hdf5(f["compiled"])
+        numpy.testing.assert_array_equal(restored.predict_probabilities(X), expected)
+
+
+def test_factory(training_data):
+    classifier = CompiledRfLazyflowClassifierFactory(10).create_and_train(*training_data)
+    assert isinstance(classifier, CompiledRfLazyflowClassifier)
+    probabilities = classifier.predict_probabilities(training_data[0])
+    assert probabilities.shape == (2000, 3)
+    assert (numpy.argmax(probabilities, axis=-1) + 1 == training_data[1]).mean() > 0.9
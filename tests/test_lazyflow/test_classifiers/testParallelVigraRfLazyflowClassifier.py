@@ -1,6 +1,7 @@
 from builtins import object
 import numpy
 from lazyflow.classifiers import ParallelVigraRfLazyflowClassifierFactory, ParallelVigraRfLazyflowClassifier
+from lazyflow.classifiers import parallelVigraRfLazyflowClassifier
 
 
 class TestParallelVigraRfLazyflowClassifier(object):
@@ -56,6 +57,57 @@ class TestParallelVigraRfLazyflowClassifier(object):
         assert (0 <= probabilities).all() and (probabilities <= 1.0).all()
         assert (numpy.argmax(probabilities, axis=-1) + 1 == self.expected_classes).all()
 
+    def test_chunked_prediction(self):
+        factory = ParallelVigraRfLazyflowClassifierFactory(10, num_forests=3)
+        classifier = factory.create_and_train(self.training_feature_matrix, self.training_labels)
+        X = numpy.random.RandomState(0).uniform(-5, 5, size=(1000, 2)).astype(numpy.float32)
+        expected = classifier.predict_probabilities(X)
+
+        try:
+            # 7 rows per chunk, the last chunk is shorter
+            parallelVigraRfLazyflowClassifier.setPredictionChunkBytes(7 * 2 * 4)
+            probabilities = classifier.predict_probabilities(X)
+        finally:
+            parallelVigraRfLazyflowClassifier.setPredictionChunkBytes(0)
+
+        assert probabilities.shape == expected.shape
+        assert probabilities.dtype == numpy.float32
+        numpy.testing.assert_allclose(probabilities, expected, rtol=1e-5)
+
+    def test_process_training(self):
+        factory = ParallelVigraRfLazyflowClassifierFactory(10, num_forests=3)
+        try:
+            parallelVigraRfLazyflowClassifier.setTrainingProcesses(2)
+            classifier = factory.create_and_train(self.training_feature_matrix, self.training_labels)
+        finally:
+            parallelVigraRfLazyflowClassifier.setTrainingProcesses(0)
+
+        assert [forest.treeCount() for forest in classifier._forests] == [4, 3, 3]
+        assert len(classifier.oobs) == 3
+        probabilities = classifier.predict_probabilities(self.prediction_data)
+        assert (numpy.argmax(probabilities, axis=-1) + 1 == self.expected_classes).all()
+
+    def test_float16_features(self):
+        """
+        Features cached as float16 (see OpFeatureSelection.ReducedPrecisionStorage) are used
+        both for training and prediction. This should hardly affect the predictions.
+        """
+        rng = numpy.random.RandomState(0)
+        features = (rng.normal(size=(4000, 20)) * rng.uniform(0.1, 100, size=20)).astype(numpy.float32)
+        labels = numpy.sin(features[:, 0] / features[:, 0].std() * 3) + features[:, 1] / features[:, 1].std() > 0
+        labels = labels.astype(numpy.uint32) + 1
+        train, test = slice(0, 3000), slice(3000, None)
+
+        def accuracy(features):
+            classifier = ParallelVigraRfLazyflowClassifierFactory(100).create_and_train(features[train], labels[train])
+            predicted = numpy.argmax(classifier.predict_probabilities(features[test]), axis=-1) + 1
+            return (predicted == labels[test]).mean()
+
+        full_precision = accuracy(features)
+        reduced_precision = accuracy(features.astype(numpy.float16).astype(numpy.float32))
+        assert full_precision > 0.9
+        assert reduced_precision >= full_precision - 0.02
+
     def test_pickle_fields(self):
         """
         Classifier factories are meant to be pickled and restored, but that only
@@ -0,0 +1,147 @@
+import threading
+import time
+
+import numpy
+import pytest
+
+from lazyflow.operators.blockPrefetcher import AccessPatternDetector, BlockPrefetcher
+
+BLOCK_SHAPE = (1, 10)
+SHAPE = (20, 10)
+
+
+def wait_until(condition):
+    deadline = time.time() + 5
+    while not condition():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def block(z):
+    return ((z, 0), (z + 1, 10))
+
+
+class Fetcher:
+    def __init__(self, release=None):
+        self.fetched = []
+        self.release = release
+
+    def __call__(self, block_roi):
+        if self.release is not None:
+            self.release.wait()
+        self.fetched.append(block_roi)
+
+    def is_cached(self, block_roi):
+        return block_roi in self.fetched
+
+
+def test_detector_needs_constant_stride():
+    detector = AccessPatternDetector(history=3)
+    assert detector.record((0,), (1,)) is None
+    assert detector.record((1,), (2,)) is None
+    assert detector.record((2,), (3,)) == (1,)
+    # Repeating the last access does not break the pattern
+    assert detector.record((2,), (3,)) == (1,)
+    assert detector.record((7,), (8,)) is None
+    assert detector.predict(3) == []
+
+
+def test_detector_requires_equal_extents():
+    detector = AccessPatternDetector(history=3)
+    for start, stop in [((0,), (1,)), ((1,), (3,)), ((2,), (3,))]:
+        stride = detector.record(start, stop)
+    assert stride is None
+
+
+def test_prefetches_ahead_of_sequential_sweep():
+    fetcher = Fetcher()
+    prefetcher = BlockPrefetcher(fetcher, fetcher.is_cached, depth=2)
+    for z in range(3):
+        scheduled = prefetcher.access([block(z)], BLOCK_SHAPE, SHAPE)
+    assert scheduled == [block(3), block(4)]
+    wait_until(lambda: prefetcher.getStats()["completed"] == 2)
+    assert sorted(fetcher.fetched) == [block(3), block(4)]
+
+    prefetcher.access([block(3)], BLOCK_SHAPE, SHAPE)
+    assert prefetcher.getStats()["hits"] == 1
+
+
+def test_prefetches_strided_and_stops_at_border():
+    fetcher = Fetcher()
+    prefetcher = BlockPrefetcher(fetcher, fetcher.is_cached, depth=5)
+    for z in (10, 13, 16):
+        scheduled = prefetcher.access([block(z)], BLOCK_SHAPE, SHAPE)
+    assert scheduled == [block(19)]
+
+
+def test_disabled_and_budget():
+    fetcher = Fetcher()
+    prefetcher = BlockPrefetcher(fetcher, fetcher.is_cached, depth=0)
+    for z in range(5):
+        assert prefetcher.access([block(z)], BLOCK_SHAPE, SHAPE) == []
+
+    prefetcher.depth = 3
+    for z in range(5, 8):
+        scheduled = prefetcher.access([block(z)], BLOCK_SHAPE, SHAPE, max_blocks=1)
+    assert scheduled == [block(8)]
+
+
+def test_cancels_when_pattern_breaks():
+    release = threading.Event()
+    fetcher = Fetcher(release)
+    prefetcher = BlockPrefetcher(fetcher, fetcher.is_cached, depth=4)
+    try:
+        for z in range(3):
+            prefetcher.access([block(z)], BLOCK_SHAPE, SHAPE)
+        assert prefetcher.getStats()["scheduled"] == 4
+
+        prefetcher.access([block(15)], BLOCK_SHAPE, SHAPE)
+        assert prefetcher.pendingBlocks() == []
+        assert prefetcher.getStats()["cancelled"] == 4
+    finally:
+        release.set()
+    wait_until(lambda: prefetcher.pendingBlocks() == [])
+    # Requests that were already running may complete, but nothing new is fetched
+    assert set(fetcher.fetched) <= {block(z) for z in range(3, 7)}
+    assert prefetcher.getStats()["completed"] == 0
+
+
+def test_is_cached_is_called_without_holding_the_lock():
+    fetcher = Fetcher()
+
+    def is_cached(block_roi):
+        # Would deadlock if the prefetcher's lock was held
+        prefetcher.getStats()
+        return fetcher.is_cached(block_roi)
+
+    prefetcher = BlockPrefetcher(fetcher, is_cached, depth=2)
+    for z in range(3):
+        scheduled = prefetcher.access([block(z)], BLOCK_SHAPE, SHAPE)
+    assert scheduled == [block(3), block(4)]
+
+
+def test_cache_prefetches_sequential_slices():
+    vigra = pytest.importorskip("vigra")
+    from lazyflow.graph import Graph
+    from lazyflow.operators.opBlockedArrayCache import OpBlockedArrayCache
+    from lazyflow.utility.testing import OpArrayPiperWithAccessCount
+
+    data = numpy.random.random((20, 10)).view(vigra.VigraArray)
+    data.axistags = vigra.defaultAxistags("zx")
+
+    graph = Graph()
+    opProvider = OpArrayPiperWithAccessCount(graph=graph)
+    opProvider.Input.setValue(data)
+    opCache = OpBlockedArrayCache(graph=graph)
+    opCache.Input.connect(opProvider.Output)
+    opCache.BlockShape.setValue((1, 10))
+    opCache.setPrefetchDepth(3)
+
+    for z in range(3):
+        numpy.testing.assert_array_equal(opCache.Output[z : z + 1].wait(), data[z : z + 1])
+    wait_until(lambda: opCache.getPrefetchStats()["completed"] == 3)
+    assert opProvider.accessCount == 6
+
+    for z in range(3, 6):
+        numpy.testing.assert_array_equal(opCache.Output[z : z + 1].wait(), data[z : z + 1])
+    assert opCache.getPrefetchStats()["hits"] == 3
@@ -0,0 +1,81 @@
+from lazyflow.operators.cacheEvictionPolicies import (
+    EvictionEntry,
+    GreedyDualSizeEvictionPolicy,
+    LRUEvictionPolicy,
+)
+
+
+def drain(policy):
+    keys = []
+    key = policy.pop()
+    while key is not None:
+        keys.append(key)
+        key = policy.pop()
+    return keys
+
+
+def test_lru_evicts_oldest_first():
+    policy = LRUEvictionPolicy()
+    policy.update(
+        [EvictionEntry("b", 2.0, 10, None), EvictionEntry("a", 1.0, 10, None), EvictionEntry("c", 3.0, 10, None)]
+    )
+    assert drain(policy) == ["a", "b", "c"]
+
+
+def test_lru_reprioritizes_accessed_entries():
+    policy = LRUEvictionPolicy()
+    policy.update([EvictionEntry("a", 1.0, 10, None), EvictionEntry("b", 2.0, 10, None)])
+    policy.update([EvictionEntry("a", 3.0, 10, None), EvictionEntry("b", 2.0, 10, None)])
+    assert drain(policy) == ["b", "a"]
+
+
+def test_update_forgets_vanished_entries():
+    policy = LRUEvictionPolicy()
+    policy.update([EvictionEntry("a", 1.0, 10, None), EvictionEntry("b", 2.0, 10, None)])
+    policy.update([EvictionEntry("b", 2.0, 10, None)])
+    assert len(policy) == 1
+    assert drain(policy) == ["b"]
+
+
+def test_heap_does_not_grow_with_repeated_accesses():
+    policy = LRUEvictionPolicy()
+    for t in range(1000):
+        policy.update([EvictionEntry("a", float(t), 10, None)])
+    assert len(policy._heap) < 100
+    assert drain(policy) == ["a"]
+
+
+def test_gds_keeps_expensive_blocks():
+    policy = GreedyDualSizeEvictionPolicy()
+    # Same size and age, but the feature block took 100x longer to compute than the raw block
+    policy.update([EvictionEntry("features", 1.0, 1000, 10.0), EvictionEntry("raw", 2.0, 1000, 0.1)])
+    assert drain(policy) == ["raw", "features"]
+
+
+def test_gds_prefers_evicting_large_blocks_of_equal_cost():
+    policy = GreedyDualSizeEvictionPolicy()
+    policy.update([EvictionEntry("small", 1.0, 100, 1.0), EvictionEntry("large", 1.0, 10000, 1.0)])
+    assert policy.pop() == "large"
+
+
+def test_gds_ages_entries_that_are_not_accessed():
+    policy = GreedyDualSizeEvictionPolicy()
+    policy.update([EvictionEntry("old", 1.0, 100, 1.0), EvictionEntry("cheap", 1.0, 100, 0.5)])
+    assert policy.pop() == "cheap"
+
+    # A cheap block that arrives after the eviction starts from the inflated baseline,
+    # so it outranks the expensive block that has not been touched since.
+    policy.update([EvictionEntry("old", 1.0, 100, 1.0), EvictionEntry("new", 2.0, 100, 0.6)])
+    assert policy.pop() == "old"
+
+
+def test_gds_uses_average_cost_for_unmeasured_entries():
+    policy = GreedyDualSizeEvictionPolicy()
+    policy.update(
+        [
+            EvictionEntry("cheap", 1.0, 100, 0.1),
+            EvictionEntry("unknown", 1.0, 100, None),
+            EvictionEntry("expensive", 1.0, 100, 10.0),
+        ]
+    )
+    assert drain(policy) == ["cheap", "unknown", "expensive"]
@@ -42,7 +42,9 @@ from lazyflow.utility import Memory
 from lazyflow.operators.cacheMemoryManager import default_refresh_interval
 from lazyflow.operators.opCache import Cache
 from lazyflow.operators.opBlockedArrayCache import OpBlockedArrayCache
+from lazyflow.operators.opCompressedCache import OpCompressedCache
 from lazyflow.operators.opSplitRequestsBlockwise import OpSplitRequestsBlockwise
+from lazyflow.operators.valueProviders import OpValueCache
 from lazyflow.operators.filterOperators import OpGaussianSmoothing
 
 from lazyflow.utility.testing import OpArrayPiperWithAccessCount
@@ -193,6 +195,91 @@ class TestCacheMemoryManager:
         c = pipe.accessCount
         assert c > b, "did not clean up"
 
+    def testEventDrivenCacheHandling(self, cacheMemoryManager):
+        n, k = 10, 5
+        vol = np.zeros((n,) * 5, dtype=np.uint8)
+        vol = vigra.taggedView(vol, axistags="txyzc")
+
+        g = Graph()
+        pipe = OpArrayPiperWithAccessCount(graph=g)
+        cache = OpBlockedArrayCache(graph=g)
+
+        # plenty of memory for now, and no polling
+        cacheMemoryManager.setRefreshInterval(3600)
+        cacheMemoryManager.setEventDriven(True)
+        cacheMemoryManager.enable()
+
+        cache.BlockShape.setValue((k,) * 5)
+        cache.Input.connect(pipe.Output)
+        pipe.Input.setValue(vol)
+
+        cache.Output[:k, :, :, :, :].wait()
+        assert cacheMemoryManager.reportedMemory() == cache.usedMemory() == vol.nbytes // 2
+
+        # the next allocation exceeds the budget and must trigger a cleanup right away
+        Memory.setAvailableRamCaches(0)
+        cache.Output[k:, :, :, :, :].wait()
+        time.sleep(0.5)
+        assert cacheMemoryManager.reportedMemory() == cache.usedMemory() == 0
+
+        a = pipe.accessCount
+        cache.Output[...].wait()
+        assert pipe.accessCount > a, "did not clean up"
+
+    def testEventDrivenPollsUnreportingCaches(self, cacheMemoryManager):
+        n, k = 10, 5
+        vol = np.zeros((n,) * 5, dtype=np.uint8)
+        vol = vigra.taggedView(vol, axistags="txyzc")
+        value = np.zeros((n, n), dtype=np.float64)
+
+        g = Graph()
+        pipe = OpArrayPiperWithAccessCount(graph=g)
+        cache = OpBlockedArrayCache(graph=g)
+        valueCache = OpValueCache(graph=g)
+
+        totals = []
+        cacheMemoryManager.totalCacheMemory.subscribe(totals.append)
+        cacheMemoryManager.setRefreshInterval(0.01)
+        cacheMemoryManager.setEventDriven(True)
+        cacheMemoryManager.enable()
+
+        cache.BlockShape.setValue((k,) * 5)
+        cache.Input.connect(pipe.Output)
+        pipe.Input.setValue(vol)
+        valueCache.Input.setValue(value)
+
+        cache.Output[:k, :, :, :, :].wait()
+        valueCache.Output.value
+        assert cacheMemoryManager.reportedMemory() == cache.usedMemory() == vol.nbytes // 2
+
+        # The value cache does not report its memory, but must not be invisible to the budget
+        del totals[:]
+        time.sleep(0.1)
+        assert totals and totals[-1] == vol.nbytes // 2 + value.nbytes
+
+    def testEventDrivenCompressedCache(self, cacheMemoryManager):
+        vol = np.random.randint(0, 255, size=(10, 20, 20, 1), dtype=np.uint8)
+        vol = vigra.taggedView(vol, axistags="zyxc")
+
+        g = Graph()
+        pipe = OpArrayPiperWithAccessCount(graph=g)
+        cache = OpCompressedCache(graph=g)
+
+        cacheMemoryManager.setRefreshInterval(3600)
+        cacheMemoryManager.setEventDriven(True)
+        cacheMemoryManager.enable()
+
+        cache.BlockShape.setValue((5, 10, 10, 1))
+        cache.Input.connect(pipe.Output)
+        pipe.Input.setValue(vol)
+
+        # Blocks that are computed for the first time are reported, too
+        cache.Output[:5, :, :, :].wait()
+        assert cacheMemoryManager.reportedMemory() == cache.usedMemory() > 0
+
+        cache.Output[...].wait()
+        assert cacheMemoryManager.reportedMemory() == cache.usedMemory()
+
     def testBadMemoryConditions(self):
         """
         TestCacheMemoryManager.testBadMemoryConditions
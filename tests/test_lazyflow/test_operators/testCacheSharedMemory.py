@@ -0,0 +1,247 @@
+import multiprocessing
+import sys
+import uuid
+
+import numpy
+import pytest
+from numpy.testing import assert_array_equal
+
+from lazyflow.operators import cacheSharedMemory
+from lazyflow.operators.cacheSharedMemory import SharedMemoryStore
+
+pytestmark = pytest.mark.skipif(sys.platform == "win32", reason="Segments are not persistent on Windows")
+
+BLOCK_ROI = ((0, 0), (10, 10))
+
+
+@pytest.fixture
+def store():
+    store = SharedMemoryStore(max_bytes=3 * 800, prefix="lzf" + uuid.uuid4().hex[:4])
+    yield store
+    store.clear()
+
+
+def block(value):
+    return numpy.full((10, 10), value, dtype=numpy.float64)
+
+
+def test_put_and_get(store):
+    name = store.blockName("graph", BLOCK_ROI, numpy.float64)
+    assert store.get(name, (10, 10), numpy.float64) is None
+
+    shared = store.put(name, block(1))
+    assert_array_equal(shared, block(1))
+    assert not shared.flags.writeable
+
+    # A second store (as in another process) maps the same memory
+    other = SharedMemoryStore(max_bytes=0, prefix="unused")
+    mapped = other.get(name, (10, 10), numpy.float64)
+    assert_array_equal(mapped, block(1))
+    assert store.getStats()["published"] == 1
+    assert other.getStats()["hits"] == 1
+
+    # Somebody else published it already
+    assert store.put(name, block(2)) is None
+
+
+def test_names_depend_on_graph_roi_and_dtype(store):
+    names = {
+        store.blockName("graph", BLOCK_ROI, numpy.float64),
+        store.blockName("other graph", BLOCK_ROI, numpy.float64),
+        store.blockName("graph", ((0, 10), (10, 20)), numpy.float64),
+        store.blockName("graph", BLOCK_ROI, numpy.float32),
+    }
+    assert len(names) == 4
+    assert all(len(name) <= 31 for name in names)
+
+
+def test_budget_unlinks_oldest_segments(store):
+    names = [store.blockName("graph", ((i, 0), (i + 10, 10)), numpy.float64) for i in range(4)]
+    for name in names:
+        assert store.put(name, block(1)) is not None
+    assert store.usedBytes() == 3 * 800
+    assert store.get(names[0], (10, 10), numpy.float64) is None
+    assert store.get(names[3], (10, 10), numpy.float64) is not None
+
+    # Too large for the budget
+    assert store.put(store.blockName("graph", ((0, 0), (1, 1)), numpy.uint8), numpy.zeros(4000)) is None
+
+
+def _publish(prefix, name, published, done):
+    store = SharedMemoryStore(max_bytes=10 ** 6, prefix=prefix)
+    store.put(name, block(5))
+    published.set()
+    done.wait(10)
+    store.clear()
+
+
+@pytest.mark.skipif(sys.platform != "linux", reason="Needs fork")
+def test_blocks_are_shared_between_processes(store):
+    ctx = multiprocessing.get_context("fork")
+    name = store.blockName("graph", BLOCK_ROI, numpy.float64)
+    published, done = ctx.Event(), ctx.Event()
+    process = ctx.Process(target=_publish, args=("unused", name, published, done))
+    process.start()
+    try:
+        assert published.wait(10)
+        mapped = store.get(name, (10, 10), numpy.float64)
+        assert_array_equal(mapped, block(5))
+    finally:
+        done.set()
+        process.join()
+    # The mapping stays valid after the owner is gone
+    assert_array_equal(mapped, block(5))
+
+
+@pytest.fixture
+def shared_store(store):
+    cacheSharedMemory.setSharedMemoryStore(store)
+    yield store
+    cacheSharedMemory.setSharedMemoryStore(None)
+
+
+def test_identical_graphs_share_blocks(shared_store):
+    vigra = pytest.importorskip("vigra")
+    from lazyflow.graph import Graph
+    from lazyflow.operators.opBlockedArrayCache import OpBlockedArrayCache
+    from lazyflow.utility.testing import OpArrayPiperWithAccessCount
+
+    shared_store._max_bytes = 10 ** 6
+    data = numpy.random.random((20, 10)).view(vigra.VigraArray)
+    data.axistags = vigra.defaultAxistags("xy")
+
+    def pipeline(data):
+        graph = Graph()
+        opProvider = OpArrayPiperWithAccessCount(graph=graph)
+        opProvider.Input.setValue(data)
+        opCache = OpBlockedArrayCache(graph=graph)
+        opCache.Input.connect(opProvider.Output)
+        opCache.BlockShape.setValue((10, 10))
+        return opProvider, opCache
+
+    opProvider1, opCache1 = pipeline(data)
+    opProvider2, opCache2 = pipeline(data.copy())
+    assert cacheSharedMemory.upstreamContentHash(opCache1.Input) == cacheSharedMemory.upstreamContentHash(
+        opCache2.Input
+    )
+
+    assert_array_equal(opCache1.Output[:].wait(), data)
+    assert_array_equal(opCache2.Output[:].wait(), data)
+    assert opProvider1.accessCount == 2
+    assert opProvider2.accessCount == 0, "blocks were not reused"
+
+    # Different data, different blocks
+    opProvider3, opCache3 = pipeline(data + 1)
+    assert_array_equal(opCache3.Output[:].wait(), data + 1)
+    assert opProvider3.accessCount == 2
+
+
+def test_operators_with_hidden_state_are_not_hashed():
+    pytest.importorskip("vigra")
+    from lazyflow.graph import Graph
+    from lazyflow.operators.opArrayPiper import OpArrayPiper
+    from lazyflow.operators.valueProviders import OpValueCache
+
+    graph = Graph()
+    opValue = OpValueCache(graph=graph)
+    opValue.Input.setValue(numpy.zeros((5, 5)))
+    opPiper = OpArrayPiper(graph=graph)
+    opPiper.Input.connect(opValue.Output)
+    with pytest.raises(cacheSharedMemory.UnhashableGraph):
+        cacheSharedMemory.upstreamContentHash(opPiper.Input)
+
+
+def test_discard(store):
+    name = store.blockName("graph", BLOCK_ROI, numpy.float64)
+    shared = store.put(name, block(1))
+    assert store.usedBytes() == 800
+
+    store.discard(name)
+    assert store.usedBytes() == 0
+    assert store.get(name, (10, 10), numpy.float64) is None
+    # Existing mappings stay valid
+    assert_array_equal(shared, block(1))
+    # Nothing to do
+    store.discard(name)
+
+
+def test_dirty_blocks_are_discarded(shared_store):
+    vigra = pytest.importorskip("vigra")
+    from lazyflow.graph import Graph
+    from lazyflow.operators.opBlockedArrayCache import OpBlockedArrayCache
+    from lazyflow.utility.testing import OpArrayPiperWithAccessCount
+
+    shared_store._max_bytes = 10 ** 6
+    data = numpy.random.random((20, 10)).view(vigra.VigraArray)
+    data.axistags = vigra.defaultAxistags("xy")
+
+    graph = Graph()
+    opProvider = OpArrayPiperWithAccessCount(graph=graph)
+    opProvider.Input.setValue(data)
+    opCache = OpBlockedArrayCache(graph=graph)
+    opCache.Input.connect(opProvider.Output)
+    opCache.BlockShape.setValue((10, 10))
+
+    opCache.Output[:].wait()
+    assert len(shared_store) == 2
+
+    opProvider.Input.setDirty(numpy.s_[0:5, :])
+    assert len(shared_store) == 1
+
+
+def test_values_in_containers_are_hashed_completely():
+    big = numpy.zeros(10000)
+    other = big.copy()
+    other[5000] = 1
+    # The repr() of both is the same
+    assert repr([big]) == repr([other])
+    assert cacheSharedMemory._value_digest([big]) != cacheSharedMemory._value_digest([other])
+    assert cacheSharedMemory._value_digest({"a": (big,)}) != cacheSharedMemory._value_digest({"a": (other,)})
+    assert cacheSharedMemory._value_digest([big]) == cacheSharedMemory._value_digest([big.copy()])
+
+    masked = numpy.ma.masked_array(big, mask=big == 0)
+    assert cacheSharedMemory._value_digest(masked) != cacheSharedMemory._value_digest(big)
+
+    with pytest.raises(cacheSharedMemory.UnhashableGraph):
+        cacheSharedMemory._value_digest([object()])
+
+
+def test_blocks_behind_another_cache_are_shared(shared_store):
+    vigra = pytest.importorskip("vigra")
+    from lazyflow.graph import Graph
+    from lazyflow.operators.opArrayPiper import OpArrayPiper
+    from lazyflow.operators.opBlockedArrayCache import OpBlockedArrayCache
+    from lazyflow.utility.testing import OpArrayPiperWithAccessCount
+
+    shared_store._max_bytes = 10 ** 6
+    data = numpy.random.random((20, 10)).view(vigra.VigraArray)
+    data.axistags = vigra.defaultAxistags("xy")
+
+    def pipeline():
+        # Like a reader (with its own cache) followed by a feature computation and the feature cache
+        graph = Graph()
+        opProvider = OpArrayPiperWithAccessCount(graph=graph)
+        opProvider.Input.setValue(data)
+        opInputCache = OpBlockedArrayCache(graph=graph)
+        opInputCache.Input.connect(opProvider.Output)
+        opPiper = OpArrayPiper(graph=graph)
+        opPiper.Input.connect(opInputCache.Output)
+        opCache = OpBlockedArrayCache(graph=graph)
+        opCache.Input.connect(opPiper.Output)
+        opCache.BlockShape.setValue((10, 10))
+        return opProvider, opInputCache, opCache
+
+    opProvider1, _, opCache1 = pipeline()
+    opProvider2, opInputCache2, opCache2 = pipeline()
+    assert_array_equal(opCache1.Output[:].wait(), data)
+    assert_array_equal(opCache2.Output[:].wait(), data)
+    assert opProvider1.accessCount > 0
+    assert opProvider2.accessCount == 0, "blocks were not reused"
+
+    # Data that was set into a cache doesn't come from its input any more
+    opInputCache2.Input[0:10, 0:10] = numpy.zeros((10, 10))
+    with pytest.raises(cacheSharedMemory.UnhashableGraph):
+        cacheSharedMemory.upstreamContentHash(opCache2.Input)
+    # Although it was not notified, the downstream cache stops sharing its blocks
+    assert opCache2._opSimpleBlockedArrayCache._shared_graph_hash() is None
+    assert opCache1._opSimpleBlockedArrayCache._shared_graph_hash() is not None
@@ -0,0 +1,120 @@
+import gc
+import os
+
+import numpy
+import pytest
+
+from lazyflow.operators import cacheSpillStore
+from lazyflow.operators.cacheSpillStore import SpillStore
+
+
+class Owner:
+    pass
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SpillStore(max_bytes=3 * 800, directory=str(tmp_path))
+
+
+def block(value):
+    return numpy.full((10, 10), value, dtype=numpy.float64)
+
+
+def test_take_returns_block_and_removes_it(store):
+    assert store.put(0, "a", block(1))
+    assert store.contains(0, "a")
+    assert store.usedBytes() == 800
+
+    numpy.testing.assert_array_equal(store.take(0, "a"), block(1))
+    assert store.take(0, "a") is None
+    assert store.usedBytes() == 0
+    assert os.listdir(store.directory) == []
+
+
+def test_evicts_least_recently_spilled(store):
+    for key in "abcd":
+        store.put(0, key, block(1))
+    assert sorted(store.keys(0)) == ["b", "c", "d"]
+    assert store.usedBytes() == 3 * 800
+    assert len(os.listdir(store.directory)) == 3
+
+
+def test_rejects_blocks_larger_than_budget(store):
+    assert not store.put(0, "a", numpy.zeros(1000))
+    assert len(store) == 0
+
+
+def test_replacing_a_block_keeps_accounting(store):
+    store.put(0, "a", block(1))
+    store.put(0, "a", block(2))
+    assert store.usedBytes() == 800
+    numpy.testing.assert_array_equal(store.take(0, "a"), block(2))
+
+
+def test_discard(store):
+    store.put(0, "a", block(1))
+    store.put(0, "b", block(1))
+    store.put(1, "a", block(1))
+    store.discard(0, ["a", "unknown"])
+    assert store.keys(0) == ["b"]
+
+    store.discardNamespace(0)
+    assert store.keys(0) == []
+    assert store.keys(1) == ["a"]
+
+
+def test_namespace_is_dropped_with_owner(store):
+    owner = Owner()
+    namespace = store.namespaceFor(owner)
+    assert store.namespaceFor(owner) == namespace
+    assert store.namespaceFor(Owner()) != namespace
+
+    store.put(namespace, "a", block(1))
+    del owner
+    gc.collect()
+    assert len(store) == 0
+
+
+@pytest.fixture
+def spill_store(store):
+    cacheSpillStore.setSpillStore(store)
+    yield store
+    cacheSpillStore.setSpillStore(None)
+
+
+def test_evicted_blocks_are_served_from_spill_store(spill_store):
+    vigra = pytest.importorskip("vigra")
+    from lazyflow.graph import Graph
+    from lazyflow.operators.opBlockedArrayCache import OpBlockedArrayCache
+    from lazyflow.utility.testing import OpArrayPiperWithAccessCount
+
+    data = numpy.random.random((20, 10)).view(vigra.VigraArray)
+    data.axistags = vigra.defaultAxistags("xy")
+
+    graph = Graph()
+    opProvider = OpArrayPiperWithAccessCount(graph=graph)
+    opProvider.Input.setValue(data)
+    opCache = OpBlockedArrayCache(graph=graph)
+    opCache.Input.connect(opProvider.Output)
+    opCache.BlockShape.setValue((10, 10))
+
+    opCache.Output[:].wait()
+    assert opProvider.accessCount == 2
+
+    for block_id, _ in opCache.getBlockAccessTimes():
+        opCache.freeBlock(block_id)
+    assert opCache.usedMemory() == 0
+    assert len(spill_store) == 2
+
+    numpy.testing.assert_array_equal(opCache.Output[:].wait(), data)
+    assert opProvider.accessCount == 2, "evicted blocks were recomputed"
+    assert len(spill_store) == 0
+
+    # Dirty blocks must not be served from disk
+    for block_id, _ in opCache.getBlockAccessTimes():
+        opCache.freeBlock(block_id)
+    opProvider.Input.setDirty((slice(0, 10), slice(None)))
+    assert len(spill_store) == 1
+    opCache.Output[:].wait()
+    assert opProvider.accessCount == 3
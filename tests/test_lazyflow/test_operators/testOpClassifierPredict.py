@@ -0,0 +1,117 @@
+import threading
+
+import numpy
+import vigra
+
+from lazyflow.classifiers import LazyflowVectorwiseClassifierABC, LazyflowVectorwiseClassifierFactoryABC
+from lazyflow.graph import Graph
+from lazyflow.operators.classifierOperators import OpClassifierPredict
+from lazyflow.operators.opSlicedBlockedArrayCache import OpSlicedBlockedArrayCache
+
+
+class TwoStageClassifierFactory(LazyflowVectorwiseClassifierFactoryABC):
+    VERSION = 1
+
+    def create_and_train(self, X, y, feature_names=None):
+        return TwoStageClassifier()
+
+    @property
+    def description(self):
+        return "two stages"
+
+
+class TwoStageClassifier(LazyflowVectorwiseClassifierABC):
+    """
+    The single feature is the probability of class 1. The complete classifier squares it.
+    """
+
+    def __init__(self):
+        self.predicted = []
+
+    def predict_probabilities(self, X):
+        self.predicted.append(len(X))
+        p = X[:, 0] ** 2
+        return numpy.stack([p, 1 - p], axis=-1).astype(numpy.float32)
+
+    def predict_probabilities_partially(self, X, fraction):
+        p = X[:, 0]
+        return numpy.stack([p, 1 - p], axis=-1).astype(numpy.float32)
+
+    known_classes = [1, 2]
+    feature_count = 1
+    feature_names = None
+
+    def serialize_hdf5(self, h5py_group):
+        pass
+
+
+def make_predict_op(features, classifier, axes="yxc"):
+    op = OpClassifierPredict(graph=Graph())
+    op.Image.setValue(vigra.taggedView(features, axes))
+    op.LabelsCount.setValue(2)
+    op.Classifier.setValue(classifier, extra_meta={"classifier_factory": TwoStageClassifierFactory()})
+    return op
+
+
+def test_progressive_prediction():
+    features = numpy.random.RandomState(0).random_sample((20, 30, 1)).astype(numpy.float32)
+    provisional = features[..., 0]
+    uncertain = (provisional < 0.9) & (provisional > 0.1)
+    classifier = TwoStageClassifier()
+    op = make_predict_op(features, classifier)
+    op.ProgressivePrediction.setValue(True)
+
+    refined = threading.Event()
+    op.PMaps.notifyDirty(lambda *args: refined.set())
+
+    predictions = op.PMaps[:, :, 0:1].wait()[..., 0]
+    numpy.testing.assert_allclose(predictions, provisional)
+
+    assert refined.wait(10)
+    assert classifier.predicted == [uncertain.sum()]
+    predictions = op.PMaps[:, :, 0:1].wait()[..., 0]
+    numpy.testing.assert_allclose(predictions[uncertain], provisional[uncertain] ** 2)
+    numpy.testing.assert_allclose(predictions[~uncertain], provisional[~uncertain])
+
+
+def test_refined_rois_are_not_refined_again():
+    """
+    Views with different slicings share the predictions, so refining the slices of one view dirties the slices of
+    the other.  Those must not be refined (and dirtied) again, or the views would keep refining each other.
+    """
+    features = numpy.random.RandomState(0).uniform(0.2, 0.8, (4, 6, 8, 1)).astype(numpy.float32)
+    provisional = features[..., 0]
+    op = make_predict_op(features, TwoStageClassifier(), "zyxc")
+    op.ProgressivePrediction.setValue(True)
+
+    cache = OpSlicedBlockedArrayCache(graph=op.graph)
+    cache.Input.connect(op.PMaps)
+    cache.BlockShape.setValue(((1, 6, 8, 2), (4, 6, 1, 2)))
+
+    refinements = threading.Semaphore(0)
+    op.PMaps.notifyDirty(lambda *args: refinements.release())
+
+    def wait_for_refinements(count):
+        for _ in range(count):
+            assert refinements.acquire(timeout=10)
+
+    def view(axis):
+        slicings = [(slice(None),) * axis + (slice(i, i + 1),) for i in range(features.shape[axis])]
+        return numpy.concatenate([cache.Output[slicing].wait() for slicing in slicings], axis=axis)[..., 0]
+
+    numpy.testing.assert_allclose(view(0), provisional)
+    wait_for_refinements(4)
+    numpy.testing.assert_allclose(view(0), provisional ** 2)
+
+    numpy.testing.assert_allclose(view(2), provisional)
+    wait_for_refinements(8)
+    numpy.testing.assert_allclose(view(0), provisional ** 2)
+    numpy.testing.assert_allclose(view(2), provisional ** 2)
+    assert not refinements.acquire(timeout=0.5)
+
+
+def test_complete_prediction_by_default():
+    features = numpy.random.RandomState(0).random_sample((20, 30, 1)).astype(numpy.float32)
+    op = make_predict_op(features, TwoStageClassifier())
+    predictions = op.PMaps[:, :, 0:1].wait()[..., 0]
+    numpy.testing.assert_allclose(predictions, features[..., 0] ** 2)
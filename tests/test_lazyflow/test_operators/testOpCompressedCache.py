@@ -47,6 +47,8 @@ from lazyflow.graph import Graph
 from lazyflow.operators import OpCompressedCache, OpArrayPiper
 from lazyflow.utility.slicingtools import slicing2shape
 from lazyflow.operators.opCache import MemInfoNode
+from lazyflow.operators.opCompressedCache import setDefaultBackend
+from lazyflow.utility.compressedArray import CompressedArray
 
 from lazyflow.utility.testing import OpArrayPiperWithAccessCount
 
@@ -966,3 +968,50 @@ class TestOpCompressedCache(object):
 
         assert op.Output.ready()
         assert_array_equal(op.Output.meta.ideal_blockshape, blockShape)
+
+
+class TestOpCompressedCacheChunksBackend(TestOpCompressedCache):
+    """
+    Run all of the above with blocks stored as dicts of compressed chunks instead of hdf5 files.
+    """
+
+    @pytest.fixture(autouse=True)
+    def chunks_backend(self):
+        setDefaultBackend("chunks", "zlib")
+        yield
+        setDefaultBackend("hdf5")
+
+    def testUsesCompressedArrays(self):
+        graph = Graph()
+        sampleData = vigra.taggedView(numpy.zeros((100, 100), dtype=numpy.uint8), axistags="xy")
+        opData = OpArrayPiper(graph=graph)
+        opData.Input.setValue(sampleData)
+        op = OpCompressedCache(graph=graph)
+        op.Input.connect(opData.Output)
+        op.BlockShape.setValue((50, 50))
+        op.Output[...].wait()
+
+        datasets = [f["data"] for f in op._cacheFiles.values()]
+        assert len(datasets) == 4
+        assert all(isinstance(ds, CompressedArray) for ds in datasets)
+        assert op.usedMemory() == sum(ds.nbytes_compressed for ds in datasets)
+
+    def testMaskedMemoryIsCompressedSize(self):
+        graph = Graph()
+        data = numpy.zeros((100, 100), dtype=numpy.uint8).view(numpy.ma.masked_array)
+        data[:10] = numpy.ma.masked
+        opData = OpArrayPiperWithAccessCount(graph=graph)
+        opData.Input.meta.has_mask = True
+        opData.Input.meta.axistags = vigra.defaultAxistags("xy")
+        opData.Input.setValue(data)
+        op = OpCompressedCache(graph=graph)
+        op.Input.connect(opData.Output)
+        op.BlockShape.setValue((50, 50))
+        op.Output[...].wait()
+
+        files = list(op._cacheFiles.values())
+        assert len(files) == 4
+        # One fill value per block, everything else is compressed
+        expected = sum(f["data"].nbytes_compressed + f["mask"].nbytes_compressed + 1 for f in files)
+        assert op.usedMemory() == expected
+        assert op.usedMemory() < data.nbytes
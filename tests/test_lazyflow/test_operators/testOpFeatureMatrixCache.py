@@ -5,6 +5,7 @@ import vigra
 from lazyflow.graph import Graph
 from lazyflow.operators.opFeatureMatrixCache import OpFeatureMatrixCache
 from lazyflow.operators.opBlockedArrayCache import OpBlockedArrayCache
+from lazyflow.utility.testing import OpArrayPiperWithAccessCount
 
 
 class TestOpFeatureMatrixCache(object):
@@ -51,3 +52,104 @@ class TestOpFeatureMatrixCache(object):
         # Just check that all features are present, regardless of order.
         for feature_vec in [[10.5, 10.5], [10.5, 11.5], [20.5, 20.5], [20.5, 21.5]]:
             assert feature_vec in labels_and_features[:, 1:]
+
+    def testSparseLabels(self):
+        features = numpy.indices((200, 200)).astype(numpy.float32) + 0.5
+        features = numpy.rollaxis(features, 0, 3)
+        features = vigra.taggedView(features, "xyc")
+
+        labels = numpy.zeros((200, 200, 1), dtype=numpy.uint8)
+        labels = vigra.taggedView(labels, "xyc")
+        # Two strokes at opposite corners of the same block
+        labels[5, 5:15] = 1
+        labels[190:195, 195] = 2
+
+        graph = Graph()
+        opLabelCache = OpBlockedArrayCache(graph=graph)
+        opLabelCache.BlockShape.setValue((200, 200, 1))
+        opLabelCache.Input.setValue(labels)
+
+        opFeatures = OpArrayPiperWithAccessCount(graph=graph)
+        opFeatures.Input.setValue(features)
+
+        opFeatureMatrixCache = OpFeatureMatrixCache(graph=graph)
+        opFeatureMatrixCache.LabelImage.connect(opLabelCache.Output)
+        opFeatureMatrixCache.FeatureImage.connect(opFeatures.Output)
+        opFeatureMatrixCache.LabelAndFeatureMatrix.value
+
+        opFeatureMatrixCache.LabelImage.setDirty(numpy.s_[:, :])
+        labels_and_features = opFeatureMatrixCache.LabelAndFeatureMatrix.value
+
+        # Features are requested for each stroke separately
+        requested = sorted((tuple(roi.start), tuple(roi.stop)) for roi in opFeatures.requests)
+        assert requested == [((5, 5, 0), (6, 15, 2)), ((190, 195, 0), (195, 196, 2))]
+
+        # Rows are in the same order as if the features were extracted from the whole block
+        positions = numpy.transpose(numpy.nonzero(labels[..., 0]))
+        numpy.testing.assert_array_equal(labels_and_features[:, 0], labels[..., 0][numpy.nonzero(labels[..., 0])])
+        numpy.testing.assert_array_equal(labels_and_features[:, 1:], positions + 0.5)
+
+    def testChannelKeys(self):
+        features = numpy.indices((100, 100)).astype(numpy.float32) + 0.5
+        features = numpy.rollaxis(features, 0, 3)
+        features = vigra.taggedView(features, "xyc")
+
+        labels = numpy.zeros((100, 100, 1), dtype=numpy.uint8)
+        labels = vigra.taggedView(labels, "xyc")
+        labels[10, 20] = 1
+
+        graph = Graph()
+        opLabelCache = OpBlockedArrayCache(graph=graph)
+        opLabelCache.BlockShape.setValue((10, 10, 1))
+        opLabelCache.Input.setValue(labels)
+
+        opFeatureMatrixCache = OpFeatureMatrixCache(graph=graph)
+        opFeatureMatrixCache.LabelImage.connect(opLabelCache.Output)
+        opFeatureMatrixCache.FeatureImage.setValue(features)
+        opFeatureMatrixCache.FeatureChannelKeys.setValue(["x", "y"])
+
+        opFeatureMatrixCache.LabelImage.setDirty(numpy.s_[10:11, 20:21])
+        assert opFeatureMatrixCache.LabelAndFeatureMatrix.value.tolist() == [[1, 10.5, 20.5]]
+
+        # Channels that only moved are not dirty, but the matrix must follow them
+        features[...] = features[..., ::-1]
+        opFeatureMatrixCache.FeatureChannelKeys.setValue(["y", "x"])
+        assert opFeatureMatrixCache.LabelAndFeatureMatrix.value.tolist() == [[1, 20.5, 10.5]]
+
+    def testOutputIsTheTrainingMatrix(self):
+        features = numpy.indices((100, 100)).astype(numpy.float32) + 0.5
+        features = numpy.rollaxis(features, 0, 3)
+        features[..., 1] *= 1e6
+        features = vigra.taggedView(features, "xyc")
+
+        labels = numpy.zeros((100, 100, 1), dtype=numpy.uint8)
+        labels = vigra.taggedView(labels, "xyc")
+        labels[10, 10] = 1
+        labels[20, 20] = 2
+
+        graph = Graph()
+        opLabelCache = OpBlockedArrayCache(graph=graph)
+        opLabelCache.BlockShape.setValue((10, 10, 1))
+        opLabelCache.Input.setValue(labels)
+
+        opFeatureMatrixCache = OpFeatureMatrixCache(graph=graph)
+        opFeatureMatrixCache.LabelImage.connect(opLabelCache.Output)
+        opFeatureMatrixCache.FeatureImage.setValue(features)
+
+        opFeatureMatrixCache.LabelImage.setDirty(numpy.s_[10:11, 10:11])
+        opFeatureMatrixCache.LabelImage.setDirty(numpy.s_[20:21, 20:21])
+
+        labels_and_features = opFeatureMatrixCache.LabelAndFeatureMatrix.value
+        assert labels_and_features.dtype == numpy.float32
+        assert numpy.isfinite(labels_and_features).all()
+        for feature_vec in [[10.5, 10.5e6], [20.5, 20.5e6]]:
+            assert feature_vec in labels_and_features[:, 1:]
+
+        # The output is the training matrix itself (not a converted copy), so it can be updated incrementally
+        generation = labels_and_features.generation
+        labels[30, 30] = 1
+        opFeatureMatrixCache.LabelImage.setDirty(numpy.s_[30:31, 30:31])
+        labels_and_features = opFeatureMatrixCache.LabelAndFeatureMatrix.value
+        added, removed = labels_and_features.changes_since(generation)
+        assert not removed
+        assert labels_and_features[added].tolist() == [[1, 30.5, 30.5e6]]
@@ -3,6 +3,7 @@ import vigra
 
 from lazyflow.graph import Graph
 from lazyflow.operators import OpPixelFeaturesPresmoothed
+from lazyflow.operators.filterOperators import WITH_FAST_FILTERS
 
 DEBUG = False
 
@@ -75,3 +76,115 @@ class TestOpPixelFeaturesPresmoothed(object):
 
         assert computed_whole.shape == computed_per_slice.shape
         assert numpy.allclose(computed_whole, computed_per_slice), abs(computed_whole - computed_per_slice).max()
+
+    def test_selection_change_dirties_only_new_channels(self):
+        op = OpPixelFeaturesPresmoothed(graph=Graph())
+        op.Scales.setValue([0.7, 1.6])
+        op.FeatureIds.setValue(["GaussianSmoothing", "LaplacianOfGaussian"])
+        op.SelectionMatrix.setValue(numpy.array([[True, False], [True, False]]))
+        op.ComputeIn2d.setValue([False, False])
+        op.Input.setValue(self.data)
+        old_keys = op.ChannelKeys.value
+
+        dirty = []
+        op.Output.notifyDirty(lambda slot, roi: dirty.append((roi.start[1], roi.stop[1])))
+        op.SelectionMatrix.setValue(numpy.array([[True, True], [True, False]]))
+
+        # Gaussian smoothing at the new scale (3 input channels) is inserted between the old features
+        new_keys = op.ChannelKeys.value
+        assert dirty == [(3, 6)]
+        assert new_keys[:3] == old_keys[:3]
+        assert new_keys[6:] == old_keys[3:]
+        assert not set(new_keys[3:6]) & set(old_keys)
+
+    def test_cascaded_presmoothing_steps(self):
+        op = OpPixelFeaturesPresmoothed(graph=Graph())
+        op.scales = [0.3, 0.7, 1.0, 1.6, 3.5, 5.0, 10.0]
+        op.ComputeIn2d.setValue([False] * 7)
+        steps = op._presmoothingSteps(list(range(7)), cascaded=True)
+
+        # Small scales are smoothed directly, larger ones from the next smaller one
+        assert [(j, base) for j, base, _ in steps] == [
+            (0, None),
+            (1, None),
+            (2, None),
+            (3, None),
+            (4, 3),
+            (5, 4),
+            (6, 5),
+        ]
+        for j, base, sigma in steps:
+            if base is not None:
+                assert numpy.isclose(sigma ** 2 + op._presmoothingSigma(base) ** 2, op._presmoothingSigma(j) ** 2)
+
+        assert all(base is None for _, base, _ in op._presmoothingSteps(list(range(7)), cascaded=False))
+
+    def test_cascaded_presmoothing_accuracy(self):
+        data = (numpy.random.rand(1, 2, 40, 41, 42) * 255).astype(numpy.float32).view(vigra.VigraArray)
+        data.axistags = vigra.defaultAxistags("tczyx")
+        feature_ids = [
+            "GaussianSmoothing",
+            "LaplacianOfGaussian",
+            "StructureTensorEigenvalues",
+            "HessianOfGaussianEigenvalues",
+            "GaussianGradientMagnitude",
+            "DifferenceOfGaussians",
+        ]
+        scales = [0.7, 1.0, 1.6, 3.5, 5.0]
+
+        def compute(cascaded, compute_in_2d):
+            op = OpPixelFeaturesPresmoothed(graph=Graph())
+            op.Scales.setValue(scales)
+            op.FeatureIds.setValue(feature_ids)
+            op.SelectionMatrix.setValue(numpy.ones((len(feature_ids), len(scales)), dtype=bool))
+            op.ComputeIn2d.setValue([compute_in_2d] * len(scales))
+            op.CascadedPresmoothing.setValue(cascaded)
+            op.Input.setValue(data)
+            # Blockwise, so that the halos are exercised, too
+            return (
+                numpy.concatenate([op.Output[:, :, z : z + 20].wait() for z in range(0, data.shape[2], 20)], axis=2),
+                op.Output.meta.channel_names,
+            )
+
+        for compute_in_2d in (False, True):
+            direct, channel_names = compute(False, compute_in_2d)
+            cascaded, _ = compute(True, compute_in_2d)
+            for c, name in enumerate(channel_names):
+                error = numpy.abs(cascaded[:, c] - direct[:, c]).max()
+                value_range = numpy.ptp(direct[:, c])
+                assert error <= 1e-2 * value_range, f"{name}: max. error {error} (range {value_range})"
+
+    def test_fused_derivatives(self):
+        data = (numpy.random.rand(2, 2, 20, 21, 22) * 255).astype(numpy.float32).view(vigra.VigraArray)
+        data.axistags = vigra.defaultAxistags("tczyx")
+        feature_ids = [
+            "GaussianSmoothing",
+            "LaplacianOfGaussian",
+            "StructureTensorEigenvalues",
+            "HessianOfGaussianEigenvalues",
+            "GaussianGradientMagnitude",
+            "DifferenceOfGaussians",
+        ]
+        scales = [0.7, 1.6, 3.5]
+        # fastfilters' kernels differ slightly from vigra's, which the fused features are computed with
+        tolerance = 1e-2 if WITH_FAST_FILTERS else 1e-4
+
+        def compute(fused, compute_in_2d, channels):
+            op = OpPixelFeaturesPresmoothed(graph=Graph())
+            op.Scales.setValue(scales)
+            op.FeatureIds.setValue(feature_ids)
+            op.SelectionMatrix.setValue(numpy.ones((len(feature_ids), len(scales)), dtype=bool))
+            op.ComputeIn2d.setValue([compute_in_2d] * len(scales))
+            op.FusedDerivatives.setValue(fused)
+            op.Input.setValue(data)
+            return op.Output[:, channels, 3:17].wait(), op.Output.meta.channel_names[channels]
+
+        for compute_in_2d in (False, True):
+            # All channels, and a range that starts and ends in the middle of features
+            for channels in (slice(None), slice(5, 40)):
+                separate, channel_names = compute(False, compute_in_2d, channels)
+                fused, _ = compute(True, compute_in_2d, channels)
+                for c, name in enumerate(channel_names):
+                    error = numpy.abs(fused[:, c] - separate[:, c]).max()
+                    value_range = numpy.ptp(separate[:, c])
+                    assert error <= tolerance * value_range, f"{name}: max. error {error} (range {value_range})"
@@ -43,3 +43,56 @@ class TestOpTrainClassifierFromFeatureVectors(object):
         assert isinstance(
             trained_classifier, ParallelVigraRfLazyflowClassifier
         ), "classifier is of the wrong type: {}".format(type(trained_classifier))
+
+    def testIncrementalTraining(self):
+        features = numpy.indices((100, 100)).astype(numpy.float32) + 0.5
+        features = numpy.rollaxis(features, 0, 3)
+        features = vigra.taggedView(features, "xyc")
+        labels = numpy.zeros((100, 100, 1), dtype=numpy.uint8)
+        labels = vigra.taggedView(labels, "xyc")
+        labels[10, 10] = 1
+        labels[20, 20] = 2
+
+        graph = Graph()
+        opFeatureMatrixCache = OpFeatureMatrixCache(graph=graph)
+        opFeatureMatrixCache.FeatureImage.setValue(features)
+        # Small blocks, so that new labels end up in a new block
+        opFeatureMatrixCache.LabelImage.setValue(labels, extra_meta={"ideal_blockshape": (25, 25, 1)})
+        opFeatureMatrixCache.LabelImage.setDirty(numpy.s_[:, :])
+
+        factory = RecordingFactory(10)
+        opTrain = OpTrainClassifierFromFeatureVectors(graph=graph)
+        opTrain.ClassifierFactory.setValue(factory)
+        opTrain.MaxLabel.setValue(2)
+        opTrain.LabelAndFeatureMatrix.connect(opFeatureMatrixCache.LabelAndFeatureMatrix)
+
+        first_classifier = opTrain.Classifier.value
+        assert factory.calls[-1] == (2, None)
+
+        # The factory gets the previous classifier, and can tell which rows were added since
+        labels[50, 50] = 1
+        opFeatureMatrixCache.LabelImage.setDirty(numpy.s_[50:51, 50:51])
+        opTrain.Classifier.value
+        assert factory.calls[-1] == (3, first_classifier)
+        added_rows, removed = factory.changes
+        assert not removed
+        assert len(added_rows) == 1
+
+
+class RecordingFactory(ParallelVigraRfLazyflowClassifierFactory):
+    VERSION = 1
+
+    def __init__(self, *args, **kwargs):
+        super(RecordingFactory, self).__init__(*args, **kwargs)
+        self.calls = []
+        self.changes = None
+
+    def train_incrementally(
+        self, labels_and_features, previous_classifier=None, previous_generation=None, feature_names=None
+    ):
+        self.calls.append((len(labels_and_features), previous_classifier))
+        if previous_classifier is not None:
+            self.changes = labels_and_features.changes_since(previous_generation)
+        return super(RecordingFactory, self).train_incrementally(
+            labels_and_features, previous_classifier, previous_generation, feature_names
+        )
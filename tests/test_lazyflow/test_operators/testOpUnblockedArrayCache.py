@@ -1,10 +1,13 @@
 from builtins import range
 from builtins import object
+import threading
+
 import numpy as np
+import pytest
 import vigra
 
-from lazyflow.request import RequestPool
-from lazyflow.graph import Graph
+from lazyflow.request import Request, RequestPool
+from lazyflow.graph import Graph, Operator, InputSlot, OutputSlot
 from lazyflow.roi import roiToSlice
 from lazyflow.operators.opUnblockedArrayCache import OpUnblockedArrayCache
 from lazyflow.utility.testing import OpArrayPiperWithAccessCount
@@ -168,3 +171,192 @@ class TestOpUnblockedArrayCacheCache(object):
         cache_data = opCache.Output(*inner_roi).wait()
         assert (cache_data == data[roiToSlice(*inner_roi)]).all()
         assert opDataProvider.accessCount == 0
+
+
+class OpSelectChannels(Operator):
+    """
+    Provides a selection of the Input channels, identified by ChannelKeys.
+    Like OpPixelFeaturesPresmoothed, only newly selected channels become dirty when the selection changes.
+    """
+
+    Input = InputSlot()
+    Channels = InputSlot()
+    Output = OutputSlot()
+    ChannelKeys = OutputSlot()
+
+    _previous = None
+
+    def setupOutputs(self):
+        self.Output.meta.assignFrom(self.Input.meta)
+        self.Output.meta.shape = self.Input.meta.shape[:-1] + (len(self.Channels.value),)
+        self.ChannelKeys.meta.shape = (1,)
+        self.ChannelKeys.meta.dtype = object
+        self.ChannelKeys.setValue(list(self.Channels.value))
+        self._new = [i for i, c in enumerate(self.Channels.value) if self._previous and c not in self._previous]
+        self._previous = list(self.Channels.value)
+
+    def execute(self, slot, subindex, roi, result):
+        channels = self.Channels.value[roi.start[-1] : roi.stop[-1]]
+        for i, c in enumerate(channels):
+            start, stop = list(roi.start), list(roi.stop)
+            start[-1], stop[-1] = c, c + 1
+            result[..., i : i + 1] = self.Input(start, stop).wait()
+
+    def propagateDirty(self, slot, subindex, roi):
+        if slot is self.Channels:
+            for c in self._new:
+                self.Output.setDirty((slice(None), slice(None), slice(c, c + 1)))
+        else:
+            self.Output.setDirty(slice(None))
+
+
+class TestChannelRemapping(object):
+    def setup_method(self, method):
+        graph = Graph()
+        self.data = vigra.taggedView(np.random.random((20, 20, 6)).astype(np.float32), "yxc")
+        self.opProvider = OpArrayPiperWithAccessCount(graph=graph)
+        self.opProvider.Input.setValue(self.data)
+        self.opSelect = OpSelectChannels(graph=graph)
+        self.opSelect.Input.connect(self.opProvider.Output)
+        self.opSelect.Channels.setValue([0, 1, 2])
+        self.opCache = OpUnblockedArrayCache(graph=graph)
+        self.opCache.Input.connect(self.opSelect.Output)
+        self.opCache.ChannelKeys.connect(self.opSelect.ChannelKeys)
+
+    def fetched_channels(self):
+        channels = sorted(c for r in self.opProvider.requests for c in range(r.start[-1], r.stop[-1]))
+        self.opProvider.clear()
+        return channels
+
+    def test_only_new_channels_are_fetched(self):
+        np.testing.assert_array_equal(self.opCache.Output[:].wait(), self.data[..., [0, 1, 2]])
+        assert self.fetched_channels() == [0, 1, 2]
+
+        self.opSelect.Channels.setValue([0, 2, 4])
+        np.testing.assert_array_equal(self.opCache.Output[:].wait(), self.data[..., [0, 2, 4]])
+        assert self.fetched_channels() == [4]
+
+        # Removing channels does not fetch anything
+        self.opSelect.Channels.setValue([4, 0])
+        np.testing.assert_array_equal(self.opCache.Output[:].wait(), self.data[..., [4, 0]])
+        assert self.fetched_channels() == []
+
+    def test_channels_survive_unready_input(self):
+        self.opCache.Output[:].wait()
+        self.opProvider.clear()
+
+        # Like the feature selection GUI, which disconnects the selection while changing it
+        self.opSelect.Channels.disconnect()
+        assert not self.opCache.Output.ready()
+        self.opSelect.Channels.setValue([1, 5])
+        np.testing.assert_array_equal(self.opCache.Output[:].wait(), self.data[..., [1, 5]])
+        assert self.fetched_channels() == [5]
+
+    def test_dirty_channels_are_fetched_again(self):
+        self.opCache.Output[:].wait()
+        self.opProvider.clear()
+
+        self.opCache.Input.setDirty((slice(None), slice(None), slice(1, 2)))
+        assert self.opCache.CleanBlocks.value == []
+        np.testing.assert_array_equal(self.opCache.Output[:].wait(), self.data[..., [0, 1, 2]])
+        assert self.fetched_channels() == [1]
+
+        # Dirtiness of all channels discards the block
+        self.opProvider.Input.setDirty(slice(None))
+        self.opCache.Output[:].wait()
+        assert self.fetched_channels() == [0, 1, 2]
+
+    def test_channel_keys_are_not_taken_from_meta(self):
+        # e.g. the meta of predictions, copied from the meta of the features they were computed from
+        graph = Graph()
+        self.opProvider = OpArrayPiperWithAccessCount(graph=graph)
+        self.opProvider.Input.setValue(self.data, extra_meta={"channel_keys": list("abcdef")})
+        opCache = OpUnblockedArrayCache(graph=graph)
+        opCache.Input.connect(self.opProvider.Output)
+        opCache.Output[:].wait()
+        self.opProvider.clear()
+
+        opCache.Input.setDirty((slice(None), slice(None), slice(1, 2)))
+        np.testing.assert_array_equal(opCache.Output[:].wait(), self.data)
+        assert self.fetched_channels() == list(range(6))
+
+
+def test_reduced_precision_storage():
+    graph = Graph()
+    opProvider = OpArrayPiperWithAccessCount(graph=graph)
+    data = vigra.taggedView(np.random.random((50, 40, 3)).astype(np.float32), "yxc")
+    opProvider.Input.setValue(data)
+    opCache = OpUnblockedArrayCache(graph=graph)
+    opCache.StorageDtype.setValue(np.float16)
+    opCache.Input.connect(opProvider.Output)
+
+    cached = opCache.Output[:].wait()
+    assert cached.dtype == np.float32
+    assert opCache.usedMemory() == data.size * 2
+    assert opCache.savedMemory() == data.size * 2
+
+    # Values are read back from the float16 copy
+    cached = opCache.Output[10:20].wait()
+    assert opProvider.accessCount == 1
+    assert cached.dtype == np.float32
+    np.testing.assert_allclose(cached, data[10:20], rtol=2**-11)
+
+
+def test_reduced_precision_storage_out_of_range():
+    graph = Graph()
+    opProvider = OpArrayPiperWithAccessCount(graph=graph)
+    data = np.random.random((50, 40, 3)).astype(np.float32)
+    data[..., 1] *= 1e6  # Beyond the range of float16
+    data = vigra.taggedView(data, "yxc")
+    opProvider.Input.setValue(data)
+    opCache = OpUnblockedArrayCache(graph=graph)
+    opCache.StorageDtype.setValue(np.float16)
+    opCache.Input.connect(opProvider.Output)
+
+    opCache.Output[:].wait()
+    assert opCache.savedMemory() == 0
+
+    cached = opCache.Output[10:20].wait()
+    assert opProvider.accessCount == 1
+    assert np.isfinite(cached).all()
+    np.testing.assert_array_equal(cached, data[10:20])
+
+
+class OpPausablePiper(OpArrayPiperWithAccessCount):
+    """
+    Pauses after reading the data of its first request, until released
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(OpPausablePiper, self).__init__(*args, **kwargs)
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def execute(self, slot, subindex, roi, result):
+        super(OpPausablePiper, self).execute(slot, subindex, roi, result)
+        if not self.started.is_set():
+            self.started.set()
+            self.release.wait(5)
+
+
+def test_dirty_during_coalesced_fetch():
+    if Request.global_thread_pool.num_workers < 2:
+        pytest.skip("Needs a worker for each request")
+    graph = Graph()
+    opProvider = OpPausablePiper(graph=graph)
+    opProvider.Input.setValue(vigra.taggedView(np.zeros((100, 100), dtype=np.uint8), "yx"))
+    opCache = OpUnblockedArrayCache(graph=graph)
+    opCache._coalescer.max_merged_bytes = 10 ** 6
+    opCache.Input.connect(opProvider.Output)
+
+    thread = threading.Thread(target=lambda: opCache.Output[0:50].wait())
+    thread.start()
+    try:
+        assert opProvider.started.wait(5)
+        # The data changes while the (outdated) upstream request for [0:50] is still running
+        opProvider.Input.setValue(vigra.taggedView(np.ones((100, 100), dtype=np.uint8), "yx"))
+        assert (opCache.Output[10:20].wait() == 1).all()
+    finally:
+        opProvider.release.set()
+        thread.join()
+    assert opCache.getCoalescingStats()["contained"] == 0
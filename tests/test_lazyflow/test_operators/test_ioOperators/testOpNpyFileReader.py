@@ -91,3 +91,23 @@ class TestOpNpyFileReader(object):
                 numpy.testing.assert_almost_equal(b, self.testDataB)
         finally:
             npyReader.cleanUp()
+
+    def test_MemmapViews(self):
+        npyReader = OpNpyFileReader(graph=self.graph)
+        try:
+            npyReader.MemmapViews.setValue(True)
+            npyReader.FileName.setValue(self.testDataFilePath)
+            # C order: whole rows
+            assert npyReader.Output.meta.ideal_blockshape == (10, 11)
+
+            a = npyReader.Output[2:5, 3:9].wait()
+            numpy.testing.assert_array_equal(a, self.testData[2:5, 3:9])
+            assert not a.flags.writeable
+            assert not a.flags.owndata
+
+            # Given destinations are filled as usual
+            destination = numpy.zeros((3, 6))
+            npyReader.Output[2:5, 3:9].writeInto(destination).wait()
+            numpy.testing.assert_array_equal(destination, self.testData[2:5, 3:9])
+        finally:
+            npyReader.cleanUp()
@@ -0,0 +1,121 @@
+import http.server
+import json
+import re
+import threading
+import time
+
+import numpy
+import pytest
+import requests
+
+from lazyflow.graph import Graph
+from lazyflow.operators.ioOperators.opRESTfulPrecomputedChunkedVolumeReader import (
+    OpRESTfulPrecomputedChunkedVolumeReaderNoCache,
+)
+from lazyflow.utility.io_util.RESTfulPrecomputedChunkedVolume import RESTfulPrecomputedChunkedVolume
+
+# czyx
+VOLUME = numpy.random.RandomState(0).randint(0, 60000, size=(1, 10, 20, 30)).astype(numpy.uint16)
+INFO = {
+    "type": "image",
+    "data_type": "uint16",
+    "num_channels": 1,
+    "scales": [
+        {
+            "key": "1_1_1",
+            "resolution": [1, 1, 1],
+            "chunk_sizes": [[16, 8, 4]],
+            "size": [30, 20, 10],
+            "voxel_offset": [0, 0, 0],
+            "encoding": "raw",
+        }
+    ],
+}
+BLOCK_URL = re.compile(r"/volume/1_1_1/(\d+)-(\d+)_(\d+)-(\d+)_(\d+)-(\d+)$")
+
+
+class PrecomputedHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+            server.requests.append(self.path)
+            fail = server.failures > 0
+            server.failures -= fail
+        try:
+            time.sleep(0.01)
+            match = BLOCK_URL.match(self.path)
+            if fail:
+                self._respond(503, b"")
+            elif self.path == "/volume/info":
+                self._respond(200, json.dumps(INFO).encode())
+            elif match:
+                x0, x1, y0, y1, z0, z1 = map(int, match.groups())
+                self._respond(200, VOLUME[:, z0:z1, y0:y1, x0:x1].tobytes())
+            else:
+                self._respond(404, b"")
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def _respond(self, status, content):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), PrecomputedHandler)
+    server.lock = threading.Lock()
+    server.in_flight = 0
+    server.max_in_flight = 0
+    server.requests = []
+    server.failures = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.url = "http://127.0.0.1:{}/volume".format(server.server_address[1])
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_read(server):
+    op = OpRESTfulPrecomputedChunkedVolumeReaderNoCache(graph=Graph())
+    op.ConcurrentDownloads.setValue(3)
+    op.BaseUrl.setValue(server.url)
+    assert op.Output.meta.shape == VOLUME.shape
+    assert op.Output.meta.dtype == numpy.uint16
+
+    del server.requests[:]
+    data = op.Output[:, 1:9, 3:17, 5:29].wait()
+    numpy.testing.assert_array_equal(data, VOLUME[:, 1:9, 3:17, 5:29])
+    # 3 x 3 x 2 blocks, no more than 3 at a time
+    assert len(server.requests) == 18
+    assert 1 < server.max_in_flight <= 3
+
+
+def test_retry(server):
+    volume = RESTfulPrecomputedChunkedVolume(server.url, max_retries=2, backoff_factor=0)
+    server.failures = 2
+    block = volume.download_block(numpy.array([0, 4, 8, 16]))
+    numpy.testing.assert_array_equal(block, VOLUME[:, 4:8, 8:16, 16:30])
+
+    server.failures = 3
+    with pytest.raises(requests.exceptions.HTTPError):
+        volume.download_block(numpy.array([0, 4, 8, 16]))
+
+
+def test_missing_block(server):
+    volume = RESTfulPrecomputedChunkedVolume(server.url)
+    volume.volume_url = server.url + "/missing"
+    block = volume.download_block(numpy.array([0, 8, 16, 16]))
+    assert block.shape == (1, 2, 4, 14)
+    assert not block.any()
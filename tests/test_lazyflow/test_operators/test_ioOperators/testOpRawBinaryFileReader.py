@@ -60,3 +60,17 @@ class TestOpRawBinaryFileReader(object):
 
         finally:
             op.cleanUp()
+
+    def test_MemmapViews(self):
+        op = OpRawBinaryFileReader(graph=Graph())
+        try:
+            op.MemmapViews.setValue(True)
+            op.FilePath.setValue(self.testDataFilePath)
+            # C order: whole planes
+            assert op.Output.meta.ideal_blockshape[1:] == (11, 12)
+
+            a = op.Output[2:5, 3:9, 1:7].wait()
+            assert (a == self.testData[2:5, 3:9, 1:7]).all()
+            assert not a.flags.writeable
+        finally:
+            op.cleanUp()
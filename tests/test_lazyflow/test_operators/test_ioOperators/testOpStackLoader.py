@@ -27,6 +27,7 @@ import shutil
 import tempfile
 
 import numpy
+import pytest
 import vigra
 
 from lazyflow.graph import Graph
@@ -218,3 +219,49 @@ class TestOpStackLoader(object):
         assert stack.shape == expected.shape
 
         assert (stack == expected).all(), "stacked 2d images did not match expected data."
+
+    def test_subregion_stack_c(self):
+        # Channel ranges that do not start at a file boundary
+        expected_volume, globstring = self._prepare_data(
+            "rand_3dc_stack_c_roi", (5, 6, 33, 44, 2), "tzyxc", "t", stack_existing_channels=True
+        )
+
+        op = OpStackLoader(graph=Graph())
+        op.SequenceAxis.setValue("c")
+        op.ConcurrentReads.setValue(3)
+        op.globstring.setValue(globstring)
+
+        volume_from_stack = op.stack[3:8, 2:5, 5:20, 10:30].wait()
+        assert (volume_from_stack == expected_volume[3:8, 2:5, 5:20, 10:30]).all()
+
+    def test_subregion_tzyxc(self):
+        expected_volume_tzyxc, globstring = self._prepare_data("rand_4dc_roi", (4, 6, 30, 40, 3), "tzyxc", "t")
+
+        op = OpStackLoader(graph=Graph())
+        op.globstring.setValue(globstring)
+
+        vol_from_stack = op.stack[1:3, 2:5, 7:19, 3:37, 1:3].wait()
+        assert (vol_from_stack == expected_volume_tzyxc[1:3, 2:5, 7:19, 3:37, 1:3]).all()
+
+    def test_compressed_tiffs(self):
+        # Uncompressed tiffs are memory-mapped, compressed ones are read with vigra
+        data = (numpy.random.random((4, 20, 30)) * 256).astype(numpy.uint8)
+        for compression in ("NONE", "LZW"):
+            for z in range(data.shape[0]):
+                file_name = os.path.join(self._tmp_dir, "stack_{}_{:03}.tiff".format(compression, z))
+                vigra.impex.writeImage(vigra.taggedView(data[z], "yx"), file_name, compression=compression)
+
+            op = OpStackLoader(graph=Graph())
+            op.globstring.setValue(os.path.join(self._tmp_dir, "stack_{}_*.tiff".format(compression)))
+            assert op.stack.meta.shape == (4, 20, 30, 1)
+
+            volume_from_stack = op.stack[1:4, 5:15, 2:29, :].wait()
+            assert (volume_from_stack[..., 0] == data[1:4, 5:15, 2:29]).all()
+
+    def test_inconsistent_shapes(self):
+        vigra.impex.writeImage(numpy.zeros((10, 20), dtype=numpy.uint8), os.path.join(self._tmp_dir, "img_0.tiff"))
+        vigra.impex.writeImage(numpy.zeros((10, 21), dtype=numpy.uint8), os.path.join(self._tmp_dir, "img_1.tiff"))
+
+        op = OpStackLoader(graph=Graph())
+        with pytest.raises(RuntimeError):
+            op.globstring.setValue(os.path.join(self._tmp_dir, "img_*.tiff"))
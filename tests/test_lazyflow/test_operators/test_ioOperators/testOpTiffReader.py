@@ -94,3 +94,21 @@ class TestOpTiffReader:
         assert op.Output.ready()
         assert op.Output.meta.shape == data.shape
         assert_array_equal(data, op.Output[:].wait())
+
+    @pytest.mark.parametrize("compression", [0, "zlib"])
+    def test_tiled(self, compression, tmp_path):
+        import tifffile
+
+        data = numpy.random.randint(0, 256, (3, 300, 500), dtype="uint8")
+        tiff_path = str(tmp_path / "tiled.tiff")
+        tifffile.imsave(tiff_path, data, tile=(64, 128), compress=compression, metadata={"axes": "ZYX"})
+
+        op = OpTiffReader(graph=Graph())
+        op.Filepath.setValue(tiff_path)
+        assert op.Output.meta.shape == data.shape
+        assert op.Output.meta.ideal_blockshape == (1, 64, 128)
+
+        # Within a single tile, across tiles, and at the border of the image
+        assert_array_equal(op.Output[1:2, 10:50, 10:100].wait(), data[1:2, 10:50, 10:100])
+        assert_array_equal(op.Output[0:3, 50:200, 100:400].wait(), data[0:3, 50:200, 100:400])
+        assert_array_equal(op.Output[2:3, 250:300, 400:500].wait(), data[2:3, 250:300, 400:500])
@@ -119,3 +119,51 @@ def test_exception_in_task_logged(caplog, pool):
     record = caplog.records[0]
 
     assert issubclass(record.exc_info[0], MyExc)
+
+
+def test_get_stats_reports_every_worker(pool: ThreadPool):
+    done = threading.Event()
+    pool.wake_up(Task(done.set))
+    assert done.wait(timeout=1)
+
+    stats = pool.get_stats()
+    assert len(stats) == NUM_WORKERS
+    assert sum(s["executed"] for s in stats) == 1
+    assert all(s["steals"] == 0 for s in stats)
+    assert all(s["queue_depth"] == 0 for s in stats)
+
+
+def test_work_stealing_runs_local_tasks_on_idle_peers():
+    pool = ThreadPool(NUM_WORKERS, work_stealing=True)
+    num_children = 3 * NUM_WORKERS
+    children_done = threading.Barrier(NUM_WORKERS - 1, timeout=2)
+    finished = []
+    parent_thread = None
+
+    def child():
+        finished.append(threading.current_thread())
+        if len(finished) <= NUM_WORKERS - 1:
+            # Keep the first wave busy simultaneously, so the children must have been spread over all idle peers.
+            children_done.wait()
+
+    def parent():
+        nonlocal parent_thread
+        parent_thread = threading.current_thread()
+        for _ in range(num_children):
+            pool.wake_up(Task(child))
+        # The parent keeps its worker busy, so its local tasks can only run if peers steal them.
+        while len(finished) < num_children:
+            time.sleep(0.01)
+
+    pool.wake_up(Task(parent))
+    deadline = time.time() + 5
+    while len(finished) < num_children and time.time() < deadline:
+        time.sleep(0.01)
+
+    try:
+        assert len(finished) == num_children
+        assert parent_thread not in finished
+        stats = pool.get_stats()
+        assert sum(s["steals"] for s in stats) == num_children
+    finally:
+        pool.stop()
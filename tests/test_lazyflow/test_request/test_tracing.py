@@ -0,0 +1,115 @@
+import json
+import time
+
+import pytest
+
+from lazyflow.request.request import Request
+from lazyflow.request.tracing import RequestTracer, request_name
+
+
+def leaf():
+    return 1
+
+
+def parent_with_direct_child():
+    return Request(leaf).wait() + 1
+
+
+def run_in_worker(fn):
+    req = Request(fn)
+    req.submit()
+    return req.wait()
+
+
+@pytest.fixture
+def tracer():
+    with RequestTracer() as t:
+        yield t
+
+
+def _kinds(tracer, name):
+    return [[kind for kind, _, _ in record.events] for record in tracer._snapshot() if record.name == name]
+
+
+def test_uninstalled_after_context():
+    with RequestTracer() as t:
+        assert Request._tracer is t
+    assert Request._tracer is None
+
+
+def test_records_submit_start_finish(tracer):
+    req = Request(leaf)
+    req.submit()
+    req.wait()
+
+    assert _kinds(tracer, "leaf") == [["submit", "start", "finish"]]
+
+
+def test_records_suspend_and_resume(tracer):
+    def slow_child():
+        time.sleep(0.1)
+
+    def waiting_parent():
+        req = Request(slow_child)
+        req.submit()
+        # The child is either still queued or running on another worker, so the parent must suspend.
+        req.wait()
+
+    run_in_worker(waiting_parent)
+
+    (events,) = _kinds(tracer, "test_records_suspend_and_resume.<locals>.waiting_parent")
+    assert events[:2] == ["submit", "start"]
+    assert events[-1] == "finish"
+    assert events.count("suspend") == events.count("resume") >= 1
+
+
+def test_records_cancel(tracer):
+    req = Request(leaf)
+    req.cancel()
+    assert _kinds(tracer, "leaf") == [["cancel"]]
+
+
+def test_child_records_parent(tracer):
+    run_in_worker(parent_with_direct_child)
+
+    records = {r.name: r for r in tracer._snapshot()}
+    assert records["leaf"].parent_id == records["parent_with_direct_child"].id
+    assert records["parent_with_direct_child"].parent_id is None
+
+
+def test_collapsed_stacks_nest_child_under_parent(tracer):
+    run_in_worker(parent_with_direct_child)
+
+    stacks = tracer.collapsed_stacks()
+    assert set(stacks) == {"parent_with_direct_child", "parent_with_direct_child;leaf"}
+    assert all(microseconds >= 0 for microseconds in stacks.values())
+
+
+def test_chrome_trace_is_valid_json(tracer, tmp_path):
+    run_in_worker(parent_with_direct_child)
+
+    path = tmp_path / "trace.json"
+    tracer.dump_chrome_trace(str(path))
+    with open(path) as f:
+        trace = json.load(f)
+
+    phases = [e["ph"] for e in trace["traceEvents"] if e.get("name") == "leaf"]
+    assert sorted(phases) == ["X", "b", "e"]
+
+
+def test_request_name_uses_operator_and_slot_for_slot_requests():
+    class FakeOperator:
+        name = "OpFake"
+
+    class FakeSlot:
+        name = "Output"
+        operator = FakeOperator()
+
+    class FakeExecutionWrapper:
+        slot = FakeSlot()
+
+        def __call__(self):
+            pass
+
+    assert request_name(FakeExecutionWrapper()) == "OpFake.Output"
+    assert request_name(Request._PartialWithAppendedArgs(leaf, destination=None)) == "leaf"
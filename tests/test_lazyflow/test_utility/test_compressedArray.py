@@ -0,0 +1,93 @@
+import threading
+
+import numpy
+import pytest
+from numpy.testing import assert_array_equal
+
+from lazyflow.utility.compressedArray import CompressedArray, available_codecs
+
+
+@pytest.fixture(params=available_codecs())
+def codec(request):
+    return request.param
+
+
+@pytest.fixture
+def data():
+    return numpy.random.randint(0, 5, size=(30, 20, 7)).astype(numpy.float32)
+
+
+def test_roundtrip(codec, data):
+    a = CompressedArray(data.shape, data.dtype, chunkshape=(8, 8, 8), codec=codec)
+    a[...] = data
+    assert_array_equal(a[...], data)
+    assert_array_equal(a[3:17, 5:6, :], data[3:17, 5:6, :])
+
+
+def test_partial_writes_merge_with_chunk_contents(codec, data):
+    a = CompressedArray(data.shape, data.dtype, chunkshape=(8, 8, 8), codec=codec)
+    a[...] = data
+    a[5:11, 2:3] = -1
+    expected = data.copy()
+    expected[5:11, 2:3] = -1
+    assert_array_equal(a[:], expected)
+
+
+def test_unwritten_chunks_are_zero_and_free():
+    a = CompressedArray((10, 10), numpy.uint16, chunkshape=(5, 5), codec="zlib")
+    assert a.nbytes_compressed == 0
+    assert_array_equal(a[:], 0)
+    a[0:5, 0:5] = 7
+    assert 0 < a.nbytes_compressed < a.nbytes
+    assert_array_equal(a[5:, :], 0)
+
+
+def test_nbytes_compressed_is_exact(data):
+    a = CompressedArray(data.shape, data.dtype, chunkshape=(8, 8, 8), codec="zlib")
+    a[...] = data
+    assert a.nbytes_compressed == sum(len(buf) for buf in a._chunks.values())
+    a[...] = 0
+    assert a.nbytes_compressed == sum(len(buf) for buf in a._chunks.values())
+    a.clear()
+    assert a.nbytes_compressed == 0
+
+
+def test_read_direct_into_destination_view(data):
+    a = CompressedArray(data.shape, data.dtype, chunkshape=(10, 10, 7), codec="zlib")
+    a[...] = data
+    out = numpy.zeros((40, 20, 7), dtype=numpy.float32)
+    a.read_direct(out, numpy.s_[0:30, :, :], numpy.s_[5:35, :, :])
+    assert_array_equal(out[5:35], data)
+    assert_array_equal(out[:5], 0)
+
+    # Non-contiguous and differently typed destinations work, too
+    out = numpy.zeros((7, 20, 30), dtype=numpy.float64).transpose()
+    a.read_direct(out)
+    assert_array_equal(out, data)
+
+
+def test_rejects_unsupported_indexing():
+    a = CompressedArray((10,), numpy.uint8, codec="zlib")
+    with pytest.raises(TypeError):
+        a[::2]
+    with pytest.raises(TypeError):
+        a[3]
+
+
+def test_unknown_codec():
+    with pytest.raises(ValueError):
+        CompressedArray((10,), numpy.uint8, codec="no-such-codec")
+
+
+def test_parallel_writes_to_different_chunks(data):
+    a = CompressedArray(data.shape, data.dtype, chunkshape=(10, 20, 7), codec="zlib")
+
+    def write(start):
+        a[start : start + 10] = data[start : start + 10]
+
+    threads = [threading.Thread(target=write, args=(start,)) for start in (0, 10, 20)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert_array_equal(a[...], data)
@@ -0,0 +1,72 @@
+import mmap
+
+import numpy
+import pytest
+
+from lazyflow.utility.io_util.memmapAccess import MemmapAccessAdvisor, contiguous_blockshape
+
+
+@pytest.mark.parametrize(
+    "shape,order,min_bytes,expected",
+    [
+        ((10, 20, 300), "C", 4096, (1, 14, 300)),
+        ((10, 20, 300), "F", 4096, (10, 20, 21)),
+        ((10, 20, 300), "C", 10 ** 6, (10, 20, 300)),
+        ((10, 20, 300), "C", 1, (1, 1, 1)),
+    ],
+)
+def test_contiguous_blockshape(shape, order, min_bytes, expected):
+    assert contiguous_blockshape(numpy.zeros(shape, dtype=numpy.uint8, order=order), min_bytes) == expected
+
+
+def test_contiguous_blockshape_strided():
+    assert contiguous_blockshape(numpy.zeros((10, 20))[:, ::2]) is None
+
+
+class RecordingMmap:
+    def __init__(self, size):
+        self.size = size
+        self.calls = []
+
+    def __len__(self):
+        return self.size
+
+    def madvise(self, option, start, length):
+        assert start % mmap.PAGESIZE == 0
+        self.calls.append((option, start, start + length))
+
+
+@pytest.fixture
+def advisor(tmp_path):
+    numpy.save(str(tmp_path / "data.npy"), numpy.zeros((100, 64, 64), dtype=numpy.uint16))
+    advisor = MemmapAccessAdvisor(numpy.load(str(tmp_path / "data.npy"), mmap_mode="r"))
+    if not advisor.enabled:
+        pytest.skip("madvise is not available")
+    advisor._mmap = RecordingMmap(len(advisor._mmap))
+    return advisor
+
+
+def test_advisor(advisor):
+    header = advisor._array_offset
+    plane = 64 * 64 * 2
+    assert advisor.byteRange((0, 0, 0), (100, 64, 64)) == (header, header + 100 * plane)
+    assert advisor.byteRange((3, 2, 1), (5, 3, 2)) == (
+        header + 3 * plane + 2 * 128 + 2,
+        header + 4 * plane + 2 * 128 + 4,
+    )
+
+    # Slices along the first axis, one after the other
+    for z in range(3):
+        advisor.access((z, 0, 0), (z + 1, 64, 64))
+    option, start, stop = advisor._mmap.calls[0]
+    assert option == mmap.MADV_RANDOM
+    assert advisor._mmap.calls[-2:] == [
+        (mmap.MADV_SEQUENTIAL, (header + 2 * plane) // mmap.PAGESIZE * mmap.PAGESIZE, header + 3 * plane),
+        (mmap.MADV_WILLNEED, (header + 3 * plane) // mmap.PAGESIZE * mmap.PAGESIZE, header + 4 * plane),
+    ]
+
+    # Small tiles: no read-ahead
+    del advisor._mmap.calls[:]
+    advisor.access((50, 0, 0), (60, 8, 8))
+    advisor.access((60, 0, 0), (70, 8, 8))
+    assert [call[0] for call in advisor._mmap.calls] == [mmap.MADV_RANDOM, mmap.MADV_RANDOM]
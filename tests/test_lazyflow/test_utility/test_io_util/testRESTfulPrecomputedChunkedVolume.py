@@ -0,0 +1,101 @@
+import gzip
+import io
+
+import numpy
+import pytest
+
+from lazyflow.utility.io_util.RESTfulPrecomputedChunkedVolume import RESTfulPrecomputedChunkedVolume
+
+
+def encode_compressed_segmentation(data, block_size):
+    """
+    Straightforward encoder of neuroglancer's compressed_segmentation format (czyx data, xyz block size)
+    """
+    block_shape = block_size[::-1]
+    table_words = data.dtype.itemsize // 4
+    grid_shape = [-(-s // b) for s, b in zip(data.shape[1:], block_shape)]
+    channels = []
+    for channel_data in data:
+        headers, body = [], []
+        offset = 2 * numpy.prod(grid_shape)
+        for z, y, x in numpy.ndindex(*grid_shape):
+            block = channel_data[
+                z * block_shape[0] : (z + 1) * block_shape[0],
+                y * block_shape[1] : (y + 1) * block_shape[1],
+                x * block_shape[2] : (x + 1) * block_shape[2],
+            ]
+            table, indices = numpy.unique(block, return_inverse=True)
+            # Pad partial blocks at the border
+            padded = numpy.zeros(block_shape, dtype=numpy.uint32)
+            padded[: block.shape[0], : block.shape[1], : block.shape[2]] = indices.reshape(block.shape)
+            bits = next(b for b in (0, 1, 2, 4, 8, 16, 32) if len(table) <= 2 ** b)
+            words = []
+            if bits:
+                packed = numpy.zeros(-(-padded.size * bits // 32), dtype=numpy.uint32)
+                for i, index in enumerate(padded.reshape(-1)):
+                    packed[i * bits // 32] |= numpy.uint32(index << (i * bits % 32))
+                words.append(packed)
+            values_offset = offset
+            offset += sum(len(w) for w in words)
+            table_offset = offset
+            words.append(table.astype(data.dtype).view(numpy.uint32))
+            offset += len(table) * table_words
+            headers += [table_offset | (bits << 24), values_offset]
+            body += words
+        channels.append(numpy.concatenate([numpy.array(headers, dtype=numpy.uint32)] + body))
+
+    channel_offsets = numpy.cumsum([len(data)] + [len(c) for c in channels[:-1]])
+    return numpy.concatenate([channel_offsets.astype(numpy.uint32)] + channels).astype("<u4").tobytes()
+
+
+@pytest.mark.parametrize("dtype", [numpy.uint32, numpy.uint64])
+def test_compressed_segmentation(dtype):
+    rng = numpy.random.RandomState(0)
+    # A partial chunk at the border of the volume, with blocks of 0 to 16 bits
+    data = numpy.zeros((2, 9, 13, 17), dtype=dtype)
+    data[0, :4] = rng.randint(0, 3, size=(4, 13, 17))
+    data[0, 4:] = rng.randint(0, 2 ** 32 - 1, size=(5, 13, 17)).astype(dtype) * (
+        2 ** 31 if dtype == numpy.uint64 else 1
+    )
+    data[1] = 7
+    data[1, 5:, 2:6, 9:] = rng.randint(100, 120, size=(4, 4, 8))
+    content = encode_compressed_segmentation(data, (16, 16, 4))
+
+    decoded = RESTfulPrecomputedChunkedVolume.decode_content(
+        content, "compressed_segmentation", data.shape, dtype, block_size=(16, 16, 4)
+    )
+    assert decoded.dtype == dtype
+    numpy.testing.assert_array_equal(decoded, data)
+
+
+def test_raw():
+    data = numpy.arange(2 * 3 * 4 * 5, dtype=numpy.uint16).reshape(2, 3, 4, 5)
+    content = data.tobytes()
+    decoded = RESTfulPrecomputedChunkedVolume.decode_content(content, "raw", data.shape, numpy.uint16)
+    numpy.testing.assert_array_equal(decoded, data)
+    # A view of the content, not a copy
+    assert not decoded.flags.owndata
+
+    # Chunks stored as gzip files
+    decoded = RESTfulPrecomputedChunkedVolume.decode_content(gzip.compress(content), "raw", data.shape, numpy.uint16)
+    numpy.testing.assert_array_equal(decoded, data)
+
+
+def test_jpeg():
+    Image = pytest.importorskip("PIL.Image")
+    # Smooth data, which jpeg preserves well
+    z, y, x = numpy.mgrid[:4, :16, :24]
+    data = (100 + 3 * x + 2 * y + 10 * z).astype(numpy.uint8)[None]
+    # Width x, height y * z
+    output = io.BytesIO()
+    Image.fromarray(data.reshape(4 * 16, 24)).save(output, format="jpeg", quality=95)
+
+    decoded = RESTfulPrecomputedChunkedVolume.decode_content(output.getvalue(), "jpeg", data.shape, numpy.uint8)
+    assert decoded.shape == data.shape
+    assert decoded.dtype == numpy.uint8
+    assert numpy.abs(decoded.astype(int) - data).max() <= 4
+
+
+def test_unknown_encoding():
+    with pytest.raises(NotImplementedError):
+        RESTfulPrecomputedChunkedVolume.decode_content(b"", "png", (1, 1, 1, 1), numpy.uint8)
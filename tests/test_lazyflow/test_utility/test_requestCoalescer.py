@@ -0,0 +1,160 @@
+import threading
+import time
+from functools import partial
+
+import numpy
+import pytest
+from numpy.testing import assert_array_equal
+
+from lazyflow.request import Request
+from lazyflow.roi import roiToSlice
+from lazyflow.utility import RequestCoalescer
+
+VOLUME = numpy.arange(100 * 100).reshape(100, 100)
+
+
+def read(start, stop, destination=None):
+    data = VOLUME[roiToSlice(start, stop)]
+    if destination is None:
+        return data.copy()
+    destination[...] = data
+    return destination
+
+
+class Source:
+    def __init__(self):
+        self.fetched = []
+
+    def __call__(self, start, stop):
+        self.fetched.append((start, stop))
+        return Request(partial(read, start, stop))
+
+
+@pytest.fixture
+def busy_pool():
+    """
+    Keep all workers busy, so that submitted requests stay queued until the fixture's event is set.
+    """
+    num_workers = Request.global_thread_pool.num_workers
+    if num_workers == 0:
+        pytest.skip("Requests are executed synchronously")
+    release = threading.Event()
+    blockers = [Request(release.wait) for _ in range(num_workers)]
+    for blocker in blockers:
+        blocker.submit()
+    yield release
+    release.set()
+    for blocker in blockers:
+        blocker.wait()
+
+
+def wait_until(condition):
+    deadline = time.time() + 5
+    while not condition():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def get_concurrently(coalescer, rois, release):
+    """
+    Issue get() for each roi from its own thread, one after another, then let the thread pool run.
+    """
+    results = [None] * len(rois)
+
+    def get(i):
+        results[i] = coalescer.get(rois[i])
+
+    threads = []
+    for i in range(len(rois)):
+        count = coalescer.getStats()["requests"]
+        threads.append(threading.Thread(target=get, args=(i,)))
+        threads[-1].start()
+        wait_until(lambda: coalescer.getStats()["requests"] > count)
+    release.set()
+    for t in threads:
+        t.join()
+    return results
+
+
+def test_disabled_forwards_every_request():
+    source = Source()
+    coalescer = RequestCoalescer(source)
+    out = numpy.zeros((10, 10), dtype=VOLUME.dtype)
+    assert coalescer.get(((0, 0), (10, 10)), out) is out
+    assert_array_equal(out, VOLUME[:10, :10])
+    assert source.fetched == [((0, 0), (10, 10))]
+
+
+def test_overlapping_requests_are_merged(busy_pool):
+    source = Source()
+    coalescer = RequestCoalescer(source, max_merged_bytes=10 ** 6)
+    rois = [((0, 0), (10, 20)), ((0, 10), (10, 30))]
+    results = get_concurrently(coalescer, rois, busy_pool)
+
+    assert source.fetched == [((0, 0), (10, 30))]
+    for roi, result in zip(rois, results):
+        assert_array_equal(result, VOLUME[roiToSlice(*roi)])
+    stats = coalescer.getStats()
+    assert stats["requests"] == 2
+    assert stats["upstream_requests"] == 1
+    assert stats["merged"] == 1
+    assert stats["saved_pixels"] == 100
+
+
+def test_contained_requests_share_the_result(busy_pool):
+    source = Source()
+    coalescer = RequestCoalescer(source, max_merged_bytes=10 ** 6)
+    rois = [((0, 0), (50, 50)), ((10, 10), (20, 20))]
+    results = get_concurrently(coalescer, rois, busy_pool)
+
+    assert source.fetched == [((0, 0), (50, 50))]
+    assert_array_equal(results[1], VOLUME[10:20, 10:20])
+    assert coalescer.getStats()["contained"] == 1
+
+
+def test_merges_respect_the_size_limit(busy_pool):
+    source = Source()
+    coalescer = RequestCoalescer(source, max_merged_bytes=200, bytes_per_pixel=1)
+    rois = [((0, 0), (10, 20)), ((0, 10), (10, 30))]
+    get_concurrently(coalescer, rois, busy_pool)
+    assert sorted(source.fetched) == sorted(rois)
+    assert coalescer.getStats()["merged"] == 0
+
+
+def test_does_not_merge_if_it_would_waste_work(busy_pool):
+    source = Source()
+    coalescer = RequestCoalescer(source, max_merged_bytes=10 ** 6)
+    # The bounding box would be much larger than both rois together
+    rois = [((0, 0), (50, 1)), ((49, 0), (50, 50))]
+    get_concurrently(coalescer, rois, busy_pool)
+    assert len(source.fetched) == 2
+
+
+def test_invalidated_requests_are_not_joined():
+    if Request.global_thread_pool.num_workers < 2:
+        pytest.skip("Needs a worker for each request")
+    started, release = threading.Event(), threading.Event()
+    fetched = []
+
+    def slow_read(start, stop):
+        started.set()
+        release.wait(5)
+        return read(start, stop)
+
+    def fetch(start, stop):
+        fetched.append((start, stop))
+        return Request(partial(slow_read if len(fetched) == 1 else read, start, stop))
+
+    coalescer = RequestCoalescer(fetch, max_merged_bytes=10 ** 6)
+    thread = threading.Thread(target=coalescer.get, args=(((0, 0), (50, 50)),))
+    thread.start()
+    try:
+        assert started.wait(5)
+        # The source data changed while the first request is running
+        coalescer.invalidate(((10, 10), (20, 20)))
+        assert_array_equal(coalescer.get(((10, 10), (20, 20))), VOLUME[10:20, 10:20])
+        assert fetched == [((0, 0), (50, 50)), ((10, 10), (20, 20))]
+        assert coalescer.getStats()["contained"] == 0
+    finally:
+        release.set()
+        thread.join()
@@ -0,0 +1,72 @@
+import random
+
+import pytest
+
+from lazyflow.utility.roiIndex import RoiIndex
+
+
+def random_roi(rng, ndim=3, max_start=90, max_extent=20):
+    start = tuple(rng.randint(0, max_start) for _ in range(ndim))
+    stop = tuple(s + rng.randint(1, max_extent) for s in start)
+    return (start, stop)
+
+
+def brute_force_containing(rois, roi):
+    return sorted(
+        r for r in rois if all(a <= b for a, b in zip(r[0], roi[0])) and all(a >= b for a, b in zip(r[1], roi[1]))
+    )
+
+
+def brute_force_intersecting(rois, roi):
+    return sorted(r for r in rois if all(a0 < b1 and b0 < a1 for a0, a1, b0, b1 in zip(r[0], r[1], roi[0], roi[1])))
+
+
+def test_empty_index():
+    index = RoiIndex()
+    assert len(index) == 0
+    assert index.containing(((0, 0), (1, 1))) == []
+    assert index.intersecting(((0, 0), (1, 1))) == []
+
+
+def test_touching_rois_do_not_intersect():
+    index = RoiIndex()
+    index.add(((0, 0), (10, 10)))
+    assert index.intersecting(((10, 0), (20, 10))) == []
+    assert index.intersecting(((9, 9), (20, 20))) == [((0, 0), (10, 10))]
+
+
+def test_add_is_idempotent():
+    index = RoiIndex()
+    index.add(((0,), (5,)))
+    index.add(((0,), (5,)))
+    assert len(index) == 1
+    index.remove(((0,), (5,)))
+    index.remove(((0,), (5,)))
+    assert len(index) == 0
+
+
+@pytest.mark.parametrize("max_entries", [4, 5, 16])
+def test_queries_match_brute_force_under_random_updates(max_entries):
+    rng = random.Random(max_entries)
+    index = RoiIndex(max_entries=max_entries)
+    rois = set()
+    for step in range(1000):
+        if rois and rng.random() < 0.4:
+            roi = rng.choice(sorted(rois))
+            rois.discard(roi)
+            index.remove(roi)
+        else:
+            roi = random_roi(rng)
+            rois.add(roi)
+            index.add(roi)
+
+        assert len(index) == len(rois)
+        if step % 10 == 0:
+            query = random_roi(rng, max_extent=10)
+            assert sorted(index.containing(query)) == brute_force_containing(rois, query)
+            assert sorted(index.intersecting(query)) == brute_force_intersecting(rois, query)
+
+    for roi in list(rois):
+        index.remove(roi)
+    assert len(index) == 0
+    assert index.intersecting(((0, 0, 0), (200, 200, 200))) == []
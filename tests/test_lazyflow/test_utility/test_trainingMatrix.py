@@ -0,0 +1,100 @@
+import numpy
+import pytest
+from numpy.testing import assert_array_equal
+
+from lazyflow.utility.trainingMatrix import TrainingMatrix, TrainingMatrixView
+
+
+def rows(value, count=3):
+    return numpy.full((count, 4), value, dtype=numpy.float32)
+
+
+def sorted_rows(matrix):
+    return sorted(map(tuple, numpy.asarray(matrix).tolist()))
+
+
+def test_set_and_remove():
+    matrix = TrainingMatrix(4, capacity=2)
+    matrix.set("a", rows(1))
+    matrix.set("b", rows(2, 2))
+    matrix.set("c", rows(3))
+    assert len(matrix) == 8
+    assert sorted(matrix.keys()) == ["a", "b", "c"]
+
+    matrix.set("a", rows(4, 1))
+    matrix.remove("b")
+    assert len(matrix) == 4
+    assert_array_equal(matrix.rows("a"), rows(4, 1))
+    assert_array_equal(matrix.rows("c"), rows(3))
+    assert sorted_rows(matrix.snapshot()) == sorted_rows(numpy.concatenate([rows(4, 1), rows(3)]))
+
+    # Empty rows remove the key
+    matrix.set("c", rows(0, 0))
+    assert "c" not in matrix
+    assert len(matrix.snapshot()) == 1
+
+
+def test_random_updates():
+    rng = numpy.random.RandomState(0)
+    matrix = TrainingMatrix(4, capacity=1)
+    expected = {}
+    for _ in range(300):
+        key = rng.randint(20)
+        if rng.rand() < 0.3:
+            matrix.remove(key)
+            expected.pop(key, None)
+        else:
+            new_rows = rng.rand(rng.randint(1, 6), 4).astype(numpy.float32)
+            matrix.set(key, new_rows)
+            expected[key] = new_rows
+
+    for key, key_rows in expected.items():
+        assert_array_equal(matrix.rows(key), key_rows)
+    assert sorted_rows(matrix.snapshot()) == sorted_rows(numpy.concatenate(list(expected.values())))
+
+
+def test_snapshots_do_not_change():
+    matrix = TrainingMatrix(4)
+    matrix.set("a", rows(1))
+    matrix.set("b", rows(2))
+    snapshot = matrix.snapshot()
+    assert isinstance(snapshot, TrainingMatrixView)
+    assert not snapshot.flags.writeable
+    features = snapshot[:, 1:]
+    del snapshot
+
+    matrix.remove("a")
+    matrix.set("b", rows(5))
+    assert_array_equal(features, numpy.concatenate([rows(1), rows(2)])[:, 1:])
+
+    # Without views, the buffer is modified in place
+    del features
+    address = matrix._data.ctypes.data
+    matrix.set("c", rows(3))
+    assert matrix._data.ctypes.data == address
+
+
+def test_changes_since():
+    matrix = TrainingMatrix(4)
+    matrix.set("a", rows(1))
+    first = matrix.snapshot()
+
+    matrix.set("b", rows(2, 2))
+    second = matrix.snapshot()
+    added, removed = second.changes_since(first.generation)
+    assert not removed
+    assert_array_equal(second[added], rows(2, 2))
+    assert first.changes_since(first.generation) is None, "the matrix changed after the first snapshot"
+
+    matrix.set("a", rows(3))
+    added, removed = matrix.snapshot().changes_since(second.generation)
+    assert removed
+    assert len(added) == 3
+
+
+@pytest.mark.parametrize("key", ["a", ("block", 0)])
+def test_unknown_key(key):
+    matrix = TrainingMatrix(4)
+    matrix.remove(key)
+    with pytest.raises(KeyError):
+        matrix.rows(key)